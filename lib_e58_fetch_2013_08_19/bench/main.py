@@ -0,0 +1,440 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# benchmarks -- microbenchmarks of selectors and extraction, and crawls
+# of synthetic site (see ``synthetic_site``) by real ``e58-fetch``
+# process, so its CPU time and peak RSS are measured apart from server.
+#
+# results are written as JSON. ``--compare`` prints ratios of results
+# to results of previous run.
+
+import argparse
+import csv
+import json
+import os
+import os.path
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import html5lib
+from .. import e58_fetch
+from .. import et_find
+from .. import html_parse
+from . import synthetic_site
+
+E58_FETCH_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        'e58-fetch',
+        )
+
+MIN_TIME = 0.2
+REPEAT = 3
+
+# name -- ``(e58_fetch_arg_list, is_lxml_needed)``
+CRAWL_CONFIG_MAP = {
+        'thread': ((), False),
+        'thread-lxml': (('--parser', 'lxml'), True),
+        'thread-stream': (('--stream', '--parser', 'lxml'), True),
+        'asyncio-lxml': (('--engine', 'asyncio', '--parser', 'lxml'), True),
+        }
+
+class BenchError(Exception):
+    pass
+
+def time_op(op, repeat=None, min_time=None):
+    # returns best time of one call of ``op()``. count of calls in every
+    # round is chosen so that round lasts at least ``min_time``
+    
+    if repeat is None:
+        repeat = REPEAT
+    
+    if min_time is None:
+        min_time = MIN_TIME
+    
+    loop_count = 1
+    
+    while True:
+        begin_time = time.perf_counter()
+        
+        for loop_i in range(loop_count):
+            op()
+        
+        round_time = time.perf_counter() - begin_time
+        
+        if round_time >= min_time:
+            break
+        
+        loop_count *= 2
+    
+    best_time = round_time / loop_count
+    
+    for repeat_i in range(repeat - 1):
+        begin_time = time.perf_counter()
+        
+        for loop_i in range(loop_count):
+            op()
+        
+        best_time = min(best_time, (time.perf_counter() - begin_time) / loop_count)
+    
+    return best_time
+
+def get_parser_name_list():
+    return tuple(
+            parser_name
+            for parser_name in html_parse.PARSER_NAME_LIST
+            if parser_name != 'lxml' or html_parse.lxml is not None
+            )
+
+def run_micro(synthetic_site_ctx, repeat=None):
+    # returns ``{name: seconds_per_op}``
+    
+    firm_url = 'http://localhost/firm/1/'
+    listing_url = 'http://localhost/firms/rubric/0/'
+    page_map = {
+            'firm': (firm_url, synthetic_site.get_page(synthetic_site_ctx, '/firm/1/')),
+            'listing': (
+                    listing_url,
+                    synthetic_site.get_page(synthetic_site_ctx, '/firms/rubric/0/'),
+                    ),
+            }
+    firm_doc = html5lib.parse(page_map['firm'][1])
+    result_map = {}
+    
+    result_map['et_find.find'] = time_op(
+            lambda: [
+                    et_find.find((firm_doc,), condition_chain)
+                    for condition_chain in e58_fetch.PAGE_CHAIN_MAP.values()
+                    ],
+            repeat=repeat,
+            )
+    result_map['et_find.find_multi'] = time_op(
+            lambda: et_find.find_multi((firm_doc,), e58_fetch.PAGE_CHAIN_MAP),
+            repeat=repeat,
+            )
+    
+    for parser_name in get_parser_name_list():
+        for page_name, (page_url, html) in page_map.items():
+            result_map['parse.{}.{}'.format(parser_name, page_name)] = time_op(
+                    lambda: html_parse.parse(html, parser_name),
+                    repeat=repeat,
+                    )
+            result_map['extract_page.{}.{}'.format(parser_name, page_name)] = time_op(
+                    lambda: e58_fetch.extract_page(page_url, html, parser_name=parser_name),
+                    repeat=repeat,
+                    )
+    
+    return result_map
+
+def count_csv_records(csv_path):
+    with open(csv_path, 'r', encoding='utf-8', newline='') as fd:
+        return max(0, sum(1 for row in csv.reader(fd)) - 1)
+
+def run_crawl(synthetic_site_ctx, site_url, arg_list, work_dir):
+    # returns dict of crawl results
+    
+    out_path = os.path.join(work_dir, 'out.csv')
+    log_path = os.path.join(work_dir, 'out.log')
+    
+    for path in (out_path, '{}.journal'.format(out_path), '{}.dead'.format(out_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    
+    synthetic_site.synthetic_site_reset(synthetic_site_ctx)
+    
+    with open(log_path, 'w', encoding='utf-8') as log_fd:
+        begin_time = time.perf_counter()
+        proc = subprocess.Popen(
+                (
+                        sys.executable,
+                        E58_FETCH_PATH,
+                        '--site-url', site_url,
+                        '--stats-interval', '3600',
+                        ) + tuple(arg_list) + (out_path,),
+                stdout=log_fd,
+                stderr=subprocess.STDOUT,
+                )
+        # ``os.wait4()`` gives resources of this child only
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        elapsed_time = time.perf_counter() - begin_time
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    
+    if proc.returncode != 0:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as log_fd:
+            log_tail = log_fd.read()[-2000:]
+        
+        raise BenchError('e58-fetch failed with code {}:\n{}'.format(
+                proc.returncode, log_tail))
+    
+    with synthetic_site_ctx.lock:
+        request_count = synthetic_site_ctx.request_count
+        error_count = synthetic_site_ctx.error_count
+        byte_count = synthetic_site_ctx.byte_count
+    
+    cpu_time = rusage.ru_utime + rusage.ru_stime
+    
+    return {
+            'elapsed_time': elapsed_time,
+            'request_count': request_count,
+            'error_count': error_count,
+            'byte_count': byte_count,
+            'firm_count': count_csv_records(out_path),
+            'page_rate': request_count / elapsed_time,
+            'cpu_time': cpu_time,
+            'cpu_per_page': cpu_time / request_count if request_count else 0.0,
+            # ``ru_maxrss`` is in KiB on Linux
+            'peak_rss': rusage.ru_maxrss * 1024,
+            }
+
+def get_site_map(synthetic_site_ctx):
+    return {
+            'rubric_count': synthetic_site_ctx.rubric_count,
+            'page_depth': synthetic_site_ctx.page_depth,
+            'firm_count': synthetic_site_ctx.firm_count,
+            'covered_firm_count': synthetic_site.get_covered_firm_count(synthetic_site_ctx),
+            'latency': synthetic_site_ctx.latency,
+            'error_rate': synthetic_site_ctx.error_rate,
+            }
+
+def format_ratio(base_value, value):
+    if not base_value:
+        return '-'
+    
+    return '{:.2f}x'.format(value / base_value)
+
+def print_compare(base_result, result):
+    # ratio is new to base: less is better for times, more is better for
+    # page rate
+    
+    for name, value in sorted(result.get('micro', {}).items()):
+        base_value = base_result.get('micro', {}).get(name)
+        
+        if base_value is None:
+            continue
+        
+        print('micro {}: {:.6f}s -> {:.6f}s ({})'.format(
+                name, base_value, value, format_ratio(base_value, value)))
+    
+    for config_name, crawl_map in sorted(result.get('crawl', {}).items()):
+        base_crawl_map = base_result.get('crawl', {}).get(config_name)
+        
+        if base_crawl_map is None:
+            continue
+        
+        for key in ('page_rate', 'cpu_per_page', 'peak_rss'):
+            print('crawl {} {}: {:.6g} -> {:.6g} ({})'.format(
+                    config_name,
+                    key,
+                    base_crawl_map[key],
+                    crawl_map[key],
+                    format_ratio(base_crawl_map[key], crawl_map[key]),
+                    ))
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='offline benchmarks of e58-fetch on synthetic site',
+            )
+    
+    parser.add_argument(
+            'result_path',
+            nargs='?',
+            metavar='RESULT-FILE-PATH',
+            help='file path to write results as JSON',
+            )
+    
+    parser.add_argument(
+            '--compare',
+            metavar='BASE-RESULT-FILE-PATH',
+            help='print ratios of results to results of previous run',
+            )
+    
+    parser.add_argument(
+            '--skip-micro',
+            action='store_true',
+            help='do not run microbenchmarks',
+            )
+    
+    parser.add_argument(
+            '--skip-crawl',
+            action='store_true',
+            help='do not run crawl benchmarks',
+            )
+    
+    parser.add_argument(
+            '--crawl-config',
+            action='append',
+            choices=tuple(CRAWL_CONFIG_MAP),
+            help='crawl configuration to run (may be given many times). '
+                    'default is all',
+            )
+    
+    parser.add_argument(
+            '--repeat',
+            type=int,
+            default=REPEAT,
+            metavar='COUNT',
+            help='rounds of every microbenchmark. default is {}'.format(REPEAT),
+            )
+    
+    parser.add_argument(
+            '--rubric-count',
+            type=int,
+            default=synthetic_site.RUBRIC_COUNT,
+            metavar='COUNT',
+            help='count of rubrics of synthetic site. default is {}'.format(
+                    synthetic_site.RUBRIC_COUNT),
+            )
+    
+    parser.add_argument(
+            '--page-depth',
+            type=int,
+            default=synthetic_site.PAGE_DEPTH,
+            metavar='COUNT',
+            help='count of listing pages in every rubric. default is {}'.format(
+                    synthetic_site.PAGE_DEPTH),
+            )
+    
+    parser.add_argument(
+            '--firm-count',
+            type=int,
+            default=synthetic_site.FIRM_COUNT,
+            metavar='COUNT',
+            help='count of firm pages. default is {}'.format(synthetic_site.FIRM_COUNT),
+            )
+    
+    parser.add_argument(
+            '--latency',
+            type=float,
+            default=synthetic_site.LATENCY,
+            metavar='SECONDS',
+            help='delay of every response. default is {}'.format(synthetic_site.LATENCY),
+            )
+    
+    parser.add_argument(
+            '--error-rate',
+            type=float,
+            default=synthetic_site.ERROR_RATE,
+            metavar='RATE',
+            help='part of responses with code 503. default is {}'.format(
+                    synthetic_site.ERROR_RATE),
+            )
+    
+    parser.add_argument(
+            '--serve',
+            action='store_true',
+            help='only serve synthetic site (for manual runs of e58-fetch '
+                    'with --site-url)',
+            )
+    
+    parser.add_argument(
+            '--port',
+            type=int,
+            default=0,
+            help='port of synthetic site. default is any free port',
+            )
+    
+    args = parser.parse_args()
+    
+    if args.rubric_count < 1 or args.page_depth < 1 or args.firm_count < 0:
+        parser.error('invalid size of synthetic site')
+    
+    if not 0.0 <= args.error_rate < 1.0:
+        parser.error('--error-rate must be in [0, 1)')
+    
+    if args.repeat < 1:
+        parser.error('--repeat must be positive')
+    
+    synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+    synthetic_site.init_synthetic_site(
+            synthetic_site_ctx,
+            rubric_count=args.rubric_count,
+            page_depth=args.page_depth,
+            firm_count=args.firm_count,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            )
+    site_url = synthetic_site.synthetic_site_start(synthetic_site_ctx, port=args.port)
+    
+    if args.serve:
+        print('*** serving synthetic site: {} ***'.format(site_url), flush=True)
+        
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return
+    
+    result = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'site': get_site_map(synthetic_site_ctx),
+            }
+    
+    if not args.skip_micro:
+        print('*** microbenchmarks ***', flush=True)
+        
+        result['micro'] = run_micro(synthetic_site_ctx, repeat=args.repeat)
+        
+        for name, value in sorted(result['micro'].items()):
+            print('{}: {:.6f}s ({:.0f}/s)'.format(name, value, 1.0 / value))
+    
+    if not args.skip_crawl:
+        result['crawl'] = {}
+        
+        config_name_list = args.crawl_config or tuple(CRAWL_CONFIG_MAP)
+        
+        with tempfile.TemporaryDirectory(prefix='e58-fetch-bench-') as work_dir:
+            for config_name in config_name_list:
+                arg_list, is_lxml_needed = CRAWL_CONFIG_MAP[config_name]
+                
+                if is_lxml_needed and html_parse.lxml is None:
+                    print('*** crawl {}: skipped (no lxml) ***'.format(config_name))
+                    
+                    continue
+                
+                print('*** crawl {} ***'.format(config_name), flush=True)
+                
+                crawl_map = run_crawl(synthetic_site_ctx, site_url, arg_list, work_dir)
+                result['crawl'][config_name] = crawl_map
+                
+                print('{:.1f} pages/s, {:.2f} ms CPU/page, {:.1f} MiB peak RSS, '
+                        '{} of {} firms'.format(
+                                crawl_map['page_rate'],
+                                crawl_map['cpu_per_page'] * 1000,
+                                crawl_map['peak_rss'] / 1024 / 1024,
+                                crawl_map['firm_count'],
+                                result['site']['covered_firm_count'],
+                                ))
+    
+    synthetic_site.synthetic_site_stop(synthetic_site_ctx)
+    
+    if args.result_path is not None:
+        with open(args.result_path, 'w', encoding='utf-8') as fd:
+            fd.write('{}\n'.format(json.dumps(result, indent=4, sort_keys=True)))
+    
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf-8') as fd:
+            base_result = json.load(fd)
+        
+        print('*** compare with {} ***'.format(args.compare))
+        
+        print_compare(base_result, result)
+    
+    print('*** done! ***')
@@ -0,0 +1,341 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# synthetic site -- local stand-in of e58.ru for offline benchmarks.
+#
+# start page ``/firms/`` links (by paginator) to first pages of rubrics.
+# every rubric has ``page_depth`` listing pages, which link to each
+# other by paginator and to their firms by ``#firms h3 a``. firm pages
+# have the same ``firminfo`` markup as the real site, so every field of
+# ``e58_fetch.FIRM_FIELD_SCHEMA`` is found. every firm is in one or two
+# rubrics, so crawler meets duplicate links too.
+#
+# ``latency`` -- delay of every response (seconds, +-50% jitter).
+# ``error_rate`` -- part of responses which are ``503`` (after delay).
+
+from urllib import parse as url
+import gzip
+import hashlib
+import http.server
+import random
+import re
+import threading
+import time
+
+RUBRIC_COUNT = 10
+PAGE_DEPTH = 5
+FIRM_COUNT = 1000
+LATENCY = 0.0
+ERROR_RATE = 0.0
+
+LISTING_PATH_RE = re.compile(r'^/firms/rubric/(?P<rubric_i>\d+)/$')
+FIRM_PATH_RE = re.compile(r'^/firm/(?P<firm_i>\d+)/$')
+
+PAGE_HEAD = (
+        '<!DOCTYPE html>\n'
+        '<html><head><meta charset="utf-8"><title>{title}</title>'
+        '<link rel="stylesheet" href="/static/style.css">'
+        '<script src="/static/site.js"></script></head>'
+        '<body><div id="header"><a href="/"><img src="/static/logo.png" alt="e58"></a>'
+        '<ul class="menu">{menu}</ul></div>'
+        '<div id="content">'
+        )
+
+PAGE_TAIL = (
+        '</div><div id="footer"><p>&copy; synthetic site. '
+        '<a href="/about/">about</a> | <a href="/contacts/">contacts</a></p>'
+        '</div></body></html>'
+        )
+
+class SyntheticSiteCtx:
+    pass
+
+def init_synthetic_site(
+        synthetic_site_ctx,
+        rubric_count=None,
+        page_depth=None,
+        firm_count=None,
+        latency=None,
+        error_rate=None,
+        ):
+    if rubric_count is None:
+        rubric_count = RUBRIC_COUNT
+    
+    if page_depth is None:
+        page_depth = PAGE_DEPTH
+    
+    if firm_count is None:
+        firm_count = FIRM_COUNT
+    
+    if latency is None:
+        latency = LATENCY
+    
+    if error_rate is None:
+        error_rate = ERROR_RATE
+    
+    synthetic_site_ctx.rubric_count = rubric_count
+    synthetic_site_ctx.page_depth = page_depth
+    synthetic_site_ctx.firm_count = firm_count
+    synthetic_site_ctx.latency = latency
+    synthetic_site_ctx.error_rate = error_rate
+    synthetic_site_ctx.firm_per_page = max(
+            1,
+            -(-firm_count // (rubric_count * page_depth)),
+            )
+    synthetic_site_ctx.lock = threading.Lock()
+    synthetic_site_ctx.request_count = 0
+    synthetic_site_ctx.error_count = 0
+    synthetic_site_ctx.byte_count = 0
+    synthetic_site_ctx.server = None
+
+def get_menu(synthetic_site_ctx):
+    return ''.join(
+            '<li><a href="/firms/rubric/{}/">Rubric {}</a></li>'.format(
+                    rubric_i, rubric_i)
+            for rubric_i in range(min(synthetic_site_ctx.rubric_count, 10))
+            )
+
+def get_page_firm_range(synthetic_site_ctx, global_page_i):
+    begin_firm_i = global_page_i * synthetic_site_ctx.firm_per_page
+    
+    return range(
+            min(begin_firm_i, synthetic_site_ctx.firm_count),
+            min(begin_firm_i + synthetic_site_ctx.firm_per_page, synthetic_site_ctx.firm_count),
+            )
+
+def get_rubric_firm_list(synthetic_site_ctx, rubric_i, page_i):
+    # firms of rubric page. the last page of rubric repeats half of
+    # firms of the next rubric, so some firms are in two rubrics
+    
+    firm_list = list(get_page_firm_range(
+            synthetic_site_ctx,
+            rubric_i * synthetic_site_ctx.page_depth + page_i,
+            ))
+    
+    if page_i == synthetic_site_ctx.page_depth - 1 and \
+            synthetic_site_ctx.rubric_count > 1:
+        next_rubric_i = (rubric_i + 1) % synthetic_site_ctx.rubric_count
+        next_firm_list = get_page_firm_range(
+                synthetic_site_ctx,
+                next_rubric_i * synthetic_site_ctx.page_depth,
+                )
+        
+        firm_list.extend(next_firm_list[:len(next_firm_list) // 2])
+    
+    return firm_list
+
+def get_covered_firm_count(synthetic_site_ctx):
+    # count of firms which crawler can reach from start page
+    
+    firm_set = set()
+    
+    for rubric_i in range(synthetic_site_ctx.rubric_count):
+        for page_i in range(synthetic_site_ctx.page_depth):
+            firm_set.update(get_rubric_firm_list(synthetic_site_ctx, rubric_i, page_i))
+    
+    return len(firm_set)
+
+def get_paginator(href_list):
+    return '<div class="paginator">{}</div>'.format(' '.join(
+            '<a href="{}">{}</a>'.format(href, href_i + 1)
+            for href_i, href in enumerate(href_list)
+            ))
+
+def get_start_page(synthetic_site_ctx):
+    return '{}<h2>Firms</h2><div id="firms"></div>{}{}'.format(
+            PAGE_HEAD.format(title='Firms', menu=get_menu(synthetic_site_ctx)),
+            get_paginator(tuple(
+                    '/firms/rubric/{}/'.format(rubric_i)
+                    for rubric_i in range(synthetic_site_ctx.rubric_count)
+                    )),
+            PAGE_TAIL,
+            )
+
+def get_listing_page(synthetic_site_ctx, rubric_i, page_i):
+    firm_html = ''.join(
+            '<div class="firm"><h3><a href="/firm/{}/">Firm {} &amp; Co</a></h3>'
+            '<p class="short">Short description of firm {}.</p>'
+            '<span class="address">Penza, street {}</span></div>'.format(
+                    firm_i, firm_i, firm_i, firm_i)
+            for firm_i in get_rubric_firm_list(synthetic_site_ctx, rubric_i, page_i)
+            )
+    
+    return '{}<h2>Rubric {}</h2><div id="firms">{}</div>{}{}'.format(
+            PAGE_HEAD.format(
+                    title='Rubric {}'.format(rubric_i),
+                    menu=get_menu(synthetic_site_ctx),
+                    ),
+            rubric_i,
+            firm_html,
+            get_paginator(tuple(
+                    '/firms/rubric/{}/?page={}'.format(rubric_i, href_page_i)
+                    if href_page_i else '/firms/rubric/{}/'.format(rubric_i)
+                    for href_page_i in range(synthetic_site_ctx.page_depth)
+                    )),
+            PAGE_TAIL,
+            )
+
+def get_firm_page(synthetic_site_ctx, firm_i):
+    return (
+            '{head}<div class="firminfo"><h1>Firm <b>{firm_i}</b> &amp; Co</h1>'
+            '<div class="director">Director: Ivanov {firm_i}</div>'
+            '<div class="uaddress">440000, Penza, legal street {firm_i}</div>'
+            '<div class="address"><div class="address">Penza, street {firm_i}</div>'
+            '<a class="maplinked" href="/map/{firm_i}/">on map</a></div>'
+            '<div class="phone"><img src="/phone/{firm_i}.png" alt=""></div>'
+            '<div class="email"><a href="mailto:firm{firm_i}@example.com">'
+            'firm{firm_i}@example.com</a></div>'
+            '<div class="www"><a href="http://firm{firm_i}.example.com/">'
+            'firm{firm_i}.example.com</a></div>'
+            '<div class="work"><b>Деятельность:</b> work of firm {firm_i}</div>'
+            '<div class="rubriks"><b>Рубрики:</b> <a href="/firms/rubric/{rubric_i}/">'
+            'Rubric {rubric_i}</a></div></div>{tail}'
+            ).format(
+                    head=PAGE_HEAD.format(
+                            title='Firm {}'.format(firm_i),
+                            menu=get_menu(synthetic_site_ctx),
+                            ),
+                    tail=PAGE_TAIL,
+                    firm_i=firm_i,
+                    rubric_i=firm_i % synthetic_site_ctx.rubric_count,
+                    )
+
+def get_page(synthetic_site_ctx, path):
+    # returns html of ``path`` (``None`` if there is no such page)
+    
+    split_path = url.urlsplit(path)
+    
+    if split_path.path == '/firms/':
+        return get_start_page(synthetic_site_ctx)
+    
+    listing_match = LISTING_PATH_RE.match(split_path.path)
+    
+    if listing_match is not None:
+        rubric_i = int(listing_match.group('rubric_i'))
+        page_i = url.parse_qs(split_path.query).get('page', ('0',))[0]
+        
+        if rubric_i >= synthetic_site_ctx.rubric_count or not page_i.isdigit() or \
+                int(page_i) >= synthetic_site_ctx.page_depth:
+            return None
+        
+        return get_listing_page(synthetic_site_ctx, rubric_i, int(page_i))
+    
+    firm_match = FIRM_PATH_RE.match(split_path.path)
+    
+    if firm_match is not None:
+        firm_i = int(firm_match.group('firm_i'))
+        
+        if firm_i >= synthetic_site_ctx.firm_count:
+            return None
+        
+        return get_firm_page(synthetic_site_ctx, firm_i)
+    
+    return None
+
+class SyntheticSiteHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def send_body(self, code, body, header_map=None):
+        self.send_response(code)
+        
+        if header_map is not None:
+            for header_name, header_value in header_map.items():
+                self.send_header(header_name, header_value)
+        
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        synthetic_site_ctx = self.server.synthetic_site_ctx
+        
+        with synthetic_site_ctx.lock:
+            synthetic_site_ctx.request_count += 1
+        
+        if synthetic_site_ctx.latency:
+            time.sleep(synthetic_site_ctx.latency * random.uniform(0.5, 1.5))
+        
+        if random.random() < synthetic_site_ctx.error_rate:
+            with synthetic_site_ctx.lock:
+                synthetic_site_ctx.error_count += 1
+            
+            self.send_body(503, b'')
+            
+            return
+        
+        html = get_page(synthetic_site_ctx, self.path)
+        
+        if html is None:
+            self.send_body(404, b'')
+            
+            return
+        
+        body = html.encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        header_map = {
+                'Content-Type': 'text/html; charset=utf-8',
+                'ETag': etag,
+                }
+        
+        if self.headers.get('If-None-Match') == etag:
+            self.send_body(304, b'', header_map=header_map)
+            
+            return
+        
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body, compresslevel=1)
+            header_map['Content-Encoding'] = 'gzip'
+        
+        with synthetic_site_ctx.lock:
+            synthetic_site_ctx.byte_count += len(body)
+        
+        self.send_body(200, body, header_map=header_map)
+
+def synthetic_site_start(synthetic_site_ctx, host=None, port=None):
+    # returns url of site. server works in background threads
+    
+    if host is None:
+        host = '127.0.0.1'
+    
+    if port is None:
+        port = 0
+    
+    server = http.server.ThreadingHTTPServer((host, port), SyntheticSiteHandler)
+    server.daemon_threads = True
+    server.synthetic_site_ctx = synthetic_site_ctx
+    synthetic_site_ctx.server = server
+    
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    return 'http://{}:{}/'.format(host, server.server_address[1])
+
+def synthetic_site_reset(synthetic_site_ctx):
+    with synthetic_site_ctx.lock:
+        synthetic_site_ctx.request_count = 0
+        synthetic_site_ctx.error_count = 0
+        synthetic_site_ctx.byte_count = 0
+
+def synthetic_site_stop(synthetic_site_ctx):
+    if synthetic_site_ctx.server is not None:
+        synthetic_site_ctx.server.shutdown()
+        synthetic_site_ctx.server.server_close()
+        synthetic_site_ctx.server = None
@@ -0,0 +1,172 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# concurrency control -- adaptive limit of concurrent fetches and
+# per-host limit of requests per second.
+#
+# limit is AIMD (like TCP congestion window): every successful fast fetch
+# adds ``1 / limit`` (about +1 per ``limit`` fetches), and overload
+# (error or latency much over base latency) multiplies limit by
+# ``DECREASE_FACTOR``, at most once per ``limit`` fetches. latency is
+# smoothed (EWMA), base latency is the lowest smoothed one seen recently.
+# small absolute growth of latency (less than ``LATENCY_MIN_EXCESS``) is
+# never overload -- it is just noise on fast servers.
+#
+# rate limit is token bucket per host. tokens are reserved in advance:
+# ``host_rate_reserve()`` returns time to wait before request, so it works
+# for threads and for asyncio tasks.
+
+import threading
+import time
+
+INCREASE_STEP = 1.0
+DECREASE_FACTOR = 0.7
+LATENCY_FACTOR = 3.0
+LATENCY_MIN_EXCESS = 0.1
+LATENCY_SMOOTHING = 0.1
+BASE_LATENCY_DRIFT = 1.01
+RATE_BURST = 1.0
+
+class ConcurrencyCtlCtx:
+    pass
+
+def init_concurrency_ctl(
+        concurrency_ctl_ctx,
+        min_concurrency,
+        max_concurrency,
+        initial_concurrency=None,
+        ):
+    if initial_concurrency is None:
+        initial_concurrency = min_concurrency
+    
+    concurrency_ctl_ctx.min_concurrency = min_concurrency
+    concurrency_ctl_ctx.max_concurrency = max_concurrency
+    concurrency_ctl_ctx.limit = float(max(
+            min_concurrency,
+            min(max_concurrency, initial_concurrency),
+            ))
+    concurrency_ctl_ctx.active_count = 0
+    concurrency_ctl_ctx.latency = None
+    concurrency_ctl_ctx.base_latency = None
+    concurrency_ctl_ctx.since_decrease_count = 0
+    concurrency_ctl_ctx.decrease_count = 0
+    concurrency_ctl_ctx.lock = threading.Lock()
+    concurrency_ctl_ctx.cond = threading.Condition(concurrency_ctl_ctx.lock)
+
+def concurrency_ctl_try_acquire(concurrency_ctl_ctx):
+    # returns ``True`` if fetch slot is taken
+    
+    with concurrency_ctl_ctx.lock:
+        if concurrency_ctl_ctx.active_count >= int(concurrency_ctl_ctx.limit):
+            return False
+        
+        concurrency_ctl_ctx.active_count += 1
+        
+        return True
+
+def concurrency_ctl_acquire(concurrency_ctl_ctx):
+    with concurrency_ctl_ctx.lock:
+        while concurrency_ctl_ctx.active_count >= int(concurrency_ctl_ctx.limit):
+            concurrency_ctl_ctx.cond.wait()
+        
+        concurrency_ctl_ctx.active_count += 1
+
+def concurrency_ctl_release(concurrency_ctl_ctx, latency=None, is_overload=False):
+    # ``latency`` -- duration of fetch (``None`` if it is not measured)
+    #
+    # ``is_overload`` -- fetch failed in the way which shows that server
+    # is overloaded
+    
+    with concurrency_ctl_ctx.lock:
+        concurrency_ctl_ctx.active_count -= 1
+        concurrency_ctl_ctx.since_decrease_count += 1
+        
+        if not is_overload and latency is not None:
+            if concurrency_ctl_ctx.latency is None:
+                concurrency_ctl_ctx.latency = latency
+                concurrency_ctl_ctx.base_latency = latency
+            else:
+                concurrency_ctl_ctx.latency += \
+                        (latency - concurrency_ctl_ctx.latency) * LATENCY_SMOOTHING
+                concurrency_ctl_ctx.base_latency = min(
+                        concurrency_ctl_ctx.latency,
+                        concurrency_ctl_ctx.base_latency * BASE_LATENCY_DRIFT,
+                        )
+            
+            if concurrency_ctl_ctx.latency > max(
+                    concurrency_ctl_ctx.base_latency * LATENCY_FACTOR,
+                    concurrency_ctl_ctx.base_latency + LATENCY_MIN_EXCESS,
+                    ):
+                is_overload = True
+        
+        if is_overload:
+            if concurrency_ctl_ctx.since_decrease_count >= concurrency_ctl_ctx.limit:
+                concurrency_ctl_ctx.limit = max(
+                        float(concurrency_ctl_ctx.min_concurrency),
+                        concurrency_ctl_ctx.limit * DECREASE_FACTOR,
+                        )
+                concurrency_ctl_ctx.since_decrease_count = 0
+                concurrency_ctl_ctx.decrease_count += 1
+        else:
+            concurrency_ctl_ctx.limit = min(
+                    float(concurrency_ctl_ctx.max_concurrency),
+                    concurrency_ctl_ctx.limit +
+                            INCREASE_STEP / concurrency_ctl_ctx.limit,
+                    )
+        
+        concurrency_ctl_ctx.cond.notify_all()
+
+class HostRateCtx:
+    pass
+
+def init_host_rate(host_rate_ctx, rps, burst=None):
+    # ``rps`` -- requests per second for every host
+    
+    if burst is None:
+        burst = RATE_BURST
+    
+    host_rate_ctx.rps = rps
+    host_rate_ctx.burst = max(1.0, burst)
+    host_rate_ctx.lock = threading.Lock()
+    host_rate_ctx.bucket_map = {}
+    host_rate_ctx.wait_count = 0
+    host_rate_ctx.wait_time = 0.0
+
+def host_rate_reserve(host_rate_ctx, host):
+    # takes token of ``host`` and returns time to wait (seconds) before
+    # request
+    
+    with host_rate_ctx.lock:
+        now = time.monotonic()
+        token_count, last_time = host_rate_ctx.bucket_map.get(
+                host, (host_rate_ctx.burst, now))
+        token_count = min(
+                host_rate_ctx.burst,
+                token_count + (now - last_time) * host_rate_ctx.rps,
+                ) - 1.0
+        host_rate_ctx.bucket_map[host] = token_count, now
+        
+        if token_count >= 0.0:
+            return 0.0
+        
+        wait_time = -token_count / host_rate_ctx.rps
+        host_rate_ctx.wait_count += 1
+        host_rate_ctx.wait_time += wait_time
+        
+        return wait_time
@@ -0,0 +1,151 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# crawl journal -- durable state of crawl for resume after crash.
+#
+# journal is SQLite database of scheduled urls and finished urls:
+# pending urls are scheduled but not finished ones, seen urls are all
+# scheduled ones. records are kept in memory and written by background
+# thread in batches, so callers never wait for disk.
+
+import sqlite3
+import threading
+
+FLUSH_INTERVAL = 1.0
+FLUSH_BATCH_SIZE = 1000
+
+class CrawlJournalCtx:
+    pass
+
+def init_crawl_journal(crawl_journal_ctx, journal_path, is_resume=False):
+    # ``is_resume`` -- keep state of previous crawl. otherwise journal
+    # is cleared
+    
+    crawl_journal_ctx.lock = threading.Lock()
+    crawl_journal_ctx.cond = threading.Condition(crawl_journal_ctx.lock)
+    crawl_journal_ctx.scheduled_url_list = []
+    crawl_journal_ctx.finished_url_list = []
+    crawl_journal_ctx.is_closed = False
+    crawl_journal_ctx.db_lock = threading.Lock()
+    crawl_journal_ctx.db = sqlite3.connect(journal_path, check_same_thread=False)
+    
+    crawl_journal_ctx.db.execute('PRAGMA journal_mode=WAL')
+    crawl_journal_ctx.db.execute(
+            'CREATE TABLE IF NOT EXISTS scheduled (url TEXT PRIMARY KEY)'
+            )
+    crawl_journal_ctx.db.execute(
+            'CREATE TABLE IF NOT EXISTS finished (url TEXT PRIMARY KEY)'
+            )
+    
+    if not is_resume:
+        crawl_journal_ctx.db.execute('DELETE FROM scheduled')
+        crawl_journal_ctx.db.execute('DELETE FROM finished')
+    
+    crawl_journal_ctx.db.commit()
+    
+    crawl_journal_ctx.flush_thread = threading.Thread(
+            target=lambda: crawl_journal_flush_thread(crawl_journal_ctx),
+            daemon=True,
+            )
+    crawl_journal_ctx.flush_thread.start()
+
+def crawl_journal_load(crawl_journal_ctx):
+    # returns ``(pending_url_list, seen_url_list)`` of previous crawl
+    
+    with crawl_journal_ctx.db_lock:
+        pending_url_list = tuple(row[0] for row in crawl_journal_ctx.db.execute(
+                'SELECT url FROM scheduled '
+                'WHERE url NOT IN (SELECT url FROM finished) '
+                'ORDER BY rowid'
+                ))
+        seen_url_list = tuple(row[0] for row in crawl_journal_ctx.db.execute(
+                'SELECT url FROM scheduled ORDER BY rowid'
+                ))
+    
+    return pending_url_list, seen_url_list
+
+def crawl_journal_scheduled(crawl_journal_ctx, scheduled_url):
+    with crawl_journal_ctx.lock:
+        crawl_journal_ctx.scheduled_url_list.append(scheduled_url)
+        
+        if len(crawl_journal_ctx.scheduled_url_list) >= FLUSH_BATCH_SIZE:
+            crawl_journal_ctx.cond.notify()
+
+def crawl_journal_finished(crawl_journal_ctx, finished_url):
+    with crawl_journal_ctx.lock:
+        crawl_journal_ctx.finished_url_list.append(finished_url)
+        
+        if len(crawl_journal_ctx.finished_url_list) >= FLUSH_BATCH_SIZE:
+            crawl_journal_ctx.cond.notify()
+
+def crawl_journal_reschedule(crawl_journal_ctx, url_list):
+    # marks finished urls as pending again (for one more attempt).
+    # it is written at once
+    
+    with crawl_journal_ctx.db_lock, crawl_journal_ctx.db:
+        crawl_journal_ctx.db.executemany(
+                'INSERT OR IGNORE INTO scheduled (url) VALUES (?)',
+                ((pending_url,) for pending_url in url_list),
+                )
+        crawl_journal_ctx.db.executemany(
+                'DELETE FROM finished WHERE url = ?',
+                ((pending_url,) for pending_url in url_list),
+                )
+
+def crawl_journal_flush(crawl_journal_ctx):
+    with crawl_journal_ctx.lock:
+        scheduled_url_list = crawl_journal_ctx.scheduled_url_list
+        finished_url_list = crawl_journal_ctx.finished_url_list
+        crawl_journal_ctx.scheduled_url_list = []
+        crawl_journal_ctx.finished_url_list = []
+    
+    if not scheduled_url_list and not finished_url_list:
+        return
+    
+    # scheduled and finished urls go in one transaction
+    with crawl_journal_ctx.db_lock, crawl_journal_ctx.db:
+        crawl_journal_ctx.db.executemany(
+                'INSERT OR IGNORE INTO scheduled (url) VALUES (?)',
+                ((scheduled_url,) for scheduled_url in scheduled_url_list),
+                )
+        crawl_journal_ctx.db.executemany(
+                'INSERT OR IGNORE INTO finished (url) VALUES (?)',
+                ((finished_url,) for finished_url in finished_url_list),
+                )
+
+def crawl_journal_flush_thread(crawl_journal_ctx):
+    while True:
+        with crawl_journal_ctx.lock:
+            if crawl_journal_ctx.is_closed:
+                return
+            
+            crawl_journal_ctx.cond.wait(FLUSH_INTERVAL)
+        
+        crawl_journal_flush(crawl_journal_ctx)
+
+def crawl_journal_close(crawl_journal_ctx):
+    with crawl_journal_ctx.lock:
+        crawl_journal_ctx.is_closed = True
+        crawl_journal_ctx.cond.notify()
+    
+    crawl_journal_ctx.flush_thread.join()
+    crawl_journal_flush(crawl_journal_ctx)
+    
+    with crawl_journal_ctx.db_lock:
+        crawl_journal_ctx.db.close()
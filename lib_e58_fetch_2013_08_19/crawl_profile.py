@@ -0,0 +1,305 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+assert str is not bytes
+
+# crawl profile -- opt-in profiling of page processing.
+#
+# extraction code adds cheap timers (``time.perf_counter()``) of its steps
+# to profile map of page, but only if profile map is given -- disabled
+# profiling costs nothing more than ``None`` checks. timer names are
+# paths of steps, separated by ``;``: ``parse;fallback``, ``extract;find``,
+# ``extract;field.title`` and so on. ``parse`` and ``extract`` themselves
+# are stages of ``timing_map``.
+#
+# every ``sample_interval``-th page is sampled: it is extracted under
+# cProfile and tracemalloc, and every condition chain is also found on its
+# own (``selector_map``), to show cost of chain out of shared
+# ``et_find.find_multi()``. sampled pages are extracted one at a time (per
+# process), but memory peak also has allocations of other threads. timers
+# of sampled pages are distorted by all of it, so they are not added to
+# timers and slowest pages.
+#
+# report is text summary sorted by total time, and collapsed stacks (file
+# with ``.collapsed`` suffix) for flamegraph tools.
+
+import cProfile
+import heapq
+import io
+import pstats
+import threading
+import tracemalloc
+
+SLOW_PAGE_COUNT = 20
+FUNCTION_COUNT = 30
+COLLAPSED_SUFFIX = '.collapsed'
+
+sample_lock = threading.Lock()
+
+def new_profile_map(is_sample=False):
+    # profile map of one page. it is plain dict: it is passed back from
+    # parse processes
+    
+    return {
+            'is_sample': is_sample,
+            'timer_map': {},
+            'selector_map': {},
+            'size': None,
+            }
+
+def profile_map_add(profile_map, timer_name, duration):
+    timer_map = profile_map['timer_map']
+    timer_map[timer_name] = timer_map.get(timer_name, 0.0) + duration
+
+def profile_map_selector(profile_map, chain_name, duration):
+    profile_map['selector_map'][chain_name] = duration
+
+def sample_call(profile_map, func):
+    # calls ``func()`` under cProfile and tracemalloc, their results go to
+    # ``profile_map``
+    
+    with sample_lock:
+        is_tracing = tracemalloc.is_tracing()
+        
+        if is_tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+        
+        profiler = cProfile.Profile()
+        profile_map['profiler'] = profiler
+        profiler.enable()
+        
+        try:
+            return func()
+        finally:
+            profiler.disable()
+            del profile_map['profiler']
+            profile_map['memory_peak'] = tracemalloc.get_traced_memory()[1]
+            
+            if not is_tracing:
+                tracemalloc.stop()
+            
+            profiler.create_stats()
+            profile_map['cprofile_stats'] = profiler.stats
+
+def sample_pause(profile_map):
+    # extra work of sampled page (between ``sample_pause()`` and
+    # ``sample_resume()``) is not profiled by cProfile
+    
+    profiler = profile_map.get('profiler')
+    
+    if profiler is not None:
+        profiler.disable()
+
+def sample_resume(profile_map):
+    profiler = profile_map.get('profiler')
+    
+    if profiler is not None:
+        profiler.enable()
+
+class StatsSource:
+    # source of ``pstats.Stats`` with ready stats (``pstats`` takes
+    # profilers and files only)
+    
+    pass
+
+def get_stats_source(cprofile_stats):
+    stats_source = StatsSource()
+    stats_source.stats = cprofile_stats
+    stats_source.create_stats = lambda: None
+    
+    return stats_source
+
+class CrawlProfileCtx:
+    pass
+
+def init_crawl_profile(crawl_profile_ctx, sample_interval=0, slow_page_count=None):
+    # ``sample_interval`` -- every such page is sampled (``0`` -- no one)
+    
+    if slow_page_count is None:
+        slow_page_count = SLOW_PAGE_COUNT
+    
+    crawl_profile_ctx.sample_interval = sample_interval
+    crawl_profile_ctx.slow_page_count = slow_page_count
+    crawl_profile_ctx.lock = threading.Lock()
+    crawl_profile_ctx.page_count = 0
+    crawl_profile_ctx.sample_count = 0
+    crawl_profile_ctx.timer_map = {}
+    crawl_profile_ctx.selector_map = {}
+    crawl_profile_ctx.slow_page_heap = []
+    crawl_profile_ctx.memory_peak_list = []
+    crawl_profile_ctx.cprofile = None
+
+def crawl_profile_begin(crawl_profile_ctx):
+    # returns profile map for next page (``None`` if profiling is off)
+    
+    if crawl_profile_ctx is None:
+        return None
+    
+    with crawl_profile_ctx.lock:
+        crawl_profile_ctx.page_count += 1
+        
+        is_sample = bool(crawl_profile_ctx.sample_interval) and \
+                not crawl_profile_ctx.page_count % crawl_profile_ctx.sample_interval
+    
+    return new_profile_map(is_sample=is_sample)
+
+def crawl_profile_page(crawl_profile_ctx, page_url, timing_map, profile_map):
+    # adds profile of page. ``timing_map`` -- stage durations of the page
+    
+    timer_item_list = tuple(timing_map.items()) + tuple(
+            profile_map['timer_map'].items())
+    page_time = sum(timing_map.values())
+    
+    with crawl_profile_ctx.lock:
+        for chain_name, duration in profile_map['selector_map'].items():
+            count, total = crawl_profile_ctx.selector_map.get(chain_name, (0, 0.0))
+            crawl_profile_ctx.selector_map[chain_name] = count + 1, total + duration
+        
+        if profile_map['is_sample']:
+            crawl_profile_ctx.sample_count += 1
+            
+            if 'memory_peak' in profile_map:
+                crawl_profile_ctx.memory_peak_list.append(profile_map['memory_peak'])
+            
+            if 'cprofile_stats' in profile_map:
+                stats_source = get_stats_source(profile_map['cprofile_stats'])
+                
+                if crawl_profile_ctx.cprofile is None:
+                    crawl_profile_ctx.cprofile = pstats.Stats(stats_source)
+                else:
+                    crawl_profile_ctx.cprofile.add(stats_source)
+            
+            return
+        
+        for timer_name, duration in timer_item_list:
+            count, total, max_duration = crawl_profile_ctx.timer_map.get(
+                    timer_name, (0, 0.0, 0.0))
+            crawl_profile_ctx.timer_map[timer_name] = \
+                    count + 1, total + duration, max(max_duration, duration)
+        
+        slow_page = page_time, page_url, profile_map['size']
+        
+        if len(crawl_profile_ctx.slow_page_heap) < crawl_profile_ctx.slow_page_count:
+            heapq.heappush(crawl_profile_ctx.slow_page_heap, slow_page)
+        else:
+            heapq.heappushpop(crawl_profile_ctx.slow_page_heap, slow_page)
+
+def format_summary(crawl_profile_ctx):
+    line_list = [
+            'pages: {}, sampled: {}'.format(
+                    crawl_profile_ctx.page_count,
+                    crawl_profile_ctx.sample_count,
+                    ),
+            '',
+            'timers, by total time:',
+            '{:>12} {:>10} {:>12} {:>12}  {}'.format(
+                    'total, s', 'count', 'mean, ms', 'max, ms', 'name'),
+            ]
+    
+    for timer_name, (count, total, max_duration) in sorted(
+            crawl_profile_ctx.timer_map.items(),
+            key=lambda item: item[1][1],
+            reverse=True,
+            ):
+        line_list.append('{:>12.3f} {:>10} {:>12.3f} {:>12.3f}  {}'.format(
+                total, count, total / count * 1000.0, max_duration * 1000.0, timer_name))
+    
+    if crawl_profile_ctx.selector_map:
+        line_list += [
+                '',
+                'condition chains found on their own (sampled pages), by total time:',
+                '{:>12} {:>10} {:>12}  {}'.format('total, s', 'count', 'mean, ms', 'name'),
+                ]
+        
+        for chain_name, (count, total) in sorted(
+                crawl_profile_ctx.selector_map.items(),
+                key=lambda item: item[1][1],
+                reverse=True,
+                ):
+            line_list.append('{:>12.3f} {:>10} {:>12.3f}  {}'.format(
+                    total, count, total / count * 1000.0, chain_name))
+    
+    line_list += [
+            '',
+            'slowest pages (parse and extract):',
+            '{:>12} {:>10}  {}'.format('time, ms', 'size', 'url'),
+            ]
+    
+    for page_time, page_url, size in sorted(
+            crawl_profile_ctx.slow_page_heap, reverse=True):
+        line_list.append('{:>12.3f} {:>10}  {}'.format(
+                page_time * 1000.0, '-' if size is None else size, page_url))
+    
+    if crawl_profile_ctx.memory_peak_list:
+        memory_peak_list = crawl_profile_ctx.memory_peak_list
+        
+        line_list += [
+                '',
+                'memory peak of sampled page: mean {:.1f} KiB, max {:.1f} KiB'.format(
+                        sum(memory_peak_list) / len(memory_peak_list) / 1024.0,
+                        max(memory_peak_list) / 1024.0,
+                        ),
+                ]
+    
+    if crawl_profile_ctx.cprofile is not None:
+        cprofile_fd = io.StringIO()
+        crawl_profile_ctx.cprofile.stream = cprofile_fd
+        crawl_profile_ctx.cprofile.sort_stats('cumulative').print_stats(FUNCTION_COUNT)
+        
+        line_list += [
+                '',
+                'cProfile of sampled pages, by cumulative time:',
+                cprofile_fd.getvalue().rstrip('\n'),
+                ]
+    
+    return ''.join('{}\n'.format(line) for line in line_list)
+
+def format_collapsed(crawl_profile_ctx):
+    # line is ``page;stage;step weight``, weight is microseconds of the
+    # step itself (without its sub-steps)
+    
+    self_time_map = dict(
+            (timer_name, total)
+            for timer_name, (count, total, max_duration)
+            in crawl_profile_ctx.timer_map.items()
+            )
+    
+    for timer_name, (count, total, max_duration) in crawl_profile_ctx.timer_map.items():
+        parent_name = timer_name.rpartition(';')[0]
+        
+        if parent_name in self_time_map:
+            self_time_map[parent_name] -= total
+    
+    return ''.join(
+            'page;{} {}\n'.format(timer_name, int(self_time * 1000000.0))
+            for timer_name, self_time in sorted(self_time_map.items())
+            if self_time > 0.0
+            )
+
+def crawl_profile_write(crawl_profile_ctx, profile_path):
+    with crawl_profile_ctx.lock:
+        summary = format_summary(crawl_profile_ctx)
+        collapsed = format_collapsed(crawl_profile_ctx)
+    
+    with open(profile_path, 'w', encoding='utf-8') as fd:
+        fd.write(summary)
+    
+    with open('{}{}'.format(profile_path, COLLAPSED_SUFFIX), 'w', encoding='utf-8') as fd:
+        fd.write(collapsed)
@@ -0,0 +1,283 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# crawl stats -- counters and latency histograms of crawl stages.
+#
+# every ``crawl_stats_*()`` recording function takes ``None`` instead of
+# context and does nothing then, so instrumented code needs no checks.
+# snapshot is plain dict, it is written as JSON or as Prometheus text
+# format (if file name ends with ``.prom``).
+
+import json
+import os
+import threading
+import time
+from . import retry_queue
+from . import url_frontier
+
+STAGE_LIST = ('fetch', 'parse', 'extract', 'write')
+
+# upper bounds of histogram buckets, seconds
+HISTOGRAM_BOUND_LIST = (
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+        1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+        )
+
+COUNTER_NAME_LIST = (
+        'page',
+        'firm',
+        'error',
+        'retry',
+        'probe_miss',
+        'byte',
+        'backpressure',
+        'backpressure_time',
+        )
+
+METRIC_PREFIX = 'e58_fetch_'
+
+class CrawlStatsCtx:
+    pass
+
+def init_crawl_stats(crawl_stats_ctx):
+    crawl_stats_ctx.lock = threading.Lock()
+    crawl_stats_ctx.start_time = time.monotonic()
+    crawl_stats_ctx.counter_map = dict(
+            (counter_name, 0)
+            for counter_name in COUNTER_NAME_LIST
+            )
+    crawl_stats_ctx.error_type_map = {}
+    crawl_stats_ctx.histogram_map = dict(
+            (stage, {
+                    'bucket_list': [0] * (len(HISTOGRAM_BOUND_LIST) + 1),
+                    'count': 0,
+                    'sum': 0.0,
+                    })
+            for stage in STAGE_LIST
+            )
+    crawl_stats_ctx.last_time = crawl_stats_ctx.start_time
+    crawl_stats_ctx.last_page_count = 0
+
+def crawl_stats_observe(crawl_stats_ctx, stage, duration):
+    if crawl_stats_ctx is None:
+        return
+    
+    bucket_i = 0
+    
+    for bound in HISTOGRAM_BOUND_LIST:
+        if duration <= bound:
+            break
+        
+        bucket_i += 1
+    
+    with crawl_stats_ctx.lock:
+        histogram = crawl_stats_ctx.histogram_map[stage]
+        histogram['bucket_list'][bucket_i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += duration
+
+def crawl_stats_observe_map(crawl_stats_ctx, timing_map):
+    # ``timing_map`` -- stage to duration
+    
+    for stage, duration in timing_map.items():
+        crawl_stats_observe(crawl_stats_ctx, stage, duration)
+
+def crawl_stats_add(crawl_stats_ctx, counter_name, value=1):
+    if crawl_stats_ctx is None:
+        return
+    
+    with crawl_stats_ctx.lock:
+        crawl_stats_ctx.counter_map[counter_name] += value
+
+def crawl_stats_error(crawl_stats_ctx, err_type):
+    if crawl_stats_ctx is None:
+        return
+    
+    err_type_name = getattr(err_type, '__name__', str(err_type))
+    
+    with crawl_stats_ctx.lock:
+        crawl_stats_ctx.counter_map['error'] += 1
+        crawl_stats_ctx.error_type_map[err_type_name] = \
+                crawl_stats_ctx.error_type_map.get(err_type_name, 0) + 1
+
+def crawl_stats_snapshot(crawl_stats_ctx, bulk_data_ctx=None, event_queue=None):
+    # returns dict of all numbers. rate of pages is given for whole
+    # crawl and for time since previous snapshot
+    
+    now = time.monotonic()
+    
+    with crawl_stats_ctx.lock:
+        counter_map = dict(crawl_stats_ctx.counter_map)
+        error_type_map = dict(crawl_stats_ctx.error_type_map)
+        histogram_map = dict(
+                (stage, {
+                        'bucket_list': list(histogram['bucket_list']),
+                        'count': histogram['count'],
+                        'sum': histogram['sum'],
+                        })
+                for stage, histogram in crawl_stats_ctx.histogram_map.items()
+                )
+        last_time = crawl_stats_ctx.last_time
+        last_page_count = crawl_stats_ctx.last_page_count
+        crawl_stats_ctx.last_time = now
+        crawl_stats_ctx.last_page_count = counter_map['page']
+    
+    elapsed_time = now - crawl_stats_ctx.start_time
+    snapshot = {
+            'elapsed_time': elapsed_time,
+            'counter_map': counter_map,
+            'error_type_map': error_type_map,
+            'histogram_map': histogram_map,
+            'page_rate': counter_map['page'] / elapsed_time if elapsed_time > 0.0 else 0.0,
+            'recent_page_rate': (counter_map['page'] - last_page_count) / (now - last_time)
+                    if now > last_time else 0.0,
+            'error_rate': counter_map['error'] / (counter_map['page'] + counter_map['error'])
+                    if counter_map['page'] + counter_map['error'] else 0.0,
+            }
+    
+    if bulk_data_ctx is not None:
+        with bulk_data_ctx.lock:
+            snapshot['frontier_depth'] = url_frontier.url_frontier_len(
+                    bulk_data_ctx.url_frontier)
+            snapshot['in_flight'] = bulk_data_ctx.in_flight_count
+        
+        if bulk_data_ctx.concurrency_ctl is not None:
+            snapshot['concurrency_limit'] = bulk_data_ctx.concurrency_ctl.limit
+            snapshot['concurrency_active'] = bulk_data_ctx.concurrency_ctl.active_count
+            snapshot['concurrency_decrease'] = bulk_data_ctx.concurrency_ctl.decrease_count
+        
+        if bulk_data_ctx.retry_queue is not None:
+            snapshot['retry_pending'] = retry_queue.retry_queue_len(
+                    bulk_data_ctx.retry_queue)
+        
+        if bulk_data_ctx.host_rate is not None:
+            snapshot['rate_wait'] = bulk_data_ctx.host_rate.wait_count
+            snapshot['rate_wait_time'] = bulk_data_ctx.host_rate.wait_time
+    
+    if event_queue is not None:
+        snapshot['event_queue_size'] = event_queue.qsize()
+    
+    return snapshot
+
+def format_progress(snapshot):
+    return '[{:.0f}s] pages: {} ({:.1f}/s), firms: {}, errors: {}, retries: {}, ' \
+            'frontier: {}, in flight: {}, limit: {}, {:.1f} MiB'.format(
+                    snapshot['elapsed_time'],
+                    snapshot['counter_map']['page'],
+                    snapshot['recent_page_rate'],
+                    snapshot['counter_map']['firm'],
+                    snapshot['counter_map']['error'],
+                    snapshot['counter_map']['retry'],
+                    snapshot.get('frontier_depth', '-'),
+                    snapshot.get('in_flight', '-'),
+                    int(snapshot['concurrency_limit'])
+                            if 'concurrency_limit' in snapshot else '-',
+                    snapshot['counter_map']['byte'] / 1024 / 1024,
+                    )
+
+def format_prometheus(snapshot):
+    line_list = []
+    
+    for counter_name, value in snapshot['counter_map'].items():
+        if counter_name == 'backpressure_time':
+            metric_name = '{}backpressure_seconds_total'.format(METRIC_PREFIX)
+        else:
+            metric_name = '{}{}_total'.format(METRIC_PREFIX, counter_name)
+        
+        line_list.append('# TYPE {} counter'.format(metric_name))
+        line_list.append('{} {}'.format(metric_name, value))
+    
+    for counter_name in ('concurrency_decrease', 'rate_wait', 'rate_wait_time'):
+        if counter_name not in snapshot:
+            continue
+        
+        if counter_name == 'rate_wait_time':
+            metric_name = '{}rate_wait_seconds_total'.format(METRIC_PREFIX)
+        else:
+            metric_name = '{}{}_total'.format(METRIC_PREFIX, counter_name)
+        
+        line_list.append('# TYPE {} counter'.format(metric_name))
+        line_list.append('{} {}'.format(metric_name, snapshot[counter_name]))
+    
+    line_list.append('# TYPE {}error_type_total counter'.format(METRIC_PREFIX))
+    
+    for err_type_name, value in sorted(snapshot['error_type_map'].items()):
+        line_list.append('{}error_type_total{{type={}}} {}'.format(
+                METRIC_PREFIX, json.dumps(err_type_name), value))
+    
+    for gauge_name in (
+            'page_rate',
+            'recent_page_rate',
+            'error_rate',
+            'frontier_depth',
+            'in_flight',
+            'event_queue_size',
+            'concurrency_limit',
+            'concurrency_active',
+            'retry_pending',
+            ):
+        if gauge_name not in snapshot:
+            continue
+        
+        metric_name = '{}{}'.format(METRIC_PREFIX, gauge_name)
+        
+        line_list.append('# TYPE {} gauge'.format(metric_name))
+        line_list.append('{} {}'.format(metric_name, snapshot[gauge_name]))
+    
+    metric_name = '{}stage_seconds'.format(METRIC_PREFIX)
+    
+    line_list.append('# TYPE {} histogram'.format(metric_name))
+    
+    for stage, histogram in snapshot['histogram_map'].items():
+        bucket_count = 0
+        
+        for bound, count in zip(
+                HISTOGRAM_BOUND_LIST + ('+Inf',),
+                histogram['bucket_list'],
+                ):
+            bucket_count += count
+            
+            line_list.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                    metric_name, stage, bound, bucket_count))
+        
+        line_list.append('{}_sum{{stage="{}"}} {}'.format(
+                metric_name, stage, histogram['sum']))
+        line_list.append('{}_count{{stage="{}"}} {}'.format(
+                metric_name, stage, histogram['count']))
+    
+    return ''.join('{}\n'.format(line) for line in line_list)
+
+def write_snapshot(snapshot, stats_path):
+    # file is replaced at once, so readers never see half of it
+    
+    if stats_path.endswith('.prom'):
+        text = format_prometheus(snapshot)
+    else:
+        text = '{}\n'.format(json.dumps(
+                dict(snapshot, histogram_bound_list=HISTOGRAM_BOUND_LIST),
+                indent=4,
+                sort_keys=True,
+                ))
+    
+    tmp_stats_path = '{}.tmp'.format(stats_path)
+    
+    with open(tmp_stats_path, 'w', encoding='utf-8') as fd:
+        fd.write(text)
+    
+    os.replace(tmp_stats_path, stats_path)
@@ -18,255 +18,1481 @@
 assert str is not bytes
 
 from urllib import parse as url
-from urllib import request
+import codecs
+import concurrent.futures
+import http.client
+import itertools
+import multiprocessing
+import re
 import threading
-import html5lib
+import time
+from . import concurrency_ctl
+from . import crawl_profile
+from . import crawl_stats
+from . import retry_queue
 from . import et_find
+from . import html_parse
+from . import http_cache
+from . import http_pool
+from . import shard_coord
+from . import url_frontier
 
 SITE_URL = 'http://e58.ru'
 FETCH_TIMEOUT = 300.0
 FETCH_MAX_LENGTH = 10000000
+PARSER_NAME = 'html5lib'
+PARSE_QUEUE_FACTOR = 2
+SEED_FEED_SIZE = 1000
+SEED_FEED_INTERVAL = 0.05
+THREAD_COUNT = 5
+MAX_THREAD_COUNT = 50
+FIRM_MARKER = 'firminfo'
+FIRM_MARKER_RE = re.compile(re.escape(FIRM_MARKER), re.IGNORECASE)
+
+FIRM_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'attrib': {'id': 'firms'}},
+        {'tag': '{http://www.w3.org/1999/xhtml}h3'},
+        {'tag': '{http://www.w3.org/1999/xhtml}a'},
+        )
+
+PAGINATOR_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('paginator', )}},
+        {'tag': '{http://www.w3.org/1999/xhtml}a'},
+        )
+
+TITLE_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'tag': '{http://www.w3.org/1999/xhtml}h1'},
+        )
+
+DIRECTOR_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('director', )}},
+        )
+
+UADDRESS_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('uaddress', )}},
+        )
+
+ADDRESS_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('address', )}},
+        {'any': (
+                {'tag': '{http://www.w3.org/1999/xhtml}div', 'in_attrib': {'class': ('address', )}},
+                {'tag': '{http://www.w3.org/1999/xhtml}a', 'in_attrib': {'class': ('maplinked', )}},
+                )},
+        )
+
+PHONE_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('phone', )}},
+        {'tag': '{http://www.w3.org/1999/xhtml}img'},
+        )
+
+EMAIL_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('email', )}},
+        )
+
+WWW_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('www', )}},
+        )
+
+WORK_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('work', )}},
+        )
+
+RUBRIKS_CHAIN = (
+        {'tag': '{http://www.w3.org/1999/xhtml}html'},
+        {'tag': '{http://www.w3.org/1999/xhtml}body'},
+        {'in_attrib': {'class': ('firminfo', )}},
+        {'in_attrib': {'class': ('rubriks', )}},
+        )
 
 class FetchError(Exception):
     pass
 
+class FetchCodeError(FetchError):
+    # response has invalid http code (``code`` attribute)
+    
+    def __init__(self, msg, code):
+        super().__init__(msg)
+        
+        self.code = code
+
+def is_overload_error(e):
+    # errors which show that server is overloaded: timeouts, dropped
+    # connections, ``429 Too Many Requests`` and ``5xx`` codes
+    
+    if isinstance(e, FetchCodeError):
+        return e.code == 429 or e.code >= 500
+    
+    return isinstance(e, (OSError, http.client.HTTPException))
+
+def is_transient_error(e):
+    # errors which may pass on next attempt. parse errors and codes
+    # like ``404`` are permanent
+    
+    if isinstance(e, FetchCodeError):
+        return e.code in (408, 429) or e.code >= 500
+    
+    return isinstance(e, (OSError, http.client.HTTPException))
+
 class ParseError(Exception):
     pass
 
-def fetch(opener, request):
-    resp = opener.open(
-            request,
+def fetch_raw(http_pool_ctx, fetch_url, http_cache_ctx=None):
+    # redirects are not followed by ``http_pool``, so any redirect
+    # is rejected here as invalid code
+    
+    cache_entry = None
+    header_map = None
+    
+    if http_cache_ctx is not None:
+        cache_entry = http_cache.http_cache_get(http_cache_ctx, fetch_url)
+        
+        if http_cache_ctx.offline:
+            body = None
+            
+            if cache_entry is not None:
+                body = http_cache.http_cache_load(
+                        http_cache_ctx, fetch_url, cache_entry)
+            
+            if body is None:
+                raise FetchError('url is not in cache (offline mode)')
+            
+            return body
+        
+        if cache_entry is not None:
+            header_map = http_cache.http_cache_conditional_header_map(
+                    cache_entry)
+    
+    code, resp_header_map, body = http_pool.http_pool_get(
+            http_pool_ctx,
+            fetch_url,
             timeout=FETCH_TIMEOUT,
+            max_length=FETCH_MAX_LENGTH,
+            header_map=header_map,
+            )
+    
+    body = fetch_raw_result(
+            http_cache_ctx,
+            fetch_url,
+            cache_entry,
+            code,
+            resp_header_map,
+            body,
             )
     
-    if resp.geturl() != request.get_full_url() or resp.getcode() != 200:
-        raise FetchError('invalid url or invalid code')
+    if body is None:
+        # cached body is lost after lookup: page is fetched again
+        code, resp_header_map, body = http_pool.http_pool_get(
+                http_pool_ctx,
+                fetch_url,
+                timeout=FETCH_TIMEOUT,
+                max_length=FETCH_MAX_LENGTH,
+                )
+        body = fetch_raw_result(
+                http_cache_ctx,
+                fetch_url,
+                None,
+                code,
+                resp_header_map,
+                body,
+                )
+    
+    return body
+
+def fetch_raw_result(
+        http_cache_ctx,
+        fetch_url,
+        cache_entry,
+        code,
+        resp_header_map,
+        body,
+        ):
+    # checks response and keeps cache in sync with it. it is shared
+    # by thread and asyncio engines. returns ``None`` if server confirmed
+    # cached body, but it is lost -- page must be fetched again without
+    # conditional headers
+    
+    if code == 304 and cache_entry is not None:
+        return http_cache.http_cache_load(
+                http_cache_ctx, fetch_url, cache_entry, is_revalidated=True)
+    
+    if code != 200:
+        raise FetchCodeError('invalid url or invalid code', code)
+    
+    if http_cache_ctx is not None:
+        http_cache.http_cache_put(
+                http_cache_ctx,
+                fetch_url,
+                body,
+                resp_header_map.get('etag'),
+                resp_header_map.get('last-modified'),
+                )
     
-    text = resp.read(FETCH_MAX_LENGTH).decode('utf-8', 'replace')
+    return body
+
+def fetch(http_pool_ctx, fetch_url, http_cache_ctx=None):
+    text = fetch_raw(
+            http_pool_ctx,
+            fetch_url,
+            http_cache_ctx=http_cache_ctx,
+            ).decode('utf-8', 'replace')
     
     return text
 
-def data_fetch_thread(
+def join_itertext(elem_list):
+    return ' | '.join(
+            ' '.join(filter(
+                    None,
+                    (frag.strip() for frag in elem.itertext()),
+                    )) for elem in elem_list
+            )
+
+def join_itertext_without_label(label):
+    def join(elem_list):
+        return ' | '.join(
+                ' '.join(filter(
+                        lambda text: text and text != label,
+                        (frag.strip() for frag in elem.itertext()),
+                        )) for elem in elem_list
+                )
+    
+    return join
+
+def join_text(elem_list):
+    return ' | '.join(filter(
+            None,
+            (elem.text for elem in elem_list),
+            ))
+
+def join_attrib(attrib_name):
+    def join(elem_list):
+        return ' | '.join(filter(
+                None,
+                (elem.get(attrib_name) for elem in elem_list),
+                ))
+    
+    return join
+
+# schema of firm page -- list of ``(field_name, condition_chain, join)``.
+#
+#   ``join`` makes field value (str) from elems found by ``condition_chain``.
+#
+#   all chains (and link chains) are found by one ``et_find.find_multi()``,
+#   so adding new field costs only its own unique chain tail.
+#
+FIRM_FIELD_SCHEMA = (
+        ('title', TITLE_CHAIN, join_itertext),
+        ('director', DIRECTOR_CHAIN, join_itertext),
+        ('uaddress', UADDRESS_CHAIN, join_text),
+        ('address', ADDRESS_CHAIN, join_text),
+        ('phone', PHONE_CHAIN, join_attrib('src')),
+        ('email', EMAIL_CHAIN, join_itertext),
+        ('www', WWW_CHAIN, join_itertext),
+        ('work', WORK_CHAIN, join_itertext_without_label('Деятельность:')),
+        ('rubriks', RUBRIKS_CHAIN, join_itertext_without_label('Рубрики:')),
+        )
+
+FIRM_FIELD_LIST = tuple(
+        field_name
+        for field_name, condition_chain, join in FIRM_FIELD_SCHEMA
+        )
+
+LINK_CHAIN_MAP = {
+        'firm_link': FIRM_CHAIN,
+        'page_link': PAGINATOR_CHAIN,
+        }
+
+PAGE_CHAIN_MAP = dict(LINK_CHAIN_MAP)
+PAGE_CHAIN_MAP.update(
+        (field_name, condition_chain)
+        for field_name, condition_chain, join in FIRM_FIELD_SCHEMA
+        )
+
+def is_extraction_suspect(html, elem_list_map):
+    return is_extraction_suspect_by_marker(
+            FIRM_MARKER_RE.search(html) is not None,
+            elem_list_map,
+            )
+
+def is_extraction_suspect_by_marker(is_firm_marker, elem_list_map):
+    # fast parser backends may build wrong tree on broken markup.
+    # such tree usually loses firm info or all links at once.
+    #
+    # ``is_firm_marker`` -- page text has ``FIRM_MARKER`` (in any case,
+    # like in ``scan_page_elems()``)
+    
+    if elem_list_map['title']:
+        return False
+    
+    if is_firm_marker:
+        return True
+    
+    for link_name in LINK_CHAIN_MAP:
+        if elem_list_map[link_name]:
+            return False
+    
+    return True
+
+def scan_page_elems(html, timing_map=None, profile_map=None):
+    # fast path of listing and paginator pages for ``html5lib``. page without
+    # ``FIRM_MARKER`` (in any case) can not have firm info, so only links
+    # are found, by ``html_parse.scan()``. returns ``None`` if page may
+    # have firm info or if no link is found -- page needs full parse then.
+    #
+    # ``timing_map`` -- if it is set, scan time is added to its
+    # ``'parse'`` item
+    
+    if FIRM_MARKER_RE.search(html) is not None:
+        return None
+    
+    if timing_map is None:
+        timing_map = {}
+    
+    begin_time = time.perf_counter()
+    
+    try:
+        link_elem_list_map = html_parse.scan(html, LINK_CHAIN_MAP)
+    except Exception:
+        link_elem_list_map = None
+    
+    scan_time = time.perf_counter() - begin_time
+    timing_map['parse'] = timing_map.get('parse', 0.0) + scan_time
+    
+    if profile_map is not None:
+        crawl_profile.profile_map_add(profile_map, 'parse;scan', scan_time)
+    
+    if link_elem_list_map is None or not any(link_elem_list_map.values()):
+        return None
+    
+    elem_list_map = dict(
+            (name, ())
+            for name in PAGE_CHAIN_MAP
+            )
+    elem_list_map.update(link_elem_list_map)
+    
+    return elem_list_map
+
+def find_page_chains(doc, profile_map=None):
+    # finds all chains of ``PAGE_CHAIN_MAP`` in tree ``doc``
+    
+    if profile_map is None:
+        return et_find.find_multi((doc,), PAGE_CHAIN_MAP)
+    
+    begin_time = time.perf_counter()
+    elem_list_map = et_find.find_multi((doc,), PAGE_CHAIN_MAP)
+    crawl_profile.profile_map_add(
+            profile_map,
+            'extract;find',
+            time.perf_counter() - begin_time,
+            )
+    
+    if profile_map['is_sample']:
+        # extra work of sampled page: cost of every chain on its own
+        crawl_profile.sample_pause(profile_map)
+        
+        for chain_name, condition_chain in PAGE_CHAIN_MAP.items():
+            begin_time = time.perf_counter()
+            tuple(et_find.find((doc,), condition_chain))
+            crawl_profile.profile_map_selector(
+                    profile_map,
+                    chain_name,
+                    time.perf_counter() - begin_time,
+                    )
+        
+        crawl_profile.sample_resume(profile_map)
+    
+    return elem_list_map
+
+def find_page_elems(html, parser_name, timing_map=None, profile_map=None):
+    # ``timing_map`` -- if it is set, time of building trees is added
+    # to its ``'parse'`` item
+    
+    if timing_map is None:
+        timing_map = {}
+    
+    timing_map.setdefault('parse', 0.0)
+    
+    if parser_name != 'html5lib':
+        try:
+            begin_time = time.perf_counter()
+            doc = html_parse.parse(html, parser_name)
+            timing_map['parse'] += time.perf_counter() - begin_time
+            elem_list_map = find_page_chains(doc, profile_map=profile_map)
+        except html_parse.ParserBackendError:
+            raise
+        except Exception:
+            elem_list_map = None
+        
+        if elem_list_map is not None and \
+                not is_extraction_suspect(html, elem_list_map):
+            return elem_list_map
+    
+    # html5lib is reference parser, also it is fallback for other backends
+    begin_time = time.perf_counter()
+    doc = html_parse.parse(html, 'html5lib')
+    parse_time = time.perf_counter() - begin_time
+    timing_map['parse'] += parse_time
+    
+    if profile_map is not None and parser_name != 'html5lib':
+        crawl_profile.profile_map_add(profile_map, 'parse;fallback', parse_time)
+    
+    return find_page_chains(doc, profile_map=profile_map)
+
+def extract_page(fetch_url, html, parser_name=None, timing_map=None, profile_map=None):
+    # returns ``(link_url_list, fetch_data)``. ``fetch_data`` is ``None``
+    # for pages without firm info (listing pages).
+    #
+    # ``timing_map`` -- if it is set, gets durations of ``'parse'``
+    # (building trees) and ``'extract'`` (the rest) stages
+    #
+    # ``profile_map`` -- if it is set, gets timers of steps (see
+    # ``crawl_profile``)
+    
+    if parser_name is None:
+        parser_name = PARSER_NAME
+    
+    if timing_map is None:
+        timing_map = {}
+    
+    begin_time = time.perf_counter()
+    
+    try:
+        elem_list_map = None
+        
+        if parser_name == 'html5lib':
+            # scan is cheaper than tree of reference parser only. C and
+            # tree backends of ``html.parser`` are as fast as scan itself
+            elem_list_map = scan_page_elems(
+                    html,
+                    timing_map=timing_map,
+                    profile_map=profile_map,
+                    )
+        
+        if elem_list_map is None:
+            elem_list_map = find_page_elems(
+                    html,
+                    parser_name,
+                    timing_map=timing_map,
+                    profile_map=profile_map,
+                    )
+        
+        return extract_page_elems(fetch_url, elem_list_map, profile_map=profile_map)
+    finally:
+        timing_map['extract'] = \
+                time.perf_counter() - begin_time - timing_map.get('parse', 0.0)
+
+def extract_page_elems(fetch_url, elem_list_map, profile_map=None):
+    if profile_map is not None:
+        begin_time = time.perf_counter()
+    
+    link_url_list = []
+    
+    for link_name in LINK_CHAIN_MAP:
+        for link_elem in elem_list_map[link_name]:
+            link_url = link_elem.get('href')
+            if link_url is not None:
+                link_url_list.append(url.urljoin(fetch_url, link_url))
+    
+    if profile_map is not None:
+        crawl_profile.profile_map_add(
+                profile_map,
+                'extract;links',
+                time.perf_counter() - begin_time,
+                )
+    
+    if not elem_list_map['title']:
+        return link_url_list, None
+    
+    fetch_data = {}
+    
+    if profile_map is None:
+        for field_name, condition_chain, join in FIRM_FIELD_SCHEMA:
+            fetch_data[field_name] = join(elem_list_map[field_name])
+    else:
+        for field_name, condition_chain, join in FIRM_FIELD_SCHEMA:
+            begin_time = time.perf_counter()
+            fetch_data[field_name] = join(elem_list_map[field_name])
+            crawl_profile.profile_map_add(
+                    profile_map,
+                    'extract;field.{}'.format(field_name),
+                    time.perf_counter() - begin_time,
+                    )
+    
+    if not fetch_data['title']:
+        return link_url_list, None
+    
+    return link_url_list, fetch_data
+
+def fetch_page_elems_stream(http_pool_ctx, fetch_url, parser_name, timing_map=None):
+    # streaming form of ``fetch()`` and ``find_page_elems()``: every part of
+    # body is decoded and fed to incremental parser as soon as it comes,
+    # so neither whole body nor whole text is kept. returns
+    # ``(elem_list_map, byte_count)``. ``elem_list_map`` is ``None`` if
+    # parser failed or its result is suspect -- page must be fetched again
+    # for ``html5lib``.
+    #
+    # ``timing_map`` -- if it is set, parse time is added to its
+    # ``'parse'`` item
+    
+    if timing_map is None:
+        timing_map = {}
+    
+    timing_map.setdefault('parse', 0.0)
+    
+    stream_parse_ctx = html_parse.StreamParseCtx()
+    html_parse.init_stream_parse(stream_parse_ctx, parser_name)
+    text_decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    
+    # ``state_map`` -- ``marker_tail`` is end of previous part, marker may
+    # be split between parts
+    state_map = {
+            'byte_count': 0,
+            'is_failed': False,
+            'is_firm_marker': False,
+            'marker_tail': '',
+            }
+    
+    def feed(html_part):
+        if not state_map['is_firm_marker']:
+            marker_text = state_map['marker_tail'] + html_part
+            state_map['is_firm_marker'] = \
+                    FIRM_MARKER_RE.search(marker_text) is not None
+            state_map['marker_tail'] = marker_text[-(len(FIRM_MARKER) - 1):]
+        
+        if state_map['is_failed']:
+            return
+        
+        begin_time = time.perf_counter()
+        
+        try:
+            html_parse.stream_parse_feed(stream_parse_ctx, html_part)
+        except Exception:
+            # the rest of body is still read: connection stays reusable
+            state_map['is_failed'] = True
+        
+        timing_map['parse'] += time.perf_counter() - begin_time
+    
+    def on_chunk(chunk):
+        state_map['byte_count'] += len(chunk)
+        
+        feed(text_decoder.decode(chunk))
+    
+    code, resp_header_map = http_pool.http_pool_get_stream(
+            http_pool_ctx,
+            fetch_url,
+            timeout=FETCH_TIMEOUT,
+            max_length=FETCH_MAX_LENGTH,
+            on_chunk=on_chunk,
+            )
+    
+    if code != 200:
+        raise FetchCodeError('invalid url or invalid code', code)
+    
+    feed(text_decoder.decode(b'', final=True))
+    
+    if state_map['is_failed']:
+        return None, state_map['byte_count']
+    
+    begin_time = time.perf_counter()
+    
+    try:
+        doc = html_parse.stream_parse_close(stream_parse_ctx)
+    except Exception:
+        return None, state_map['byte_count']
+    finally:
+        timing_map['parse'] += time.perf_counter() - begin_time
+    
+    elem_list_map = et_find.find_multi((doc,), PAGE_CHAIN_MAP)
+    
+    if is_extraction_suspect_by_marker(state_map['is_firm_marker'], elem_list_map):
+        return None, state_map['byte_count']
+    
+    return elem_list_map, state_map['byte_count']
+
+def extract_page_raw_timed(fetch_url, raw_html, parser_name=None, profile_map=None):
+    # entry point of parse processes: bytes are much cheaper to pass
+    # between processes than ``str``, and result is plain lists and dicts.
+    # returns ``(link_url_list, fetch_data, timing_map)``: timing map can
+    # not be passed back from parse process by argument.
+    #
+    # ``profile_map`` -- if it is set, it is filled and passed back as
+    # ``'profile_map'`` item of timing map (see ``observe_page()``)
+    
+    timing_map = {}
+    
+    def extract():
+        return extract_page(
+                fetch_url,
+                raw_html.decode('utf-8', 'replace'),
+                parser_name=parser_name,
+                timing_map=timing_map,
+                profile_map=profile_map,
+                )
+    
+    if profile_map is None:
+        link_url_list, fetch_data = extract()
+    else:
+        profile_map['size'] = len(raw_html)
+        
+        if profile_map['is_sample']:
+            link_url_list, fetch_data = crawl_profile.sample_call(profile_map, extract)
+        else:
+            link_url_list, fetch_data = extract()
+        
+        timing_map['profile_map'] = profile_map
+    
+    return link_url_list, fetch_data, timing_map
+
+def observe_page(bulk_data_ctx, fetch_url, timing_map):
+    # stage durations of page go to crawl stats, its profile map (if
+    # there is) goes to crawl profile
+    
+    profile_map = timing_map.pop('profile_map', None)
+    
+    crawl_stats.crawl_stats_observe_map(bulk_data_ctx.crawl_stats, timing_map)
+    
+    if profile_map is not None:
+        crawl_profile.crawl_profile_page(
+                bulk_data_ctx.crawl_profile,
+                fetch_url,
+                timing_map,
+                profile_map,
+                )
+
+def is_own_url(bulk_data_ctx, link_url):
+    # ``False`` if url is of other shard
+    
+    return bulk_data_ctx.shard_coord is None or \
+            shard_coord.shard_coord_is_own(bulk_data_ctx.shard_coord, link_url)
+
+def route_url(bulk_data_ctx, link_url):
+    # sends url of other shard to its owner (once per url)
+    
+    with bulk_data_ctx.cond:
+        if not url_frontier.url_frontier_mark_seen(
+                bulk_data_ctx.url_frontier, link_url):
+            return
+    
+    shard_coord.shard_coord_route(bulk_data_ctx.shard_coord, link_url)
+
+def is_discovery_page(bulk_data_ctx, fetch_data):
+    # ``True`` if links of page go to background lane of frontier: page
+    # is listing page (it has no firm info), and discovery is background
+    
+    return bulk_data_ctx.is_background_discovery and fetch_data is None
+
+def is_probe_miss(bulk_data_ctx, fetch_url, e):
+    # ``True`` if ``e`` is ``404`` of probe url -- such url is just not
+    # firm, it is not error
+    
+    if not isinstance(e, FetchCodeError) or e.code != 404 or \
+            fetch_url not in bulk_data_ctx.probe_url_set:
+        return False
+    
+    crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'probe_miss')
+    
+    return True
+
+def schedule_url_list(
+        bulk_data_ctx,
+        link_url_list,
+        on_scheduled=None,
+        is_background=False,
+        ):
+    # returns count of newly scheduled urls. ``is_background`` -- urls go
+    # to background lane of frontier
+    
+    scheduled_count = 0
+    
+    for link_url in link_url_list:
+        if not is_own_url(bulk_data_ctx, link_url):
+            route_url(bulk_data_ctx, link_url)
+            
+            continue
+        
+        with bulk_data_ctx.cond:
+            if not url_frontier.url_frontier_add(
+                    bulk_data_ctx.url_frontier,
+                    link_url,
+                    is_background=is_background,
+                    ):
+                continue
+            
+            bulk_data_ctx.cond.notify()
+        
+        scheduled_count += 1
+        
+        if on_scheduled is not None:
+            on_scheduled(link_url)
+    
+    return scheduled_count
+
+def schedule_retry(bulk_data_ctx, fetch_url, e):
+    # returns ``True`` if url is scheduled for retry after error ``e``
+    
+    if bulk_data_ctx.retry_queue is None or not is_transient_error(e):
+        return False
+    
+    with bulk_data_ctx.cond:
+        if retry_queue.retry_queue_schedule(
+                bulk_data_ctx.retry_queue, fetch_url) is None:
+            return False
+        
+        # waiting workers must recount their timeouts
+        bulk_data_ctx.cond.notify_all()
+    
+    crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'retry')
+    
+    return True
+
+def schedule_due_retries(bulk_data_ctx):
+    # moves due urls from retry queue to frontier. returns time until
+    # next url is due (``None`` if there is no one). must be called under
+    # ``bulk_data_ctx.lock``
+    
+    if bulk_data_ctx.retry_queue is None:
+        return None
+    
+    for retry_url in retry_queue.retry_queue_pop_due(bulk_data_ctx.retry_queue):
+        url_frontier.url_frontier_push(bulk_data_ctx.url_frontier, retry_url)
+    
+    return retry_queue.retry_queue_wait_time(bulk_data_ctx.retry_queue)
+
+def fetch_observed(bulk_data_ctx, fetch_url, fetch_func, timing_map=None):
+    # calls ``fetch_func()`` (it returns ``(result, byte_count)``) under
+    # concurrency control and rate limit (if they are set), with crawl
+    # stats of fetch stage. returns ``result``.
+    #
+    # ``timing_map`` -- the map where ``fetch_func()`` adds time of
+    # parsing (``'parse'`` item) if it parses while fetching. this time
+    # is not counted as fetch time
+    
+    concurrency_ctl_ctx = bulk_data_ctx.concurrency_ctl
+    host_rate_ctx = bulk_data_ctx.host_rate
+    
+    if timing_map is None:
+        timing_map = {}
+    
+    if host_rate_ctx is not None:
+        # rate wait is before slot: sleeping worker must not take slot
+        time.sleep(concurrency_ctl.host_rate_reserve(
+                host_rate_ctx,
+                url.urlsplit(fetch_url).netloc,
+                ))
+    
+    if concurrency_ctl_ctx is not None:
+        concurrency_ctl.concurrency_ctl_acquire(concurrency_ctl_ctx)
+    
+    latency = None
+    is_overload = False
+    
+    try:
+        begin_parse_time = timing_map.get('parse', 0.0)
+        begin_time = time.perf_counter()
+        
+        try:
+            result, byte_count = fetch_func()
+        except Exception as e:
+            is_overload = is_overload_error(e)
+            
+            raise
+        
+        latency = time.perf_counter() - begin_time - \
+                (timing_map.get('parse', 0.0) - begin_parse_time)
+    finally:
+        if concurrency_ctl_ctx is not None:
+            concurrency_ctl.concurrency_ctl_release(
+                    concurrency_ctl_ctx,
+                    latency=latency,
+                    is_overload=is_overload,
+                    )
+    
+    crawl_stats.crawl_stats_observe(bulk_data_ctx.crawl_stats, 'fetch', latency)
+    crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'page')
+    crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'byte', byte_count)
+    
+    return result
+
+def fetch_raw_observed(bulk_data_ctx, fetch_url):
+    def fetch_func():
+        raw_html = fetch_raw(
+                bulk_data_ctx.http_pool,
+                fetch_url,
+                http_cache_ctx=bulk_data_ctx.http_cache,
+                )
+        
+        return raw_html, len(raw_html)
+    
+    return fetch_observed(bulk_data_ctx, fetch_url, fetch_func)
+
+def fetch_extract_stream_observed(bulk_data_ctx, fetch_url):
+    # streaming form of ``fetch_raw_observed()`` and
+    # ``extract_page_raw_timed()``. returns
+    # ``(link_url_list, fetch_data, timing_map)``
+    
+    timing_map = {}
+    
+    # page is not whole at any time, so it is never sampled
+    profile_map = crawl_profile.crawl_profile_begin(bulk_data_ctx.crawl_profile)
+    
+    if profile_map is not None:
+        profile_map['is_sample'] = False
+    
+    def fetch_func():
+        elem_list_map, byte_count = fetch_page_elems_stream(
+                bulk_data_ctx.http_pool,
+                fetch_url,
+                bulk_data_ctx.parser_name,
+                timing_map=timing_map,
+                )
+        
+        if profile_map is not None:
+            profile_map['size'] = byte_count
+        
+        return elem_list_map, byte_count
+    
+    elem_list_map = fetch_observed(
+            bulk_data_ctx,
+            fetch_url,
+            fetch_func,
+            timing_map=timing_map,
+            )
+    
+    if elem_list_map is None:
+        # rare case of broken markup: reference parser needs whole text.
+        # it is one more request, so it is under the same concurrency
+        # control and rate limit
+        raw_html = fetch_raw_observed(bulk_data_ctx, fetch_url)
+    
+    begin_time = time.perf_counter()
+    begin_parse_time = timing_map['parse']
+    
+    try:
+        if elem_list_map is None:
+            elem_list_map = find_page_elems(
+                    raw_html.decode('utf-8', 'replace'),
+                    'html5lib',
+                    timing_map=timing_map,
+                    profile_map=profile_map,
+                    )
+        
+        link_url_list, fetch_data = extract_page_elems(
+                fetch_url,
+                elem_list_map,
+                profile_map=profile_map,
+                )
+    finally:
+        timing_map['extract'] = time.perf_counter() - begin_time - \
+                (timing_map['parse'] - begin_parse_time)
+    
+    if profile_map is not None:
+        timing_map['profile_map'] = profile_map
+    
+    return link_url_list, fetch_data, timing_map
+
+def data_fetch_url(
         bulk_data_ctx,
+        fetch_url,
         on_scheduled=None,
         on_begin=None,
         on_fetch=None,
         on_error=None,
         ):
-    while True:
-        with bulk_data_ctx.lock:
-            try:
-                fetch_url = bulk_data_ctx.url_list.pop(0)
-                bulk_data_ctx.used_url_list.append(fetch_url)
-            except IndexError:
-                return
+    # returns ``True`` if url failed and is scheduled for retry
+    
+    try:
+        if on_begin is not None:
+            on_begin(fetch_url)
+        
+        if bulk_data_ctx.is_stream:
+            link_url_list, fetch_data, timing_map = fetch_extract_stream_observed(
+                    bulk_data_ctx, fetch_url)
+        else:
+            raw_html = fetch_raw_observed(bulk_data_ctx, fetch_url)
+            link_url_list, fetch_data, timing_map = extract_page_raw_timed(
+                    fetch_url,
+                    raw_html,
+                    parser_name=bulk_data_ctx.parser_name,
+                    profile_map=crawl_profile.crawl_profile_begin(
+                            bulk_data_ctx.crawl_profile),
+                    )
+            del raw_html
+        
+        observe_page(bulk_data_ctx, fetch_url, timing_map)
+        
+        schedule_url_list(
+                bulk_data_ctx,
+                link_url_list,
+                on_scheduled=on_scheduled,
+                is_background=is_discovery_page(bulk_data_ctx, fetch_data),
+                )
+        
+        if fetch_data is not None:
+            crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'firm')
+            
+            if on_fetch is not None:
+                on_fetch(fetch_url, fetch_data)
+    except Exception as e:
+        if is_probe_miss(bulk_data_ctx, fetch_url, e):
+            return False
+        
+        crawl_stats.crawl_stats_error(bulk_data_ctx.crawl_stats, type(e))
+        
+        if schedule_retry(bulk_data_ctx, fetch_url, e):
+            return True
+        
+        if on_error is not None:
+            on_error(fetch_url, type(e), str(e))
+    
+    return False
+
+def data_fetch_url_done(bulk_data_ctx, fetch_url, on_finish=None, is_retried=False):
+    # ``on_finish`` -- called for every url when its processing is over
+    # (with or without error). url which is scheduled for retry is not
+    # over yet
+    
+    if on_finish is not None and not is_retried:
+        on_finish(fetch_url)
+    
+    with bulk_data_ctx.cond:
+        bulk_data_ctx.in_flight_count -= 1
+        bulk_data_ctx.cond.notify_all()
+
+def data_fetch_url_pipelined(
+        bulk_data_ctx,
+        fetch_url,
+        on_scheduled=None,
+        on_begin=None,
+        on_fetch=None,
+        on_error=None,
+        on_finish=None,
+        ):
+    # fetches raw page and passes it to parse process. the url stays
+    # in flight until its result comes back (see ``on_extracted()``)
+    
+    try:
+        if on_begin is not None:
+            on_begin(fetch_url)
+        
+        raw_html = fetch_raw_observed(bulk_data_ctx, fetch_url)
         
+        # bounds count of raw pages waiting for parse process
+        bulk_data_ctx.parse_semaphore.acquire()
         try:
-            if on_begin is not None:
-                on_begin(fetch_url)
+            future = bulk_data_ctx.parse_executor.submit(
+                    extract_page_raw_timed,
+                    fetch_url,
+                    raw_html,
+                    bulk_data_ctx.parser_name,
+                    crawl_profile.crawl_profile_begin(bulk_data_ctx.crawl_profile),
+                    )
+        except Exception:
+            bulk_data_ctx.parse_semaphore.release()
+            raise
+        
+        del raw_html
+    except Exception as e:
+        is_retried = False
+        
+        if not is_probe_miss(bulk_data_ctx, fetch_url, e):
+            crawl_stats.crawl_stats_error(bulk_data_ctx.crawl_stats, type(e))
             
-            opener = request.build_opener()
+            is_retried = schedule_retry(bulk_data_ctx, fetch_url, e)
             
-            html = fetch(opener, request.Request(fetch_url))
-            doc = html5lib.parse(html)
+            if not is_retried and on_error is not None:
+                on_error(fetch_url, type(e), str(e))
+        
+        data_fetch_url_done(
+                bulk_data_ctx,
+                fetch_url,
+                on_finish=on_finish,
+                is_retried=is_retried,
+                )
+        
+        return
+    
+    def on_extracted(future):
+        bulk_data_ctx.parse_semaphore.release()
+        
+        is_retried = False
+        
+        try:
+            link_url_list, fetch_data, timing_map = future.result()
             
-            firm_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'attrib': {'id': 'firms'}},
-                    {'tag': '{http://www.w3.org/1999/xhtml}h3'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}a'},
-                    ))
+            observe_page(bulk_data_ctx, fetch_url, timing_map)
             
-            for firm_elem in firm_elem_list:
-                firm_url = firm_elem.get('href')
-                if firm_url is not None:
-                    firm_url = url.urljoin(fetch_url, firm_url)
-                
-                with bulk_data_ctx.lock:
-                    if firm_url in bulk_data_ctx.url_list or \
-                            firm_url in bulk_data_ctx.new_url_list or \
-                            firm_url in bulk_data_ctx.used_url_list:
-                        continue
-                    
-                    bulk_data_ctx.new_url_list.append(firm_url)
+            schedule_url_list(
+                    bulk_data_ctx,
+                    link_url_list,
+                    on_scheduled=on_scheduled,
+                    is_background=is_discovery_page(bulk_data_ctx, fetch_data),
+                    )
+            
+            if fetch_data is not None:
+                crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'firm')
                 
-                if on_scheduled is not None:
-                    on_scheduled(firm_url)
+                if on_fetch is not None:
+                    on_fetch(fetch_url, fetch_data)
+        except Exception as e:
+            crawl_stats.crawl_stats_error(bulk_data_ctx.crawl_stats, type(e))
             
-            paginator_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('paginator', )}},
-                    {'tag': '{http://www.w3.org/1999/xhtml}a'},
-                    ))
+            is_retried = schedule_retry(bulk_data_ctx, fetch_url, e)
             
-            for paginator_elem in paginator_elem_list:
-                page_url = paginator_elem.get('href')
-                if page_url is not None:
-                    page_url = url.urljoin(fetch_url, page_url)
+            if not is_retried and on_error is not None:
+                on_error(fetch_url, type(e), str(e))
+        finally:
+            data_fetch_url_done(
+                    bulk_data_ctx,
+                    fetch_url,
+                    on_finish=on_finish,
+                    is_retried=is_retried,
+                    )
+    
+    future.add_done_callback(on_extracted)
+
+def data_fetch_thread(
+        bulk_data_ctx,
+        on_scheduled=None,
+        on_begin=None,
+        on_fetch=None,
+        on_error=None,
+        on_finish=None,
+        ):
+    while True:
+        with bulk_data_ctx.cond:
+            while True:
+                if bulk_data_ctx.is_cancelled:
+                    bulk_data_ctx.cond.notify_all()
+                    return
+                
+                retry_wait_time = schedule_due_retries(bulk_data_ctx)
                 
-                with bulk_data_ctx.lock:
-                    if page_url in bulk_data_ctx.url_list or \
-                            page_url in bulk_data_ctx.new_url_list or \
-                            page_url in bulk_data_ctx.used_url_list:
-                        continue
-                    
-                    bulk_data_ctx.new_url_list.append(page_url)
+                if url_frontier.url_frontier_len(bulk_data_ctx.url_frontier):
+                    break
                 
-                if on_scheduled is not None:
-                    on_scheduled(page_url)
+                if not bulk_data_ctx.in_flight_count and retry_wait_time is None \
+                        and not bulk_data_ctx.hold_count:
+                    # quiescence: frontier is empty, nothing in flight
+                    # and nothing waits for retry
+                    bulk_data_ctx.cond.notify_all()
+                    return
+                
+                bulk_data_ctx.cond.wait(retry_wait_time)
             
-            title_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'tag': '{http://www.w3.org/1999/xhtml}h1'},
-                    ))
-            title = ' | '.join(
-                    ' '.join(filter(
-                            None,
-                            (frag.strip() for frag in elem.itertext()),
-                            )) for elem in title_elem_list
+            fetch_url = url_frontier.url_frontier_pop(bulk_data_ctx.url_frontier)
+            bulk_data_ctx.in_flight_count += 1
+        
+        if bulk_data_ctx.parse_executor is not None:
+            data_fetch_url_pipelined(
+                    bulk_data_ctx,
+                    fetch_url,
+                    on_scheduled=on_scheduled,
+                    on_begin=on_begin,
+                    on_fetch=on_fetch,
+                    on_error=on_error,
+                    on_finish=on_finish,
                     )
-            if not title:
-                continue
-            fetch_data = {'title': title}
             
-            director_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('director', )}},
-                    ))
-            fetch_data['director'] = ' | '.join(
-                    ' '.join(filter(
-                            None,
-                            (frag.strip() for frag in elem.itertext()),
-                            )) for elem in director_elem_list
+            continue
+        
+        is_retried = False
+        
+        try:
+            is_retried = data_fetch_url(
+                    bulk_data_ctx,
+                    fetch_url,
+                    on_scheduled=on_scheduled,
+                    on_begin=on_begin,
+                    on_fetch=on_fetch,
+                    on_error=on_error,
+                    )
+        finally:
+            data_fetch_url_done(
+                    bulk_data_ctx,
+                    fetch_url,
+                    on_finish=on_finish,
+                    is_retried=is_retried,
                     )
+
+def get_start_url_list(site_url=None):
+    if site_url is None:
+        site_url = SITE_URL
+    
+    return (url.urljoin(site_url, 'firms/'),)
+
+def get_fetch_control(
+        min_concurrency,
+        max_concurrency,
+        concurrency,
+        rps=None,
+        max_attempts=None,
+        retry_delay=None,
+        ):
+    # returns ``(concurrency_ctl_ctx, host_rate_ctx, retry_queue_ctx)``
+    # for ``init_bulk_data_ctx()``. ``host_rate_ctx`` is ``None`` without
+    # ``rps``, ``retry_queue_ctx`` is ``None`` if url has one attempt
+    
+    if max_attempts is None:
+        max_attempts = retry_queue.MAX_ATTEMPTS
+    
+    concurrency_ctl_ctx = concurrency_ctl.ConcurrencyCtlCtx()
+    concurrency_ctl.init_concurrency_ctl(
+            concurrency_ctl_ctx,
+            min_concurrency,
+            max_concurrency,
+            initial_concurrency=concurrency,
+            )
+    
+    if rps is not None:
+        host_rate_ctx = concurrency_ctl.HostRateCtx()
+        concurrency_ctl.init_host_rate(host_rate_ctx, rps)
+    else:
+        host_rate_ctx = None
+    
+    if max_attempts > 1:
+        retry_queue_ctx = retry_queue.RetryQueueCtx()
+        retry_queue.init_retry_queue(
+                retry_queue_ctx,
+                max_attempts=max_attempts,
+                base_delay=retry_delay,
+                )
+    else:
+        retry_queue_ctx = None
+    
+    return concurrency_ctl_ctx, host_rate_ctx, retry_queue_ctx
+
+class BulkDataCtx:
+    pass
+
+def init_bulk_data_ctx(
+        bulk_data_ctx,
+        site_url=None,
+        parser_name=None,
+        http_cache_ctx=None,
+        seed_url_list=None,
+        seen_url_list=None,
+        direct_url_iter=None,
+        probe_url_iter=None,
+        is_background_discovery=False,
+        crawl_stats_ctx=None,
+        concurrency_ctl_ctx=None,
+        host_rate_ctx=None,
+        retry_queue_ctx=None,
+        is_stream=False,
+        shard_coord_ctx=None,
+        crawl_profile_ctx=None,
+        ):
+    # ``retry_queue_ctx`` -- if it is set, urls failed with transient
+    # errors are fetched again.
+    #
+    # ``is_stream`` -- pages are parsed while they are downloaded (see
+    # ``fetch_page_elems_stream()``). it needs parser from
+    # ``html_parse.STREAM_PARSER_NAME_LIST`` and no ``http_cache_ctx``
+    # (cache needs whole body). parse processes are not used with it.
+    #
+    # ``concurrency_ctl_ctx`` -- adaptive limit of concurrent fetches.
+    # if it is set, count of fetch threads is its upper bound.
+    # ``host_rate_ctx`` -- limit of requests per second for every host.
+    #
+    # ``seed_url_list`` -- urls to start from (instead of firm list of
+    # ``site_url``). ``seen_url_list`` -- urls which must not be scheduled
+    # again (for resume of interrupted crawl)
+    #
+    # ``direct_url_iter`` -- urls of firms, known without firm list (see
+    # ``seed_source``). ``probe_url_iter`` -- the same, but they may be
+    # not firms: their ``404`` is not error. both are iterated lazily, by
+    # ``seed_feed_thread()``. ``is_background_discovery`` --
+    # ``seed_url_list`` and links of listing pages go to background lane
+    # of frontier, they are fetched only when no firm url waits
+    #
+    # ``shard_coord_ctx`` -- crawl is one shard of sharded crawl: only
+    # urls of this shard are fetched, others are routed to their owners.
+    # local quiescence is not the end then -- crawl is held till all
+    # shards are over (see ``shard_sync_thread()``)
+    #
+    # ``crawl_profile_ctx`` -- if it is set, pages are profiled (see
+    # ``crawl_profile``). with ``is_stream`` pages are not sampled
+    
+    if site_url is None:
+        site_url = SITE_URL
+    
+    if parser_name is None:
+        parser_name = PARSER_NAME
+    
+    bulk_data_ctx.parser_name = parser_name
+    bulk_data_ctx.http_cache = http_cache_ctx
+    bulk_data_ctx.crawl_stats = crawl_stats_ctx
+    bulk_data_ctx.crawl_profile = crawl_profile_ctx
+    bulk_data_ctx.concurrency_ctl = concurrency_ctl_ctx
+    bulk_data_ctx.host_rate = host_rate_ctx
+    bulk_data_ctx.retry_queue = retry_queue_ctx
+    bulk_data_ctx.is_stream = is_stream
+    bulk_data_ctx.is_background_discovery = is_background_discovery
+    bulk_data_ctx.probe_url_set = set()
+    bulk_data_ctx.shard_coord = shard_coord_ctx
+    bulk_data_ctx.lock = threading.RLock()
+    bulk_data_ctx.cond = threading.Condition(bulk_data_ctx.lock)
+    bulk_data_ctx.in_flight_count = 0
+    bulk_data_ctx.is_cancelled = False
+    # crawl is not over at quiescence while it is held by shard sync or
+    # by seed feed
+    bulk_data_ctx.hold_count = 0
+    bulk_data_ctx.on_wakeup_list = []
+    bulk_data_ctx.parse_executor = None
+    bulk_data_ctx.http_pool = http_pool.HttpPoolCtx()
+    http_pool.init_http_pool(bulk_data_ctx.http_pool)
+    bulk_data_ctx.url_frontier = url_frontier.UrlFrontierCtx()
+    url_frontier.init_url_frontier(bulk_data_ctx.url_frontier)
+    
+    if seed_url_list is None:
+        seed_url_list = get_start_url_list(site_url)
+    
+    if direct_url_iter is not None or probe_url_iter is not None:
+        # ``(seed_url, is_probe)``
+        bulk_data_ctx.seed_iter = itertools.chain(
+                ((direct_url, False) for direct_url in direct_url_iter or ()),
+                ((probe_url, True) for probe_url in probe_url_iter or ()),
+                )
+    else:
+        bulk_data_ctx.seed_iter = None
+    
+    if shard_coord_ctx is not None:
+        bulk_data_ctx.hold_count += 1
+    
+    if bulk_data_ctx.seed_iter is not None:
+        bulk_data_ctx.hold_count += 1
+    
+    for seed_url in seed_url_list:
+        if not is_own_url(bulk_data_ctx, seed_url):
+            route_url(bulk_data_ctx, seed_url)
             
-            uaddress_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('uaddress', )}},
-                    ))
-            fetch_data['uaddress'] = ' | '.join(filter(
-                    None,
-                    (elem.text for elem in uaddress_elem_list),
-                    ))
+            continue
+        
+        url_frontier.url_frontier_add(
+                bulk_data_ctx.url_frontier,
+                seed_url,
+                is_background=is_background_discovery,
+                )
+    
+    if seen_url_list is not None:
+        for seen_url in seen_url_list:
+            url_frontier.url_frontier_mark_seen(bulk_data_ctx.url_frontier, seen_url)
+
+def bulk_data_cancel(bulk_data_ctx):
+    # stops crawl: workers take no new urls, fetches in flight are
+    # finished as usual, then ``on_done`` is called. it may be called
+    # from any thread
+    
+    with bulk_data_ctx.cond:
+        bulk_data_ctx.is_cancelled = True
+    
+    bulk_data_wakeup(bulk_data_ctx)
+
+def bulk_data_wakeup(bulk_data_ctx):
+    # wakes all waiting workers. it may be called from any thread
+    
+    with bulk_data_ctx.cond:
+        bulk_data_ctx.cond.notify_all()
+        on_wakeup_list = tuple(bulk_data_ctx.on_wakeup_list)
+    
+    # engines which do not wait on ``bulk_data_ctx.cond`` are woken here
+    for on_wakeup in on_wakeup_list:
+        on_wakeup()
+
+def is_idle(bulk_data_ctx):
+    # ``True`` if there is nothing to fetch and nothing in flight. must be
+    # called under ``bulk_data_ctx.lock``
+    
+    return not url_frontier.url_frontier_len(bulk_data_ctx.url_frontier) and \
+            bulk_data_ctx.seed_iter is None and \
+            not bulk_data_ctx.in_flight_count and (
+                    bulk_data_ctx.retry_queue is None or
+                    not retry_queue.retry_queue_len(bulk_data_ctx.retry_queue)
+                    )
+
+def shard_sync_thread(bulk_data_ctx, on_scheduled=None):
+    # exchanges urls with other shards, till all of them are over. then
+    # crawl is not held anymore, and workers finish at quiescence
+    
+    while True:
+        with bulk_data_ctx.cond:
+            if bulk_data_ctx.is_cancelled:
+                return
             
-            address_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('address', )}},
-                    {'any': (
-                            {'tag': '{http://www.w3.org/1999/xhtml}div', 'in_attrib': {'class': ('address', )}},
-                            {'tag': '{http://www.w3.org/1999/xhtml}a', 'in_attrib': {'class': ('maplinked', )}},
-                            )},
-                    ))
-            fetch_data['address'] = ' | '.join(filter(
-                    None,
-                    (elem.text for elem in address_elem_list),
-                    ))
+            is_shard_idle = is_idle(bulk_data_ctx)
+        
+        try:
+            taken_url_list, is_done = shard_coord.shard_coord_sync(
+                    bulk_data_ctx.shard_coord, is_shard_idle)
+        except Exception as e:
+            # coordinator is busy too long (for example). it is tried again
+            crawl_stats.crawl_stats_error(bulk_data_ctx.crawl_stats, type(e))
             
-            phone_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('phone', )}},
-                    {'tag': '{http://www.w3.org/1999/xhtml}img'},
-                    ))
-            fetch_data['phone'] = ' | '.join(filter(
-                    None,
-                    (elem.get('src') for elem in phone_elem_list),
-                    ))
+            time.sleep(shard_coord.SYNC_INTERVAL)
             
-            email_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('email', )}},
-                    ))
-            fetch_data['email'] = ' | '.join(
-                    ' '.join(filter(
-                            None,
-                            (frag.strip() for frag in elem.itertext()),
-                            )) for elem in email_elem_list
+            continue
+        
+        if taken_url_list:
+            schedule_url_list(
+                    bulk_data_ctx,
+                    taken_url_list,
+                    on_scheduled=on_scheduled,
                     )
+            bulk_data_wakeup(bulk_data_ctx)
+        
+        if is_done:
+            with bulk_data_ctx.cond:
+                bulk_data_ctx.hold_count -= 1
             
-            www_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('www', )}},
-                    ))
-            fetch_data['www'] = ' | '.join(
-                    ' '.join(filter(
-                            None,
-                            (frag.strip() for frag in elem.itertext()),
-                            )) for elem in www_elem_list
-                    )
+            bulk_data_wakeup(bulk_data_ctx)
             
-            work_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('work', )}},
-                    ))
-            fetch_data['work'] = ' | '.join(
-                    ' '.join(filter(
-                            lambda text: text and text != 'Деятельность:',
-                            (frag.strip() for frag in elem.itertext()),
-                            )) for elem in work_elem_list
-                    )
+            return
+        
+        time.sleep(shard_coord.SYNC_INTERVAL)
+
+def start_shard_sync(bulk_data_ctx, on_scheduled=None):
+    # returns sync thread (``None`` if crawl is not sharded)
+    
+    if bulk_data_ctx.shard_coord is None:
+        return None
+    
+    thread = threading.Thread(
+            target=lambda: shard_sync_thread(
+                    bulk_data_ctx,
+                    on_scheduled=on_scheduled,
+                    ),
+            daemon=True,
+            )
+    thread.start()
+    
+    return thread
+
+def seed_feed_thread(bulk_data_ctx, on_scheduled=None):
+    # moves lazy seeds to frontier by batches, while main lane of
+    # frontier is short, so long seed ranges are never kept whole. then
+    # crawl is not held by seeds anymore
+    
+    while True:
+        with bulk_data_ctx.cond:
+            if bulk_data_ctx.is_cancelled:
+                return
+            
+            is_short = url_frontier.url_frontier_main_len(
+                    bulk_data_ctx.url_frontier) < SEED_FEED_SIZE
+        
+        if not is_short:
+            # workers do not report pops, so frontier is polled
+            time.sleep(SEED_FEED_INTERVAL)
             
-            rubriks_elem_list = et_find.find((doc,), (
-                    {'tag': '{http://www.w3.org/1999/xhtml}html'},
-                    {'tag': '{http://www.w3.org/1999/xhtml}body'},
-                    {'in_attrib': {'class': ('firminfo', )}},
-                    {'in_attrib': {'class': ('rubriks', )}},
-                    ))
-            fetch_data['rubriks'] = ' | '.join(
-                    ' '.join(filter(
-                            lambda text: text and text != 'Рубрики:',
-                            (frag.strip() for frag in elem.itertext()),
-                            )) for elem in rubriks_elem_list
+            continue
+        
+        seed_list = tuple(itertools.islice(bulk_data_ctx.seed_iter, SEED_FEED_SIZE))
+        
+        with bulk_data_ctx.cond:
+            # before scheduling: probe may fail at once
+            bulk_data_ctx.probe_url_set.update(
+                    seed_url
+                    for seed_url, is_probe in seed_list
+                    if is_probe
                     )
+        
+        schedule_url_list(
+                bulk_data_ctx,
+                tuple(seed_url for seed_url, is_probe in seed_list),
+                on_scheduled=on_scheduled,
+                )
+        
+        if len(seed_list) < SEED_FEED_SIZE:
+            with bulk_data_ctx.cond:
+                bulk_data_ctx.seed_iter = None
+                bulk_data_ctx.hold_count -= 1
             
-            if on_fetch is not None:
-                on_fetch(fetch_url, fetch_data)
-        except Exception as e:
-            if on_error is not None:
-                on_error(fetch_url, type(e), str(e))
+            bulk_data_wakeup(bulk_data_ctx)
+            
+            return
+        
+        bulk_data_wakeup(bulk_data_ctx)
 
-class BulkDataCtx:
-    pass
+def start_seed_feed(bulk_data_ctx, on_scheduled=None):
+    # returns seed feed thread (``None`` if there are no lazy seeds)
+    
+    if bulk_data_ctx.seed_iter is None:
+        return None
+    
+    thread = threading.Thread(
+            target=lambda: seed_feed_thread(
+                    bulk_data_ctx,
+                    on_scheduled=on_scheduled,
+                    ),
+            daemon=True,
+            )
+    thread.start()
+    
+    return thread
 
-def init_bulk_data_ctx(bulk_data_ctx):
-    bulk_data_ctx.lock = threading.RLock()
-    bulk_data_ctx.new_url_list = [
-            url.urljoin(SITE_URL, 'firms/'),
-            ]
-    bulk_data_ctx.used_url_list = []
+def start_parse_executor(bulk_data_ctx, parse_process_count):
+    # process pool for parsing pages out of GIL. processes are spawned
+    # (not forked), because fetch threads may hold locks at fork time
+    
+    bulk_data_ctx.parse_executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=parse_process_count,
+            mp_context=multiprocessing.get_context('spawn'),
+            )
+    bulk_data_ctx.parse_semaphore = threading.BoundedSemaphore(
+            parse_process_count * PARSE_QUEUE_FACTOR)
+
+def stop_parse_executor(bulk_data_ctx):
+    if bulk_data_ctx.parse_executor is not None:
+        bulk_data_ctx.parse_executor.shutdown()
+        bulk_data_ctx.parse_executor = None
 
 def bulk_data_fetch(
         bulk_data_ctx,
         thread_count,
+        parse_process_count=None,
         on_scheduled=None,
         on_begin=None,
         on_fetch=None,
         on_error=None,
+        on_finish=None,
         on_done=None,
         ):
-    with bulk_data_ctx.lock:
-        bulk_data_ctx.url_list = bulk_data_ctx.new_url_list
-        bulk_data_ctx.new_url_list = []
-        
-        if not bulk_data_ctx.url_list:
-            raise StopIteration
+    # ``parse_process_count`` -- if it is set, threads only fetch pages
+    # and parsing goes to pool of that many processes
+    
+    if parse_process_count and not bulk_data_ctx.is_stream:
+        start_parse_executor(bulk_data_ctx, parse_process_count)
+    
+    if bulk_data_ctx.concurrency_ctl is not None:
+        # concurrency is limited by controller, threads are just upper bound
+        thread_count = bulk_data_ctx.concurrency_ctl.max_concurrency
     
     thread_list = tuple(
             threading.Thread(target=lambda: data_fetch_thread(
@@ -275,6 +1501,7 @@ def bulk_data_fetch(
                     on_begin=on_begin,
                     on_fetch=on_fetch,
                     on_error=on_error,
+                    on_finish=on_finish,
                     ), daemon=True)
             for thread_i in range(thread_count)
             )
@@ -282,10 +1509,21 @@ def bulk_data_fetch(
     for thread in thread_list:
         thread.start()
     
+    sync_thread = start_shard_sync(bulk_data_ctx, on_scheduled=on_scheduled)
+    feed_thread = start_seed_feed(bulk_data_ctx, on_scheduled=on_scheduled)
+    
     def wait_thread():
         for thread in thread_list:
             thread.join()
         
+        if sync_thread is not None:
+            sync_thread.join()
+        
+        if feed_thread is not None:
+            feed_thread.join()
+        
+        stop_parse_executor(bulk_data_ctx)
+        
         if on_done is not None:
             on_done()
     
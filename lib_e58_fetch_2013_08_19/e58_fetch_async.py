@@ -0,0 +1,772 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# asyncio engine -- alternative to ``e58_fetch.bulk_data_fetch()``.
+#
+# all fetches run in one event loop (in its own thread), parsing is handed
+# to bounded executor. it shares ``BulkDataCtx`` and callbacks with
+# thread engine, so ``main()`` can use either of them.
+#
+# connections are kept alive and reused per host (see
+# ``AsyncHttpPoolCtx``), like ``http_pool`` of thread engine.
+#
+# callbacks may block (``main()`` puts events to bounded queue), so they
+# are called in one callback thread, in order of calls. task waits for
+# its callback, so slow consumer pauses tasks, but never event loop.
+
+from urllib import parse as url
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import ssl
+import threading
+import time
+from . import concurrency_ctl
+from . import crawl_profile
+from . import crawl_stats
+from . import url_frontier
+from . import http_pool
+from . import http_cache
+from . import e58_fetch
+
+ASYNC_CONCURRENCY = 200
+ASYNC_MAX_CONCURRENCY = 1000
+ENGINE_NAME_LIST = ('thread', 'asyncio')
+
+def get_default_concurrency(engine):
+    # returns ``(concurrency, max_concurrency)`` of ``engine`` by default
+    
+    if engine == 'asyncio':
+        return ASYNC_CONCURRENCY, ASYNC_MAX_CONCURRENCY
+    
+    if engine == 'thread':
+        return e58_fetch.THREAD_COUNT, e58_fetch.MAX_THREAD_COUNT
+    
+    raise ValueError('unknown engine: {!r}'.format(engine))
+
+async def async_readline(reader):
+    # line longer than limit of ``reader`` is broken response, not bug
+    
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError):
+        raise e58_fetch.FetchError('invalid http response')
+
+async def async_read_body(reader, header_map):
+    # returns ``(raw_body, is_complete)``. ``is_complete`` -- body is read
+    # to its end by its framing (not by end of connection), so connection
+    # may be used again
+    
+    body_list = []
+    body_length = 0
+    
+    if header_map.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            if body_length >= e58_fetch.FETCH_MAX_LENGTH:
+                return b''.join(body_list)[:e58_fetch.FETCH_MAX_LENGTH], False
+            
+            chunk_size_line = await async_readline(reader)
+            
+            try:
+                chunk_size = int(chunk_size_line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise e58_fetch.FetchError('invalid http response')
+            
+            if not chunk_size:
+                break
+            
+            if chunk_size > e58_fetch.FETCH_MAX_LENGTH - body_length:
+                # size is not trusted: only the rest of limit is read
+                body_list.append(await reader.readexactly(
+                        e58_fetch.FETCH_MAX_LENGTH - body_length))
+                
+                return b''.join(body_list), False
+            
+            chunk = await reader.readexactly(chunk_size)
+            await async_readline(reader)
+            
+            body_list.append(chunk)
+            body_length += len(chunk)
+        
+        # trailer
+        while (await async_readline(reader)).strip():
+            pass
+        
+        return b''.join(body_list), True
+    
+    if 'content-length' in header_map:
+        try:
+            content_length = int(header_map['content-length'])
+        except ValueError:
+            raise e58_fetch.FetchError('invalid http response')
+        
+        if content_length > e58_fetch.FETCH_MAX_LENGTH:
+            return await reader.readexactly(e58_fetch.FETCH_MAX_LENGTH), False
+        
+        return await reader.readexactly(content_length), True
+    
+    while body_length < e58_fetch.FETCH_MAX_LENGTH:
+        chunk = await reader.read(e58_fetch.FETCH_MAX_LENGTH - body_length)
+        
+        if not chunk:
+            break
+        
+        body_list.append(chunk)
+        body_length += len(chunk)
+    
+    return b''.join(body_list), False
+
+def is_keep_alive(http_version, header_map):
+    connection_list = tuple(
+            connection.strip().lower()
+            for connection in header_map.get('connection', '').split(',')
+            )
+    
+    if 'close' in connection_list:
+        return False
+    
+    if http_version == 'HTTP/1.0':
+        return 'keep-alive' in connection_list
+    
+    return True
+
+class AsyncHttpPoolCtx:
+    # asyncio form of ``http_pool.HttpPoolCtx``: per-host keep-alive
+    # connections (``(reader, writer)`` pairs) of one event loop
+    pass
+
+def init_async_http_pool(async_http_pool_ctx, http_pool_ctx, max_idle_per_host=None):
+    # ``http_pool_ctx`` -- counters of connections and bytes are added
+    # there, so both engines are reported the same way
+    
+    if max_idle_per_host is None:
+        max_idle_per_host = http_pool.MAX_IDLE_PER_HOST
+    
+    async_http_pool_ctx.http_pool = http_pool_ctx
+    async_http_pool_ctx.max_idle_per_host = max_idle_per_host
+    async_http_pool_ctx.idle_conn_map = {}
+
+def async_http_pool_count(async_http_pool_ctx, counter_name, value=1):
+    http_pool_ctx = async_http_pool_ctx.http_pool
+    
+    with http_pool_ctx.lock:
+        setattr(http_pool_ctx, counter_name, getattr(http_pool_ctx, counter_name) + value)
+
+async def async_http_pool_take_conn(async_http_pool_ctx, conn_key):
+    # returns ``(reader, writer, is_reused)``
+    
+    idle_conn_list = async_http_pool_ctx.idle_conn_map.get(conn_key)
+    
+    while idle_conn_list:
+        reader, writer = idle_conn_list.pop()
+        
+        if reader.at_eof() or writer.is_closing():
+            # closed by server while it was idle
+            writer.close()
+            
+            continue
+        
+        async_http_pool_count(async_http_pool_ctx, 'conn_reuse_count')
+        
+        return reader, writer, True
+    
+    scheme, host, port = conn_key
+    
+    reader, writer = await asyncio.open_connection(
+            host,
+            port,
+            ssl=ssl.create_default_context() if scheme == 'https' else None,
+            )
+    
+    async_http_pool_count(async_http_pool_ctx, 'conn_new_count')
+    
+    return reader, writer, False
+
+def async_http_pool_put_conn(async_http_pool_ctx, conn_key, reader, writer):
+    idle_conn_list = async_http_pool_ctx.idle_conn_map.setdefault(conn_key, [])
+    
+    if len(idle_conn_list) < async_http_pool_ctx.max_idle_per_host:
+        idle_conn_list.append((reader, writer))
+        
+        return
+    
+    writer.close()
+
+def async_http_pool_close(async_http_pool_ctx):
+    idle_conn_map = async_http_pool_ctx.idle_conn_map
+    async_http_pool_ctx.idle_conn_map = {}
+    
+    for idle_conn_list in idle_conn_map.values():
+        for reader, writer in idle_conn_list:
+            writer.close()
+
+async def async_http_read_head(reader):
+    # returns ``(http_version, code, header_map)``. ``header_map`` keys are
+    # lower-case. raises ``ConnectionError`` if connection is closed
+    # before response
+    
+    status_line = (await async_readline(reader)).decode('latin-1')
+    
+    if not status_line:
+        raise ConnectionResetError('connection is closed before response')
+    
+    status_split = status_line.split(None, 2)
+    
+    if len(status_split) < 2 or not status_split[0].startswith('HTTP/'):
+        raise e58_fetch.FetchError('invalid http response')
+    
+    try:
+        code = int(status_split[1])
+    except ValueError:
+        raise e58_fetch.FetchError('invalid http response')
+    
+    header_map = {}
+    
+    while True:
+        header_line = (await async_readline(reader)).decode('latin-1').strip()
+        
+        if not header_line:
+            break
+        
+        header_name, header_sep, header_value = header_line.partition(':')
+        header_map[header_name.strip().lower()] = header_value.strip()
+    
+    return status_split[0], code, header_map
+
+async def async_http_get(async_http_pool_ctx, get_url, header_map=None):
+    # returns ``(code, resp_header_map, body)``, like
+    # ``http_pool.http_pool_get()``. body is returned only for code 200.
+    # ``resp_header_map`` keys are lower-case
+    
+    conn_key, path = http_pool.get_conn_key_and_path(get_url)
+    
+    request_header_map = {'Host': url.urlsplit(get_url).netloc}
+    request_header_map.update(http_pool.get_request_header_map(header_map))
+    request_data = ''.join(
+            ['GET {} HTTP/1.1\r\n'.format(path)] + [
+                    '{}: {}\r\n'.format(header_name, header_value)
+                    for header_name, header_value in request_header_map.items()
+                    ] + ['\r\n']
+            ).encode('latin-1')
+    
+    while True:
+        reader, writer, is_reused = await async_http_pool_take_conn(
+                async_http_pool_ctx, conn_key)
+        
+        try:
+            writer.write(request_data)
+            
+            http_version, code, resp_header_map = await async_http_read_head(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            
+            if is_reused:
+                # idle connection was closed by server. try again
+                continue
+            
+            raise
+        except BaseException:
+            # also on cancel (timeout): connection is in unknown state
+            writer.close()
+            
+            raise
+        
+        break
+    
+    try:
+        if code in (204, 304) or 100 <= code < 200:
+            raw_body, is_complete = b'', True
+        else:
+            raw_body, is_complete = await async_read_body(reader, resp_header_map)
+    except BaseException:
+        writer.close()
+        
+        raise
+    
+    if is_complete and is_keep_alive(http_version, resp_header_map):
+        async_http_pool_put_conn(async_http_pool_ctx, conn_key, reader, writer)
+    else:
+        writer.close()
+    
+    if code != 200:
+        async_http_pool_count(async_http_pool_ctx, 'wire_byte_count', len(raw_body))
+        
+        return code, resp_header_map, b''
+    
+    body = http_pool.decode_content(
+            resp_header_map.get('content-encoding'),
+            raw_body,
+            e58_fetch.FETCH_MAX_LENGTH,
+            )
+    
+    async_http_pool_count(async_http_pool_ctx, 'wire_byte_count', len(raw_body))
+    async_http_pool_count(async_http_pool_ctx, 'content_byte_count', len(body))
+    
+    return code, resp_header_map, body
+
+async def async_fetch_raw(async_http_pool_ctx, fetch_url, http_cache_ctx=None):
+    # the same as ``e58_fetch.fetch_raw()``. cache is blocking (SQLite and
+    # files), so it is used from default executor
+    
+    loop = asyncio.get_running_loop()
+    cache_entry = None
+    header_map = None
+    
+    if http_cache_ctx is not None:
+        cache_entry = await loop.run_in_executor(
+                None,
+                http_cache.http_cache_get,
+                http_cache_ctx,
+                fetch_url,
+                )
+        
+        if http_cache_ctx.offline:
+            body = None
+            
+            if cache_entry is not None:
+                body = await loop.run_in_executor(
+                        None,
+                        http_cache.http_cache_load,
+                        http_cache_ctx,
+                        fetch_url,
+                        cache_entry,
+                        )
+            
+            if body is None:
+                raise e58_fetch.FetchError('url is not in cache (offline mode)')
+            
+            return body
+        
+        if cache_entry is not None:
+            header_map = http_cache.http_cache_conditional_header_map(
+                    cache_entry)
+    
+    code, resp_header_map, body = await async_http_get(
+            async_http_pool_ctx,
+            fetch_url,
+            header_map=header_map,
+            )
+    
+    if http_cache_ctx is None:
+        return e58_fetch.fetch_raw_result(
+                None, fetch_url, None, code, resp_header_map, body)
+    
+    body = await loop.run_in_executor(
+            None,
+            e58_fetch.fetch_raw_result,
+            http_cache_ctx,
+            fetch_url,
+            cache_entry,
+            code,
+            resp_header_map,
+            body,
+            )
+    
+    if body is None:
+        # cached body is lost after lookup: page is fetched again
+        code, resp_header_map, body = await async_http_get(
+                async_http_pool_ctx,
+                fetch_url,
+                )
+        body = await loop.run_in_executor(
+                None,
+                e58_fetch.fetch_raw_result,
+                http_cache_ctx,
+                fetch_url,
+                None,
+                code,
+                resp_header_map,
+                body,
+                )
+    
+    return body
+
+async def async_fetch(async_http_pool_ctx, fetch_url, http_cache_ctx=None):
+    text = (await async_fetch_raw(
+            async_http_pool_ctx,
+            fetch_url,
+            http_cache_ctx=http_cache_ctx,
+            )).decode('utf-8', 'replace')
+    
+    return text
+
+async def async_fetch_raw_observed(
+        bulk_data_ctx,
+        async_http_pool_ctx,
+        fetch_url,
+        slot_cond,
+        ):
+    # the same as ``e58_fetch.fetch_raw_observed()``. ``slot_cond`` is
+    # notified when fetch slot is released
+    
+    concurrency_ctl_ctx = bulk_data_ctx.concurrency_ctl
+    host_rate_ctx = bulk_data_ctx.host_rate
+    
+    if host_rate_ctx is not None:
+        # rate wait is before slot: sleeping task must not take slot
+        await asyncio.sleep(concurrency_ctl.host_rate_reserve(
+                host_rate_ctx,
+                url.urlsplit(fetch_url).netloc,
+                ))
+    
+    if concurrency_ctl_ctx is not None:
+        async with slot_cond:
+            while not concurrency_ctl.concurrency_ctl_try_acquire(concurrency_ctl_ctx):
+                await slot_cond.wait()
+    
+    latency = None
+    is_overload = False
+    
+    try:
+        begin_time = time.perf_counter()
+        
+        try:
+            raw_html = await asyncio.wait_for(
+                    async_fetch_raw(
+                            async_http_pool_ctx,
+                            fetch_url,
+                            http_cache_ctx=bulk_data_ctx.http_cache,
+                            ),
+                    e58_fetch.FETCH_TIMEOUT,
+                    )
+        except Exception as e:
+            is_overload = e58_fetch.is_overload_error(e)
+            
+            raise
+        
+        latency = time.perf_counter() - begin_time
+    finally:
+        if concurrency_ctl_ctx is not None:
+            concurrency_ctl.concurrency_ctl_release(
+                    concurrency_ctl_ctx,
+                    latency=latency,
+                    is_overload=is_overload,
+                    )
+            
+            async with slot_cond:
+                # limit may grow over one slot at once
+                slot_cond.notify(max(1,
+                        int(concurrency_ctl_ctx.limit) - concurrency_ctl_ctx.active_count))
+    
+    crawl_stats.crawl_stats_observe(bulk_data_ctx.crawl_stats, 'fetch', latency)
+    crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'page')
+    crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'byte', len(raw_html))
+    
+    return raw_html
+
+async def async_callback(callback_executor, callback, *args):
+    if callback is None:
+        return
+    
+    await asyncio.get_running_loop().run_in_executor(
+            callback_executor,
+            callback,
+            *args
+            )
+
+def call_each(callback, arg_list):
+    for arg in arg_list:
+        callback(arg)
+
+async def async_data_fetch_url(
+        bulk_data_ctx,
+        async_http_pool_ctx,
+        fetch_url,
+        parse_executor,
+        parse_semaphore,
+        callback_executor,
+        wakeup_cond,
+        slot_cond,
+        on_scheduled=None,
+        on_begin=None,
+        on_fetch=None,
+        on_error=None,
+        ):
+    # returns ``True`` if url failed and is scheduled for retry
+    
+    loop = asyncio.get_running_loop()
+    
+    try:
+        await async_callback(callback_executor, on_begin, fetch_url)
+        
+        raw_html = await async_fetch_raw_observed(
+                bulk_data_ctx,
+                async_http_pool_ctx,
+                fetch_url,
+                slot_cond,
+                )
+        
+        # bounds count of raw pages waiting for parse executor
+        async with parse_semaphore:
+            link_url_list, fetch_data, timing_map = await loop.run_in_executor(
+                    parse_executor,
+                    e58_fetch.extract_page_raw_timed,
+                    fetch_url,
+                    raw_html,
+                    bulk_data_ctx.parser_name,
+                    crawl_profile.crawl_profile_begin(bulk_data_ctx.crawl_profile),
+                    )
+            del raw_html
+        
+        e58_fetch.observe_page(bulk_data_ctx, fetch_url, timing_map)
+        
+        scheduled_url_list = []
+        scheduled_count = e58_fetch.schedule_url_list(
+                bulk_data_ctx,
+                link_url_list,
+                on_scheduled=scheduled_url_list.append,
+                is_background=e58_fetch.is_discovery_page(bulk_data_ctx, fetch_data),
+                )
+        
+        if scheduled_count:
+            async with wakeup_cond:
+                wakeup_cond.notify(scheduled_count)
+        
+        if on_scheduled is not None and scheduled_url_list:
+            await async_callback(
+                    callback_executor,
+                    call_each,
+                    on_scheduled,
+                    scheduled_url_list,
+                    )
+        
+        if fetch_data is not None:
+            crawl_stats.crawl_stats_add(bulk_data_ctx.crawl_stats, 'firm')
+            
+            await async_callback(callback_executor, on_fetch, fetch_url, fetch_data)
+    except Exception as e:
+        if e58_fetch.is_probe_miss(bulk_data_ctx, fetch_url, e):
+            return False
+        
+        crawl_stats.crawl_stats_error(bulk_data_ctx.crawl_stats, type(e))
+        
+        if e58_fetch.schedule_retry(bulk_data_ctx, fetch_url, e):
+            # waiting tasks must recount their timeouts
+            async with wakeup_cond:
+                wakeup_cond.notify_all()
+            
+            return True
+        
+        await async_callback(
+                callback_executor, on_error, fetch_url, type(e), str(e))
+    
+    return False
+
+async def async_data_fetch_task(
+        bulk_data_ctx,
+        async_http_pool_ctx,
+        parse_executor,
+        parse_semaphore,
+        callback_executor,
+        wakeup_cond,
+        slot_cond,
+        on_scheduled=None,
+        on_begin=None,
+        on_fetch=None,
+        on_error=None,
+        on_finish=None,
+        ):
+    while True:
+        async with wakeup_cond:
+            while True:
+                with bulk_data_ctx.lock:
+                    if bulk_data_ctx.is_cancelled:
+                        wakeup_cond.notify_all()
+                        return
+                    
+                    retry_wait_time = e58_fetch.schedule_due_retries(bulk_data_ctx)
+                    
+                    if url_frontier.url_frontier_len(bulk_data_ctx.url_frontier):
+                        fetch_url = url_frontier.url_frontier_pop(
+                                bulk_data_ctx.url_frontier)
+                        bulk_data_ctx.in_flight_count += 1
+                        break
+                    
+                    if not bulk_data_ctx.in_flight_count and \
+                            retry_wait_time is None and \
+                            not bulk_data_ctx.hold_count:
+                        # quiescence: frontier is empty, nothing in flight
+                        # and nothing waits for retry
+                        wakeup_cond.notify_all()
+                        return
+                
+                try:
+                    await asyncio.wait_for(wakeup_cond.wait(), retry_wait_time)
+                except asyncio.TimeoutError:
+                    pass
+        
+        is_retried = False
+        
+        try:
+            is_retried = await async_data_fetch_url(
+                    bulk_data_ctx,
+                    async_http_pool_ctx,
+                    fetch_url,
+                    parse_executor,
+                    parse_semaphore,
+                    callback_executor,
+                    wakeup_cond,
+                    slot_cond,
+                    on_scheduled=on_scheduled,
+                    on_begin=on_begin,
+                    on_fetch=on_fetch,
+                    on_error=on_error,
+                    )
+        finally:
+            if not is_retried:
+                await async_callback(callback_executor, on_finish, fetch_url)
+            
+            with bulk_data_ctx.lock:
+                bulk_data_ctx.in_flight_count -= 1
+                is_quiescent = not bulk_data_ctx.in_flight_count and \
+                        not url_frontier.url_frontier_len(bulk_data_ctx.url_frontier)
+            
+            if is_quiescent:
+                async with wakeup_cond:
+                    wakeup_cond.notify_all()
+
+async def async_bulk_data_fetch(
+        bulk_data_ctx,
+        concurrency,
+        parse_worker_count=None,
+        parse_process_count=None,
+        on_scheduled=None,
+        on_begin=None,
+        on_fetch=None,
+        on_error=None,
+        on_finish=None,
+        ):
+    # ``parse_process_count`` -- if it is set, parsing goes to pool of
+    # that many processes instead of ``parse_worker_count`` threads
+    
+    if parse_worker_count is None:
+        parse_worker_count = os.cpu_count() or 1
+    
+    wakeup_cond = asyncio.Condition()
+    slot_cond = asyncio.Condition()
+    
+    if bulk_data_ctx.concurrency_ctl is not None:
+        # concurrency is limited by controller, tasks are just upper bound
+        concurrency = bulk_data_ctx.concurrency_ctl.max_concurrency
+    
+    if parse_process_count:
+        parse_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=parse_process_count,
+                mp_context=multiprocessing.get_context('spawn'),
+                )
+    else:
+        parse_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=parse_worker_count)
+    
+    parse_semaphore = asyncio.Semaphore(
+            (parse_process_count or parse_worker_count) * e58_fetch.PARSE_QUEUE_FACTOR)
+    
+    # one thread keeps order of callbacks (record is written before its
+    # url is finished)
+    callback_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    
+    async_http_pool_ctx = AsyncHttpPoolCtx()
+    init_async_http_pool(async_http_pool_ctx, bulk_data_ctx.http_pool)
+    
+    loop = asyncio.get_running_loop()
+    
+    async def wakeup():
+        async with wakeup_cond:
+            wakeup_cond.notify_all()
+    
+    def on_wakeup():
+        try:
+            asyncio.run_coroutine_threadsafe(wakeup(), loop)
+        except RuntimeError:
+            # loop is closed already
+            pass
+    
+    with bulk_data_ctx.lock:
+        bulk_data_ctx.on_wakeup_list.append(on_wakeup)
+    
+    try:
+        with parse_executor, callback_executor:
+            await asyncio.gather(*(
+                    async_data_fetch_task(
+                            bulk_data_ctx,
+                            async_http_pool_ctx,
+                            parse_executor,
+                            parse_semaphore,
+                            callback_executor,
+                            wakeup_cond,
+                            slot_cond,
+                            on_scheduled=on_scheduled,
+                            on_begin=on_begin,
+                            on_fetch=on_fetch,
+                            on_error=on_error,
+                            on_finish=on_finish,
+                            )
+                    for task_i in range(concurrency)
+                    ))
+    finally:
+        async_http_pool_close(async_http_pool_ctx)
+        
+        with bulk_data_ctx.lock:
+            bulk_data_ctx.on_wakeup_list.remove(on_wakeup)
+
+def bulk_data_fetch_async(
+        bulk_data_ctx,
+        concurrency,
+        parse_worker_count=None,
+        parse_process_count=None,
+        on_scheduled=None,
+        on_begin=None,
+        on_fetch=None,
+        on_error=None,
+        on_finish=None,
+        on_done=None,
+        ):
+    sync_thread = e58_fetch.start_shard_sync(
+            bulk_data_ctx,
+            on_scheduled=on_scheduled,
+            )
+    feed_thread = e58_fetch.start_seed_feed(
+            bulk_data_ctx,
+            on_scheduled=on_scheduled,
+            )
+    
+    def loop_thread():
+        asyncio.run(async_bulk_data_fetch(
+                bulk_data_ctx,
+                concurrency,
+                parse_worker_count=parse_worker_count,
+                parse_process_count=parse_process_count,
+                on_scheduled=on_scheduled,
+                on_begin=on_begin,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_finish=on_finish,
+                ))
+        
+        if sync_thread is not None:
+            sync_thread.join()
+        
+        if feed_thread is not None:
+            feed_thread.join()
+        
+        if on_done is not None:
+            on_done()
+    
+    threading.Thread(target=loop_thread, daemon=True).start()
@@ -99,6 +99,185 @@ def elem_condition_check(elem, condition):
     
     return True
 
+COMPILED_CHAIN_CACHE_MAX = 1000
+
+compiled_chain_cache = {}
+
+def compile_in_attrib(in_attrib_name, in_attrib_list):
+    assert isinstance(in_attrib_name, str)
+    assert isinstance(in_attrib_list, (tuple, list))
+    
+    for in_attrib_value in in_attrib_list:
+        assert isinstance(in_attrib_value, str)
+    
+    in_attrib_value_set = frozenset(
+            in_attrib_value.lower() for in_attrib_value in in_attrib_list
+            )
+    
+    def in_attrib_check(elem):
+        elem_attrib_value_str = elem.attrib.get(in_attrib_name)
+        
+        if elem_attrib_value_str is None:
+            return False
+        
+        return in_attrib_value_set.issubset(
+                elem_attrib_value_str.lower().split(),
+                )
+    
+    return in_attrib_check
+
+def compile_condition(condition):
+    # turns ``condition`` into matcher function ``(elem) -> bool``.
+    # it gives same result as ``elem_condition_check(elem, condition)``,
+    # but all checks of ``condition`` are done once, at compile time
+    
+    assert isinstance(condition, dict)
+    
+    tag = condition.get('tag')
+    attrib_map = condition.get('attrib')
+    in_attrib_map = condition.get('in_attrib')
+    any_condition = condition.get('any')
+    not_condition = condition.get('not')
+    
+    check_list = []
+    
+    if tag is not None:
+        assert isinstance(tag, str)
+        
+        tag_lower = tag.lower()
+        
+        def tag_check(elem):
+            return elem.tag.lower() == tag_lower
+        
+        check_list.append(tag_check)
+    
+    if attrib_map is not None:
+        assert isinstance(attrib_map, dict)
+        
+        for attrib_name, attrib_value in attrib_map.items():
+            assert isinstance(attrib_name, str)
+            assert isinstance(attrib_value, str)
+        
+        attrib_lower_tuple = tuple(
+                (attrib_name, attrib_value.lower())
+                for attrib_name, attrib_value in attrib_map.items()
+                )
+        
+        def attrib_check(elem):
+            for attrib_name, attrib_value_lower in attrib_lower_tuple:
+                elem_attrib_value = elem.attrib.get(attrib_name)
+                
+                if elem_attrib_value is None or \
+                        elem_attrib_value.lower() != attrib_value_lower:
+                    return False
+            
+            return True
+        
+        check_list.append(attrib_check)
+    
+    if in_attrib_map is not None:
+        assert isinstance(in_attrib_map, dict)
+        
+        for in_attrib_name, in_attrib_list in in_attrib_map.items():
+            if not in_attrib_list:
+                # nothing to check: condition is always true
+                continue
+            
+            check_list.append(compile_in_attrib(in_attrib_name, in_attrib_list))
+    
+    if any_condition is not None:
+        assert isinstance(any_condition, (tuple, list))
+        
+        # recursion!
+        any_match_tuple = tuple(
+                compile_condition(condition) for condition in any_condition
+                )
+        
+        def any_check(elem):
+            for any_match in any_match_tuple:
+                if any_match(elem):
+                    return True
+            
+            return False
+        
+        check_list.append(any_check)
+    
+    if not_condition is not None:
+        # recursion!
+        not_match = compile_condition(not_condition)
+        
+        def not_check(elem):
+            return not not_match(elem)
+        
+        check_list.append(not_check)
+    
+    check_tuple = tuple(check_list)
+    
+    def condition_match(elem):
+        if not isinstance(elem, et.Element) or not isinstance(elem.tag, str):
+            return False
+        
+        for check in check_tuple:
+            if not check(elem):
+                return False
+        
+        return True
+    
+    return condition_match
+
+def compile_condition_chain(condition_chain):
+    assert isinstance(condition_chain, (tuple, list))
+    
+    return tuple(compile_condition(condition) for condition in condition_chain)
+
+def get_compiled_condition_chain(condition_chain):
+    # compiled chains are cached by chain identity. cache holds reference
+    # to chain itself, so ``id()`` of cached chain can not be reused
+    
+    cached = compiled_chain_cache.get(id(condition_chain))
+    
+    if cached is not None and cached[0] is condition_chain:
+        return cached[1]
+    
+    compiled_chain = compile_condition_chain(condition_chain)
+    
+    if len(compiled_chain_cache) >= COMPILED_CHAIN_CACHE_MAX:
+        compiled_chain_cache.clear()
+    
+    compiled_chain_cache[id(condition_chain)] = condition_chain, compiled_chain
+    
+    return compiled_chain
+
+def find_compiled(root_elem_list, compiled_chain):
+    # same as ``find()``, but takes result of ``compile_condition_chain()``
+    
+    candidate_list = tuple(root_elem_list)
+    
+    for condition_match in compiled_chain:
+        root_elem_list = candidate_list
+        candidate_list = []
+        # elems are compared by identity. if root elem is visited already,
+        # then all its subtree is visited too
+        visited_set = set()
+        
+        for root_elem in root_elem_list:
+            if root_elem in visited_set:
+                continue
+            
+            for elem in root_elem.iter():
+                if elem in visited_set:
+                    continue
+                
+                visited_set.add(elem)
+                
+                if condition_match(elem):
+                    candidate_list.append(elem)
+        
+        if not candidate_list:
+            break
+    
+    return tuple(candidate_list)
+
 # find() -- it is main function of this module
 #
 #   ``root_elem_list`` -- list of elems, where will be search.
@@ -130,23 +309,128 @@ def find(root_elem_list, condition_chain):
     assert isinstance(root_elem_list, (tuple, list))
     assert isinstance(condition_chain, (tuple, list))
     
-    root_elem_list = tuple(root_elem_list)
-    condition_chain = tuple(condition_chain)
+    return find_compiled(
+            root_elem_list,
+            get_compiled_condition_chain(condition_chain),
+            )
+
+def condition_key(condition):
+    # hashable form of ``condition``. equal conditions give equal keys
+    
+    if isinstance(condition, dict):
+        return tuple(sorted(
+                (key, condition_key(value)) for key, value in condition.items()
+                ))
+    
+    if isinstance(condition, (tuple, list)):
+        return tuple(condition_key(value) for value in condition)
+    
+    return condition
+
+class CompiledTrieNode:
+    pass
+
+def compile_condition_chain_map(condition_chain_map):
+    # builds trie of compiled conditions. chains with common prefix
+    # share nodes of that prefix, so the prefix is matched only once
     
-    candidate_list = []
-    condition = condition_chain[0]
-    next_condition_chain = condition_chain[1:]
+    assert isinstance(condition_chain_map, dict)
     
+    root_node = CompiledTrieNode()
+    root_node.child_map = {}
+    
+    for name, condition_chain in condition_chain_map.items():
+        assert isinstance(condition_chain, (tuple, list))
+        assert condition_chain
+        
+        node = root_node
+        
+        for condition in condition_chain:
+            key = condition_key(condition)
+            child_node = node.child_map.get(key)
+            
+            if child_node is None:
+                child_node = CompiledTrieNode()
+                child_node.condition_match = compile_condition(condition)
+                child_node.name_list = []
+                child_node.child_map = {}
+                node.child_map[key] = child_node
+            
+            node = child_node
+        
+        node.name_list.append(name)
+    
+    return root_node
+
+def get_compiled_condition_chain_map(condition_chain_map):
+    cached = compiled_chain_cache.get(id(condition_chain_map))
+    
+    if cached is not None and cached[0] is condition_chain_map:
+        return cached[1]
+    
+    root_node = compile_condition_chain_map(condition_chain_map)
+    
+    if len(compiled_chain_cache) >= COMPILED_CHAIN_CACHE_MAX:
+        compiled_chain_cache.clear()
+    
+    compiled_chain_cache[id(condition_chain_map)] = condition_chain_map, root_node
+    
+    return root_node
+
+def find_multi_node(root_elem_list, node, result_map):
+    child_node_list = tuple(node.child_map.values())
+    candidate_list_list = tuple([] for child_node in child_node_list)
+    match_pair_list = tuple(zip(
+            tuple(child_node.condition_match for child_node in child_node_list),
+            candidate_list_list,
+            ))
+    visited_set = set()
+    
+    # one traversal for all child conditions of this node
     for root_elem in root_elem_list:
+        if root_elem in visited_set:
+            continue
+        
         for elem in root_elem.iter():
-            if elem in candidate_list:
+            if elem in visited_set:
                 continue
             
-            if elem_condition_check(elem, condition):
-                candidate_list.append(elem)
+            visited_set.add(elem)
+            
+            for condition_match, candidate_list in match_pair_list:
+                if condition_match(elem):
+                    candidate_list.append(elem)
     
-    if candidate_list and next_condition_chain:
-        # recursion!
-        return find(candidate_list, next_condition_chain)
+    for child_node, candidate_list in zip(child_node_list, candidate_list_list):
+        if not candidate_list:
+            continue
+        
+        candidate_tuple = tuple(candidate_list)
+        
+        for name in child_node.name_list:
+            result_map[name] = candidate_tuple
+        
+        if child_node.child_map:
+            # recursion!
+            find_multi_node(candidate_tuple, child_node, result_map)
+
+# find_multi() -- does ``find()`` for several chains at once
+#
+#   ``condition_chain_map`` -- dict of chains by name. keep it as constant:
+#       compiled form is cached by identity of the dict
+#
+#   returns dict of same names, each value is equal to
+#   ``find(root_elem_list, condition_chain_map[name])``
+#
+def find_multi(root_elem_list, condition_chain_map):
+    assert isinstance(root_elem_list, (tuple, list))
     
-    return tuple(candidate_list)
+    result_map = {name: () for name in condition_chain_map}
+    
+    find_multi_node(
+            tuple(root_elem_list),
+            get_compiled_condition_chain_map(condition_chain_map),
+            result_map,
+            )
+    
+    return result_map
@@ -0,0 +1,134 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# firm delta -- changes of firm records since previous run.
+#
+# state is SQLite database of firm url and hash of its record. records
+# of this run are compared with state: firm is added, changed or
+# (at the end of crawl) removed. urls which failed in this run are not
+# removed -- they keep their previous hash. if some other page failed
+# (listing page, for example), firms behind it are unknown -- so no firm
+# is removed in this run. the same is for partial crawl (only seeded
+# urls, without walking of firm list).
+
+import hashlib
+import json
+import sqlite3
+
+CHANGE_ADDED = 'added'
+CHANGE_CHANGED = 'changed'
+CHANGE_REMOVED = 'removed'
+
+def get_record_hash(fetch_data):
+    return hashlib.sha1(json.dumps(
+            fetch_data,
+            ensure_ascii=False,
+            sort_keys=True,
+            ).encode('utf-8')).hexdigest()
+
+class FirmDeltaCtx:
+    pass
+
+def init_firm_delta(firm_delta_ctx, state_path, is_partial=False):
+    # ``is_partial`` -- crawl does not visit all firms, so firms which are
+    # not visited keep their previous hashes and are not removed
+    
+    firm_delta_ctx.is_partial = is_partial
+    firm_delta_ctx.db = sqlite3.connect(state_path)
+    
+    firm_delta_ctx.db.execute(
+            'CREATE TABLE IF NOT EXISTS firm ('
+            'url TEXT PRIMARY KEY, '
+            'record_hash TEXT NOT NULL)'
+            )
+    firm_delta_ctx.db.commit()
+    
+    firm_delta_ctx.prev_hash_map = dict(firm_delta_ctx.db.execute(
+            'SELECT url, record_hash FROM firm'
+            ))
+    firm_delta_ctx.hash_map = {}
+    firm_delta_ctx.error_url_set = set()
+
+def firm_delta_fetch(firm_delta_ctx, firm_url, fetch_data):
+    # returns ``CHANGE_ADDED``, ``CHANGE_CHANGED`` or ``None`` (not changed)
+    
+    record_hash = get_record_hash(fetch_data)
+    prev_record_hash = firm_delta_ctx.prev_hash_map.get(firm_url)
+    
+    firm_delta_ctx.hash_map[firm_url] = record_hash
+    
+    if prev_record_hash is None:
+        return CHANGE_ADDED
+    
+    if prev_record_hash != record_hash:
+        return CHANGE_CHANGED
+    
+    return None
+
+def firm_delta_error(firm_delta_ctx, error_url):
+    firm_delta_ctx.error_url_set.add(error_url)
+
+def firm_delta_is_complete(firm_delta_ctx):
+    # ``True`` if crawl is full and every failed url is known firm
+    
+    if firm_delta_ctx.is_partial:
+        return False
+    
+    return all(
+            error_url in firm_delta_ctx.prev_hash_map
+            for error_url in firm_delta_ctx.error_url_set
+            )
+
+def firm_delta_removed_list(firm_delta_ctx):
+    # must be called only when crawl is complete
+    
+    if not firm_delta_is_complete(firm_delta_ctx):
+        return []
+    
+    return sorted(
+            firm_url
+            for firm_url in firm_delta_ctx.prev_hash_map
+            if firm_url not in firm_delta_ctx.hash_map and
+                    firm_url not in firm_delta_ctx.error_url_set
+            )
+
+def firm_delta_commit(firm_delta_ctx):
+    # replaces state by records of this run. must be called only when
+    # crawl is complete
+    
+    hash_map = dict(firm_delta_ctx.hash_map)
+    
+    if firm_delta_is_complete(firm_delta_ctx):
+        kept_url_list = firm_delta_ctx.error_url_set
+    else:
+        kept_url_list = firm_delta_ctx.prev_hash_map
+    
+    for kept_url in kept_url_list:
+        if kept_url not in hash_map and kept_url in firm_delta_ctx.prev_hash_map:
+            hash_map[kept_url] = firm_delta_ctx.prev_hash_map[kept_url]
+    
+    with firm_delta_ctx.db:
+        firm_delta_ctx.db.execute('DELETE FROM firm')
+        firm_delta_ctx.db.executemany(
+                'INSERT INTO firm (url, record_hash) VALUES (?, ?)',
+                hash_map.items(),
+                )
+
+def firm_delta_close(firm_delta_ctx):
+    firm_delta_ctx.db.close()
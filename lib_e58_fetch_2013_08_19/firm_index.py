@@ -0,0 +1,280 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+assert str is not bytes
+
+# firm index -- local query layer over fetched firm records.
+#
+# index is SQLite database: table ``firm`` keeps records (and hash of
+# every record), full text index ``firm_fts`` (FTS5, external content) is
+# over fields of ``INDEX_FIELD_LIST`` and is kept in step with ``firm`` by
+# triggers. index is updated by records of new crawls: new firms are
+# added, changed ones are replaced, unchanged ones are not touched.
+#
+# text is split by ``unicode61`` tokenizer: words of any case and
+# language, ``www.firm.ru`` is ``www firm ru`` (so it is found by phrase
+# ``"firm ru"``), ``/ph/12.png`` is ``ph 12 png``.
+
+import sqlite3
+from . import firm_delta
+
+INDEX_FIELD_LIST = ('title', 'rubriks', 'work', 'address', 'www', 'phone')
+BATCH_SIZE = 1000
+
+# urls of one ``IN (...)`` -- less than limit of SQLite variables
+SELECT_URL_COUNT = 500
+
+class FirmIndexError(Exception):
+    pass
+
+def quote_phrase(text):
+    # FTS5 phrase of ``text``. ``*`` at the end makes it prefix
+    
+    is_prefix = text.endswith('*')
+    
+    if is_prefix:
+        text = text[:-1]
+    
+    phrase = '"{}"'.format(text.replace('"', '""'))
+    
+    if is_prefix:
+        phrase = '{} *'.format(phrase)
+    
+    return phrase
+
+def build_match(text=None, field_map=None):
+    # returns FTS5 query: ``text`` (FTS5 syntax, over all fields) and
+    # phrase of every field of ``field_map``, all of them at once
+    
+    match_list = []
+    
+    if text is not None:
+        match_list.append('({})'.format(text))
+    
+    if field_map is not None:
+        for field_name, field_text in field_map.items():
+            if field_name not in INDEX_FIELD_LIST:
+                raise FirmIndexError('field is not indexed: {!r}'.format(field_name))
+            
+            match_list.append('{} : {}'.format(field_name, quote_phrase(field_text)))
+    
+    return ' AND '.join(match_list)
+
+class FirmIndexCtx:
+    pass
+
+def init_firm_index(firm_index_ctx, index_path, field_list):
+    # ``field_list`` -- all fields of record (``INDEX_FIELD_LIST`` is
+    # part of them)
+    
+    firm_index_ctx.field_list = tuple(field_list)
+    firm_index_ctx.db = sqlite3.connect(index_path)
+    
+    db = firm_index_ctx.db
+    
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute(
+            'CREATE TABLE IF NOT EXISTS firm ('
+            'url TEXT NOT NULL UNIQUE, '
+            'record_hash TEXT NOT NULL, {})'.format(', '.join(
+                    '{} TEXT'.format(field_name)
+                    for field_name in firm_index_ctx.field_list
+                    ))
+            )
+    
+    column_set = frozenset(row[1] for row in db.execute('PRAGMA table_info(firm)'))
+    
+    if not column_set.issuperset(firm_index_ctx.field_list):
+        db.close()
+        
+        raise FirmIndexError('index is of other fields')
+    
+    db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS firm_fts USING fts5("
+            "{}, content='firm', content_rowid='rowid', "
+            "tokenize='unicode61 remove_diacritics 2')".format(
+                    ', '.join(INDEX_FIELD_LIST))
+            )
+    
+    fts_column_list = ', '.join(INDEX_FIELD_LIST)
+    new_column_list = ', '.join(
+            'new.{}'.format(field_name)
+            for field_name in INDEX_FIELD_LIST
+            )
+    old_column_list = ', '.join(
+            'old.{}'.format(field_name)
+            for field_name in INDEX_FIELD_LIST
+            )
+    
+    db.execute(
+            'CREATE TRIGGER IF NOT EXISTS firm_insert AFTER INSERT ON firm BEGIN '
+            'INSERT INTO firm_fts (rowid, {0}) VALUES (new.rowid, {1}); '
+            'END'.format(fts_column_list, new_column_list)
+            )
+    db.execute(
+            'CREATE TRIGGER IF NOT EXISTS firm_delete AFTER DELETE ON firm BEGIN '
+            "INSERT INTO firm_fts (firm_fts, rowid, {0}) VALUES ('delete', old.rowid, {1}); "
+            'END'.format(fts_column_list, old_column_list)
+            )
+    db.execute(
+            'CREATE TRIGGER IF NOT EXISTS firm_update AFTER UPDATE ON firm BEGIN '
+            "INSERT INTO firm_fts (firm_fts, rowid, {0}) VALUES ('delete', old.rowid, {1}); "
+            'INSERT INTO firm_fts (rowid, {0}) VALUES (new.rowid, {2}); '
+            'END'.format(fts_column_list, old_column_list, new_column_list)
+            )
+    db.commit()
+
+def firm_index_update_batch(firm_index_ctx, record_list, count_map):
+    db = firm_index_ctx.db
+    hash_map = {}
+    
+    for record_url, fetch_data in record_list:
+        hash_map[record_url] = firm_delta.get_record_hash(fetch_data)
+    
+    prev_hash_map = {}
+    url_list = tuple(hash_map)
+    
+    for url_i in range(0, len(url_list), SELECT_URL_COUNT):
+        part_url_list = url_list[url_i:url_i + SELECT_URL_COUNT]
+        
+        prev_hash_map.update(db.execute(
+                'SELECT url, record_hash FROM firm WHERE url IN ({})'.format(
+                        ', '.join('?' for part_url in part_url_list)),
+                part_url_list,
+                ))
+    
+    insert_list = []
+    update_list = []
+    
+    for record_url, fetch_data in record_list:
+        record_hash = hash_map[record_url]
+        prev_record_hash = prev_hash_map.get(record_url)
+        
+        if prev_record_hash == record_hash:
+            count_map['unchanged'] += 1
+            
+            continue
+        
+        # the same url may be twice in batch
+        prev_hash_map[record_url] = record_hash
+        
+        row = (record_hash,) + tuple(
+                fetch_data[field_name]
+                for field_name in firm_index_ctx.field_list
+                ) + (record_url,)
+        
+        if prev_record_hash is None:
+            insert_list.append(row)
+            count_map['added'] += 1
+        else:
+            update_list.append(row)
+            count_map['changed'] += 1
+    
+    db.executemany(
+            'INSERT INTO firm (record_hash, {}, url) VALUES (?, {}, ?)'.format(
+                    ', '.join(firm_index_ctx.field_list),
+                    ', '.join('?' for field_name in firm_index_ctx.field_list),
+                    ),
+            insert_list,
+            )
+    db.executemany(
+            'UPDATE firm SET record_hash = ?, {} WHERE url = ?'.format(
+                    ', '.join(
+                            '{} = ?'.format(field_name)
+                            for field_name in firm_index_ctx.field_list
+                            )),
+            update_list,
+            )
+
+def firm_index_update(firm_index_ctx, record_iter, is_prune=False):
+    # adds records of ``record_iter`` (``(record_url, fetch_data)``) to
+    # index, in one transaction. returns dict of counts: ``added``,
+    # ``changed``, ``unchanged`` and ``removed``.
+    #
+    # ``is_prune`` -- firms which are not in ``record_iter`` are removed
+    # (records are of full crawl)
+    
+    count_map = {
+            'added': 0,
+            'changed': 0,
+            'unchanged': 0,
+            'removed': 0,
+            }
+    url_set = set()
+    
+    with firm_index_ctx.db:
+        record_list = []
+        
+        for record_url, fetch_data in record_iter:
+            record_list.append((record_url, fetch_data))
+            
+            if is_prune:
+                url_set.add(record_url)
+            
+            if len(record_list) >= BATCH_SIZE:
+                firm_index_update_batch(firm_index_ctx, record_list, count_map)
+                record_list = []
+        
+        firm_index_update_batch(firm_index_ctx, record_list, count_map)
+        
+        if is_prune:
+            removed_url_list = tuple(
+                    (row[0],)
+                    for row in firm_index_ctx.db.execute('SELECT url FROM firm')
+                    if row[0] not in url_set
+                    )
+            
+            firm_index_ctx.db.executemany(
+                    'DELETE FROM firm WHERE url = ?',
+                    removed_url_list,
+                    )
+            
+            count_map['removed'] = len(removed_url_list)
+    
+    return count_map
+
+def firm_index_query(firm_index_ctx, match, limit=None):
+    # returns list of ``(record_url, fetch_data)``, the best matches
+    # first. ``match`` -- FTS5 query (see ``build_match()``)
+    
+    try:
+        cursor = firm_index_ctx.db.execute(
+                'SELECT firm.url, {} FROM firm_fts '
+                'JOIN firm ON firm.rowid = firm_fts.rowid '
+                'WHERE firm_fts MATCH ? ORDER BY firm_fts.rank LIMIT ?'.format(
+                        ', '.join(
+                                'firm.{}'.format(field_name)
+                                for field_name in firm_index_ctx.field_list
+                                )),
+                (match, -1 if limit is None else limit),
+                )
+        row_list = cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        # syntax error of query, for example
+        raise FirmIndexError('invalid query: {}'.format(e))
+    
+    return [
+            (row[0], dict(zip(firm_index_ctx.field_list, row[1:])))
+            for row in row_list
+            ]
+
+def firm_index_count(firm_index_ctx):
+    return firm_index_ctx.db.execute('SELECT COUNT(*) FROM firm').fetchone()[0]
+
+def firm_index_close(firm_index_ctx):
+    firm_index_ctx.db.close()
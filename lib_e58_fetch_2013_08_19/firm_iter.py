@@ -0,0 +1,284 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# firm iter -- generator API of crawler, for embedding it without CLI.
+#
+#   for firm_url, fetch_data in iter_firms(parser_name='lxml'):
+#       ...
+#
+#   async for firm_url, fetch_data in aiter_firms(parser_name='lxml'):
+#       ...
+#
+# crawl runs in background (thread or asyncio engine) and puts records to
+# bounded buffer, so slow consumer stops workers (backpressure). closing
+# of generator (``break`` out of loop, ``close()``, exception in loop
+# body) cancels crawl: fetches in flight are finished and their records
+# are dropped, and generator returns only when all workers are stopped.
+# ``async for`` does not close generator on ``break``, so
+# ``contextlib.aclosing()`` is needed there for deterministic shutdown.
+# otherwise crawl is cancelled when event loop finalizes generator or
+# is closed.
+
+import asyncio
+import concurrent.futures
+import queue
+from . import e58_fetch
+from . import e58_fetch_async
+from . import http_pool
+
+BUFFER_SIZE = 100
+LOOP_CHECK_INTERVAL = 1.0
+ENGINE = 'thread'
+
+def init_crawl(
+        bulk_data_ctx,
+        engine,
+        site_url=None,
+        seed_url_list=None,
+        parser_name=None,
+        concurrency=None,
+        max_concurrency=None,
+        rps=None,
+        max_attempts=None,
+        http_cache_ctx=None,
+        crawl_stats_ctx=None,
+        ):
+    # the same setup as CLI has by default
+    
+    default_concurrency, default_max_concurrency = \
+            e58_fetch_async.get_default_concurrency(engine)
+    
+    if concurrency is None:
+        concurrency = default_concurrency
+    
+    if max_concurrency is None:
+        max_concurrency = max(default_max_concurrency, concurrency)
+    
+    concurrency_ctl_ctx, host_rate_ctx, retry_queue_ctx = e58_fetch.get_fetch_control(
+            1,
+            max_concurrency,
+            concurrency,
+            rps=rps,
+            max_attempts=max_attempts,
+            )
+    
+    e58_fetch.init_bulk_data_ctx(
+            bulk_data_ctx,
+            site_url=site_url,
+            parser_name=parser_name,
+            http_cache_ctx=http_cache_ctx,
+            seed_url_list=seed_url_list,
+            crawl_stats_ctx=crawl_stats_ctx,
+            concurrency_ctl_ctx=concurrency_ctl_ctx,
+            host_rate_ctx=host_rate_ctx,
+            retry_queue_ctx=retry_queue_ctx,
+            )
+
+def start_crawl(bulk_data_ctx, engine, put_event):
+    # ``put_event(event)`` -- it is called by workers and may block them.
+    # events are ``('fetch', url, fetch_data)``,
+    # ``('error', url, err_type, err_msg)`` and ``('done',)``
+    
+    def on_fetch(url, fetch_data):
+        put_event(('fetch', url, fetch_data))
+    
+    def on_error(url, err_type, err_msg):
+        put_event(('error', url, err_type, err_msg))
+    
+    def on_done():
+        http_pool.http_pool_close(bulk_data_ctx.http_pool)
+        put_event(('done',))
+    
+    if engine == 'asyncio':
+        e58_fetch_async.bulk_data_fetch_async(
+                bulk_data_ctx,
+                concurrency=bulk_data_ctx.concurrency_ctl.max_concurrency,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=on_done,
+                )
+    else:
+        e58_fetch.bulk_data_fetch(
+                bulk_data_ctx,
+                thread_count=bulk_data_ctx.concurrency_ctl.max_concurrency,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=on_done,
+                )
+
+def iter_firms(
+        site_url=None,
+        seed_url_list=None,
+        parser_name=None,
+        engine=None,
+        concurrency=None,
+        max_concurrency=None,
+        rps=None,
+        max_attempts=None,
+        http_cache_ctx=None,
+        crawl_stats_ctx=None,
+        buffer_size=None,
+        on_error=None,
+        ):
+    # yields ``(firm_url, fetch_data)``. crawl starts on first record
+    # request.
+    #
+    # ``buffer_size`` -- count of records which workers may put ahead of
+    # consumer.
+    #
+    # ``on_error(url, err_type, err_msg)`` -- it is called in consumer
+    # thread for every url which failed finally. exception of it stops
+    # crawl
+    
+    if engine is None:
+        engine = ENGINE
+    
+    if buffer_size is None:
+        buffer_size = BUFFER_SIZE
+    
+    event_queue = queue.Queue(maxsize=buffer_size)
+    bulk_data_ctx = e58_fetch.BulkDataCtx()
+    init_crawl(
+            bulk_data_ctx,
+            engine,
+            site_url=site_url,
+            seed_url_list=seed_url_list,
+            parser_name=parser_name,
+            concurrency=concurrency,
+            max_concurrency=max_concurrency,
+            rps=rps,
+            max_attempts=max_attempts,
+            http_cache_ctx=http_cache_ctx,
+            crawl_stats_ctx=crawl_stats_ctx,
+            )
+    start_crawl(bulk_data_ctx, engine, event_queue.put)
+    
+    is_done = False
+    
+    try:
+        while True:
+            event = event_queue.get()
+            
+            if event[0] == 'done':
+                is_done = True
+                
+                return
+            
+            if event[0] == 'fetch':
+                yield event[1], event[2]
+            elif event[0] == 'error' and on_error is not None:
+                on_error(event[1], event[2], event[3])
+    finally:
+        if not is_done:
+            e58_fetch.bulk_data_cancel(bulk_data_ctx)
+            
+            # workers may wait for room in buffer. records are dropped
+            while event_queue.get()[0] != 'done':
+                pass
+
+async def aiter_firms(
+        site_url=None,
+        seed_url_list=None,
+        parser_name=None,
+        engine=None,
+        concurrency=None,
+        max_concurrency=None,
+        rps=None,
+        max_attempts=None,
+        http_cache_ctx=None,
+        crawl_stats_ctx=None,
+        buffer_size=None,
+        on_error=None,
+        ):
+    # the same as ``iter_firms()`` for ``async for``. workers never run
+    # in event loop of consumer: they wait for room in buffer in their
+    # own threads
+    
+    if engine is None:
+        engine = ENGINE
+    
+    if buffer_size is None:
+        buffer_size = BUFFER_SIZE
+    
+    loop = asyncio.get_running_loop()
+    event_queue = asyncio.Queue(maxsize=buffer_size)
+    
+    bulk_data_ctx = e58_fetch.BulkDataCtx()
+    
+    def put_event(event):
+        if loop.is_closed():
+            e58_fetch.bulk_data_cancel(bulk_data_ctx)
+            
+            return
+        
+        try:
+            future = asyncio.run_coroutine_threadsafe(event_queue.put(event), loop)
+            
+            while True:
+                try:
+                    future.result(LOOP_CHECK_INTERVAL)
+                    
+                    return
+                except concurrent.futures.TimeoutError:
+                    # put which is scheduled on closed loop never ends
+                    if loop.is_closed():
+                        break
+        except (RuntimeError, concurrent.futures.CancelledError):
+            pass
+        
+        # consumer is gone without closing of generator
+        e58_fetch.bulk_data_cancel(bulk_data_ctx)
+    
+    init_crawl(
+            bulk_data_ctx,
+            engine,
+            site_url=site_url,
+            seed_url_list=seed_url_list,
+            parser_name=parser_name,
+            concurrency=concurrency,
+            max_concurrency=max_concurrency,
+            rps=rps,
+            max_attempts=max_attempts,
+            http_cache_ctx=http_cache_ctx,
+            crawl_stats_ctx=crawl_stats_ctx,
+            )
+    start_crawl(bulk_data_ctx, engine, put_event)
+    
+    is_done = False
+    
+    try:
+        while True:
+            event = await event_queue.get()
+            
+            if event[0] == 'done':
+                is_done = True
+                
+                return
+            
+            if event[0] == 'fetch':
+                yield event[1], event[2]
+            elif event[0] == 'error' and on_error is not None:
+                on_error(event[1], event[2], event[3])
+    finally:
+        if not is_done:
+            e58_fetch.bulk_data_cancel(bulk_data_ctx)
+            
+            # workers may wait for room in buffer. records are dropped
+            while (await event_queue.get())[0] != 'done':
+                pass
@@ -0,0 +1,453 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# html parser backends.
+#
+# every backend returns ``xml.etree.ElementTree`` tree (root is ``html``
+# elem) with XHTML-namespaced tags -- the same form as ``html5lib.parse()``
+# gives, so ``et_find`` chains work with any backend.
+#
+#   ``html5lib`` -- reference parser. slow (pure python), but exact.
+#
+#   ``htmlparser`` -- tree builder on top of ``html.parser``. fast, knows
+#       only basic rules of implied end tags.
+#
+#   ``lxml`` -- ``lxml.html`` (if installed), converted to ElementTree.
+#       self-closing syntax of non-void tags is removed from text before
+#       it, as ``html5lib`` ignores it (see ``open_self_closing()``).
+#
+# ``htmlparser`` and ``lxml`` also parse text fed by parts
+# (``init_stream_parse()``, ``stream_parse_feed()``, ``stream_parse_close()``),
+# so page is parsed while it is downloaded and whole text is never kept.
+#
+# ``scan()`` is not a backend: it finds elems of ``et_find`` chains right
+# in token stream of ``html.parser``, without building tree. found elems
+# have only tag and attributes, so it suits chains of links.
+
+from xml.etree import ElementTree as et
+import html.parser
+import html5lib
+import re
+from . import et_find
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+XHTML_NS = '{http://www.w3.org/1999/xhtml}'
+
+PARSER_NAME_LIST = ('html5lib', 'htmlparser', 'lxml')
+STREAM_PARSER_NAME_LIST = ('htmlparser', 'lxml')
+
+VOID_TAG_SET = frozenset((
+        'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+        'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr',
+        ))
+
+HEAD_TAG_SET = frozenset((
+        'base', 'link', 'meta', 'noscript', 'script', 'style', 'title',
+        ))
+
+# start of these tags closes open ``p``
+P_CLOSING_TAG_SET = frozenset((
+        'address', 'article', 'aside', 'blockquote', 'dd', 'div', 'dl',
+        'dt', 'fieldset', 'figure', 'footer', 'form', 'h1', 'h2', 'h3',
+        'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'menu', 'nav',
+        'ol', 'p', 'pre', 'section', 'table', 'ul',
+        ))
+
+# open tag -- start tags which close it implicitly
+IMPLIED_END_MAP = {
+        'p': P_CLOSING_TAG_SET,
+        'li': frozenset(('li',)),
+        'dt': frozenset(('dt', 'dd')),
+        'dd': frozenset(('dt', 'dd')),
+        'option': frozenset(('option', 'optgroup')),
+        'tr': frozenset(('tr',)),
+        'td': frozenset(('td', 'th', 'tr')),
+        'th': frozenset(('td', 'th', 'tr')),
+        }
+
+# search of implicitly closed tag stops on these tags
+SCOPE_TAG_SET = frozenset((
+        'button', 'dl', 'li', 'ol', 'select', 'table', 'td', 'th', 'ul',
+        ))
+
+# start tag with self-closing syntax. unquoted attribute value takes
+# ``/`` before ``>``, so such tag is not self-closing
+SELF_CLOSING_TAG_RE = re.compile(
+        r'<(?P<tag>[a-zA-Z][^\s/>]*)'
+        r'(?P<attrs>(?:\s+[^\s"\'>/=]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|'
+        r'[^\s"\'=<>`]+(?=[\s>])))?)*)'
+        r'\s*/>'
+        )
+
+class ParserBackendError(Exception):
+    pass
+
+class EtTreeBuilder(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        
+        self.root_elem = et.Element(XHTML_NS + 'html')
+        self.head_elem = et.SubElement(self.root_elem, XHTML_NS + 'head')
+        self.body_elem = None
+        self.elem_stack = [self.root_elem]
+        self.tag_stack = ['html']
+    
+    def get_body(self):
+        if self.body_elem is None:
+            self.body_elem = et.SubElement(self.root_elem, XHTML_NS + 'body')
+            self.elem_stack = [self.root_elem, self.body_elem]
+            self.tag_stack = ['html', 'body']
+        
+        return self.body_elem
+    
+    def pop_to(self, stack_i):
+        del self.elem_stack[stack_i:]
+        del self.tag_stack[stack_i:]
+    
+    def close_implied(self, tag):
+        stack_i = len(self.tag_stack) - 1
+        
+        while stack_i > 1:
+            open_tag = self.tag_stack[stack_i]
+            
+            if tag in IMPLIED_END_MAP.get(open_tag, ()):
+                self.pop_to(stack_i)
+            elif open_tag in SCOPE_TAG_SET:
+                return
+            
+            stack_i -= 1
+    
+    def append_text(self, data):
+        parent_elem = self.elem_stack[-1]
+        
+        if len(parent_elem):
+            last_elem = parent_elem[-1]
+            last_elem.tail = (last_elem.tail or '') + data
+        else:
+            parent_elem.text = (parent_elem.text or '') + data
+    
+    def handle_starttag(self, tag, attrs):
+        attrib = {}
+        for attr_name, attr_value in attrs:
+            attrib.setdefault(attr_name, attr_value if attr_value is not None else '')
+        
+        if tag == 'html':
+            for attr_name, attr_value in attrib.items():
+                self.root_elem.attrib.setdefault(attr_name, attr_value)
+            
+            return
+        
+        if tag == 'head':
+            return
+        
+        if tag == 'body':
+            self.get_body().attrib.update(attrib)
+            
+            return
+        
+        if self.body_elem is None and tag in HEAD_TAG_SET:
+            elem = et.SubElement(self.head_elem, XHTML_NS + tag, attrib)
+            
+            if tag not in VOID_TAG_SET:
+                self.elem_stack = [self.root_elem, elem]
+                self.tag_stack = ['html', tag]
+            
+            return
+        
+        self.get_body()
+        self.close_implied(tag)
+        
+        elem = et.SubElement(self.elem_stack[-1], XHTML_NS + tag, attrib)
+        
+        if tag not in VOID_TAG_SET:
+            self.elem_stack.append(elem)
+            self.tag_stack.append(tag)
+    
+    def handle_startendtag(self, tag, attrs):
+        # self-closing syntax does not close non-void elem in html
+        self.handle_starttag(tag, attrs)
+    
+    def handle_endtag(self, tag):
+        if tag in ('html', 'body', 'head'):
+            return
+        
+        for stack_i in range(len(self.tag_stack) - 1, 0, -1):
+            if self.tag_stack[stack_i] == tag:
+                self.pop_to(stack_i)
+                
+                if len(self.tag_stack) == 1 and self.body_elem is not None:
+                    # end of head elem after body is started
+                    self.elem_stack = [self.root_elem, self.body_elem]
+                    self.tag_stack = ['html', 'body']
+                
+                return
+    
+    def handle_data(self, data):
+        if len(self.tag_stack) == 1:
+            if not data.strip():
+                return
+            
+            self.get_body()
+        
+        self.append_text(data)
+    
+    def handle_comment(self, data):
+        self.elem_stack[-1].append(et.Comment(data))
+
+def parse_htmlparser(html):
+    tree_builder = EtTreeBuilder()
+    tree_builder.feed(html)
+    
+    return close_htmlparser(tree_builder)
+
+def close_htmlparser(tree_builder):
+    tree_builder.close()
+    tree_builder.get_body()
+    
+    return tree_builder.root_elem
+
+def lxml_to_et(lxml_elem, et_parent_elem):
+    for lxml_child in lxml_elem:
+        lxml_tag = lxml_child.tag
+        
+        if lxml_tag is lxml.etree.Comment:
+            et_child = et.Comment(lxml_child.text)
+        elif isinstance(lxml_tag, str):
+            et_child = et.Element(XHTML_NS + lxml_tag, dict(lxml_child.attrib))
+            et_child.text = lxml_child.text
+            
+            # recursion!
+            lxml_to_et(lxml_child, et_child)
+        else:
+            # processing instructions and entities. keep only tail
+            if lxml_child.tail:
+                if len(et_parent_elem):
+                    et_parent_elem[-1].tail = (et_parent_elem[-1].tail or '') + lxml_child.tail
+                else:
+                    et_parent_elem.text = (et_parent_elem.text or '') + lxml_child.tail
+            
+            continue
+        
+        et_child.tail = lxml_child.tail
+        et_parent_elem.append(et_child)
+
+def open_self_closing_tag(match):
+    if match.group('tag').lower() in VOID_TAG_SET:
+        return match.group()
+    
+    return '<{}{}>'.format(match.group('tag'), match.group('attrs'))
+
+def open_self_closing(html):
+    # ``<div/>`` to ``<div>``: ``lxml`` closes such elem at once, but in
+    # html (and in other backends) self-closing syntax of non-void tag
+    # is ignored
+    
+    if '/>' not in html:
+        return html
+    
+    return SELF_CLOSING_TAG_RE.sub(open_self_closing_tag, html)
+
+def parse_lxml(html):
+    if lxml is None:
+        raise ParserBackendError('lxml is not installed')
+    
+    return lxml_root_to_et(lxml.html.document_fromstring(open_self_closing(html)))
+
+def lxml_root_to_et(lxml_root):
+    et_root = et.Element(XHTML_NS + 'html', dict(lxml_root.attrib))
+    
+    lxml_to_et(lxml_root, et_root)
+    
+    return et_root
+
+def parse(html, parser_name):
+    if parser_name == 'html5lib':
+        return html5lib.parse(html)
+    
+    if parser_name == 'htmlparser':
+        return parse_htmlparser(html)
+    
+    if parser_name == 'lxml':
+        return parse_lxml(html)
+    
+    raise ParserBackendError('unknown parser: {!r}'.format(parser_name))
+
+class StreamParseCtx:
+    pass
+
+def init_stream_parse(stream_parse_ctx, parser_name):
+    stream_parse_ctx.parser_name = parser_name
+    
+    if parser_name == 'htmlparser':
+        stream_parse_ctx.parser = EtTreeBuilder()
+    elif parser_name == 'lxml':
+        if lxml is None:
+            raise ParserBackendError('lxml is not installed')
+        
+        stream_parse_ctx.parser = lxml.html.HTMLParser()
+        # text after last ``<`` may be part of tag (see ``open_self_closing()``)
+        stream_parse_ctx.tag_tail = ''
+    elif parser_name in PARSER_NAME_LIST:
+        raise ParserBackendError('parser can not parse by parts: {!r}'.format(parser_name))
+    else:
+        raise ParserBackendError('unknown parser: {!r}'.format(parser_name))
+
+def stream_parse_feed(stream_parse_ctx, html_part):
+    if stream_parse_ctx.parser_name == 'htmlparser':
+        stream_parse_ctx.parser.feed(html_part)
+        
+        return
+    
+    html_part = stream_parse_ctx.tag_tail + html_part
+    tag_i = html_part.rfind('<')
+    
+    if tag_i != -1 and html_part.find('>', tag_i) == -1:
+        stream_parse_ctx.tag_tail = html_part[tag_i:]
+        html_part = html_part[:tag_i]
+    else:
+        stream_parse_ctx.tag_tail = ''
+    
+    if html_part:
+        stream_parse_ctx.parser.feed(open_self_closing(html_part))
+
+def stream_parse_close(stream_parse_ctx):
+    # returns the same tree as ``parse()`` gives for whole text
+    
+    if stream_parse_ctx.parser_name == 'htmlparser':
+        return close_htmlparser(stream_parse_ctx.parser)
+    
+    if stream_parse_ctx.tag_tail:
+        stream_parse_ctx.parser.feed(stream_parse_ctx.tag_tail)
+    
+    lxml_root = stream_parse_ctx.parser.close()
+    
+    if lxml_root is None:
+        raise lxml.etree.ParserError('Document is empty')
+    
+    return lxml_root_to_et(lxml_root)
+
+class ElemScanner(html.parser.HTMLParser):
+    # every open elem keeps progress of every chain -- count of chain
+    # conditions matched by the elem and its ancestors. conditions match
+    # elem itself or its descendants (as in ``et_find``), so progress is
+    # greedy
+    
+    def __init__(self, condition_chain_map):
+        super().__init__(convert_charrefs=True)
+        
+        self.chain_list = tuple(
+                (name, et_find.get_compiled_condition_chain(condition_chain))
+                for name, condition_chain in condition_chain_map.items()
+                )
+        self.elem_list_map = dict(
+                (name, [])
+                for name in condition_chain_map
+                )
+        
+        # ``html`` and ``body`` elems are implied, as tree backends do
+        progress_list = tuple(0 for chain in self.chain_list)
+        progress_list = self.match(progress_list, et.Element(XHTML_NS + 'html'))
+        progress_list = self.match(progress_list, et.Element(XHTML_NS + 'body'))
+        
+        self.progress_stack = [progress_list]
+        self.tag_stack = ['body']
+    
+    def match(self, parent_progress_list, elem):
+        progress_list = []
+        
+        for (name, compiled_chain), parent_progress in zip(
+                self.chain_list, parent_progress_list):
+            # elem inside of found elem still may be found by last condition
+            progress = min(parent_progress, len(compiled_chain) - 1)
+            
+            while progress < len(compiled_chain) and \
+                    compiled_chain[progress](elem):
+                progress += 1
+            
+            if progress == len(compiled_chain):
+                self.elem_list_map[name].append(elem)
+            
+            progress_list.append(max(progress, parent_progress))
+        
+        return tuple(progress_list)
+    
+    def pop_to(self, stack_i):
+        del self.progress_stack[stack_i:]
+        del self.tag_stack[stack_i:]
+    
+    def close_implied(self, tag):
+        stack_i = len(self.tag_stack) - 1
+        
+        while stack_i > 0:
+            open_tag = self.tag_stack[stack_i]
+            
+            if tag in IMPLIED_END_MAP.get(open_tag, ()):
+                self.pop_to(stack_i)
+            elif open_tag in SCOPE_TAG_SET:
+                return
+            
+            stack_i -= 1
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in ('html', 'head', 'body'):
+            return
+        
+        attrib = {}
+        for attr_name, attr_value in attrs:
+            attrib.setdefault(attr_name, attr_value if attr_value is not None else '')
+        
+        self.close_implied(tag)
+        
+        progress_list = self.match(
+                self.progress_stack[-1],
+                et.Element(XHTML_NS + tag, attrib),
+                )
+        
+        if tag not in VOID_TAG_SET:
+            self.progress_stack.append(progress_list)
+            self.tag_stack.append(tag)
+    
+    def handle_startendtag(self, tag, attrs):
+        # self-closing syntax does not close non-void elem in html
+        self.handle_starttag(tag, attrs)
+    
+    def handle_endtag(self, tag):
+        for stack_i in range(len(self.tag_stack) - 1, 0, -1):
+            if self.tag_stack[stack_i] == tag:
+                self.pop_to(stack_i)
+                
+                return
+
+def scan(html, condition_chain_map):
+    # returns ``{name: elem_list}`` -- like ``et_find.find_multi()``
+    # over parsed tree, but found elems have no text and no children
+    
+    elem_scanner = ElemScanner(condition_chain_map)
+    elem_scanner.feed(html)
+    elem_scanner.close()
+    
+    return dict(
+            (name, tuple(elem_list))
+            for name, elem_list in elem_scanner.elem_list_map.items()
+            )
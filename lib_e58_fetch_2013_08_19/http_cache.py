@@ -0,0 +1,303 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# http cache -- persistent cache of fetched pages.
+#
+# index is SQLite database (url, ETag, Last-Modified, access time).
+# bodies are gzip files, named by hash of content -- so same content
+# of several urls is stored once. when size of bodies goes over limit,
+# least recently used entries are evicted. access times of hits are
+# written by batches, not by one commit per page.
+
+import gzip
+import hashlib
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+INDEX_FILE_NAME = 'index.sqlite'
+BODY_DIR_NAME = 'bodies'
+EVICT_BATCH_SIZE = 100
+ACCESS_BATCH_SIZE = 500
+
+class HttpCacheCtx:
+    pass
+
+def init_http_cache(http_cache_ctx, cache_dir, max_size=None, offline=False):
+    # ``max_size`` -- limit of compressed bodies size in bytes (or ``None``)
+    #
+    # ``offline`` -- never go to network: urls not in cache are errors
+    
+    os.makedirs(os.path.join(cache_dir, BODY_DIR_NAME), exist_ok=True)
+    
+    http_cache_ctx.cache_dir = cache_dir
+    http_cache_ctx.max_size = max_size
+    http_cache_ctx.offline = offline
+    http_cache_ctx.lock = threading.Lock()
+    http_cache_ctx.hit_count = 0
+    http_cache_ctx.revalidated_count = 0
+    http_cache_ctx.miss_count = 0
+    http_cache_ctx.evicted_count = 0
+    # ``{url: access_time}`` -- not written yet
+    http_cache_ctx.access_time_map = {}
+    http_cache_ctx.db = sqlite3.connect(
+            os.path.join(cache_dir, INDEX_FILE_NAME),
+            check_same_thread=False,
+            )
+    
+    http_cache_ctx.db.execute('PRAGMA journal_mode=WAL')
+    http_cache_ctx.db.execute('PRAGMA synchronous=NORMAL')
+    http_cache_ctx.db.execute(
+            'CREATE TABLE IF NOT EXISTS entry ('
+            'url TEXT PRIMARY KEY, '
+            'body_hash TEXT NOT NULL, '
+            'body_size INTEGER NOT NULL, '
+            'etag TEXT, '
+            'last_modified TEXT, '
+            'access_time REAL NOT NULL)'
+            )
+    http_cache_ctx.db.execute(
+            'CREATE INDEX IF NOT EXISTS entry_access_time ON entry (access_time)'
+            )
+    http_cache_ctx.db.execute(
+            'CREATE INDEX IF NOT EXISTS entry_body_hash ON entry (body_hash)'
+            )
+    http_cache_ctx.db.commit()
+    
+    http_cache_ctx.total_size = http_cache_ctx.db.execute(
+            'SELECT COALESCE(SUM(body_size), 0) FROM '
+            '(SELECT DISTINCT body_hash, body_size FROM entry)'
+            ).fetchone()[0]
+    
+    if max_size is not None:
+        # limit could be lowered since last run
+        http_cache_evict(http_cache_ctx)
+        http_cache_ctx.db.commit()
+
+def http_cache_close(http_cache_ctx):
+    with http_cache_ctx.lock:
+        http_cache_flush_access(http_cache_ctx)
+        http_cache_ctx.db.commit()
+        http_cache_ctx.db.close()
+
+def http_cache_flush_access(http_cache_ctx):
+    # writes access times of hits (without commit). must be called under
+    # ``http_cache_ctx.lock``
+    
+    if not http_cache_ctx.access_time_map:
+        return
+    
+    http_cache_ctx.db.executemany(
+            'UPDATE entry SET access_time = ? WHERE url = ?',
+            (
+                    (access_time, access_url)
+                    for access_url, access_time in http_cache_ctx.access_time_map.items()
+                    ),
+            )
+    http_cache_ctx.access_time_map = {}
+
+def http_cache_drop_lost(http_cache_ctx, cache_url, body_hash):
+    # entry whose body file is gone is removed. must be called under
+    # ``http_cache_ctx.lock``
+    
+    lost_entry = http_cache_ctx.db.execute(
+            'SELECT body_size FROM entry WHERE url = ? AND body_hash = ?',
+            (cache_url, body_hash),
+            ).fetchone()
+    
+    if lost_entry is None:
+        return
+    
+    http_cache_ctx.db.execute('DELETE FROM entry WHERE url = ?', (cache_url,))
+    http_cache_ctx.access_time_map.pop(cache_url, None)
+    
+    if http_cache_ctx.db.execute(
+            'SELECT 1 FROM entry WHERE body_hash = ? LIMIT 1',
+            (body_hash,),
+            ).fetchone() is None:
+        http_cache_ctx.total_size -= lost_entry[0]
+    
+    http_cache_ctx.db.commit()
+
+def get_body_path(http_cache_ctx, body_hash):
+    return os.path.join(
+            http_cache_ctx.cache_dir,
+            BODY_DIR_NAME,
+            body_hash[:2],
+            '{}.gz'.format(body_hash),
+            )
+
+def http_cache_get(http_cache_ctx, cache_url):
+    # returns ``(body_hash, etag, last_modified)`` or ``None``
+    
+    with http_cache_ctx.lock:
+        return http_cache_ctx.db.execute(
+                'SELECT body_hash, etag, last_modified FROM entry WHERE url = ?',
+                (cache_url,),
+                ).fetchone()
+
+def http_cache_url_list(http_cache_ctx):
+    # urls of all entries, the oldest first
+    
+    with http_cache_ctx.lock:
+        return tuple(row[0] for row in http_cache_ctx.db.execute(
+                'SELECT url FROM entry ORDER BY rowid'
+                ))
+
+def http_cache_conditional_header_map(cache_entry):
+    # headers for revalidation of ``cache_entry`` by server
+    
+    body_hash, etag, last_modified = cache_entry
+    header_map = {}
+    
+    if etag is not None:
+        header_map['If-None-Match'] = etag
+    
+    if last_modified is not None:
+        header_map['If-Modified-Since'] = last_modified
+    
+    return header_map
+
+def http_cache_load(http_cache_ctx, cache_url, cache_entry, is_revalidated=False):
+    # returns body of ``cache_entry`` and marks it as recently used.
+    # returns ``None`` if body is lost (evicted after lookup, or removed
+    # by hand) -- it is cache miss then
+    
+    body_hash, etag, last_modified = cache_entry
+    
+    with http_cache_ctx.lock:
+        # file is read under lock: eviction can not remove it meanwhile
+        try:
+            with open(get_body_path(http_cache_ctx, body_hash), 'rb') as fd:
+                gzip_body = fd.read()
+        except FileNotFoundError:
+            http_cache_drop_lost(http_cache_ctx, cache_url, body_hash)
+            
+            return None
+        
+        if is_revalidated:
+            http_cache_ctx.revalidated_count += 1
+        else:
+            http_cache_ctx.hit_count += 1
+        
+        http_cache_ctx.access_time_map[cache_url] = time.time()
+        
+        if len(http_cache_ctx.access_time_map) >= ACCESS_BATCH_SIZE:
+            http_cache_flush_access(http_cache_ctx)
+            http_cache_ctx.db.commit()
+    
+    return gzip.decompress(gzip_body)
+
+def http_cache_evict(http_cache_ctx):
+    # must be called under ``http_cache_ctx.lock``
+    
+    # recent hits must not be evicted as old ones
+    http_cache_flush_access(http_cache_ctx)
+    
+    while http_cache_ctx.total_size > http_cache_ctx.max_size:
+        evict_list = http_cache_ctx.db.execute(
+                'SELECT url, body_hash, body_size FROM entry '
+                'ORDER BY access_time LIMIT ?',
+                (EVICT_BATCH_SIZE,),
+                ).fetchall()
+        
+        if not evict_list:
+            break
+        
+        for evict_url, body_hash, body_size in evict_list:
+            http_cache_ctx.db.execute(
+                    'DELETE FROM entry WHERE url = ?',
+                    (evict_url,),
+                    )
+            http_cache_ctx.evicted_count += 1
+            
+            if http_cache_ctx.db.execute(
+                    'SELECT 1 FROM entry WHERE body_hash = ? LIMIT 1',
+                    (body_hash,),
+                    ).fetchone() is not None:
+                continue
+            
+            http_cache_ctx.total_size -= body_size
+            
+            try:
+                os.remove(get_body_path(http_cache_ctx, body_hash))
+            except FileNotFoundError:
+                pass
+            
+            if http_cache_ctx.total_size <= http_cache_ctx.max_size:
+                break
+
+def http_cache_put(http_cache_ctx, cache_url, body, etag, last_modified):
+    body_hash = hashlib.sha1(body).hexdigest()
+    body_path = get_body_path(http_cache_ctx, body_hash)
+    gzip_body = gzip.compress(body)
+    
+    with http_cache_ctx.lock:
+        # body file is written under lock: eviction must not remove
+        # file which is not in index yet
+        
+        if not os.path.exists(body_path):
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            
+            tmp_body_path = '{}.tmp'.format(body_path)
+            
+            with open(tmp_body_path, 'wb') as fd:
+                fd.write(gzip_body)
+            
+            os.replace(tmp_body_path, body_path)
+        
+        body_size = os.path.getsize(body_path)
+        http_cache_ctx.miss_count += 1
+        
+        if http_cache_ctx.db.execute(
+                'SELECT 1 FROM entry WHERE body_hash = ? LIMIT 1',
+                (body_hash,),
+                ).fetchone() is None:
+            http_cache_ctx.total_size += body_size
+        
+        old_entry = http_cache_ctx.db.execute(
+                'SELECT body_hash, body_size FROM entry WHERE url = ?',
+                (cache_url,),
+                ).fetchone()
+        
+        http_cache_ctx.db.execute(
+                'INSERT OR REPLACE INTO entry '
+                '(url, body_hash, body_size, etag, last_modified, access_time) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (cache_url, body_hash, body_size, etag, last_modified, time.time()),
+                )
+        
+        if old_entry is not None and old_entry[0] != body_hash and \
+                http_cache_ctx.db.execute(
+                        'SELECT 1 FROM entry WHERE body_hash = ? LIMIT 1',
+                        (old_entry[0],),
+                        ).fetchone() is None:
+            http_cache_ctx.total_size -= old_entry[1]
+            
+            try:
+                os.remove(get_body_path(http_cache_ctx, old_entry[0]))
+            except FileNotFoundError:
+                pass
+        
+        if http_cache_ctx.max_size is not None:
+            http_cache_evict(http_cache_ctx)
+        
+        http_cache_ctx.db.commit()
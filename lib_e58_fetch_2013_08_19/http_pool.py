@@ -0,0 +1,359 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# http pool -- per-host keep-alive connections shared by all workers.
+#
+# redirects are never followed: response always belongs to requested url.
+# compressed bodies (gzip, deflate and -- if ``brotli`` module is
+# installed -- br) are decoded transparently.
+
+from urllib import parse as url
+import http.client
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MAX_IDLE_PER_HOST = 100
+USER_AGENT = 'e58-fetch'
+STREAM_CHUNK_SIZE = 64 * 1024
+HTML_CONTENT_TYPE_LIST = ('text/html', 'application/xhtml+xml')
+
+if brotli is not None:
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+else:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+class HttpPoolError(Exception):
+    pass
+
+def decode_content(content_encoding, body, max_length):
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    
+    if content_encoding == 'identity':
+        return body
+    
+    if content_encoding in ('gzip', 'x-gzip'):
+        decompress_obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        
+        return decompress_obj.decompress(body, max_length)
+    
+    if content_encoding == 'deflate':
+        try:
+            decompress_obj = zlib.decompressobj()
+            
+            return decompress_obj.decompress(body, max_length)
+        except zlib.error:
+            # some servers send raw deflate stream without zlib header
+            decompress_obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            
+            return decompress_obj.decompress(body, max_length)
+    
+    if content_encoding == 'br' and brotli is not None:
+        return brotli.decompress(body)[:max_length]
+    
+    raise HttpPoolError('unsupported content encoding: {!r}'.format(content_encoding))
+
+class StreamDecodeCtx:
+    # incremental form of ``decode_content()``
+    pass
+
+def init_stream_decode(stream_decode_ctx, content_encoding):
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    
+    stream_decode_ctx.content_encoding = content_encoding
+    stream_decode_ctx.decompress_obj = None
+    stream_decode_ctx.is_raw_deflate = False
+    stream_decode_ctx.unconsumed_tail = b''
+    
+    if content_encoding in ('gzip', 'x-gzip'):
+        stream_decode_ctx.decompress_obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == 'deflate':
+        stream_decode_ctx.decompress_obj = zlib.decompressobj()
+    elif content_encoding == 'br' and brotli is not None:
+        stream_decode_ctx.decompress_obj = brotli.Decompressor()
+    elif content_encoding != 'identity':
+        raise HttpPoolError('unsupported content encoding: {!r}'.format(content_encoding))
+
+def stream_decode(stream_decode_ctx, chunk, max_length):
+    # returns at most ``max_length`` bytes: compressed chunk may expand
+    # much more. input which is not decoded yet is kept for next call
+    
+    if stream_decode_ctx.decompress_obj is None:
+        return chunk
+    
+    if stream_decode_ctx.content_encoding == 'br':
+        return stream_decode_ctx.decompress_obj.process(chunk)
+    
+    chunk = stream_decode_ctx.unconsumed_tail + chunk
+    
+    try:
+        decoded_chunk = stream_decode_ctx.decompress_obj.decompress(chunk, max_length)
+    except zlib.error:
+        if stream_decode_ctx.content_encoding != 'deflate' or \
+                stream_decode_ctx.is_raw_deflate:
+            raise
+        
+        # some servers send raw deflate stream without zlib header
+        stream_decode_ctx.decompress_obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        stream_decode_ctx.is_raw_deflate = True
+        
+        decoded_chunk = stream_decode_ctx.decompress_obj.decompress(chunk, max_length)
+    
+    stream_decode_ctx.unconsumed_tail = stream_decode_ctx.decompress_obj.unconsumed_tail
+    
+    return decoded_chunk
+
+def is_html_content_type(content_type):
+    # missing content type is allowed
+    
+    if not content_type:
+        return True
+    
+    return content_type.split(';', 1)[0].strip().lower() in HTML_CONTENT_TYPE_LIST
+
+class HttpPoolCtx:
+    pass
+
+def init_http_pool(http_pool_ctx, max_idle_per_host=None):
+    if max_idle_per_host is None:
+        max_idle_per_host = MAX_IDLE_PER_HOST
+    
+    http_pool_ctx.lock = threading.Lock()
+    http_pool_ctx.max_idle_per_host = max_idle_per_host
+    http_pool_ctx.idle_conn_map = {}
+    http_pool_ctx.conn_new_count = 0
+    http_pool_ctx.conn_reuse_count = 0
+    http_pool_ctx.wire_byte_count = 0
+    http_pool_ctx.content_byte_count = 0
+
+def http_pool_take_conn(http_pool_ctx, conn_key, timeout):
+    with http_pool_ctx.lock:
+        idle_conn_list = http_pool_ctx.idle_conn_map.get(conn_key)
+        
+        if idle_conn_list:
+            http_pool_ctx.conn_reuse_count += 1
+            
+            return idle_conn_list.pop(), True
+        
+        http_pool_ctx.conn_new_count += 1
+    
+    scheme, host, port = conn_key
+    
+    if scheme == 'https':
+        conn = http.client.HTTPSConnection(host, port, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    
+    return conn, False
+
+def http_pool_put_conn(http_pool_ctx, conn_key, conn):
+    with http_pool_ctx.lock:
+        idle_conn_list = http_pool_ctx.idle_conn_map.setdefault(conn_key, [])
+        
+        if len(idle_conn_list) < http_pool_ctx.max_idle_per_host:
+            idle_conn_list.append(conn)
+            
+            return
+    
+    conn.close()
+
+def http_pool_close(http_pool_ctx):
+    with http_pool_ctx.lock:
+        idle_conn_map = http_pool_ctx.idle_conn_map
+        http_pool_ctx.idle_conn_map = {}
+    
+    for idle_conn_list in idle_conn_map.values():
+        for conn in idle_conn_list:
+            conn.close()
+
+def get_conn_key_and_path(get_url):
+    split_url = url.urlsplit(get_url)
+    
+    if split_url.scheme not in ('http', 'https') or not split_url.hostname:
+        raise HttpPoolError('unsupported url: {!r}'.format(get_url))
+    
+    conn_key = (
+            split_url.scheme,
+            split_url.hostname,
+            split_url.port or (443 if split_url.scheme == 'https' else 80),
+            )
+    
+    path = split_url.path or '/'
+    if split_url.query:
+        path = '{}?{}'.format(path, split_url.query)
+    
+    return conn_key, path
+
+def get_request_header_map(header_map):
+    request_header_map = {
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': ACCEPT_ENCODING,
+            }
+    if header_map is not None:
+        request_header_map.update(header_map)
+    
+    return request_header_map
+
+def http_pool_request(http_pool_ctx, conn_key, path, request_header_map, timeout):
+    # returns ``(conn, resp)``. body is not read yet, so failure in the
+    # middle of body can not be tried again
+    
+    while True:
+        conn, is_reused = http_pool_take_conn(http_pool_ctx, conn_key, timeout)
+        
+        try:
+            conn.request('GET', path, headers=request_header_map)
+            resp = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError):
+            conn.close()
+            
+            if is_reused:
+                # idle connection was closed by server. try again
+                continue
+            
+            raise
+        except Exception:
+            conn.close()
+            
+            raise
+        
+        return conn, resp
+
+def http_pool_release(http_pool_ctx, conn_key, conn, resp):
+    if resp.will_close or not resp.isclosed():
+        conn.close()
+    else:
+        http_pool_put_conn(http_pool_ctx, conn_key, conn)
+
+def http_pool_get_stream(
+        http_pool_ctx,
+        get_url,
+        timeout,
+        max_length,
+        on_chunk,
+        header_map=None,
+        ):
+    # streaming form of ``http_pool_get()``. for code 200 decoded body is
+    # passed to ``on_chunk(chunk)`` by parts, as soon as they come. it
+    # fails early on content which is not html or is longer than
+    # ``max_length``. returns ``(code, resp_header_map)``
+    
+    conn_key, path = get_conn_key_and_path(get_url)
+    conn, resp = http_pool_request(
+            http_pool_ctx,
+            conn_key,
+            path,
+            get_request_header_map(header_map),
+            timeout,
+            )
+    
+    wire_length = 0
+    content_length = 0
+    
+    try:
+        if resp.status != 200:
+            wire_length = len(resp.read(max_length))
+        else:
+            if not is_html_content_type(resp.getheader('Content-Type')):
+                raise HttpPoolError('content is not html: {!r}'.format(
+                        resp.getheader('Content-Type')))
+            
+            resp_content_length = resp.getheader('Content-Length')
+            
+            if resp_content_length is not None and \
+                    resp_content_length.strip().isdigit() and \
+                    int(resp_content_length) > max_length:
+                raise HttpPoolError('content is too long')
+            
+            stream_decode_ctx = StreamDecodeCtx()
+            init_stream_decode(stream_decode_ctx, resp.getheader('Content-Encoding'))
+            
+            while True:
+                raw_chunk = resp.read(STREAM_CHUNK_SIZE)
+                
+                if not raw_chunk:
+                    break
+                
+                wire_length += len(raw_chunk)
+                # one byte over budget is enough to see that it is too long
+                chunk = stream_decode(
+                        stream_decode_ctx,
+                        raw_chunk,
+                        max_length - content_length + 1,
+                        )
+                del raw_chunk
+                
+                content_length += len(chunk)
+                
+                if content_length > max_length:
+                    raise HttpPoolError('content is too long')
+                
+                if chunk:
+                    on_chunk(chunk)
+    except Exception:
+        conn.close()
+        
+        raise
+    finally:
+        with http_pool_ctx.lock:
+            http_pool_ctx.wire_byte_count += wire_length
+            http_pool_ctx.content_byte_count += content_length
+    
+    http_pool_release(http_pool_ctx, conn_key, conn, resp)
+    
+    return resp.status, resp.headers
+
+def http_pool_get(http_pool_ctx, get_url, timeout, max_length, header_map=None):
+    # returns ``(code, resp_header_map, body)``. ``body`` is already decoded
+    # from content encoding and cut to ``max_length``.
+    # ``resp_header_map`` keys are case-insensitive
+    
+    conn_key, path = get_conn_key_and_path(get_url)
+    conn, resp = http_pool_request(
+            http_pool_ctx,
+            conn_key,
+            path,
+            get_request_header_map(header_map),
+            timeout,
+            )
+    
+    try:
+        raw_body = resp.read(max_length)
+    except Exception:
+        conn.close()
+        
+        raise
+    
+    http_pool_release(http_pool_ctx, conn_key, conn, resp)
+    
+    body = decode_content(
+            resp.getheader('Content-Encoding'),
+            raw_body,
+            max_length,
+            )
+    
+    with http_pool_ctx.lock:
+        http_pool_ctx.wire_byte_count += len(raw_body)
+        http_pool_ctx.content_byte_count += len(body)
+    
+    return resp.status, resp.headers, body
@@ -20,131 +20,1213 @@ assert str is not bytes
 
 import argparse
 import csv
+import itertools
+import json
+import os
 import queue
+import sys
+import threading
+import time
 from . import e58_fetch
+from . import e58_fetch_async
+from . import html_parse
+from . import http_cache
+from . import crawl_journal
+from . import firm_delta
+from . import firm_index
+from . import out_sink
+from . import crawl_stats
+from . import crawl_profile
+from . import retry_queue
+from . import seed_source
+from . import shard_coord
+from . import url_frontier
 
-THREAD_COUNT = 5
+STATS_INTERVAL = 2.0
 
 class CsvCtx:
     pass
 
-def csv_write_header(csv_ctx):
-    csv_ctx.writer.writerow((
-            'url',
-            'title',
-            'director',
-            'uaddress',
-            'address',
-            'phone',
-            'email',
-            'www',
-            'work',
-            'rubriks',
-            ))
+class DeltaCtx:
+    pass
+
+class StatsCtx:
+    pass
+
+def csv_write_delta_header(csv_ctx):
+    csv_ctx.writer.writerow(('change', 'url') + e58_fetch.FIRM_FIELD_LIST)
     csv_ctx.fd.flush()
 
-def csv_write_data(csv_ctx, url, fetch_data):
-    csv_ctx.writer.writerow((
-            url,
-            fetch_data['title'],
-            fetch_data['director'],
-            fetch_data['uaddress'],
-            fetch_data['address'],
-            fetch_data['phone'],
-            fetch_data['email'],
-            fetch_data['www'],
-            fetch_data['work'],
-            fetch_data['rubriks'],
+def csv_write_delta_data(csv_ctx, change, url, fetch_data):
+    # ``fetch_data`` is ``None`` for removed firm
+    
+    if fetch_data is None:
+        fetch_data = {}
+    
+    csv_ctx.writer.writerow((change, url) + tuple(
+            fetch_data.get(field_name, '')
+            for field_name in e58_fetch.FIRM_FIELD_LIST
             ))
     csv_ctx.fd.flush()
 
-def on_scheduled(event_queue, url):
-    print('scheduled: {!r}'.format(url))
+def put_event(event_queue, crawl_stats_ctx, event):
+    # full queue means that main loop is the bottleneck. such waits are
+    # counted as backpressure
+    
+    try:
+        event_queue.put_nowait(event)
+    except queue.Full:
+        begin_time = time.perf_counter()
+        
+        event_queue.put(event)
+        
+        crawl_stats.crawl_stats_add(crawl_stats_ctx, 'backpressure')
+        crawl_stats.crawl_stats_add(
+                crawl_stats_ctx,
+                'backpressure_time',
+                time.perf_counter() - begin_time,
+                )
+
+def stats_report(crawl_stats_ctx, bulk_data_ctx, event_queue, stats_path):
+    snapshot = crawl_stats.crawl_stats_snapshot(
+            crawl_stats_ctx,
+            bulk_data_ctx=bulk_data_ctx,
+            event_queue=event_queue,
+            )
+    
+    print('*** {} ***'.format(crawl_stats.format_progress(snapshot)), flush=True)
+    
+    if stats_path is not None:
+        crawl_stats.write_snapshot(snapshot, stats_path)
 
-def on_begin(event_queue, url):
-    print('begin: {!r}'.format(url))
+def stats_report_thread(
+        stop_event,
+        stats_interval,
+        crawl_stats_ctx,
+        bulk_data_ctx,
+        event_queue,
+        stats_path,
+        ):
+    while not stop_event.wait(stats_interval):
+        stats_report(crawl_stats_ctx, bulk_data_ctx, event_queue, stats_path)
 
-def on_fetch(event_queue, csv_ctx, url, fetch_data):
-    print('fetched: {!r}'.format(url))
+def on_scheduled(event_queue, verbose, crawl_journal_ctx, url):
+    if verbose:
+        print('scheduled: {!r}'.format(url))
+    
+    crawl_journal.crawl_journal_scheduled(crawl_journal_ctx, url)
+
+def on_begin(event_queue, verbose, url):
+    if verbose:
+        print('begin: {!r}'.format(url))
+
+def on_fetch(event_queue, verbose, out_sink_ctx, delta_ctx, url, fetch_data):
+    if verbose:
+        print('fetched: {!r}'.format(url))
+    
+    if delta_ctx is not None:
+        change = firm_delta.firm_delta_fetch(delta_ctx.firm_delta, url, fetch_data)
+        
+        if change is not None:
+            csv_write_delta_data(delta_ctx.csv, change, url, fetch_data)
     
-    csv_write_data(csv_ctx, url, fetch_data)
+    if out_sink_ctx is not None:
+        out_sink.out_sink_put(out_sink_ctx, url, fetch_data)
 
-def on_error(event_queue, url, err_type, err_msg):
+def read_dead_letter(dead_letter_path):
+    # returns urls of dead letter file
+    
+    try:
+        fd = open(dead_letter_path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return ()
+    
+    with fd:
+        return tuple(
+                line.split('\t', 1)[0]
+                for line in fd.read().splitlines()
+                if line.strip()
+                )
+
+def on_error(event_queue, delta_ctx, dead_letter_fd, url, err_type, err_msg):
     print('error: {!r}: {!r}: {}'.format(url, err_type, err_msg))
+    
+    # line is url and error, separated by tab
+    dead_letter_fd.write('{}\t{}: {}\n'.format(
+            url,
+            getattr(err_type, '__name__', err_type),
+            ' '.join(err_msg.split()),
+            ))
+    dead_letter_fd.flush()
+    
+    if delta_ctx is not None:
+        firm_delta.firm_delta_error(delta_ctx.firm_delta, url)
+
+def on_finish(event_queue, out_sink_ctx, crawl_journal_ctx, url):
+    # event comes after fetch event of the same url. so url is marked
+    # finished only when its record is committed by sink
+    
+    if out_sink_ctx is not None:
+        out_sink.out_sink_mark(out_sink_ctx, url)
+    else:
+        crawl_journal.crawl_journal_finished(crawl_journal_ctx, url)
 
-def on_continue(event_queue):
-    print('*** continue! ***')
+def on_commit(crawl_journal_ctx, url_list):
+    for url in url_list:
+        crawl_journal.crawl_journal_finished(crawl_journal_ctx, url)
 
-def on_done(event_queue):
+def on_done(
+        event_queue,
+        bulk_data_ctx,
+        out_sink_ctx,
+        crawl_journal_ctx,
+        delta_ctx,
+        stats_ctx,
+        dead_letter_fd,
+        ):
+    http_pool_ctx = bulk_data_ctx.http_pool
+    
+    print('*** http pool: {} new connections, {} reused, {} bytes on wire, {} bytes of content ***'.format(
+            http_pool_ctx.conn_new_count,
+            http_pool_ctx.conn_reuse_count,
+            http_pool_ctx.wire_byte_count,
+            http_pool_ctx.content_byte_count,
+            ))
+    
+    http_cache_ctx = bulk_data_ctx.http_cache
+    
+    if http_cache_ctx is not None:
+        print('*** http cache: {} hits, {} revalidated, {} misses, {} evicted ***'.format(
+                http_cache_ctx.hit_count,
+                http_cache_ctx.revalidated_count,
+                http_cache_ctx.miss_count,
+                http_cache_ctx.evicted_count,
+                ))
+        http_cache.http_cache_close(http_cache_ctx)
+    
+    if out_sink_ctx is not None:
+        out_sink.out_sink_close(out_sink_ctx)
+        
+        print('*** out sink: {} records in {} batches ***'.format(
+                out_sink_ctx.record_count,
+                out_sink_ctx.batch_count,
+                ))
+    
+    shard_coord_ctx = bulk_data_ctx.shard_coord
+    
+    if shard_coord_ctx is not None:
+        print('*** shard {} of {}: {} urls routed to other shards, {} taken from them ***'.format(
+                shard_coord_ctx.shard_index,
+                shard_coord_ctx.shard_count,
+                shard_coord_ctx.routed_count,
+                shard_coord_ctx.taken_count,
+                ))
+        shard_coord.shard_coord_close(shard_coord_ctx)
+    
+    crawl_journal.crawl_journal_close(crawl_journal_ctx)
+    dead_letter_fd.close()
+    
+    if delta_ctx is not None:
+        for removed_url in firm_delta.firm_delta_removed_list(delta_ctx.firm_delta):
+            csv_write_delta_data(
+                    delta_ctx.csv,
+                    firm_delta.CHANGE_REMOVED,
+                    removed_url,
+                    None,
+                    )
+        
+        firm_delta.firm_delta_commit(delta_ctx.firm_delta)
+        firm_delta.firm_delta_close(delta_ctx.firm_delta)
+    
+    stats_ctx.stop_event.set()
+    stats_ctx.thread.join()
+    stats_report(
+            stats_ctx.crawl_stats,
+            bulk_data_ctx,
+            event_queue,
+            stats_ctx.stats_path,
+            )
+    
+    if bulk_data_ctx.crawl_profile is not None:
+        crawl_profile.crawl_profile_write(
+                bulk_data_ctx.crawl_profile,
+                stats_ctx.profile_path,
+                )
+        
+        print('*** profile: {} and {}{} ***'.format(
+                stats_ctx.profile_path,
+                stats_ctx.profile_path,
+                crawl_profile.COLLAPSED_SUFFIX,
+                ))
+    
     print('*** done! ***')
 
+def merge_main(argv=None):
+    # ``e58-fetch-merge`` -- joins outputs of crawl shards. ``argv`` --
+    # arguments without program name (default is ``sys.argv[1:]``)
+    
+    parser = argparse.ArgumentParser(
+            description='merge outputs of shards of sharded crawl into one '
+                    'output. records are deduplicated by url',
+            )
+    
+    parser.add_argument(
+            'out_path',
+            metavar='OUT-FILE-PATH',
+            help='file path to merged output',
+            )
+    
+    parser.add_argument(
+            'in_path_list',
+            nargs='+',
+            metavar='IN-FILE-PATH',
+            help='file path to output of shard',
+            )
+    
+    parser.add_argument(
+            '--format',
+            choices=out_sink.SINK_FORMAT_LIST,
+            default='csv',
+            help='format of input files and output. default is csv',
+            )
+    
+    args = parser.parse_args(argv)
+    
+    if args.out_path in args.in_path_list:
+        parser.error('output can not be one of inputs')
+    
+    out_sink_ctx = out_sink.OutSinkCtx()
+    out_sink.init_out_sink(
+            out_sink_ctx,
+            args.format,
+            args.out_path,
+            e58_fetch.FIRM_FIELD_LIST,
+            )
+    
+    url_key_set = set()
+    duplicate_count = 0
+    
+    try:
+        for in_path in args.in_path_list:
+            for record_url, fetch_data in out_sink.read_record_iter(
+                    args.format, in_path, e58_fetch.FIRM_FIELD_LIST):
+                url_key = url_frontier.normalize_url(record_url)
+                
+                if url_key in url_key_set:
+                    duplicate_count += 1
+                    
+                    continue
+                
+                url_key_set.add(url_key)
+                out_sink.out_sink_put(out_sink_ctx, record_url, fetch_data)
+    finally:
+        out_sink.out_sink_close(out_sink_ctx)
+    
+    print('*** merge: {} records of {} files, {} duplicates skipped ***'.format(
+            len(url_key_set),
+            len(args.in_path_list),
+            duplicate_count,
+            ))
+
+def index_main(argv=None):
+    # ``e58-fetch-index`` -- builds or updates index of outputs
+    
+    parser = argparse.ArgumentParser(
+            description='build full text index over firm records of outputs, '
+                    'or update it by outputs of new crawls. only new and '
+                    'changed records are written',
+            )
+    
+    parser.add_argument(
+            'index_path',
+            metavar='INDEX-FILE-PATH',
+            help='file path to index (SQLite database)',
+            )
+    
+    parser.add_argument(
+            'in_path_list',
+            nargs='+',
+            metavar='IN-FILE-PATH',
+            help='file path to output of crawl',
+            )
+    
+    parser.add_argument(
+            '--format',
+            choices=out_sink.SINK_FORMAT_LIST,
+            default='csv',
+            help='format of input files. default is csv',
+            )
+    
+    parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='inputs are of full crawl: firms which are not in them '
+                    'are removed from index',
+            )
+    
+    args = parser.parse_args(argv)
+    
+    begin_time = time.monotonic()
+    firm_index_ctx = firm_index.FirmIndexCtx()
+    
+    try:
+        firm_index.init_firm_index(
+                firm_index_ctx,
+                args.index_path,
+                e58_fetch.FIRM_FIELD_LIST,
+                )
+    except firm_index.FirmIndexError as e:
+        parser.error(str(e))
+    
+    def record_iter():
+        for in_path in args.in_path_list:
+            yield from out_sink.read_record_iter(
+                    args.format, in_path, e58_fetch.FIRM_FIELD_LIST)
+    
+    try:
+        count_map = firm_index.firm_index_update(
+                firm_index_ctx,
+                record_iter(),
+                is_prune=args.prune,
+                )
+        firm_count = firm_index.firm_index_count(firm_index_ctx)
+    finally:
+        firm_index.firm_index_close(firm_index_ctx)
+    
+    print('*** index: {} added, {} changed, {} unchanged, {} removed, '
+            '{} firms in index, {:.1f}s ***'.format(
+                    count_map['added'],
+                    count_map['changed'],
+                    count_map['unchanged'],
+                    count_map['removed'],
+                    firm_count,
+                    time.monotonic() - begin_time,
+                    ))
+
+def query_main(argv=None):
+    # ``e58-fetch-query`` -- finds firms in index
+    
+    parser = argparse.ArgumentParser(
+            description='find firms in index (see "e58-fetch-index"). '
+                    'records are written to standard output, '
+                    'the best matches first',
+            )
+    
+    parser.add_argument(
+            'index_path',
+            metavar='INDEX-FILE-PATH',
+            help='file path to index',
+            )
+    
+    parser.add_argument(
+            'text',
+            nargs='?',
+            metavar='QUERY',
+            help='words to find in any indexed field. it is FTS5 query: '
+                    'AND, OR, NOT, "phrase", prefix* and FIELD: WORD work',
+            )
+    
+    for field_name in firm_index.INDEX_FIELD_LIST:
+        parser.add_argument(
+                '--{}'.format(field_name),
+                metavar='TEXT',
+                help='phrase to find in field {}. '
+                        '"*" at the end finds it as prefix'.format(field_name),
+                )
+    
+    parser.add_argument(
+            '--limit',
+            type=int,
+            metavar='COUNT',
+            help='write only COUNT best matches',
+            )
+    
+    parser.add_argument(
+            '--format',
+            choices=('csv', 'jsonl'),
+            default='csv',
+            help='format of records. default is csv',
+            )
+    
+    args = parser.parse_args(argv)
+    
+    field_map = dict(
+            (field_name, getattr(args, field_name))
+            for field_name in firm_index.INDEX_FIELD_LIST
+            if getattr(args, field_name) is not None
+            )
+    
+    if args.text is None and not field_map:
+        parser.error('query or field is needed')
+    
+    if not os.path.exists(args.index_path):
+        parser.error('no index: {}'.format(args.index_path))
+    
+    begin_time = time.perf_counter()
+    firm_index_ctx = firm_index.FirmIndexCtx()
+    
+    try:
+        firm_index.init_firm_index(
+                firm_index_ctx,
+                args.index_path,
+                e58_fetch.FIRM_FIELD_LIST,
+                )
+    except firm_index.FirmIndexError as e:
+        parser.error(str(e))
+    
+    try:
+        record_list = firm_index.firm_index_query(
+                firm_index_ctx,
+                firm_index.build_match(text=args.text, field_map=field_map),
+                limit=args.limit,
+                )
+    except firm_index.FirmIndexError as e:
+        parser.error(str(e))
+    finally:
+        firm_index.firm_index_close(firm_index_ctx)
+    
+    query_time = time.perf_counter() - begin_time
+    
+    if args.format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(('url',) + e58_fetch.FIRM_FIELD_LIST)
+        writer.writerows(
+                (record_url,) + tuple(
+                        fetch_data[field_name]
+                        for field_name in e58_fetch.FIRM_FIELD_LIST
+                        )
+                for record_url, fetch_data in record_list
+                )
+    else:
+        for record_url, fetch_data in record_list:
+            print(json.dumps(
+                    dict((('url', record_url),) + tuple(
+                            (field_name, fetch_data[field_name])
+                            for field_name in e58_fetch.FIRM_FIELD_LIST
+                            )),
+                    ensure_ascii=False,
+                    ))
+    
+    # standard output is for records only
+    print('*** query: {} firms in {:.1f}ms ***'.format(
+            len(record_list),
+            query_time * 1000.0,
+            ), file=sys.stderr)
+
 def main():
     parser = argparse.ArgumentParser(
             description='utility for fetching firm database of Penza city',
+            epilog='other utilities: "e58-fetch-merge" (outputs of sharded '
+                    'crawl), "e58-fetch-index" and "e58-fetch-query" (index '
+                    'of outputs)',
             )
     
     parser.add_argument(
             'out_path',
             metavar='OUT-FILE-PATH',
-            help='file path to output. format CSV',
+            help='file path to output. format is set by --format',
+            )
+    
+    parser.add_argument(
+            '--format',
+            choices=out_sink.SINK_FORMAT_LIST,
+            default='csv',
+            help='format of output: CSV, JSON lines or SQLite database. '
+                    'default is csv',
+            )
+    
+    parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=out_sink.BATCH_SIZE,
+            metavar='COUNT',
+            help='records are written in batches of this size. '
+                    'default is {}'.format(out_sink.BATCH_SIZE),
+            )
+    
+    parser.add_argument(
+            '--batch-time',
+            type=float,
+            default=out_sink.BATCH_TIME,
+            metavar='SECONDS',
+            help='incomplete batch is written after this time. '
+                    'default is {}'.format(out_sink.BATCH_TIME),
+            )
+    
+    parser.add_argument(
+            '--engine',
+            choices=e58_fetch_async.ENGINE_NAME_LIST,
+            default='thread',
+            help='crawl engine. default is thread',
+            )
+    
+    parser.add_argument(
+            '--concurrency',
+            type=int,
+            help='initial count of concurrent fetches. it is adjusted at runtime '
+                    'by latency and errors of server (see --min-concurrency and '
+                    '--max-concurrency). '
+                    'default is {} for thread engine and {} for asyncio engine'.format(
+                            e58_fetch.THREAD_COUNT, e58_fetch_async.ASYNC_CONCURRENCY),
+            )
+    
+    parser.add_argument(
+            '--min-concurrency',
+            type=int,
+            default=1,
+            help='lower bound of concurrent fetches. default is 1',
+            )
+    
+    parser.add_argument(
+            '--max-concurrency',
+            type=int,
+            help='upper bound of concurrent fetches (equal bounds turn off '
+                    'adjusting). '
+                    'default is {} for thread engine and {} for asyncio engine'.format(
+                            e58_fetch.MAX_THREAD_COUNT,
+                            e58_fetch_async.ASYNC_MAX_CONCURRENCY,
+                            ),
+            )
+    
+    parser.add_argument(
+            '--rps',
+            type=float,
+            metavar='REQUESTS-PER-SECOND',
+            help='limit of requests per second for every host. '
+                    'default is no limit',
+            )
+    
+    parser.add_argument(
+            '--site-url',
+            default=e58_fetch.SITE_URL,
+            help='site url to crawl. default is {}'.format(e58_fetch.SITE_URL),
+            )
+    
+    parser.add_argument(
+            '--parser',
+            choices=html_parse.PARSER_NAME_LIST,
+            default=e58_fetch.PARSER_NAME,
+            help='html parser backend. fast backends fall back to html5lib '
+                    'for pages they can not extract. default is {}'.format(
+                            e58_fetch.PARSER_NAME),
+            )
+    
+    parser.add_argument(
+            '--parse-processes',
+            type=int,
+            default=0,
+            metavar='COUNT',
+            help='parse pages in pool of COUNT processes (0 -- parse in '
+                    'fetch workers, -1 -- one process per CPU core). '
+                    'default is 0',
+            )
+    
+    parser.add_argument(
+            '--stream',
+            action='store_true',
+            help='parse pages while they are downloaded, without keeping '
+                    'whole page in memory. it needs thread engine and '
+                    '--parser htmlparser or lxml, and can not be used with '
+                    '--cache-dir or --parse-processes',
+            )
+    
+    parser.add_argument(
+            '--cache-dir',
+            metavar='CACHE-DIR-PATH',
+            help='keep fetched pages in this directory and revalidate them '
+                    'by ETag/Last-Modified on next runs',
+            )
+    
+    parser.add_argument(
+            '--cache-max-size',
+            type=int,
+            metavar='MEGABYTES',
+            help='limit of cache size. least recently used pages are evicted',
+            )
+    
+    parser.add_argument(
+            '--offline',
+            action='store_true',
+            help='do not go to network: extract data only from cache',
+            )
+    
+    parser.add_argument(
+            '--journal',
+            metavar='JOURNAL-FILE-PATH',
+            help='file path to crawl journal (scheduled and finished urls). '
+                    'default is OUT-FILE-PATH with ".journal" suffix',
+            )
+    
+    parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='continue interrupted crawl from its journal. '
+                    'rows are appended to existing output file. seed '
+                    'options of interrupted crawl must be given again: '
+                    'seeds are journaled only when they are fed to frontier',
+            )
+    
+    parser.add_argument(
+            '--delta',
+            metavar='DELTA-FILE-PATH',
+            help='file path to output of added, changed and removed firms '
+                    'since previous run. format CSV. with --discovery off '
+                    'no firm is removed (firms which are not seeded keep '
+                    'their previous state)',
+            )
+    
+    parser.add_argument(
+            '--delta-state',
+            metavar='STATE-FILE-PATH',
+            help='file path to record hashes of previous run. '
+                    'default is OUT-FILE-PATH with ".state" suffix',
+            )
+    
+    parser.add_argument(
+            '--delta-only',
+            action='store_true',
+            help='write only delta. full output file is not written',
+            )
+    
+    parser.add_argument(
+            '--verbose',
+            action='store_true',
+            help='print every scheduled, begun and fetched url',
+            )
+    
+    parser.add_argument(
+            '--stats-file',
+            metavar='STATS-FILE-PATH',
+            help='file path to crawl stats, rewritten periodically. '
+                    'format is Prometheus text if name ends with ".prom", '
+                    'otherwise JSON',
+            )
+    
+    parser.add_argument(
+            '--stats-interval',
+            type=float,
+            default=STATS_INTERVAL,
+            metavar='SECONDS',
+            help='interval of progress line and stats file. '
+                    'default is {}'.format(STATS_INTERVAL),
+            )
+    
+    parser.add_argument(
+            '--profile',
+            metavar='PROFILE-FILE-PATH',
+            help='profile parsing and extraction of pages: timers of steps '
+                    'and fields, slowest pages. summary is written to this '
+                    'file at the end, collapsed stacks (for flamegraph '
+                    'tools) -- to file with "{}" suffix'.format(
+                            crawl_profile.COLLAPSED_SUFFIX),
+            )
+    
+    parser.add_argument(
+            '--profile-sample',
+            type=int,
+            default=0,
+            metavar='INTERVAL',
+            help='every INTERVAL-th page is also profiled by cProfile and '
+                    'tracemalloc, and its condition chains are timed one by '
+                    'one. it needs --profile. default is 0 (no sampling)',
+            )
+    
+    parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=retry_queue.MAX_ATTEMPTS,
+            metavar='COUNT',
+            help='count of attempts to fetch url which fails with transient '
+                    'error (timeout, 5xx code and so on). default is {}'.format(
+                            retry_queue.MAX_ATTEMPTS),
+            )
+    
+    parser.add_argument(
+            '--retry-delay',
+            type=float,
+            default=retry_queue.BASE_DELAY,
+            metavar='SECONDS',
+            help='delay before second attempt. it is doubled for every next '
+                    'attempt. default is {}'.format(retry_queue.BASE_DELAY),
+            )
+    
+    parser.add_argument(
+            '--dead-letter',
+            metavar='DEAD-LETTER-FILE-PATH',
+            help='file path to urls which finally failed. '
+                    'default is OUT-FILE-PATH with ".dead" suffix',
+            )
+    
+    parser.add_argument(
+            '--retry-dead-letter',
+            action='store_true',
+            help='crawl again urls of dead letter file of previous run. '
+                    'urls which were fetched by previous run (by its journal) '
+                    'are not fetched, rows are appended to existing output file',
+            )
+    
+    parser.add_argument(
+            '--shard-count',
+            type=int,
+            default=1,
+            metavar='COUNT',
+            help='crawl is split between COUNT processes (on one host or '
+                    'on hosts which share --coordinator file) by stable '
+                    'hash of url. every process is started with its own '
+                    '--shard-index and output file. default is 1',
+            )
+    
+    parser.add_argument(
+            '--shard-index',
+            type=int,
+            default=0,
+            metavar='INDEX',
+            help='shard of this process, from 0 to --shard-count minus 1. '
+                    'default is 0',
+            )
+    
+    parser.add_argument(
+            '--coordinator',
+            metavar='COORDINATOR-FILE-PATH',
+            help='file path to SQLite database, shared by all shards. '
+                    'urls found for other shards are routed through it. '
+                    'it must be new for every crawl (use --resume to '
+                    'restart interrupted shard)',
+            )
+    
+    parser.add_argument(
+            '--seed-sitemap',
+            action='append',
+            default=[],
+            metavar='SITEMAP-URL-OR-FILE-PATH',
+            help='firm urls are taken from sitemap (sitemap index is '
+                    'followed, gzipped sitemaps are read too). '
+                    'may be given many times',
+            )
+    
+    parser.add_argument(
+            '--seed-file',
+            action='append',
+            default=[],
+            metavar='URL-FILE-PATH',
+            help='firm urls are taken from file, one url per line. '
+                    'may be given many times',
+            )
+    
+    parser.add_argument(
+            '--seed-output',
+            action='append',
+            default=[],
+            metavar='OUT-FILE-PATH',
+            help='firm urls are taken from output of previous run '
+                    '(in --format). may be given many times',
+            )
+    
+    parser.add_argument(
+            '--seed-cache',
+            action='store_true',
+            help='urls of all pages in --cache-dir are fetched at once',
+            )
+    
+    parser.add_argument(
+            '--seed-ids',
+            action='append',
+            default=[],
+            metavar='FIRST-LAST',
+            help='firm urls are made from range of firm ids (by '
+                    '--seed-id-template). ids which are not firms are '
+                    'not errors. may be given many times',
+            )
+    
+    parser.add_argument(
+            '--seed-id-template',
+            default=seed_source.FIRM_URL_TEMPLATE,
+            metavar='TEMPLATE',
+            help='template of firm url for --seed-ids, relative to '
+                    '--site-url ("{{}}" is firm id). '
+                    'default is "{}"'.format(seed_source.FIRM_URL_TEMPLATE),
+            )
+    
+    parser.add_argument(
+            '--discovery',
+            choices=('foreground', 'background', 'off'),
+            metavar='MODE',
+            help='walking of firm list, to find firms which are not in '
+                    'seeds: "foreground" (together with seeds), '
+                    '"background" (only when no seeded url waits) or '
+                    '"off". default is "background" with seed options, '
+                    'otherwise "foreground"',
             )
     
     args = parser.parse_args()
     
-    csv_ctx = CsvCtx()
-    csv_ctx.fd = open(args.out_path, 'w', encoding='utf-8', newline='')
-    csv_ctx.writer = csv.writer(csv_ctx.fd)
-    csv_write_header(csv_ctx)
+    if args.offline and args.cache_dir is None:
+        parser.error('--offline needs --cache-dir')
     
-    event_queue = queue.Queue(maxsize=100)
-    bulk_data_ctx = e58_fetch.BulkDataCtx()
-    e58_fetch.init_bulk_data_ctx(bulk_data_ctx)
+    if args.parse_processes < 0:
+        args.parse_processes = os.cpu_count() or 1
     
-    def bulk_data_fetch_start():
-        def on_scheduled_wrapper(url):
-            event_queue.put(('scheduled', url))
+    if args.parser == 'lxml' and html_parse.lxml is None:
+        parser.error('lxml parser backend needs lxml package')
+    
+    if args.stream:
+        if args.engine != 'thread':
+            parser.error('--stream needs thread engine')
         
-        def on_begin_wrapper(url):
-            event_queue.put(('begin', url))
+        if args.parser not in html_parse.STREAM_PARSER_NAME_LIST:
+            parser.error('--stream needs --parser {}'.format(
+                    ' or '.join(html_parse.STREAM_PARSER_NAME_LIST)))
         
-        def on_fetch_wrapper(url, fetch_data):
-            event_queue.put(('fetch', url, fetch_data))
+        if args.cache_dir is not None or args.parse_processes:
+            parser.error('--stream can not be used with --cache-dir or --parse-processes')
+    
+    default_concurrency, default_max_concurrency = \
+            e58_fetch_async.get_default_concurrency(args.engine)
+    
+    if args.max_concurrency is None:
+        args.max_concurrency = max(
+                default_max_concurrency,
+                args.concurrency or 0,
+                args.min_concurrency,
+                )
+    
+    if args.concurrency is None:
+        args.concurrency = default_concurrency
+    
+    if args.min_concurrency < 1 or args.max_concurrency < args.min_concurrency:
+        parser.error('invalid bounds of concurrency')
+    
+    if args.rps is not None and args.rps <= 0.0:
+        parser.error('--rps must be positive')
+    
+    if args.delta_only and args.delta is None:
+        parser.error('--delta-only needs --delta')
+    
+    if args.delta is not None and (args.resume or args.retry_dead_letter):
+        # records of previous run are not in state
+        parser.error('--delta can not be used with --resume or --retry-dead-letter')
+    
+    if args.max_attempts < 1:
+        parser.error('--max-attempts must be positive')
+    
+    if args.profile_sample < 0:
+        parser.error('--profile-sample must not be negative')
+    
+    if args.profile_sample and args.profile is None:
+        parser.error('--profile-sample needs --profile')
+    
+    if args.shard_count < 1 or not 0 <= args.shard_index < args.shard_count:
+        parser.error('invalid --shard-index or --shard-count')
+    
+    if args.shard_count > 1:
+        if args.coordinator is None:
+            parser.error('--shard-count needs --coordinator')
         
-        def on_error_wrapper(url, err_type, err_msg):
-            event_queue.put(('error', url, err_type, err_msg))
+        if args.delta is not None:
+            # shard does not see records of other shards
+            parser.error('--delta can not be used with --shard-count')
+    
+    is_seeded = bool(args.seed_sitemap or args.seed_file or args.seed_output or
+            args.seed_cache or args.seed_ids)
+    
+    if args.discovery is None:
+        args.discovery = 'background' if is_seeded else 'foreground'
+    
+    if is_seeded and args.retry_dead_letter:
+        parser.error('seed options can not be used with --retry-dead-letter')
+    
+    if args.seed_cache and args.cache_dir is None:
+        parser.error('--seed-cache needs --cache-dir')
+    
+    if args.journal is None:
+        args.journal = '{}.journal'.format(args.out_path)
+    
+    if args.dead_letter is None:
+        args.dead_letter = '{}.dead'.format(args.out_path)
+    
+    if args.cache_dir is not None:
+        http_cache_ctx = http_cache.HttpCacheCtx()
+        http_cache.init_http_cache(
+                http_cache_ctx,
+                args.cache_dir,
+                max_size=args.cache_max_size * 1024 * 1024
+                        if args.cache_max_size is not None else None,
+                offline=args.offline,
+                )
+    else:
+        http_cache_ctx = None
+    
+    # seeds are read before output is opened (it may be one of them).
+    # ids are not: their urls are made lazily, while frontier is fed
+    direct_url_list = []
+    id_range_list = []
+    
+    try:
+        for sitemap_location in args.seed_sitemap:
+            direct_url_list.extend(seed_source.read_sitemap(sitemap_location))
+        
+        for url_file_path in args.seed_file:
+            direct_url_list.extend(seed_source.read_url_file(url_file_path))
+        
+        for seed_out_path in args.seed_output:
+            direct_url_list.extend(
+                    seed_source.read_output_urls(args.format, seed_out_path))
         
-        def on_done_wrapper():
-            event_queue.put(('done',))
+        if args.seed_cache:
+            direct_url_list.extend(seed_source.read_cache_urls(http_cache_ctx))
+        
+        for id_range in args.seed_ids:
+            id_range_list.append(seed_source.parse_id_range(id_range))
+    except seed_source.SeedSourceError as e:
+        parser.error(str(e))
+    
+    probe_url_iter = itertools.chain.from_iterable(
+            seed_source.iter_id_urls(
+                    args.site_url,
+                    first_id,
+                    last_id,
+                    url_template=args.seed_id_template,
+                    )
+            for first_id, last_id in id_range_list
+            )
+    
+    if is_seeded:
+        print('*** seeds: {} urls, {} probes of ids, discovery: {} ***'.format(
+                len(direct_url_list),
+                sum(last_id - first_id + 1 for first_id, last_id in id_range_list),
+                args.discovery,
+                ), flush=True)
+    
+    if args.shard_count > 1:
+        shard_coord_ctx = shard_coord.ShardCoordCtx()
         
+        try:
+            shard_coord.init_shard_coord(
+                    shard_coord_ctx,
+                    args.coordinator,
+                    args.shard_index,
+                    args.shard_count,
+                    is_resume=args.resume,
+                    )
+        except shard_coord.ShardCoordError as e:
+            parser.error(str(e))
+    else:
+        shard_coord_ctx = None
+    
+    # previous run continues on resume, and on retry of its dead letter
+    is_append = args.resume or args.retry_dead_letter
+    
+    if args.retry_dead_letter:
+        dead_url_list = read_dead_letter(args.dead_letter)
+    else:
+        dead_url_list = ()
+    
+    crawl_journal_ctx = crawl_journal.CrawlJournalCtx()
+    crawl_journal.init_crawl_journal(
+            crawl_journal_ctx,
+            args.journal,
+            is_resume=is_append,
+            )
+    
+    if args.discovery != 'off':
+        seed_url_list = e58_fetch.get_start_url_list(args.site_url)
+    else:
+        seed_url_list = ()
+    
+    seen_url_list = None
+    
+    if is_append:
+        pending_url_list, journal_url_list = \
+                crawl_journal.crawl_journal_load(crawl_journal_ctx)
+        
+        if journal_url_list:
+            seed_url_list = pending_url_list if args.resume else ()
+            seen_url_list = journal_url_list
+    
+    if args.retry_dead_letter:
+        if seen_url_list is None:
+            # no journal: only dead urls are known
+            seed_url_list = ()
+        
+        seed_url_list = tuple(seed_url_list) + dead_url_list
+        
+        crawl_journal.crawl_journal_reschedule(crawl_journal_ctx, dead_url_list)
+    
+    dead_letter_fd = open(
+            args.dead_letter,
+            'a' if args.resume else 'w',
+            encoding='utf-8',
+            )
+    
+    # direct and probe seeds are journaled by ``on_scheduled``, when they
+    # are fed to frontier
+    for seed_url in seed_url_list:
+        crawl_journal.crawl_journal_scheduled(crawl_journal_ctx, seed_url)
+    
+    stats_ctx = StatsCtx()
+    stats_ctx.crawl_stats = crawl_stats.CrawlStatsCtx()
+    crawl_stats.init_crawl_stats(stats_ctx.crawl_stats)
+    stats_ctx.stats_path = args.stats_file
+    stats_ctx.profile_path = args.profile
+    stats_ctx.stop_event = threading.Event()
+    
+    if not args.delta_only:
+        out_sink_ctx = out_sink.OutSinkCtx()
+        out_sink.init_out_sink(
+                out_sink_ctx,
+                args.format,
+                args.out_path,
+                e58_fetch.FIRM_FIELD_LIST,
+                is_append=is_append,
+                batch_size=args.batch_size,
+                batch_time=args.batch_time,
+                on_commit=lambda url_list: on_commit(crawl_journal_ctx, url_list),
+                crawl_stats_ctx=stats_ctx.crawl_stats,
+                )
+    else:
+        out_sink_ctx = None
+    
+    if args.delta is not None:
+        if args.delta_state is None:
+            args.delta_state = '{}.state'.format(args.out_path)
+        
+        delta_ctx = DeltaCtx()
+        delta_ctx.firm_delta = firm_delta.FirmDeltaCtx()
+        firm_delta.init_firm_delta(
+                delta_ctx.firm_delta,
+                args.delta_state,
+                # without firm list only seeded firms are visited
+                is_partial=args.discovery == 'off',
+                )
+        delta_ctx.csv = CsvCtx()
+        delta_ctx.csv.fd = open(args.delta, 'w', encoding='utf-8', newline='')
+        delta_ctx.csv.writer = csv.writer(delta_ctx.csv.fd)
+        csv_write_delta_header(delta_ctx.csv)
+    else:
+        delta_ctx = None
+    
+    concurrency_ctl_ctx, host_rate_ctx, retry_queue_ctx = e58_fetch.get_fetch_control(
+            args.min_concurrency,
+            args.max_concurrency,
+            args.concurrency,
+            rps=args.rps,
+            max_attempts=args.max_attempts,
+            retry_delay=args.retry_delay,
+            )
+    
+    if args.profile is not None:
+        crawl_profile_ctx = crawl_profile.CrawlProfileCtx()
+        crawl_profile.init_crawl_profile(
+                crawl_profile_ctx,
+                sample_interval=args.profile_sample,
+                )
+    else:
+        crawl_profile_ctx = None
+    
+    event_queue = queue.Queue(maxsize=100)
+    bulk_data_ctx = e58_fetch.BulkDataCtx()
+    e58_fetch.init_bulk_data_ctx(
+            bulk_data_ctx,
+            site_url=args.site_url,
+            parser_name=args.parser,
+            http_cache_ctx=http_cache_ctx,
+            seed_url_list=seed_url_list,
+            seen_url_list=seen_url_list,
+            direct_url_iter=direct_url_list if is_seeded else None,
+            probe_url_iter=probe_url_iter if is_seeded else None,
+            is_background_discovery=args.discovery == 'background',
+            crawl_stats_ctx=stats_ctx.crawl_stats,
+            concurrency_ctl_ctx=concurrency_ctl_ctx,
+            host_rate_ctx=host_rate_ctx,
+            retry_queue_ctx=retry_queue_ctx,
+            is_stream=args.stream,
+            shard_coord_ctx=shard_coord_ctx,
+            crawl_profile_ctx=crawl_profile_ctx,
+            )
+    
+    def on_scheduled_wrapper(url):
+        put_event(event_queue, stats_ctx.crawl_stats, ('scheduled', url))
+    
+    def on_begin_wrapper(url):
+        put_event(event_queue, stats_ctx.crawl_stats, ('begin', url))
+    
+    def on_fetch_wrapper(url, fetch_data):
+        put_event(event_queue, stats_ctx.crawl_stats, ('fetch', url, fetch_data))
+    
+    def on_error_wrapper(url, err_type, err_msg):
+        put_event(event_queue, stats_ctx.crawl_stats, ('error', url, err_type, err_msg))
+    
+    def on_finish_wrapper(url):
+        put_event(event_queue, stats_ctx.crawl_stats, ('finish', url))
+    
+    def on_done_wrapper():
+        event_queue.put(('done',))
+    
+    if not args.verbose:
+        # begin events are only printed
+        on_begin_wrapper = None
+    
+    stats_ctx.thread = threading.Thread(
+            target=lambda: stats_report_thread(
+                    stats_ctx.stop_event,
+                    args.stats_interval,
+                    stats_ctx.crawl_stats,
+                    bulk_data_ctx,
+                    event_queue,
+                    stats_ctx.stats_path,
+                    ),
+            daemon=True,
+            )
+    stats_ctx.thread.start()
+    
+    if args.engine == 'asyncio':
+        e58_fetch_async.bulk_data_fetch_async(
+                bulk_data_ctx,
+                concurrency=args.concurrency,
+                parse_process_count=args.parse_processes,
+                on_scheduled=on_scheduled_wrapper,
+                on_fetch=on_fetch_wrapper,
+                on_begin=on_begin_wrapper,
+                on_error=on_error_wrapper,
+                on_finish=on_finish_wrapper,
+                on_done=on_done_wrapper,
+                )
+    else:
         e58_fetch.bulk_data_fetch(
                 bulk_data_ctx,
-                thread_count=THREAD_COUNT,
+                thread_count=args.concurrency,
+                parse_process_count=args.parse_processes,
                 on_scheduled=on_scheduled_wrapper,
                 on_fetch=on_fetch_wrapper,
                 on_begin=on_begin_wrapper,
                 on_error=on_error_wrapper,
+                on_finish=on_finish_wrapper,
                 on_done=on_done_wrapper,
                 )
     
-    bulk_data_fetch_start()
-    
     while True:
         event = event_queue.get()
         try:
             if event[0] == 'done':
-                try:
-                    bulk_data_fetch_start()
-                    on_continue(event_queue)
-                except StopIteration:
-                    on_done(event_queue)
-                    break
+                on_done(
+                        event_queue,
+                        bulk_data_ctx,
+                        out_sink_ctx,
+                        crawl_journal_ctx,
+                        delta_ctx,
+                        stats_ctx,
+                        dead_letter_fd,
+                        )
+                break
             elif event[0] == 'scheduled':
-                on_scheduled(event_queue, event[1])
+                on_scheduled(event_queue, args.verbose, crawl_journal_ctx, event[1])
             elif event[0] == 'begin':
-                on_begin(event_queue, event[1])
+                on_begin(event_queue, args.verbose, event[1])
             elif event[0] == 'fetch':
-                on_fetch(event_queue, csv_ctx, event[1], event[2])
+                on_fetch(event_queue, args.verbose, out_sink_ctx, delta_ctx, event[1], event[2])
             elif event[0] == 'error':
-                on_error(event_queue, event[1], event[2], event[3])
+                on_error(event_queue, delta_ctx, dead_letter_fd, event[1], event[2], event[3])
+            elif event[0] == 'finish':
+                on_finish(event_queue, out_sink_ctx, crawl_journal_ctx, event[1])
         finally:
             event_queue.task_done()
@@ -0,0 +1,508 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# out sink -- batched output of firm records.
+#
+# records are collected in memory and written by writer thread in
+# batches (by count or by time). every batch is a durability checkpoint:
+# file is flushed and synced (or SQLite transaction is committed), and
+# only then ``on_commit`` gets urls marked in this batch.
+#
+#   ``csv`` -- CSV file with header row.
+#
+#   ``jsonl`` -- one JSON object per line.
+#
+#   ``sqlite`` -- table ``firm`` of SQLite database. rows are inserted
+#       by ``executemany()``, one transaction per batch.
+#
+# resumed run (``is_append``) first cuts record cut by interrupted run
+# off the end of file.
+
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from . import crawl_stats
+
+SINK_FORMAT_LIST = ('csv', 'jsonl', 'sqlite')
+BATCH_SIZE = 1000
+BATCH_TIME = 1.0
+PENDING_FACTOR = 4
+
+class OutSinkError(Exception):
+    pass
+
+def csv_row_iter(in_path):
+    # yields ``(row, length)`` of complete rows of CSV file (header row
+    # too). ``length`` -- length of file up to the end of row.
+    #
+    # quoted cell may have line breaks, so row cut by interrupted run
+    # may look complete by its cells: row is complete only if parser
+    # ends it on line break, not on end of file
+    
+    read_length = 0
+    last_line = b''
+    is_eof = False
+    
+    def line_iter(fd):
+        nonlocal read_length, last_line, is_eof
+        
+        for line in fd:
+            read_length += len(line)
+            last_line = line
+            
+            yield line.decode('utf-8', 'replace')
+        
+        is_eof = True
+    
+    with open(in_path, 'rb') as fd:
+        reader = csv.reader(line_iter(fd))
+        
+        try:
+            for row in reader:
+                if is_eof or not last_line.endswith(b'\n'):
+                    return
+                
+                yield row, read_length
+        except csv.Error:
+            return
+
+def csv_get_complete_length(in_path):
+    complete_length = 0
+    
+    for row, complete_length in csv_row_iter(in_path):
+        pass
+    
+    return complete_length
+
+def jsonl_get_complete_length(in_path):
+    # JSON line has no line breaks inside
+    
+    complete_length = 0
+    read_length = 0
+    
+    with open(in_path, 'rb') as fd:
+        for line in fd:
+            read_length += len(line)
+            
+            if line.endswith(b'\n'):
+                complete_length = read_length
+    
+    return complete_length
+
+def truncate_cut_record(sink_format, out_path):
+    # removes record cut by interrupted run from the end of output file,
+    # so records of resumed run do not join it. SQLite database has no
+    # cut records
+    
+    if sink_format == 'sqlite' or not os.path.exists(out_path):
+        return
+    
+    if sink_format == 'csv':
+        complete_length = csv_get_complete_length(out_path)
+    else:
+        complete_length = jsonl_get_complete_length(out_path)
+    
+    if complete_length < os.path.getsize(out_path):
+        with open(out_path, 'r+b') as fd:
+            fd.truncate(complete_length)
+
+def csv_open(out_sink_ctx, is_append):
+    out_sink_ctx.fd = open(
+            out_sink_ctx.out_path,
+            'a' if is_append else 'w',
+            encoding='utf-8',
+            newline='',
+            )
+    out_sink_ctx.writer = csv.writer(out_sink_ctx.fd)
+    
+    if not out_sink_ctx.fd.tell():
+        out_sink_ctx.writer.writerow(('url',) + out_sink_ctx.field_list)
+
+def csv_write_batch(out_sink_ctx, record_list):
+    out_sink_ctx.writer.writerows(
+            (record_url,) + tuple(
+                    fetch_data[field_name]
+                    for field_name in out_sink_ctx.field_list
+                    )
+            for record_url, fetch_data in record_list
+            )
+    out_sink_ctx.fd.flush()
+    os.fsync(out_sink_ctx.fd.fileno())
+
+def csv_read_url_set(out_path):
+    return frozenset(
+            record_url
+            for record_url, fetch_data in csv_read_record_iter(out_path, ())
+            )
+
+def csv_read_record_iter(in_path, field_list):
+    header_row = None
+    
+    for row, complete_length in csv_row_iter(in_path):
+        if header_row is None:
+            header_row = row
+            
+            continue
+        
+        if len(row) != len(header_row):
+            # row of broken file
+            continue
+        
+        record = dict(zip(header_row, row))
+        
+        yield record['url'], dict(
+                (field_name, record.get(field_name, ''))
+                for field_name in field_list
+                )
+
+def jsonl_open(out_sink_ctx, is_append):
+    out_sink_ctx.fd = open(
+            out_sink_ctx.out_path,
+            'a' if is_append else 'w',
+            encoding='utf-8',
+            )
+
+def jsonl_write_batch(out_sink_ctx, record_list):
+    out_sink_ctx.fd.write(''.join(
+            '{}\n'.format(json.dumps(
+                    dict(
+                            (('url', record_url),) + tuple(
+                                    (field_name, fetch_data[field_name])
+                                    for field_name in out_sink_ctx.field_list
+                                    ),
+                            ),
+                    ensure_ascii=False,
+                    ))
+            for record_url, fetch_data in record_list
+            ))
+    out_sink_ctx.fd.flush()
+    os.fsync(out_sink_ctx.fd.fileno())
+
+def jsonl_read_url_set(out_path):
+    url_set = set()
+    
+    # line cut by interrupted run may end inside of character
+    with open(out_path, 'r', encoding='utf-8', errors='replace') as fd:
+        for line in fd:
+            try:
+                url_set.add(json.loads(line)['url'])
+            except ValueError:
+                # line is cut by interrupted run
+                continue
+    
+    return frozenset(url_set)
+
+def jsonl_read_record_iter(in_path, field_list):
+    with open(in_path, 'r', encoding='utf-8', errors='replace') as fd:
+        for line in fd:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # line is cut by interrupted run
+                continue
+            
+            yield record['url'], dict(
+                    (field_name, record.get(field_name, ''))
+                    for field_name in field_list
+                    )
+
+def sqlite_open(out_sink_ctx, is_append):
+    out_sink_ctx.db = sqlite3.connect(
+            out_sink_ctx.out_path,
+            check_same_thread=False,
+            )
+    
+    if not is_append:
+        out_sink_ctx.db.execute('DROP TABLE IF EXISTS firm')
+    
+    out_sink_ctx.db.execute(
+            'CREATE TABLE IF NOT EXISTS firm (url TEXT PRIMARY KEY, {})'.format(
+                    ', '.join(
+                            '{} TEXT'.format(field_name)
+                            for field_name in out_sink_ctx.field_list
+                            ),
+                    )
+            )
+    out_sink_ctx.db.commit()
+
+def sqlite_write_batch(out_sink_ctx, record_list):
+    with out_sink_ctx.db:
+        out_sink_ctx.db.executemany(
+                'INSERT OR REPLACE INTO firm (url, {}) VALUES (?, {})'.format(
+                        ', '.join(out_sink_ctx.field_list),
+                        ', '.join('?' for field_name in out_sink_ctx.field_list),
+                        ),
+                (
+                        (record_url,) + tuple(
+                                fetch_data[field_name]
+                                for field_name in out_sink_ctx.field_list
+                                )
+                        for record_url, fetch_data in record_list
+                        ),
+                )
+
+def sqlite_read_url_set(out_path):
+    db = sqlite3.connect(out_path)
+    
+    try:
+        return frozenset(row[0] for row in db.execute('SELECT url FROM firm'))
+    except sqlite3.OperationalError:
+        # no table yet
+        return frozenset()
+    finally:
+        db.close()
+
+def sqlite_read_record_iter(in_path, field_list):
+    db = sqlite3.connect(in_path)
+    
+    try:
+        try:
+            cursor = db.execute('SELECT * FROM firm ORDER BY rowid')
+        except sqlite3.OperationalError:
+            # no table
+            return
+        
+        column_list = tuple(column[0] for column in cursor.description)
+        
+        for row in cursor:
+            record = dict(zip(column_list, row))
+            
+            yield record['url'], dict(
+                    (field_name, record.get(field_name) or '')
+                    for field_name in field_list
+                    )
+    finally:
+        db.close()
+
+def read_url_set(sink_format, out_path):
+    # urls of records which are already in output (for resume)
+    
+    if not os.path.exists(out_path):
+        return frozenset()
+    
+    if sink_format == 'csv':
+        return csv_read_url_set(out_path)
+    
+    if sink_format == 'jsonl':
+        return jsonl_read_url_set(out_path)
+    
+    if sink_format == 'sqlite':
+        return sqlite_read_url_set(out_path)
+    
+    raise OutSinkError('unknown sink format: {!r}'.format(sink_format))
+
+def read_record_iter(sink_format, in_path, field_list):
+    # yields ``(record_url, fetch_data)`` of output file. records cut by
+    # interrupted run are skipped
+    
+    if sink_format == 'csv':
+        return csv_read_record_iter(in_path, field_list)
+    
+    if sink_format == 'jsonl':
+        return jsonl_read_record_iter(in_path, field_list)
+    
+    if sink_format == 'sqlite':
+        return sqlite_read_record_iter(in_path, field_list)
+    
+    raise OutSinkError('unknown sink format: {!r}'.format(sink_format))
+
+class OutSinkCtx:
+    pass
+
+def init_out_sink(
+        out_sink_ctx,
+        sink_format,
+        out_path,
+        field_list,
+        is_append=False,
+        batch_size=None,
+        batch_time=None,
+        on_commit=None,
+        crawl_stats_ctx=None,
+        ):
+    # ``on_commit`` -- called from writer thread with list of urls marked
+    # by ``out_sink_mark()``, when their records are durable
+    
+    if sink_format not in SINK_FORMAT_LIST:
+        raise OutSinkError('unknown sink format: {!r}'.format(sink_format))
+    
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+    
+    if batch_time is None:
+        batch_time = BATCH_TIME
+    
+    out_sink_ctx.sink_format = sink_format
+    out_sink_ctx.out_path = out_path
+    out_sink_ctx.field_list = tuple(field_list)
+    out_sink_ctx.batch_size = batch_size
+    out_sink_ctx.batch_time = batch_time
+    out_sink_ctx.on_commit = on_commit
+    out_sink_ctx.crawl_stats = crawl_stats_ctx
+    
+    if is_append:
+        truncate_cut_record(sink_format, out_path)
+    
+    out_sink_ctx.written_url_set = \
+            read_url_set(sink_format, out_path) if is_append else frozenset()
+    out_sink_ctx.lock = threading.Lock()
+    out_sink_ctx.cond = threading.Condition(out_sink_ctx.lock)
+    out_sink_ctx.record_list = []
+    out_sink_ctx.mark_url_list = []
+    out_sink_ctx.first_time = None
+    out_sink_ctx.is_closed = False
+    out_sink_ctx.error = None
+    out_sink_ctx.record_count = 0
+    out_sink_ctx.batch_count = 0
+    
+    if sink_format == 'csv':
+        csv_open(out_sink_ctx, is_append)
+    elif sink_format == 'jsonl':
+        jsonl_open(out_sink_ctx, is_append)
+    else:
+        sqlite_open(out_sink_ctx, is_append)
+    
+    out_sink_ctx.writer_thread = threading.Thread(
+            target=lambda: out_sink_writer_thread(out_sink_ctx),
+            daemon=True,
+            )
+    out_sink_ctx.writer_thread.start()
+
+def out_sink_wait_room(out_sink_ctx):
+    # must be called under ``out_sink_ctx.lock``. bounds memory if
+    # writer is slower than crawl
+    
+    while out_sink_ctx.error is None and \
+            len(out_sink_ctx.record_list) >= out_sink_ctx.batch_size * PENDING_FACTOR:
+        out_sink_ctx.cond.wait()
+    
+    if out_sink_ctx.error is not None:
+        raise OutSinkError('writer failed: {}'.format(out_sink_ctx.error))
+    
+    if out_sink_ctx.first_time is None:
+        out_sink_ctx.first_time = time.monotonic()
+        out_sink_ctx.cond.notify_all()
+
+def out_sink_put(out_sink_ctx, record_url, fetch_data):
+    if record_url in out_sink_ctx.written_url_set:
+        # record is written by interrupted run
+        return
+    
+    with out_sink_ctx.lock:
+        out_sink_wait_room(out_sink_ctx)
+        out_sink_ctx.record_list.append((record_url, fetch_data))
+        
+        if len(out_sink_ctx.record_list) >= out_sink_ctx.batch_size:
+            out_sink_ctx.cond.notify_all()
+
+def out_sink_mark(out_sink_ctx, mark_url):
+    # ``mark_url`` goes to ``on_commit`` with batch of records put
+    # before it
+    
+    with out_sink_ctx.lock:
+        out_sink_wait_room(out_sink_ctx)
+        out_sink_ctx.mark_url_list.append(mark_url)
+
+def out_sink_take_batch(out_sink_ctx):
+    # returns ``(record_list, mark_url_list, is_closed)``
+    
+    with out_sink_ctx.lock:
+        while not out_sink_ctx.is_closed and \
+                len(out_sink_ctx.record_list) < out_sink_ctx.batch_size:
+            if out_sink_ctx.first_time is None:
+                out_sink_ctx.cond.wait()
+                
+                continue
+            
+            wait_time = out_sink_ctx.first_time + out_sink_ctx.batch_time - \
+                    time.monotonic()
+            
+            if wait_time <= 0.0:
+                break
+            
+            out_sink_ctx.cond.wait(wait_time)
+        
+        record_list = out_sink_ctx.record_list
+        mark_url_list = out_sink_ctx.mark_url_list
+        out_sink_ctx.record_list = []
+        out_sink_ctx.mark_url_list = []
+        out_sink_ctx.first_time = None
+        out_sink_ctx.cond.notify_all()
+        
+        return record_list, mark_url_list, out_sink_ctx.is_closed
+
+def out_sink_write_batch(out_sink_ctx, record_list):
+    if out_sink_ctx.sink_format == 'csv':
+        csv_write_batch(out_sink_ctx, record_list)
+    elif out_sink_ctx.sink_format == 'jsonl':
+        jsonl_write_batch(out_sink_ctx, record_list)
+    else:
+        sqlite_write_batch(out_sink_ctx, record_list)
+
+def out_sink_writer_thread(out_sink_ctx):
+    while True:
+        record_list, mark_url_list, is_closed = out_sink_take_batch(out_sink_ctx)
+        
+        try:
+            if record_list:
+                begin_time = time.perf_counter()
+                
+                out_sink_write_batch(out_sink_ctx, record_list)
+                
+                crawl_stats.crawl_stats_observe(
+                        out_sink_ctx.crawl_stats,
+                        'write',
+                        time.perf_counter() - begin_time,
+                        )
+                
+                out_sink_ctx.record_count += len(record_list)
+                out_sink_ctx.batch_count += 1
+            
+            if mark_url_list and out_sink_ctx.on_commit is not None:
+                out_sink_ctx.on_commit(mark_url_list)
+        except Exception as e:
+            with out_sink_ctx.lock:
+                out_sink_ctx.error = e
+                out_sink_ctx.cond.notify_all()
+            
+            return
+        
+        if is_closed:
+            return
+
+def out_sink_close(out_sink_ctx):
+    # writes the rest of records. raises ``OutSinkError`` if writer
+    # failed
+    
+    with out_sink_ctx.lock:
+        out_sink_ctx.is_closed = True
+        out_sink_ctx.cond.notify_all()
+    
+    out_sink_ctx.writer_thread.join()
+    
+    if out_sink_ctx.sink_format == 'sqlite':
+        out_sink_ctx.db.close()
+    else:
+        out_sink_ctx.fd.close()
+    
+    if out_sink_ctx.error is not None:
+        raise OutSinkError('writer failed: {}'.format(out_sink_ctx.error))
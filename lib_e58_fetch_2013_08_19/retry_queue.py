@@ -0,0 +1,111 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# retry queue -- delayed urls of failed fetches.
+#
+# urls wait in heap ordered by due time, so no worker sleeps for them.
+# delay is exponential by count of attempts, with jitter (random half of
+# it), so urls failed at once are not retried at once. like frontier,
+# queue is not thread-safe by itself -- caller must hold its own lock.
+
+import heapq
+import itertools
+import random
+import time
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+class RetryQueueCtx:
+    pass
+
+def init_retry_queue(
+        retry_queue_ctx,
+        max_attempts=None,
+        base_delay=None,
+        max_delay=None,
+        ):
+    # ``max_attempts`` -- count of fetches of url, first one included
+    
+    if max_attempts is None:
+        max_attempts = MAX_ATTEMPTS
+    
+    if base_delay is None:
+        base_delay = BASE_DELAY
+    
+    if max_delay is None:
+        max_delay = MAX_DELAY
+    
+    retry_queue_ctx.max_attempts = max_attempts
+    retry_queue_ctx.base_delay = base_delay
+    retry_queue_ctx.max_delay = max_delay
+    retry_queue_ctx.heap = []
+    retry_queue_ctx.counter = itertools.count()
+    retry_queue_ctx.attempt_map = {}
+
+def get_delay(retry_queue_ctx, attempt):
+    delay = min(
+            retry_queue_ctx.max_delay,
+            retry_queue_ctx.base_delay * 2 ** (attempt - 1),
+            )
+    
+    return delay / 2 + random.uniform(0.0, delay / 2)
+
+def retry_queue_schedule(retry_queue_ctx, retry_url):
+    # returns delay of retry, or ``None`` if url has no attempts left
+    
+    attempt = retry_queue_ctx.attempt_map.get(retry_url, 1)
+    
+    if attempt >= retry_queue_ctx.max_attempts:
+        return None
+    
+    delay = get_delay(retry_queue_ctx, attempt)
+    
+    retry_queue_ctx.attempt_map[retry_url] = attempt + 1
+    heapq.heappush(retry_queue_ctx.heap, (
+            time.monotonic() + delay,
+            next(retry_queue_ctx.counter),
+            retry_url,
+            ))
+    
+    return delay
+
+def retry_queue_pop_due(retry_queue_ctx):
+    # returns list of urls which are due now
+    
+    now = time.monotonic()
+    due_url_list = []
+    
+    while retry_queue_ctx.heap and retry_queue_ctx.heap[0][0] <= now:
+        due_time, counter, retry_url = heapq.heappop(retry_queue_ctx.heap)
+        due_url_list.append(retry_url)
+    
+    return due_url_list
+
+def retry_queue_wait_time(retry_queue_ctx):
+    # returns time until next url is due, or ``None`` if queue is empty
+    
+    if not retry_queue_ctx.heap:
+        return None
+    
+    return max(0.0, retry_queue_ctx.heap[0][0] - time.monotonic())
+
+def retry_queue_len(retry_queue_ctx):
+    return len(retry_queue_ctx.heap)
@@ -0,0 +1,173 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+assert str is not bytes
+
+# seed source -- urls of firms to crawl at once, without walking firm
+# list of site page by page.
+#
+#   sitemap -- ``<loc>`` urls of sitemap (url or file, gzipped or not).
+#       sitemap index is followed to its sitemaps.
+#
+#   url file -- one url per line. empty lines and lines from ``#`` are
+#       skipped.
+#
+#   output -- urls of records of previous run (see ``out_sink``).
+#
+#   cache -- urls of pages in http cache of previous runs.
+#
+#   id range -- firm urls made by template from range of firm ids. not
+#       every id is firm, so these urls are probes: their ``404`` is
+#       expected (see ``e58_fetch.init_bulk_data_ctx()``).
+
+from urllib import parse as url
+from xml.etree import ElementTree as et
+import collections
+import gzip
+import os
+from . import e58_fetch
+from . import http_cache
+from . import http_pool
+from . import out_sink
+
+FIRM_URL_TEMPLATE = 'firm/{}/'
+SITEMAP_MAX_DEPTH = 3
+GZIP_MAGIC = b'\x1f\x8b'
+
+class SeedSourceError(Exception):
+    pass
+
+def parse_sitemap(body):
+    # returns ``(loc_list, is_index)``
+    
+    if body.startswith(GZIP_MAGIC):
+        body = gzip.decompress(body)
+    
+    try:
+        root = et.fromstring(body)
+    except et.ParseError as e:
+        raise SeedSourceError('invalid sitemap: {}'.format(e))
+    
+    # tags are in namespace of sitemap protocol (or in no one)
+    loc_list = tuple(
+            elem.text.strip()
+            for elem in root.iter()
+            if isinstance(elem.tag, str) and
+                    elem.tag.rpartition('}')[2] == 'loc' and
+                    elem.text and elem.text.strip()
+            )
+    
+    return loc_list, root.tag.rpartition('}')[2] == 'sitemapindex'
+
+def read_sitemap_body(http_pool_ctx, sitemap_location):
+    if url.urlsplit(sitemap_location).scheme in ('http', 'https'):
+        try:
+            return e58_fetch.fetch_raw(http_pool_ctx, sitemap_location)
+        except Exception as e:
+            raise SeedSourceError('sitemap {!r} is not fetched: {}'.format(
+                    sitemap_location, e))
+    
+    try:
+        with open(sitemap_location, 'rb') as fd:
+            return fd.read()
+    except OSError as e:
+        raise SeedSourceError('sitemap {!r} is not read: {}'.format(
+                sitemap_location, e))
+
+def read_sitemap(sitemap_location):
+    # ``sitemap_location`` -- url or file path
+    
+    http_pool_ctx = http_pool.HttpPoolCtx()
+    http_pool.init_http_pool(http_pool_ctx)
+    
+    sitemap_url_list = []
+    pending_deque = collections.deque(((sitemap_location, 0),))
+    
+    try:
+        while pending_deque:
+            location, depth = pending_deque.popleft()
+            loc_list, is_index = parse_sitemap(
+                    read_sitemap_body(http_pool_ctx, location))
+            
+            if not is_index:
+                sitemap_url_list.extend(loc_list)
+                
+                continue
+            
+            if depth >= SITEMAP_MAX_DEPTH:
+                raise SeedSourceError('sitemap index is too deep: {!r}'.format(location))
+            
+            pending_deque.extend(
+                    (url.urljoin(location, loc), depth + 1)
+                    for loc in loc_list
+                    )
+    finally:
+        http_pool.http_pool_close(http_pool_ctx)
+    
+    return tuple(sitemap_url_list)
+
+def read_url_file(url_file_path):
+    try:
+        fd = open(url_file_path, 'r', encoding='utf-8')
+    except OSError as e:
+        raise SeedSourceError('url file {!r} is not read: {}'.format(
+                url_file_path, e))
+    
+    with fd:
+        return tuple(
+                line.strip()
+                for line in fd
+                if line.strip() and not line.lstrip().startswith('#')
+                )
+
+def read_output_urls(sink_format, out_path):
+    # urls of records of output, in stable order
+    
+    if not os.path.exists(out_path):
+        raise SeedSourceError('no output: {!r}'.format(out_path))
+    
+    return tuple(sorted(out_sink.read_url_set(sink_format, out_path)))
+
+def read_cache_urls(http_cache_ctx):
+    return http_cache.http_cache_url_list(http_cache_ctx)
+
+def parse_id_range(id_range):
+    # ``'FIRST-LAST'`` (both are in range) to ``(first_id, last_id)``
+    
+    first_id, sep, last_id = id_range.partition('-')
+    
+    try:
+        first_id = int(first_id)
+        last_id = int(last_id)
+    except ValueError:
+        raise SeedSourceError('invalid id range: {!r}'.format(id_range))
+    
+    if not sep or first_id < 0 or last_id < first_id:
+        raise SeedSourceError('invalid id range: {!r}'.format(id_range))
+    
+    return first_id, last_id
+
+def iter_id_urls(site_url, first_id, last_id, url_template=None):
+    # lazy: range may be long. ``url_template`` -- ``str.format()``
+    # template of firm url, relative to ``site_url``
+    
+    if url_template is None:
+        url_template = FIRM_URL_TEMPLATE
+    
+    for firm_id in range(first_id, last_id + 1):
+        yield url.urljoin(site_url, url_template.format(firm_id))
@@ -0,0 +1,228 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+assert str is not bytes
+
+# shard coord -- routing of urls between shards of one crawl.
+#
+# url space is split by stable hash of normalized url (see
+# ``get_url_shard()``): every url has exactly one owner shard, and only
+# owner fetches it. shards are separate processes (on one host, or on
+# hosts which share coordinator file). links which shard finds for other
+# shards are routed to their owners through coordinator -- SQLite
+# database in WAL mode. table ``route`` keeps every routed url once, so
+# owner gets url once, how many shards found it.
+#
+# every shard keeps in coordinator whether it is idle and how many urls
+# it has taken. crawl is over only when all shards are idle and no routed
+# url waits for its owner. shard sends its urls, takes its urls and
+# becomes idle in one transaction, so no url is lost between shards.
+
+import hashlib
+import sqlite3
+import threading
+from . import url_frontier
+
+SYNC_INTERVAL = 0.2
+LOCK_TIMEOUT = 60.0
+
+class ShardCoordError(Exception):
+    pass
+
+def get_url_shard(raw_url, shard_count):
+    # the same on every host and every run (unlike ``hash()``)
+    
+    url_hash = hashlib.sha1(
+            url_frontier.normalize_url(raw_url).encode('utf-8')).digest()
+    
+    return int.from_bytes(url_hash[:8], 'big') % shard_count
+
+class ShardCoordCtx:
+    pass
+
+def init_shard_coord(
+        shard_coord_ctx,
+        coord_path,
+        shard_index,
+        shard_count,
+        is_resume=False,
+        ):
+    # coordinator file must be new for every crawl. ``is_resume`` -- shard
+    # continues interrupted crawl: all urls routed to it are taken again
+    # (urls which are in its journal are skipped by frontier)
+    
+    if not 0 <= shard_index < shard_count:
+        raise ShardCoordError('invalid shard index: {!r}'.format(shard_index))
+    
+    shard_coord_ctx.shard_index = shard_index
+    shard_coord_ctx.shard_count = shard_count
+    shard_coord_ctx.lock = threading.Lock()
+    shard_coord_ctx.route_list = []
+    shard_coord_ctx.routed_count = 0
+    shard_coord_ctx.taken_count = 0
+    shard_coord_ctx.db = sqlite3.connect(
+            coord_path,
+            timeout=LOCK_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            )
+    
+    shard_coord_ctx.db.execute('PRAGMA journal_mode=WAL')
+    shard_coord_ctx.db.execute(
+            'CREATE TABLE IF NOT EXISTS route ('
+            'url_key TEXT PRIMARY KEY, '
+            'url TEXT NOT NULL, '
+            'shard_index INTEGER NOT NULL)'
+            )
+    shard_coord_ctx.db.execute(
+            'CREATE INDEX IF NOT EXISTS route_shard_index '
+            'ON route (shard_index)'
+            )
+    shard_coord_ctx.db.execute(
+            'CREATE TABLE IF NOT EXISTS shard ('
+            'shard_index INTEGER PRIMARY KEY, '
+            'shard_count INTEGER NOT NULL, '
+            'is_idle INTEGER NOT NULL, '
+            'taken_rowid INTEGER NOT NULL)'
+            )
+    
+    shard_coord_ctx.db.execute('BEGIN IMMEDIATE')
+    try:
+        shard_count_set = frozenset(row[0] for row in shard_coord_ctx.db.execute(
+                'SELECT shard_count FROM shard'
+                ))
+        
+        if shard_count_set - {shard_count}:
+            raise ShardCoordError(
+                    'coordinator is of crawl with other count of shards')
+        
+        is_registered = shard_coord_ctx.db.execute(
+                'SELECT 1 FROM shard WHERE shard_index = ?',
+                (shard_index,),
+                ).fetchone() is not None
+        
+        if is_registered and not is_resume:
+            raise ShardCoordError(
+                    'shard {} is in coordinator already. coordinator must be '
+                    'new for every crawl'.format(shard_index))
+        
+        shard_coord_ctx.db.execute(
+                'INSERT OR REPLACE INTO shard '
+                '(shard_index, shard_count, is_idle, taken_rowid) '
+                'VALUES (?, ?, 0, 0)',
+                (shard_index, shard_count),
+                )
+    except Exception:
+        shard_coord_ctx.db.execute('ROLLBACK')
+        shard_coord_ctx.db.close()
+        raise
+    
+    shard_coord_ctx.db.execute('COMMIT')
+
+def shard_coord_is_own(shard_coord_ctx, raw_url):
+    return get_url_shard(raw_url, shard_coord_ctx.shard_count) == \
+            shard_coord_ctx.shard_index
+
+def shard_coord_route(shard_coord_ctx, raw_url):
+    # url of other shard. it is sent by next ``shard_coord_sync()``
+    
+    with shard_coord_ctx.lock:
+        shard_coord_ctx.route_list.append((
+                url_frontier.normalize_url(raw_url),
+                raw_url,
+                get_url_shard(raw_url, shard_coord_ctx.shard_count),
+                ))
+
+def shard_coord_sync(shard_coord_ctx, is_idle):
+    # sends routed urls and takes urls of this shard. returns
+    # ``(url_list, is_done)``.
+    #
+    # ``is_idle`` -- shard has nothing to fetch. it must be found before
+    # the call: urls routed after it are not sent by this call
+    
+    with shard_coord_ctx.lock:
+        route_list = shard_coord_ctx.route_list
+        shard_coord_ctx.route_list = []
+    
+    db = shard_coord_ctx.db
+    
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        
+        routed_count = db.total_changes
+        
+        db.executemany(
+                'INSERT OR IGNORE INTO route (url_key, url, shard_index) '
+                'VALUES (?, ?, ?)',
+                route_list,
+                )
+        
+        routed_count = db.total_changes - routed_count
+        taken_rowid, = db.execute(
+                'SELECT taken_rowid FROM shard WHERE shard_index = ?',
+                (shard_coord_ctx.shard_index,),
+                ).fetchone()
+        row_list = db.execute(
+                'SELECT rowid, url FROM route '
+                'WHERE shard_index = ? AND rowid > ? ORDER BY rowid',
+                (shard_coord_ctx.shard_index, taken_rowid),
+                ).fetchall()
+        
+        if row_list:
+            # taken urls are work, shard is not idle
+            is_idle = False
+            taken_rowid = row_list[-1][0]
+        
+        db.execute(
+                'UPDATE shard SET is_idle = ?, taken_rowid = ? '
+                'WHERE shard_index = ?',
+                (int(is_idle), taken_rowid, shard_coord_ctx.shard_index),
+                )
+        
+        is_done = False
+        
+        if is_idle:
+            shard_count, idle_count = db.execute(
+                    'SELECT COUNT(*), SUM(is_idle) FROM shard'
+                    ).fetchone()
+            is_done = shard_count == shard_coord_ctx.shard_count and \
+                    idle_count == shard_count and \
+                    db.execute(
+                            'SELECT 1 FROM route JOIN shard '
+                            'ON route.shard_index = shard.shard_index '
+                            'WHERE route.rowid > shard.taken_rowid LIMIT 1'
+                            ).fetchone() is None
+    except Exception:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        
+        # urls are sent by next call
+        with shard_coord_ctx.lock:
+            shard_coord_ctx.route_list[:0] = route_list
+        
+        raise
+    
+    db.execute('COMMIT')
+    
+    shard_coord_ctx.routed_count += routed_count
+    shard_coord_ctx.taken_count += len(row_list)
+    
+    return tuple(row[1] for row in row_list), is_done
+
+def shard_coord_close(shard_coord_ctx):
+    shard_coord_ctx.db.close()
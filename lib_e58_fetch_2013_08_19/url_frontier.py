@@ -0,0 +1,108 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import collections
+from urllib import parse as url
+
+# url frontier -- queue of pending urls plus set of all seen urls.
+#
+# every operation is O(1). frontier is not thread-safe by itself --
+# caller must hold its own lock (``BulkDataCtx.lock``).
+#
+# urls are compared by normalized form (see ``normalize_url()``),
+# but queue keeps original url as it was given.
+#
+# queue has two lanes: urls of background lane are taken only when main
+# lane is empty (discovery of new urls behind pages of known ones).
+
+def normalize_url(raw_url):
+    assert isinstance(raw_url, str)
+    
+    split_url = url.urlsplit(raw_url)
+    
+    path = split_url.path.rstrip('/')
+    if not path:
+        path = '/'
+    
+    query = url.urlencode(sorted(
+            url.parse_qsl(split_url.query, keep_blank_values=True),
+            ))
+    
+    return url.urlunsplit((
+            split_url.scheme.lower(),
+            split_url.netloc.lower(),
+            path,
+            query,
+            '',
+            ))
+
+class UrlFrontierCtx:
+    pass
+
+def init_url_frontier(url_frontier_ctx):
+    url_frontier_ctx.url_deque = collections.deque()
+    url_frontier_ctx.background_url_deque = collections.deque()
+    url_frontier_ctx.seen_set = set()
+
+def url_frontier_mark_seen(url_frontier_ctx, raw_url):
+    # returns ``True`` if url was not seen before
+    
+    url_key = normalize_url(raw_url)
+    
+    if url_key in url_frontier_ctx.seen_set:
+        return False
+    
+    url_frontier_ctx.seen_set.add(url_key)
+    
+    return True
+
+def url_frontier_add(url_frontier_ctx, raw_url, is_background=False):
+    # returns ``True`` if url was scheduled, ``False`` if it is duplicate
+    
+    if not url_frontier_mark_seen(url_frontier_ctx, raw_url):
+        return False
+    
+    if is_background:
+        url_frontier_ctx.background_url_deque.append(raw_url)
+    else:
+        url_frontier_ctx.url_deque.append(raw_url)
+    
+    return True
+
+def url_frontier_push(url_frontier_ctx, raw_url):
+    # schedules url again (it is already seen). it is for retries
+    
+    url_frontier_ctx.url_deque.append(raw_url)
+
+def url_frontier_pop(url_frontier_ctx):
+    # raises ``IndexError`` if frontier is empty
+    
+    if url_frontier_ctx.url_deque:
+        return url_frontier_ctx.url_deque.popleft()
+    
+    return url_frontier_ctx.background_url_deque.popleft()
+
+def url_frontier_main_len(url_frontier_ctx):
+    # count of urls of main lane only
+    
+    return len(url_frontier_ctx.url_deque)
+
+def url_frontier_len(url_frontier_ctx):
+    return len(url_frontier_ctx.url_deque) + \
+            len(url_frontier_ctx.background_url_deque)
@@ -0,0 +1,124 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# http of asyncio engine -- response framing of ``e58_fetch_async``:
+# sizes sent by server are not trusted over ``FETCH_MAX_LENGTH``, and
+# broken responses are ``FetchError``
+
+import asyncio
+import unittest
+from unittest import mock
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import e58_fetch_async
+
+MAX_LENGTH = 1000
+READER_LIMIT = 256
+
+def run_with_reader(data, coro_func, *args):
+    # ``coro_func(reader, *args)`` over reader of ``data``
+    
+    async def run():
+        reader = asyncio.StreamReader(limit=READER_LIMIT)
+        reader.feed_data(data)
+        reader.feed_eof()
+        
+        return await coro_func(reader, *args)
+    
+    with mock.patch.object(e58_fetch, 'FETCH_MAX_LENGTH', MAX_LENGTH):
+        return asyncio.run(run())
+
+class AsyncReadBodyTest(unittest.TestCase):
+    def test_chunked(self):
+        self.assertEqual(
+                run_with_reader(
+                        b'5\r\nhello\r\n6;ext=1\r\n world\r\n0\r\nTrailer: x\r\n\r\n',
+                        e58_fetch_async.async_read_body,
+                        {'transfer-encoding': 'chunked'},
+                        ),
+                (b'hello world', True),
+                )
+    
+    def test_chunk_over_limit(self):
+        raw_body, is_complete = run_with_reader(
+                b'FFFFFFFF\r\n' + b'x' * (MAX_LENGTH * 2),
+                e58_fetch_async.async_read_body,
+                {'transfer-encoding': 'chunked'},
+                )
+        
+        self.assertEqual(raw_body, b'x' * MAX_LENGTH)
+        self.assertFalse(is_complete)
+    
+    def test_chunks_over_limit(self):
+        chunk = b'x' * (MAX_LENGTH // 3 + 1)
+        raw_body, is_complete = run_with_reader(
+                (hex(len(chunk))[2:].encode() + b'\r\n' + chunk + b'\r\n') * 4,
+                e58_fetch_async.async_read_body,
+                {'transfer-encoding': 'chunked'},
+                )
+        
+        self.assertEqual(len(raw_body), MAX_LENGTH)
+        self.assertFalse(is_complete)
+    
+    def test_content_length(self):
+        self.assertEqual(
+                run_with_reader(
+                        b'hello world',
+                        e58_fetch_async.async_read_body,
+                        {'content-length': '5'},
+                        ),
+                (b'hello', True),
+                )
+        
+        raw_body, is_complete = run_with_reader(
+                b'x' * (MAX_LENGTH * 2),
+                e58_fetch_async.async_read_body,
+                {'content-length': str(MAX_LENGTH * 2)},
+                )
+        
+        self.assertEqual(len(raw_body), MAX_LENGTH)
+        self.assertFalse(is_complete)
+    
+    def test_invalid_chunk_size(self):
+        for data in (b'xyz\r\n', b'1' * (READER_LIMIT * 2) + b'\r\n'):
+            with self.subTest(data=data[:10]):
+                with self.assertRaises(e58_fetch.FetchError):
+                    run_with_reader(
+                            data,
+                            e58_fetch_async.async_read_body,
+                            {'transfer-encoding': 'chunked'},
+                            )
+
+class AsyncHttpReadHeadTest(unittest.TestCase):
+    def test_head(self):
+        self.assertEqual(
+                run_with_reader(
+                        b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\nETag: "x"\r\n\r\nhello',
+                        e58_fetch_async.async_http_read_head,
+                        ),
+                ('HTTP/1.1', 200, {'content-length': '5', 'etag': '"x"'}),
+                )
+    
+    def test_long_line(self):
+        for data in (
+                b'HTTP/1.1 200 ' + b'O' * (READER_LIMIT * 2) + b'\r\n\r\n',
+                b'HTTP/1.1 200 OK\r\nX: ' + b'y' * (READER_LIMIT * 2) + b'\r\n\r\n',
+                ):
+            with self.subTest(data=data[:20]):
+                with self.assertRaises(e58_fetch.FetchError):
+                    run_with_reader(data, e58_fetch_async.async_http_read_head)
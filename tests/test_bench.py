@@ -0,0 +1,221 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# benchmarks -- pages and responses of the synthetic site, and runs of
+# microbenchmarks and of crawl benchmark (``bench.main``)
+
+from urllib import error as url_error
+from urllib import request as url_request
+import gzip
+import tempfile
+import unittest
+from unittest import mock
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19.bench import main as bench_main
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+RUBRIC_COUNT = 3
+PAGE_DEPTH = 4
+FIRM_COUNT = 50
+TIMEOUT = 10.0
+
+def init_site(synthetic_site_ctx, error_rate=None):
+    synthetic_site.init_synthetic_site(
+            synthetic_site_ctx,
+            rubric_count=RUBRIC_COUNT,
+            page_depth=PAGE_DEPTH,
+            firm_count=FIRM_COUNT,
+            error_rate=error_rate,
+            )
+
+class SyntheticSitePageTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        init_site(self.synthetic_site_ctx)
+    
+    def extract(self, path):
+        return e58_fetch.extract_page(
+                'http://e58.ru' + path,
+                synthetic_site.get_page(self.synthetic_site_ctx, path),
+                )
+    
+    def test_covered_firms(self):
+        # firms linked by every listing page of every rubric
+        
+        firm_url_set = set()
+        
+        for rubric_i in range(RUBRIC_COUNT):
+            for page_i in range(PAGE_DEPTH):
+                link_url_list, fetch_data = self.extract(
+                        '/firms/rubric/{}/?page={}'.format(rubric_i, page_i))
+                
+                self.assertIsNone(fetch_data)
+                firm_url_set.update(
+                        link_url
+                        for link_url in link_url_list
+                        if '/firm/' in link_url
+                        )
+        
+        self.assertEqual(
+                len(firm_url_set),
+                synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                )
+        self.assertLessEqual(len(firm_url_set), FIRM_COUNT)
+    
+    def test_firm_page(self):
+        # every field of schema is found
+        
+        link_url_list, fetch_data = self.extract('/firm/7/')
+        
+        for field_name, condition_chain, join in e58_fetch.FIRM_FIELD_SCHEMA:
+            with self.subTest(field_name=field_name):
+                self.assertTrue(fetch_data[field_name])
+    
+    def test_no_page(self):
+        for path in (
+                '/firm/{}/'.format(FIRM_COUNT),
+                '/firms/rubric/{}/'.format(RUBRIC_COUNT),
+                '/firms/rubric/0/?page={}'.format(PAGE_DEPTH),
+                '/firms/rubric/0/?page=x',
+                '/about/',
+                ):
+            with self.subTest(path=path):
+                self.assertIsNone(synthetic_site.get_page(self.synthetic_site_ctx, path))
+
+class SyntheticSiteServerTest(unittest.TestCase):
+    def setUp(self):
+        self.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+    
+    def tearDown(self):
+        synthetic_site.synthetic_site_stop(self.synthetic_site_ctx)
+    
+    def get(self, path, header_map=None):
+        # returns ``(code, resp_header_map, body)``
+        
+        request = url_request.Request(self.site_url + path.lstrip('/'))
+        
+        if header_map is not None:
+            for header_name, header_value in header_map.items():
+                request.add_header(header_name, header_value)
+        
+        try:
+            with url_request.urlopen(request, timeout=TIMEOUT) as resp:
+                return resp.status, resp.headers, resp.read()
+        except url_error.HTTPError as e:
+            return e.code, e.headers, e.read()
+    
+    def test_responses(self):
+        init_site(self.synthetic_site_ctx)
+        self.site_url = synthetic_site.synthetic_site_start(self.synthetic_site_ctx)
+        
+        code, resp_header_map, body = self.get('/firm/1/')
+        
+        self.assertEqual(code, 200)
+        self.assertEqual(
+                body.decode('utf-8'),
+                synthetic_site.get_page(self.synthetic_site_ctx, '/firm/1/'),
+                )
+        
+        code, gzip_header_map, gzip_body = self.get(
+                '/firm/1/',
+                header_map={'Accept-Encoding': 'gzip'},
+                )
+        
+        self.assertEqual(gzip_header_map['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzip_body), body)
+        
+        code, resp_header_map, body = self.get(
+                '/firm/1/',
+                header_map={'If-None-Match': resp_header_map['ETag']},
+                )
+        
+        self.assertEqual(code, 304)
+        self.assertEqual(body, b'')
+        
+        code, resp_header_map, body = self.get('/firm/{}/'.format(FIRM_COUNT))
+        
+        self.assertEqual(code, 404)
+        self.assertEqual(self.synthetic_site_ctx.request_count, 4)
+        self.assertEqual(self.synthetic_site_ctx.error_count, 0)
+        
+        synthetic_site.synthetic_site_reset(self.synthetic_site_ctx)
+        
+        self.assertEqual(self.synthetic_site_ctx.request_count, 0)
+        self.assertEqual(self.synthetic_site_ctx.byte_count, 0)
+    
+    def test_error_rate(self):
+        init_site(self.synthetic_site_ctx, error_rate=1.0)
+        self.site_url = synthetic_site.synthetic_site_start(self.synthetic_site_ctx)
+        
+        for path in ('/firms/', '/firm/1/'):
+            with self.subTest(path=path):
+                code, resp_header_map, body = self.get(path)
+                
+                self.assertEqual(code, 503)
+        
+        self.assertEqual(self.synthetic_site_ctx.error_count, 2)
+
+class BenchMainTest(unittest.TestCase):
+    def test_time_op(self):
+        call_list = []
+        op_time = bench_main.time_op(lambda: call_list.append(None), repeat=2, min_time=0.01)
+        
+        self.assertGreater(op_time, 0.0)
+        self.assertLess(op_time, 0.01)
+        self.assertGreater(len(call_list), 2)
+    
+    def test_run_micro(self):
+        synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        init_site(synthetic_site_ctx)
+        
+        with mock.patch.object(bench_main, 'MIN_TIME', 0.001):
+            result_map = bench_main.run_micro(synthetic_site_ctx, repeat=1)
+        
+        self.assertIn('et_find.find', result_map)
+        self.assertIn('extract_page.html5lib.listing', result_map)
+        self.assertIn('extract_page.html5lib.firm', result_map)
+        
+        for name, op_time in result_map.items():
+            with self.subTest(name=name):
+                self.assertGreater(op_time, 0.0)
+    
+    def test_run_crawl(self):
+        synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        init_site(synthetic_site_ctx)
+        site_url = synthetic_site.synthetic_site_start(synthetic_site_ctx)
+        
+        try:
+            with tempfile.TemporaryDirectory() as work_dir:
+                crawl_map = bench_main.run_crawl(
+                        synthetic_site_ctx,
+                        site_url,
+                        bench_main.CRAWL_CONFIG_MAP['thread'][0],
+                        work_dir,
+                        )
+        finally:
+            synthetic_site.synthetic_site_stop(synthetic_site_ctx)
+        
+        self.assertEqual(
+                crawl_map['firm_count'],
+                synthetic_site.get_covered_firm_count(synthetic_site_ctx),
+                )
+        self.assertEqual(crawl_map['error_count'], 0)
+        self.assertGreater(crawl_map['request_count'], crawl_map['firm_count'])
+        self.assertGreater(crawl_map['page_rate'], 0.0)
+        self.assertGreater(crawl_map['peak_rss'], 0)
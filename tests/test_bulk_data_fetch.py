@@ -0,0 +1,145 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# worker pool of ``e58_fetch.bulk_data_fetch()`` -- slow page does not
+# hold other workers (no waves), seen urls are not fetched, and
+# cancelled crawl is over with ``on_done``
+
+import http.server
+import threading
+import time
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+RUBRIC_COUNT = 2
+PAGE_DEPTH = 2
+FIRM_COUNT = 40
+THREAD_COUNT = 2
+SLOW_PATH = '/firm/0/'
+SLOW_TIME = 1.0
+SLOW_FETCH_COUNT = 5
+CRAWL_TIMEOUT = 30.0
+
+class SlowPageHandler(synthetic_site.SyntheticSiteHandler):
+    def do_GET(self):
+        if self.path == SLOW_PATH:
+            self.server.slow_begin_time = time.monotonic()
+            time.sleep(SLOW_TIME)
+        
+        super().do_GET()
+
+class BulkDataFetchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                cls.synthetic_site_ctx,
+                rubric_count=RUBRIC_COUNT,
+                page_depth=PAGE_DEPTH,
+                firm_count=FIRM_COUNT,
+                )
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SlowPageHandler)
+        cls.server.daemon_threads = True
+        cls.server.synthetic_site_ctx = cls.synthetic_site_ctx
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.site_url = 'http://127.0.0.1:{}/'.format(cls.server.server_address[1])
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def crawl(self, seen_url_list=None, on_first_fetch=None):
+        # returns list of ``(fetch_url, fetch_time)`` in order of fetch
+        
+        bulk_data_ctx = e58_fetch.BulkDataCtx()
+        e58_fetch.init_bulk_data_ctx(
+                bulk_data_ctx,
+                site_url=self.site_url,
+                parser_name='htmlparser',
+                seen_url_list=seen_url_list,
+                )
+        
+        lock = threading.Lock()
+        done_event = threading.Event()
+        fetch_url_list = []
+        
+        def on_fetch(fetch_url, fetch_data):
+            with lock:
+                fetch_url_list.append((fetch_url, time.monotonic()))
+            
+            if on_first_fetch is not None and len(fetch_url_list) == 1:
+                on_first_fetch(bulk_data_ctx)
+        
+        def on_error(fetch_url, error_type, error_str):
+            self.fail('{}: {}: {}'.format(fetch_url, error_type, error_str))
+        
+        e58_fetch.bulk_data_fetch(
+                bulk_data_ctx,
+                thread_count=THREAD_COUNT,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=done_event.set,
+                )
+        
+        if not done_event.wait(CRAWL_TIMEOUT):
+            e58_fetch.bulk_data_cancel(bulk_data_ctx)
+            
+            raise AssertionError('crawl is not over')
+        
+        return fetch_url_list
+    
+    def test_slow_page(self):
+        # one worker waits for slow page, the other one crawls the rest
+        # of site meanwhile
+        
+        fetch_url_list = self.crawl()
+        slow_end_time = dict(fetch_url_list)[self.site_url + SLOW_PATH[1:]]
+        
+        self.assertEqual(
+                len(set(fetch_url for fetch_url, fetch_time in fetch_url_list)),
+                synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                )
+        self.assertGreaterEqual(
+                sum(
+                        1 for fetch_url, fetch_time in fetch_url_list
+                        if self.server.slow_begin_time < fetch_time < slow_end_time
+                        ),
+                SLOW_FETCH_COUNT,
+                )
+    
+    def test_seen_url_list(self):
+        seen_url_list = tuple(
+                '{}firm/{}/'.format(self.site_url, firm_i)
+                for firm_i in range(FIRM_COUNT // 2)
+                )
+        
+        fetch_url_set = set(
+                fetch_url
+                for fetch_url, fetch_time in self.crawl(seen_url_list=seen_url_list)
+                )
+        
+        self.assertTrue(fetch_url_set)
+        self.assertFalse(fetch_url_set & set(seen_url_list))
+    
+    def test_cancel(self):
+        fetch_url_list = self.crawl(on_first_fetch=e58_fetch.bulk_data_cancel)
+        
+        self.assertLessEqual(len(fetch_url_list), THREAD_COUNT)
@@ -0,0 +1,148 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# concurrency control -- adaptive limit of concurrent fetches, rate
+# limit of every host, and ``e58_fetch.fetch_observed()``: fetch which
+# waits for rate limit must not hold fetch slot
+
+import threading
+import time
+import unittest
+from lib_e58_fetch_2013_08_19 import concurrency_ctl
+from lib_e58_fetch_2013_08_19 import e58_fetch
+
+RPS = 4.0
+
+class ConcurrencyCtlTest(unittest.TestCase):
+    def open_ctl(self, initial_concurrency):
+        concurrency_ctl_ctx = concurrency_ctl.ConcurrencyCtlCtx()
+        concurrency_ctl.init_concurrency_ctl(
+                concurrency_ctl_ctx,
+                min_concurrency=1,
+                max_concurrency=4,
+                initial_concurrency=initial_concurrency,
+                )
+        
+        return concurrency_ctl_ctx
+    
+    def test_try_acquire(self):
+        concurrency_ctl_ctx = self.open_ctl(2)
+        
+        self.assertTrue(concurrency_ctl.concurrency_ctl_try_acquire(concurrency_ctl_ctx))
+        self.assertTrue(concurrency_ctl.concurrency_ctl_try_acquire(concurrency_ctl_ctx))
+        self.assertFalse(concurrency_ctl.concurrency_ctl_try_acquire(concurrency_ctl_ctx))
+        
+        concurrency_ctl.concurrency_ctl_release(concurrency_ctl_ctx)
+        
+        self.assertTrue(concurrency_ctl.concurrency_ctl_try_acquire(concurrency_ctl_ctx))
+    
+    def test_increase_to_max(self):
+        concurrency_ctl_ctx = self.open_ctl(1)
+        
+        for fetch_i in range(100):
+            concurrency_ctl.concurrency_ctl_acquire(concurrency_ctl_ctx)
+            concurrency_ctl.concurrency_ctl_release(concurrency_ctl_ctx, latency=0.01)
+        
+        self.assertEqual(concurrency_ctl_ctx.limit, 4.0)
+        self.assertEqual(concurrency_ctl_ctx.active_count, 0)
+    
+    def test_decrease_on_overload(self):
+        concurrency_ctl_ctx = self.open_ctl(4)
+        
+        for fetch_i in range(100):
+            concurrency_ctl.concurrency_ctl_acquire(concurrency_ctl_ctx)
+            concurrency_ctl.concurrency_ctl_release(concurrency_ctl_ctx, is_overload=True)
+        
+        self.assertEqual(concurrency_ctl_ctx.limit, 1.0)
+        self.assertGreater(concurrency_ctl_ctx.decrease_count, 0)
+    
+    def test_decrease_on_latency(self):
+        concurrency_ctl_ctx = self.open_ctl(4)
+        
+        for latency in (0.01,) * 10 + (1.0,) * 50:
+            concurrency_ctl.concurrency_ctl_acquire(concurrency_ctl_ctx)
+            concurrency_ctl.concurrency_ctl_release(concurrency_ctl_ctx, latency=latency)
+        
+        self.assertLess(concurrency_ctl_ctx.limit, 4.0)
+        self.assertGreater(concurrency_ctl_ctx.decrease_count, 0)
+
+class HostRateTest(unittest.TestCase):
+    def test_reserve(self):
+        host_rate_ctx = concurrency_ctl.HostRateCtx()
+        concurrency_ctl.init_host_rate(host_rate_ctx, RPS)
+        
+        self.assertEqual(concurrency_ctl.host_rate_reserve(host_rate_ctx, 'a'), 0.0)
+        
+        # next tokens of the same host are spaced by ``1 / RPS``
+        self.assertAlmostEqual(
+                concurrency_ctl.host_rate_reserve(host_rate_ctx, 'a'),
+                1.0 / RPS,
+                delta=0.05,
+                )
+        self.assertAlmostEqual(
+                concurrency_ctl.host_rate_reserve(host_rate_ctx, 'a'),
+                2.0 / RPS,
+                delta=0.05,
+                )
+        
+        # other host has its own bucket
+        self.assertEqual(concurrency_ctl.host_rate_reserve(host_rate_ctx, 'b'), 0.0)
+        self.assertEqual(host_rate_ctx.wait_count, 2)
+
+class FetchObservedTest(unittest.TestCase):
+    def test_rate_wait_does_not_hold_slot(self):
+        # one slot. fetch of host ``a`` waits for its rate, and fetch of
+        # host ``b`` must go in the meantime
+        
+        concurrency_ctl_ctx = concurrency_ctl.ConcurrencyCtlCtx()
+        concurrency_ctl.init_concurrency_ctl(concurrency_ctl_ctx, 1, 1)
+        host_rate_ctx = concurrency_ctl.HostRateCtx()
+        concurrency_ctl.init_host_rate(host_rate_ctx, RPS)
+        bulk_data_ctx = e58_fetch.BulkDataCtx()
+        e58_fetch.init_bulk_data_ctx(
+                bulk_data_ctx,
+                concurrency_ctl_ctx=concurrency_ctl_ctx,
+                host_rate_ctx=host_rate_ctx,
+                )
+        
+        fetch_list = []
+        
+        def fetch(fetch_url):
+            def fetch_func():
+                fetch_list.append((fetch_url, time.monotonic()))
+                
+                return None, 0
+            
+            e58_fetch.fetch_observed(bulk_data_ctx, fetch_url, fetch_func)
+        
+        fetch('http://a.e58.ru/1')
+        
+        begin_time = time.monotonic()
+        thread = threading.Thread(target=fetch, args=('http://a.e58.ru/2',))
+        thread.start()
+        time.sleep(0.1 / RPS)
+        fetch('http://b.e58.ru/1')
+        thread.join()
+        
+        self.assertEqual(
+                [fetch_url for fetch_url, fetch_time in fetch_list],
+                ['http://a.e58.ru/1', 'http://b.e58.ru/1', 'http://a.e58.ru/2'],
+                )
+        self.assertLess(fetch_list[1][1] - begin_time, 0.5 / RPS)
+        self.assertEqual(concurrency_ctl_ctx.active_count, 0)
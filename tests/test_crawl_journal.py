@@ -0,0 +1,186 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# crawl journal -- pending and seen urls of previous crawl, and
+# ``e58-fetch --resume`` after crawl is killed: resumed output must have
+# every record of uninterrupted crawl, once
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from lib_e58_fetch_2013_08_19 import crawl_journal
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import out_sink
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+E58_FETCH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'e58-fetch')
+KILL_RECORD_COUNT = 10
+CRAWL_TIMEOUT = 60.0
+
+class CrawlJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.tmp_dir.name, 'out.csv.journal')
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def open_journal(self, is_resume):
+        crawl_journal_ctx = crawl_journal.CrawlJournalCtx()
+        crawl_journal.init_crawl_journal(
+                crawl_journal_ctx,
+                self.journal_path,
+                is_resume=is_resume,
+                )
+        
+        return crawl_journal_ctx
+    
+    def test_load(self):
+        crawl_journal_ctx = self.open_journal(False)
+        
+        for url_i in range(5):
+            crawl_journal.crawl_journal_scheduled(crawl_journal_ctx, 'http://e58.ru/{}/'.format(url_i))
+        
+        crawl_journal.crawl_journal_finished(crawl_journal_ctx, 'http://e58.ru/1/')
+        crawl_journal.crawl_journal_finished(crawl_journal_ctx, 'http://e58.ru/3/')
+        crawl_journal.crawl_journal_close(crawl_journal_ctx)
+        
+        crawl_journal_ctx = self.open_journal(True)
+        
+        self.assertEqual(
+                crawl_journal.crawl_journal_load(crawl_journal_ctx),
+                (
+                        ('http://e58.ru/0/', 'http://e58.ru/2/', 'http://e58.ru/4/'),
+                        tuple('http://e58.ru/{}/'.format(url_i) for url_i in range(5)),
+                        ),
+                )
+        
+        # finished url is pending again
+        crawl_journal.crawl_journal_reschedule(crawl_journal_ctx, ('http://e58.ru/3/',))
+        
+        self.assertEqual(
+                crawl_journal.crawl_journal_load(crawl_journal_ctx)[0],
+                ('http://e58.ru/0/', 'http://e58.ru/2/', 'http://e58.ru/3/', 'http://e58.ru/4/'),
+                )
+        
+        crawl_journal.crawl_journal_close(crawl_journal_ctx)
+        
+        # not resumed crawl starts from clean journal
+        crawl_journal_ctx = self.open_journal(False)
+        
+        self.assertEqual(crawl_journal.crawl_journal_load(crawl_journal_ctx), ((), ()))
+        
+        crawl_journal.crawl_journal_close(crawl_journal_ctx)
+    
+    def test_flush_without_close(self):
+        # journal of killed crawl has everything flushed before kill
+        
+        crawl_journal_ctx = self.open_journal(False)
+        crawl_journal.crawl_journal_scheduled(crawl_journal_ctx, 'http://e58.ru/0/')
+        crawl_journal.crawl_journal_flush(crawl_journal_ctx)
+        
+        other_crawl_journal_ctx = self.open_journal(True)
+        
+        self.assertEqual(
+                crawl_journal.crawl_journal_load(other_crawl_journal_ctx)[0],
+                ('http://e58.ru/0/',),
+                )
+        
+        crawl_journal.crawl_journal_close(other_crawl_journal_ctx)
+        crawl_journal.crawl_journal_close(crawl_journal_ctx)
+
+class ResumeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                cls.synthetic_site_ctx,
+                rubric_count=2,
+                page_depth=3,
+                firm_count=60,
+                latency=0.02,
+                )
+        cls.site_url = synthetic_site.synthetic_site_start(cls.synthetic_site_ctx)
+    
+    @classmethod
+    def tearDownClass(cls):
+        synthetic_site.synthetic_site_stop(cls.synthetic_site_ctx)
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def start(self, out_path, *arg_list):
+        return subprocess.Popen(
+                (
+                        sys.executable,
+                        E58_FETCH,
+                        '--site-url', self.site_url,
+                        '--parser', 'htmlparser',
+                        '--concurrency', '2',
+                        '--max-concurrency', '2',
+                        '--batch-size', '2',
+                        '--batch-time', '0.05',
+                        ) + arg_list + (out_path,),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                )
+    
+    def run_crawl(self, out_path, *arg_list):
+        self.assertEqual(self.start(out_path, *arg_list).wait(CRAWL_TIMEOUT), 0)
+    
+    def read(self, out_path):
+        return list(out_sink.read_record_iter('csv', out_path, e58_fetch.FIRM_FIELD_LIST))
+    
+    def test_resume(self):
+        full_path = os.path.join(self.tmp_dir.name, 'full.csv')
+        out_path = os.path.join(self.tmp_dir.name, 'out.csv')
+        
+        self.run_crawl(full_path)
+        
+        proc = self.start(out_path)
+        
+        try:
+            begin_time = time.monotonic()
+            
+            while len(out_sink.read_url_set('csv', out_path)) < KILL_RECORD_COUNT:
+                self.assertIsNone(proc.poll(), 'crawl is over before kill')
+                self.assertLess(time.monotonic() - begin_time, CRAWL_TIMEOUT)
+                
+                time.sleep(0.01)
+        finally:
+            proc.kill()
+            proc.wait()
+        
+        self.assertLess(len(self.read(out_path)), len(self.read(full_path)))
+        
+        self.run_crawl(out_path, '--resume')
+        
+        record_list = self.read(out_path)
+        
+        self.assertEqual(
+                len(record_list),
+                synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                )
+        self.assertEqual(sorted(record_list), sorted(self.read(full_path)))
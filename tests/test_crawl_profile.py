@@ -0,0 +1,243 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# crawl profile -- timers of extraction steps, sampled pages, slowest
+# pages, and summary and collapsed stacks of ``--profile``
+
+import os
+import tempfile
+import threading
+import unittest
+from lib_e58_fetch_2013_08_19 import crawl_profile
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+CRAWL_TIMEOUT = 60.0
+
+def get_synthetic_site_ctx():
+    synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+    synthetic_site.init_synthetic_site(
+            synthetic_site_ctx,
+            rubric_count=2,
+            page_depth=2,
+            firm_count=20,
+            )
+    
+    return synthetic_site_ctx
+
+def open_profile(sample_interval=0, slow_page_count=None):
+    crawl_profile_ctx = crawl_profile.CrawlProfileCtx()
+    crawl_profile.init_crawl_profile(
+            crawl_profile_ctx,
+            sample_interval=sample_interval,
+            slow_page_count=slow_page_count,
+            )
+    
+    return crawl_profile_ctx
+
+def add_page(crawl_profile_ctx, page_url, page_time, timer_map, size=None):
+    profile_map = crawl_profile.crawl_profile_begin(crawl_profile_ctx)
+    profile_map['size'] = size
+    
+    for timer_name, duration in timer_map.items():
+        crawl_profile.profile_map_add(profile_map, timer_name, duration)
+    
+    crawl_profile.crawl_profile_page(
+            crawl_profile_ctx,
+            page_url,
+            {'parse': page_time},
+            profile_map,
+            )
+
+class CrawlProfileTest(unittest.TestCase):
+    def test_disabled(self):
+        self.assertIsNone(crawl_profile.crawl_profile_begin(None))
+    
+    def test_sample_interval(self):
+        crawl_profile_ctx = open_profile(sample_interval=3)
+        
+        self.assertEqual(
+                [
+                        crawl_profile.crawl_profile_begin(crawl_profile_ctx)['is_sample']
+                        for page_i in range(6)
+                        ],
+                [False, False, True, False, False, True],
+                )
+        
+        crawl_profile_ctx = open_profile()
+        
+        self.assertFalse(any(
+                crawl_profile.crawl_profile_begin(crawl_profile_ctx)['is_sample']
+                for page_i in range(6)
+                ))
+    
+    def test_timers(self):
+        crawl_profile_ctx = open_profile(slow_page_count=2)
+        
+        add_page(crawl_profile_ctx, 'http://e58.ru/1/', 0.3, {'extract;find': 0.1}, size=100)
+        add_page(crawl_profile_ctx, 'http://e58.ru/2/', 0.1, {'extract;find': 0.2})
+        add_page(crawl_profile_ctx, 'http://e58.ru/3/', 0.2, {})
+        
+        self.assertEqual(crawl_profile_ctx.page_count, 3)
+        
+        for timer_name, (count, total, max_duration) in (
+                ('parse', (3, 0.6, 0.3)),
+                ('extract;find', (2, 0.3, 0.2)),
+                ):
+            with self.subTest(timer_name=timer_name):
+                timer = crawl_profile_ctx.timer_map[timer_name]
+                
+                self.assertEqual(timer[0], count)
+                self.assertAlmostEqual(timer[1], total)
+                self.assertAlmostEqual(timer[2], max_duration)
+        
+        # two slowest pages, slowest first
+        summary = crawl_profile.format_summary(crawl_profile_ctx)
+        slow_part = summary.partition('slowest pages')[2]
+        
+        self.assertIn('http://e58.ru/1/', slow_part)
+        self.assertIn('http://e58.ru/3/', slow_part)
+        self.assertNotIn('http://e58.ru/2/', slow_part)
+        self.assertLess(slow_part.index('/1/'), slow_part.index('/3/'))
+        self.assertIn('100', slow_part.partition('/1/')[0])
+        
+        # timers by total time
+        self.assertLess(summary.index('  parse\n'), summary.index('  extract;find\n'))
+    
+    def test_collapsed(self):
+        # weight of step is its time without sub-steps
+        
+        crawl_profile_ctx = open_profile()
+        
+        add_page(crawl_profile_ctx, 'http://e58.ru/1/', 0.5, {
+                'parse;fallback': 0.25,
+                'extract': 0.5,
+                'extract;find': 0.25,
+                'extract;field.title': 0.125,
+                })
+        
+        self.assertEqual(
+                crawl_profile.format_collapsed(crawl_profile_ctx),
+                'page;extract 125000\n'
+                'page;extract;field.title 125000\n'
+                'page;extract;find 250000\n'
+                'page;parse 250000\n'
+                'page;parse;fallback 250000\n',
+                )
+    
+    def test_sample(self):
+        # sampled page has cProfile and memory peak, but no timers
+        
+        crawl_profile_ctx = open_profile(sample_interval=1)
+        synthetic_site_ctx = get_synthetic_site_ctx()
+        raw_html = synthetic_site.get_page(synthetic_site_ctx, '/firm/1/').encode('utf-8')
+        
+        link_url_list, fetch_data, timing_map = e58_fetch.extract_page_raw_timed(
+                'http://e58.ru/firm/1/',
+                raw_html,
+                parser_name='html5lib',
+                profile_map=crawl_profile.crawl_profile_begin(crawl_profile_ctx),
+                )
+        profile_map = timing_map.pop('profile_map')
+        
+        self.assertTrue(fetch_data['title'])
+        self.assertIn('cprofile_stats', profile_map)
+        self.assertGreater(profile_map['memory_peak'], 0)
+        self.assertEqual(set(profile_map['selector_map']), set(e58_fetch.PAGE_CHAIN_MAP))
+        
+        crawl_profile.crawl_profile_page(
+                crawl_profile_ctx,
+                'http://e58.ru/firm/1/',
+                timing_map,
+                profile_map,
+                )
+        
+        self.assertEqual(crawl_profile_ctx.sample_count, 1)
+        self.assertEqual(crawl_profile_ctx.timer_map, {})
+        self.assertEqual(crawl_profile_ctx.slow_page_heap, [])
+        
+        summary = crawl_profile.format_summary(crawl_profile_ctx)
+        
+        self.assertIn('memory peak of sampled page', summary)
+        self.assertIn('cProfile of sampled pages', summary)
+        self.assertIn('  title\n', summary)
+    
+    def test_extract_timers(self):
+        synthetic_site_ctx = get_synthetic_site_ctx()
+        
+        for parser_name, path, timer_name in (
+                ('html5lib', '/firm/1/', 'extract;field.title'),
+                ('html5lib', '/firms/rubric/1/', 'parse;scan'),
+                ('htmlparser', '/firm/1/', 'extract;find'),
+                ):
+            with self.subTest(parser_name=parser_name, path=path):
+                profile_map = crawl_profile.new_profile_map()
+                
+                e58_fetch.extract_page(
+                        'http://e58.ru' + path,
+                        synthetic_site.get_page(synthetic_site_ctx, path),
+                        parser_name=parser_name,
+                        profile_map=profile_map,
+                        )
+                
+                self.assertIn(timer_name, profile_map['timer_map'])
+                self.assertIn('extract;links', profile_map['timer_map'])
+
+class ProfiledCrawlTest(unittest.TestCase):
+    def test_crawl(self):
+        synthetic_site_ctx = get_synthetic_site_ctx()
+        site_url = synthetic_site.synthetic_site_start(synthetic_site_ctx)
+        crawl_profile_ctx = open_profile(sample_interval=5)
+        
+        try:
+            bulk_data_ctx = e58_fetch.BulkDataCtx()
+            e58_fetch.init_bulk_data_ctx(
+                    bulk_data_ctx,
+                    site_url=site_url,
+                    crawl_profile_ctx=crawl_profile_ctx,
+                    )
+            done_event = threading.Event()
+            
+            e58_fetch.bulk_data_fetch(
+                    bulk_data_ctx,
+                    thread_count=4,
+                    on_done=done_event.set,
+                    )
+            
+            self.assertTrue(done_event.wait(CRAWL_TIMEOUT))
+        finally:
+            synthetic_site.synthetic_site_stop(synthetic_site_ctx)
+        
+        self.assertEqual(crawl_profile_ctx.page_count, synthetic_site_ctx.request_count)
+        self.assertEqual(
+                crawl_profile_ctx.sample_count,
+                crawl_profile_ctx.page_count // 5,
+                )
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_path = os.path.join(tmp_dir, 'profile.txt')
+            crawl_profile.crawl_profile_write(crawl_profile_ctx, profile_path)
+            
+            with open(profile_path, 'r', encoding='utf-8') as fd:
+                self.assertTrue(fd.read().startswith('pages: {}, sampled: {}\n'.format(
+                        crawl_profile_ctx.page_count, crawl_profile_ctx.sample_count)))
+            
+            with open(profile_path + crawl_profile.COLLAPSED_SUFFIX, 'r', encoding='utf-8') as fd:
+                for line in fd:
+                    self.assertRegex(line, r'^page;\S+ \d+$')
@@ -0,0 +1,170 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# crawl stats -- counters, histograms of stages, snapshot files, and
+# stats of crawl on the synthetic site of benchmarks
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from lib_e58_fetch_2013_08_19 import crawl_stats
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+CRAWL_TIMEOUT = 60.0
+
+class CrawlStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.crawl_stats_ctx = crawl_stats.CrawlStatsCtx()
+        crawl_stats.init_crawl_stats(self.crawl_stats_ctx)
+    
+    def test_none(self):
+        # instrumented code needs no checks
+        
+        crawl_stats.crawl_stats_observe(None, 'fetch', 0.1)
+        crawl_stats.crawl_stats_observe_map(None, {'parse': 0.1})
+        crawl_stats.crawl_stats_add(None, 'page')
+        crawl_stats.crawl_stats_error(None, ValueError)
+    
+    def test_counters(self):
+        crawl_stats.crawl_stats_add(self.crawl_stats_ctx, 'page')
+        crawl_stats.crawl_stats_add(self.crawl_stats_ctx, 'page')
+        crawl_stats.crawl_stats_add(self.crawl_stats_ctx, 'byte', 1000)
+        crawl_stats.crawl_stats_error(self.crawl_stats_ctx, ValueError)
+        crawl_stats.crawl_stats_error(self.crawl_stats_ctx, 'timeout')
+        
+        snapshot = crawl_stats.crawl_stats_snapshot(self.crawl_stats_ctx)
+        
+        self.assertEqual(snapshot['counter_map']['page'], 2)
+        self.assertEqual(snapshot['counter_map']['byte'], 1000)
+        self.assertEqual(snapshot['counter_map']['error'], 2)
+        self.assertEqual(snapshot['error_type_map'], {'ValueError': 1, 'timeout': 1})
+        self.assertAlmostEqual(snapshot['error_rate'], 0.5)
+        self.assertNotIn('frontier_depth', snapshot)
+        
+        # recent rate is for time since previous snapshot
+        snapshot = crawl_stats.crawl_stats_snapshot(self.crawl_stats_ctx)
+        
+        self.assertEqual(snapshot['recent_page_rate'], 0.0)
+        self.assertGreater(snapshot['page_rate'], 0.0)
+    
+    def test_histogram(self):
+        crawl_stats.crawl_stats_observe_map(self.crawl_stats_ctx, {
+                'fetch': 0.001,
+                'parse': 0.003,
+                })
+        crawl_stats.crawl_stats_observe(self.crawl_stats_ctx, 'fetch', 100.0)
+        
+        histogram_map = crawl_stats.crawl_stats_snapshot(self.crawl_stats_ctx)['histogram_map']
+        
+        self.assertEqual(histogram_map['fetch']['bucket_list'][0], 1)
+        self.assertEqual(histogram_map['fetch']['bucket_list'][-1], 1)
+        self.assertEqual(histogram_map['parse']['bucket_list'][2], 1)
+        self.assertEqual(histogram_map['fetch']['count'], 2)
+        self.assertAlmostEqual(histogram_map['fetch']['sum'], 100.001)
+        self.assertEqual(histogram_map['write']['count'], 0)
+    
+    def test_write_snapshot(self):
+        crawl_stats.crawl_stats_add(self.crawl_stats_ctx, 'page', 3)
+        crawl_stats.crawl_stats_observe(self.crawl_stats_ctx, 'fetch', 0.02)
+        crawl_stats.crawl_stats_observe(self.crawl_stats_ctx, 'fetch', 0.2)
+        crawl_stats.crawl_stats_error(self.crawl_stats_ctx, ValueError)
+        snapshot = crawl_stats.crawl_stats_snapshot(self.crawl_stats_ctx)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_path = os.path.join(tmp_dir, 'stats.json')
+            prom_path = os.path.join(tmp_dir, 'stats.prom')
+            
+            crawl_stats.write_snapshot(snapshot, json_path)
+            crawl_stats.write_snapshot(snapshot, prom_path)
+            
+            with open(json_path, 'r', encoding='utf-8') as fd:
+                json_snapshot = json.load(fd)
+            
+            with open(prom_path, 'r', encoding='utf-8') as fd:
+                prom_line_list = fd.read().splitlines()
+            
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['stats.json', 'stats.prom'])
+        
+        self.assertEqual(json_snapshot['counter_map']['page'], 3)
+        self.assertEqual(
+                json_snapshot['histogram_bound_list'],
+                list(crawl_stats.HISTOGRAM_BOUND_LIST),
+                )
+        
+        self.assertIn('e58_fetch_page_total 3', prom_line_list)
+        self.assertIn('e58_fetch_error_type_total{type="ValueError"} 1', prom_line_list)
+        
+        # buckets are cumulative
+        self.assertIn('e58_fetch_stage_seconds_bucket{stage="fetch",le="0.01"} 0', prom_line_list)
+        self.assertIn('e58_fetch_stage_seconds_bucket{stage="fetch",le="0.025"} 1', prom_line_list)
+        self.assertIn('e58_fetch_stage_seconds_bucket{stage="fetch",le="+Inf"} 2', prom_line_list)
+        self.assertIn('e58_fetch_stage_seconds_count{stage="fetch"} 2', prom_line_list)
+    
+    def test_format_progress(self):
+        crawl_stats.crawl_stats_add(self.crawl_stats_ctx, 'page', 5)
+        
+        progress = crawl_stats.format_progress(
+                crawl_stats.crawl_stats_snapshot(self.crawl_stats_ctx))
+        
+        self.assertIn('pages: 5', progress)
+        self.assertIn('frontier: -', progress)
+
+class CrawlStatsCrawlTest(unittest.TestCase):
+    def test_crawl(self):
+        synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                synthetic_site_ctx,
+                rubric_count=2,
+                page_depth=2,
+                firm_count=20,
+                )
+        site_url = synthetic_site.synthetic_site_start(synthetic_site_ctx)
+        
+        try:
+            crawl_stats_ctx = crawl_stats.CrawlStatsCtx()
+            crawl_stats.init_crawl_stats(crawl_stats_ctx)
+            bulk_data_ctx = e58_fetch.BulkDataCtx()
+            e58_fetch.init_bulk_data_ctx(
+                    bulk_data_ctx,
+                    site_url=site_url,
+                    crawl_stats_ctx=crawl_stats_ctx,
+                    )
+            done_event = threading.Event()
+            
+            e58_fetch.bulk_data_fetch(bulk_data_ctx, thread_count=4, on_done=done_event.set)
+            
+            self.assertTrue(done_event.wait(CRAWL_TIMEOUT))
+            
+            snapshot = crawl_stats.crawl_stats_snapshot(
+                    crawl_stats_ctx,
+                    bulk_data_ctx=bulk_data_ctx,
+                    )
+        finally:
+            synthetic_site.synthetic_site_stop(synthetic_site_ctx)
+        
+        self.assertEqual(snapshot['counter_map']['page'], synthetic_site_ctx.request_count)
+        self.assertEqual(snapshot['counter_map']['error'], 0)
+        self.assertGreater(snapshot['counter_map']['byte'], 0)
+        self.assertEqual(snapshot['histogram_map']['fetch']['count'], synthetic_site_ctx.request_count)
+        self.assertEqual(snapshot['histogram_map']['parse']['count'], synthetic_site_ctx.request_count)
+        self.assertEqual(snapshot['frontier_depth'], 0)
+        self.assertEqual(snapshot['in_flight'], 0)
@@ -0,0 +1,106 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# engine conformance -- asyncio engine (``e58_fetch_async``) must give
+# the same records as thread engine (``e58_fetch``) on the synthetic
+# site of benchmarks, and both must reach every firm of the site
+
+import threading
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import e58_fetch_async
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+RUBRIC_COUNT = 4
+PAGE_DEPTH = 3
+FIRM_COUNT = 120
+CONCURRENCY = 8
+CRAWL_TIMEOUT = 60.0
+
+def crawl(site_url, engine):
+    # returns ``(record_set, error_list)``. record is ``(firm_url,
+    # fetch_data_items)``
+    
+    bulk_data_ctx = e58_fetch.BulkDataCtx()
+    e58_fetch.init_bulk_data_ctx(bulk_data_ctx, site_url=site_url)
+    
+    lock = threading.Lock()
+    done_event = threading.Event()
+    record_set = set()
+    error_list = []
+    
+    def on_fetch(fetch_url, fetch_data):
+        with lock:
+            record_set.add((fetch_url, tuple(sorted(fetch_data.items()))))
+    
+    def on_error(fetch_url, error_type, error_str):
+        with lock:
+            error_list.append((fetch_url, error_type, error_str))
+    
+    if engine == 'asyncio':
+        e58_fetch_async.bulk_data_fetch_async(
+                bulk_data_ctx,
+                concurrency=CONCURRENCY,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=done_event.set,
+                )
+    else:
+        e58_fetch.bulk_data_fetch(
+                bulk_data_ctx,
+                thread_count=CONCURRENCY,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=done_event.set,
+                )
+    
+    if not done_event.wait(CRAWL_TIMEOUT):
+        e58_fetch.bulk_data_cancel(bulk_data_ctx)
+        
+        raise AssertionError('crawl of {} engine is not over'.format(engine))
+    
+    return record_set, error_list
+
+class EngineConformanceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                cls.synthetic_site_ctx,
+                rubric_count=RUBRIC_COUNT,
+                page_depth=PAGE_DEPTH,
+                firm_count=FIRM_COUNT,
+                )
+        cls.site_url = synthetic_site.synthetic_site_start(cls.synthetic_site_ctx)
+    
+    @classmethod
+    def tearDownClass(cls):
+        synthetic_site.synthetic_site_stop(cls.synthetic_site_ctx)
+    
+    def test_asyncio_as_thread(self):
+        thread_record_set, thread_error_list = crawl(self.site_url, 'thread')
+        async_record_set, async_error_list = crawl(self.site_url, 'asyncio')
+        
+        self.assertEqual(thread_error_list, [])
+        self.assertEqual(async_error_list, [])
+        self.assertEqual(
+                len(thread_record_set),
+                synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                )
+        self.assertEqual(async_record_set, thread_record_set)
@@ -0,0 +1,156 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# et find -- compiled ``et_find.find()`` and ``et_find.find_multi()``
+# must give the same elems as uncompiled search by
+# ``et_find.elem_condition_check()`` (``find()`` before compilation) on
+# pages of ``fixtures`` and on small trees with every kind of condition
+
+import os
+import unittest
+from xml.etree import ElementTree as et
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import et_find
+from lib_e58_fetch_2013_08_19 import html_parse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+TREE = (
+        '<root>'
+        '<div class="Firm info" id="a"><p class="x">1</p><span>2</span></div>'
+        '<DIV class="firminfo"><p class="y x">3</p><div id="b"><p>4</p></div></DIV>'
+        '<p class="X">5</p>'
+        '</root>'
+        )
+
+CONDITION_CHAIN_LIST = (
+        ({'tag': 'div'},),
+        ({'tag': 'div'}, {'tag': 'p'}),
+        ({'tag': 'div'}, {'tag': 'div'}),
+        ({'attrib': {'id': 'A'}}, {'tag': 'p'}),
+        ({'in_attrib': {'class': ('x',)}},),
+        ({'in_attrib': {'class': ('x', 'y')}},),
+        ({'in_attrib': {'class': ()}},),
+        ({'tag': 'div', 'in_attrib': {'class': ('info',)}}, {'tag': 'p'}),
+        ({'any': ({'tag': 'span'}, {'attrib': {'id': 'b'}})},),
+        ({'tag': 'p', 'not': {'in_attrib': {'class': ('x',)}}},),
+        ({'tag': 'div', 'not': {'any': ({'attrib': {'id': 'a'}}, {'attrib': {'id': 'b'}})}},),
+        ({'tag': 'table'}, {'tag': 'p'}),
+        ({'tag': 'p'}, {'tag': 'span'}),
+        )
+
+def reference_find(root_elem_list, condition_chain):
+    # ``find()`` before compilation
+    
+    candidate_list = []
+    
+    for root_elem in root_elem_list:
+        for elem in root_elem.iter():
+            if elem in candidate_list:
+                continue
+            
+            if et_find.elem_condition_check(elem, condition_chain[0]):
+                candidate_list.append(elem)
+    
+    if candidate_list and condition_chain[1:]:
+        return reference_find(candidate_list, condition_chain[1:])
+    
+    return tuple(candidate_list)
+
+def read_fixture_doc_map():
+    # ``{file_name: doc}``
+    
+    doc_map = {}
+    
+    for file_name in sorted(os.listdir(FIXTURE_DIR)):
+        if not file_name.endswith('.html'):
+            continue
+        
+        with open(os.path.join(FIXTURE_DIR, file_name), 'r', encoding='utf-8') as fd:
+            doc_map[file_name] = html_parse.parse(fd.read(), 'html5lib')
+    
+    return doc_map
+
+class FindTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.doc_map = read_fixture_doc_map()
+        cls.tree = et.fromstring(TREE)
+    
+    def test_tree(self):
+        for condition_chain in CONDITION_CHAIN_LIST:
+            with self.subTest(condition_chain=condition_chain):
+                self.assertEqual(
+                        et_find.find((self.tree,), condition_chain),
+                        reference_find((self.tree,), condition_chain),
+                        )
+    
+    def test_nested_roots(self):
+        # elem under two roots is found once
+        
+        root_elem_list = (self.tree,) + tuple(self.tree.iter('DIV'))
+        
+        self.assertEqual(
+                et_find.find(root_elem_list, ({'tag': 'p'},)),
+                reference_find(root_elem_list, ({'tag': 'p'},)),
+                )
+        self.assertEqual(len(et_find.find(root_elem_list, ({'tag': 'p'},))), 4)
+    
+    def test_fixtures(self):
+        for file_name, doc in self.doc_map.items():
+            for chain_name, condition_chain in e58_fetch.PAGE_CHAIN_MAP.items():
+                with self.subTest(file_name=file_name, chain_name=chain_name):
+                    self.assertEqual(
+                            et_find.find((doc,), condition_chain),
+                            reference_find((doc,), condition_chain),
+                            )
+    
+    def test_find_multi(self):
+        condition_chain_map = dict(enumerate(CONDITION_CHAIN_LIST))
+        
+        self.assertEqual(
+                et_find.find_multi((self.tree,), condition_chain_map),
+                dict(
+                        (name, et_find.find((self.tree,), condition_chain))
+                        for name, condition_chain in condition_chain_map.items()
+                        ),
+                )
+        
+        for file_name, doc in self.doc_map.items():
+            with self.subTest(file_name=file_name):
+                self.assertEqual(
+                        et_find.find_multi((doc,), e58_fetch.PAGE_CHAIN_MAP),
+                        dict(
+                                (chain_name, reference_find((doc,), condition_chain))
+                                for chain_name, condition_chain
+                                in e58_fetch.PAGE_CHAIN_MAP.items()
+                                ),
+                        )
+    
+    def test_empty_chain(self):
+        # empty chain finds roots (uncompiled ``find()`` raised
+        # ``IndexError``)
+        
+        self.assertEqual(et_find.find((self.tree,), ()), (self.tree,))
+    
+    def test_cache(self):
+        condition_chain = ({'tag': 'p'},)
+        compiled_chain = et_find.get_compiled_condition_chain(condition_chain)
+        
+        self.assertIs(et_find.get_compiled_condition_chain(condition_chain), compiled_chain)
@@ -0,0 +1,132 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# extraction -- one ``et_find.find_multi()`` pass over firm page
+# (``e58_fetch.extract_page_elems()``) must give the same record as
+# search of every field on its own, and known record of ``firm.html``
+
+import os
+import unittest
+from urllib import parse as url
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import et_find
+from lib_e58_fetch_2013_08_19 import html_parse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURE_URL = 'http://e58.ru/firm/101/'
+
+FIRM_FETCH_DATA = {
+        'title': 'ООО «Ромашка» (автосервис)',
+        'director': 'Директор: Петров\xa0Пётр Петрович',
+        'uaddress': '440000, г. Пенза, ул. Кирова, д. 14',
+        'address': '\n | г. Пенза, ул. Кирова, 14 | на карте | '
+                'г. Пенза, ул. Московская, 2 & 4',
+        'phone': '/phone/101-1.png | /phone/101-2.png',
+        'email': 'info@romashka.ru',
+        'www': 'romashka.ru',
+        'work': 'ремонт автомобилей, шиномонтаж,\n  продажа запчастей',
+        'rubriks': 'Автосервис , Шиномонтаж',
+        }
+
+def read_fixture(file_name):
+    with open(os.path.join(FIXTURE_DIR, file_name), 'r', encoding='utf-8') as fd:
+        return fd.read()
+
+def reference_extract(fetch_url, doc):
+    # search of every chain on its own
+    
+    link_url_list = []
+    
+    for link_name, condition_chain in e58_fetch.LINK_CHAIN_MAP.items():
+        for link_elem in et_find.find((doc,), condition_chain):
+            if link_elem.get('href') is not None:
+                link_url_list.append(url.urljoin(fetch_url, link_elem.get('href')))
+    
+    fetch_data = dict(
+            (field_name, join(et_find.find((doc,), condition_chain)))
+            for field_name, condition_chain, join in e58_fetch.FIRM_FIELD_SCHEMA
+            )
+    
+    if not fetch_data['title']:
+        return link_url_list, None
+    
+    return link_url_list, fetch_data
+
+class ExtractTest(unittest.TestCase):
+    def test_firm(self):
+        link_url_list, fetch_data = e58_fetch.extract_page(
+                FIXTURE_URL,
+                read_fixture('firm.html'),
+                parser_name='html5lib',
+                )
+        
+        self.assertEqual(fetch_data, FIRM_FETCH_DATA)
+        self.assertEqual(tuple(fetch_data), e58_fetch.FIRM_FIELD_LIST)
+        self.assertEqual(link_url_list, ['http://e58.ru/firms/rubric/1/'])
+    
+    def test_firm_list(self):
+        link_url_list, fetch_data = e58_fetch.extract_page(
+                FIXTURE_URL,
+                read_fixture('firm_list.html'),
+                parser_name='html5lib',
+                )
+        
+        self.assertIsNone(fetch_data)
+        self.assertIn('http://e58.ru/firm/101/', link_url_list)
+        self.assertIn('http://e58.ru/firms/?page=2', link_url_list)
+    
+    def test_as_reference(self):
+        for file_name in sorted(os.listdir(FIXTURE_DIR)):
+            if not file_name.endswith('.html'):
+                continue
+            
+            with self.subTest(file_name=file_name):
+                doc = html_parse.parse(read_fixture(file_name), 'html5lib')
+                
+                self.assertEqual(
+                        e58_fetch.extract_page_elems(
+                                FIXTURE_URL,
+                                e58_fetch.find_page_chains(doc),
+                                ),
+                        reference_extract(FIXTURE_URL, doc),
+                        )
+    
+    def test_join(self):
+        doc = html_parse.parse(
+                '<div class="work"><b>Деятельность:</b> a <i>b</i></div>'
+                '<div class="work">c</div>'
+                '<img src="1.png"><img><img src="2.png">',
+                'html5lib',
+                )
+        work_elem_list = tuple(
+                elem for elem in doc.iter()
+                if elem.get('class') == 'work'
+                )
+        img_elem_list = tuple(
+                elem for elem in doc.iter()
+                if elem.tag == '{http://www.w3.org/1999/xhtml}img'
+                )
+        
+        self.assertEqual(e58_fetch.join_itertext(work_elem_list), 'Деятельность: a b | c')
+        self.assertEqual(
+                e58_fetch.join_itertext_without_label('Деятельность:')(work_elem_list),
+                'a b | c',
+                )
+        self.assertEqual(e58_fetch.join_text(work_elem_list), 'c')
+        self.assertEqual(e58_fetch.join_attrib('src')(img_elem_list), '1.png | 2.png')
@@ -0,0 +1,185 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# firm delta -- added, changed and removed firms between runs, and
+# firms which are kept when crawl is not complete
+
+import os
+import tempfile
+import unittest
+from lib_e58_fetch_2013_08_19 import firm_delta
+
+def get_fetch_data(title):
+    return {'title': title, 'phone': '/phone/1.png'}
+
+class FirmDeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmp_dir.name, 'out.csv.state')
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def run_delta(self, record_map, error_url_list=(), is_partial=False):
+        # one run. returns ``(change_map, removed_list)``
+        
+        firm_delta_ctx = firm_delta.FirmDeltaCtx()
+        firm_delta.init_firm_delta(firm_delta_ctx, self.state_path, is_partial=is_partial)
+        
+        change_map = dict(
+                (firm_url, firm_delta.firm_delta_fetch(firm_delta_ctx, firm_url, fetch_data))
+                for firm_url, fetch_data in record_map.items()
+                )
+        
+        for error_url in error_url_list:
+            firm_delta.firm_delta_error(firm_delta_ctx, error_url)
+        
+        removed_list = firm_delta.firm_delta_removed_list(firm_delta_ctx)
+        firm_delta.firm_delta_commit(firm_delta_ctx)
+        firm_delta.firm_delta_close(firm_delta_ctx)
+        
+        return change_map, removed_list
+    
+    def run_first(self):
+        change_map, removed_list = self.run_delta({
+                'http://e58.ru/firm/1/': get_fetch_data('a'),
+                'http://e58.ru/firm/2/': get_fetch_data('b'),
+                'http://e58.ru/firm/3/': get_fetch_data('c'),
+                })
+        
+        self.assertEqual(set(change_map.values()), set((firm_delta.CHANGE_ADDED,)))
+        self.assertEqual(removed_list, [])
+    
+    def test_changes(self):
+        self.run_first()
+        
+        change_map, removed_list = self.run_delta({
+                'http://e58.ru/firm/1/': get_fetch_data('a'),
+                'http://e58.ru/firm/2/': get_fetch_data('b2'),
+                'http://e58.ru/firm/4/': get_fetch_data('d'),
+                })
+        
+        self.assertEqual(change_map, {
+                'http://e58.ru/firm/1/': None,
+                'http://e58.ru/firm/2/': firm_delta.CHANGE_CHANGED,
+                'http://e58.ru/firm/4/': firm_delta.CHANGE_ADDED,
+                })
+        self.assertEqual(removed_list, ['http://e58.ru/firm/3/'])
+        
+        # state is replaced by this run
+        change_map, removed_list = self.run_delta({
+                'http://e58.ru/firm/2/': get_fetch_data('b2'),
+                'http://e58.ru/firm/3/': get_fetch_data('c'),
+                'http://e58.ru/firm/4/': get_fetch_data('d'),
+                })
+        
+        self.assertEqual(change_map, {
+                'http://e58.ru/firm/2/': None,
+                'http://e58.ru/firm/3/': firm_delta.CHANGE_ADDED,
+                'http://e58.ru/firm/4/': None,
+                })
+        self.assertEqual(removed_list, ['http://e58.ru/firm/1/'])
+    
+    def test_failed_firm(self):
+        # failed firm is not removed and keeps its hash
+        
+        self.run_first()
+        
+        change_map, removed_list = self.run_delta(
+                {'http://e58.ru/firm/1/': get_fetch_data('a')},
+                error_url_list=('http://e58.ru/firm/2/',),
+                )
+        
+        self.assertEqual(removed_list, ['http://e58.ru/firm/3/'])
+        
+        change_map, removed_list = self.run_delta({
+                'http://e58.ru/firm/1/': get_fetch_data('a'),
+                'http://e58.ru/firm/2/': get_fetch_data('b'),
+                })
+        
+        self.assertEqual(change_map['http://e58.ru/firm/2/'], None)
+        self.assertEqual(removed_list, [])
+    
+    def test_failed_listing(self):
+        # firms behind failed page are unknown: nothing is removed, and
+        # firms which are not visited keep their hashes
+        
+        self.run_first()
+        
+        change_map, removed_list = self.run_delta(
+                {'http://e58.ru/firm/1/': get_fetch_data('a2')},
+                error_url_list=('http://e58.ru/firms/rubric/1/',),
+                )
+        
+        self.assertEqual(change_map, {'http://e58.ru/firm/1/': firm_delta.CHANGE_CHANGED})
+        self.assertEqual(removed_list, [])
+        
+        change_map, removed_list = self.run_delta({
+                'http://e58.ru/firm/1/': get_fetch_data('a2'),
+                'http://e58.ru/firm/2/': get_fetch_data('b'),
+                })
+        
+        self.assertEqual(change_map, {
+                'http://e58.ru/firm/1/': None,
+                'http://e58.ru/firm/2/': None,
+                })
+        self.assertEqual(removed_list, ['http://e58.ru/firm/3/'])
+    
+    def test_partial(self):
+        # partial crawl (seeded by ids or urls) removes nothing, and firms
+        # which are not visited keep their hashes
+        
+        self.run_first()
+        
+        change_map, removed_list = self.run_delta(
+                {
+                        'http://e58.ru/firm/1/': get_fetch_data('a2'),
+                        'http://e58.ru/firm/5/': get_fetch_data('e'),
+                        },
+                is_partial=True,
+                )
+        
+        self.assertEqual(change_map, {
+                'http://e58.ru/firm/1/': firm_delta.CHANGE_CHANGED,
+                'http://e58.ru/firm/5/': firm_delta.CHANGE_ADDED,
+                })
+        self.assertEqual(removed_list, [])
+        
+        change_map, removed_list = self.run_delta({
+                'http://e58.ru/firm/1/': get_fetch_data('a2'),
+                'http://e58.ru/firm/2/': get_fetch_data('b'),
+                'http://e58.ru/firm/5/': get_fetch_data('e'),
+                })
+        
+        self.assertEqual(change_map, {
+                'http://e58.ru/firm/1/': None,
+                'http://e58.ru/firm/2/': None,
+                'http://e58.ru/firm/5/': None,
+                })
+        self.assertEqual(removed_list, ['http://e58.ru/firm/3/'])
+    
+    def test_record_hash(self):
+        self.assertEqual(
+                firm_delta.get_record_hash({'title': 'a', 'phone': 'b'}),
+                firm_delta.get_record_hash({'phone': 'b', 'title': 'a'}),
+                )
+        self.assertNotEqual(
+                firm_delta.get_record_hash({'title': 'a', 'phone': 'b'}),
+                firm_delta.get_record_hash({'title': 'a', 'phone': 'c'}),
+                )
@@ -0,0 +1,277 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# firm index -- queries of full text index (``firm_index``), its update
+# by records of new crawls, and ``e58-fetch-index`` / ``e58-fetch-query``
+
+import contextlib
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import firm_index
+from lib_e58_fetch_2013_08_19 import main
+from lib_e58_fetch_2013_08_19 import out_sink
+
+def get_fetch_data(**field_map):
+    fetch_data = dict(
+            (field_name, '')
+            for field_name in e58_fetch.FIRM_FIELD_LIST
+            )
+    fetch_data.update(field_map)
+    
+    return fetch_data
+
+RECORD_LIST = (
+        ('http://e58.ru/firm/1/', get_fetch_data(
+                title='ООО Ромашка',
+                rubriks='Автосервис',
+                work='ремонт автомобилей, шиномонтаж',
+                address='Пенза, ул. Кирова, 14',
+                www='www.romashka.ru',
+                )),
+        ('http://e58.ru/firm/2/', get_fetch_data(
+                title='Строй & Ко',
+                rubriks='Строительство',
+                work='строительство домов',
+                address='Пенза, ул. Московская, 1',
+                www='stroy.example.com',
+                )),
+        ('http://e58.ru/firm/3/', get_fetch_data(
+                title='Шиномонтаж на Кирова',
+                rubriks='Автосервис',
+                work='шиномонтаж',
+                address='Заречный, ул. Ленина, 5',
+                phone='/ph/12.png',
+                )),
+        )
+
+class FirmIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmp_dir.name, 'index.db')
+        self.firm_index_ctx = self.open_index()
+        firm_index.firm_index_update(self.firm_index_ctx, RECORD_LIST)
+    
+    def tearDown(self):
+        firm_index.firm_index_close(self.firm_index_ctx)
+        self.tmp_dir.cleanup()
+    
+    def open_index(self, field_list=e58_fetch.FIRM_FIELD_LIST):
+        firm_index_ctx = firm_index.FirmIndexCtx()
+        firm_index.init_firm_index(firm_index_ctx, self.index_path, field_list)
+        
+        return firm_index_ctx
+    
+    def query(self, text=None, field_map=None, limit=None):
+        # returns urls of found firms
+        
+        return [
+                record_url
+                for record_url, fetch_data in firm_index.firm_index_query(
+                        self.firm_index_ctx,
+                        firm_index.build_match(text=text, field_map=field_map),
+                        limit=limit,
+                        )
+                ]
+    
+    def test_query(self):
+        for text, field_map, url_set in (
+                ('шиномонтаж', None, {'/1/', '/3/'}),
+                ('ШИНОМОНТАЖ', None, {'/1/', '/3/'}),
+                ('шиномонтаж NOT Ромашка', None, {'/3/'}),
+                ('кирова', None, {'/1/', '/3/'}),
+                (None, {'address': 'ул. Кирова'}, {'/1/'}),
+                ('шиномонтаж', {'rubriks': 'Автосервис'}, {'/1/', '/3/'}),
+                (None, {'title': 'строй'}, {'/2/'}),
+                (None, {'title': 'стро*'}, {'/2/'}),
+                (None, {'www': 'romashka ru'}, {'/1/'}),
+                (None, {'phone': '12'}, {'/3/'}),
+                ('Пенза', {'rubriks': 'Автосервис'}, {'/1/'}),
+                ('нет', None, set()),
+                ):
+            with self.subTest(text=text, field_map=field_map):
+                self.assertEqual(
+                        set(self.query(text=text, field_map=field_map)),
+                        set('http://e58.ru/firm{}'.format(url_path) for url_path in url_set),
+                        )
+    
+    def test_query_record(self):
+        self.assertEqual(
+                firm_index.firm_index_query(
+                        self.firm_index_ctx,
+                        firm_index.build_match(field_map={'title': 'Строй & Ко'}),
+                        ),
+                [RECORD_LIST[1]],
+                )
+        
+        # the best match first
+        self.assertEqual(self.query(text='шиномонтаж', limit=1), ['http://e58.ru/firm/3/'])
+    
+    def test_invalid_query(self):
+        with self.assertRaisesRegex(firm_index.FirmIndexError, 'invalid query'):
+            self.query(text='"unclosed')
+        
+        with self.assertRaisesRegex(firm_index.FirmIndexError, 'not indexed'):
+            self.query(field_map={'director': 'Иванов'})
+        
+        # quotes of field text are not query syntax
+        self.assertEqual(self.query(field_map={'title': '"Ромашка'}), ['http://e58.ru/firm/1/'])
+    
+    def test_update(self):
+        changed_fetch_data = dict(RECORD_LIST[0][1])
+        changed_fetch_data['work'] = 'мойка'
+        
+        self.assertEqual(
+                firm_index.firm_index_update(self.firm_index_ctx, (
+                        (RECORD_LIST[0][0], changed_fetch_data),
+                        RECORD_LIST[1],
+                        ('http://e58.ru/firm/4/', get_fetch_data(title='Новая')),
+                        )),
+                {'added': 1, 'changed': 1, 'unchanged': 1, 'removed': 0},
+                )
+        
+        # full text index follows changed record
+        self.assertEqual(self.query(text='шиномонтаж'), ['http://e58.ru/firm/3/'])
+        self.assertEqual(self.query(text='мойка'), ['http://e58.ru/firm/1/'])
+        self.assertEqual(firm_index.firm_index_count(self.firm_index_ctx), 4)
+        
+        self.assertEqual(
+                firm_index.firm_index_update(
+                        self.firm_index_ctx,
+                        RECORD_LIST[1:],
+                        is_prune=True,
+                        ),
+                {'added': 0, 'changed': 0, 'unchanged': 2, 'removed': 2},
+                )
+        self.assertEqual(self.query(text='мойка OR Новая'), [])
+        self.assertEqual(firm_index.firm_index_count(self.firm_index_ctx), 2)
+    
+    def test_update_batches(self):
+        record_list = [
+                ('http://e58.ru/firm/{}/'.format(url_i), get_fetch_data(
+                        title='Фирма {}'.format(url_i)))
+                for url_i in range(firm_index.BATCH_SIZE + 10)
+                ]
+        
+        # the same url twice: the last record wins
+        record_list.append((record_list[0][0], get_fetch_data(title='Другая')))
+        
+        count_map = firm_index.firm_index_update(self.firm_index_ctx, record_list)
+        
+        self.assertEqual(count_map['added'] + count_map['changed'], len(record_list))
+        self.assertEqual(
+                firm_index.firm_index_count(self.firm_index_ctx),
+                len(record_list) - 1,
+                )
+        self.assertEqual(self.query(text='Другая'), ['http://e58.ru/firm/0/'])
+    
+    def test_other_fields(self):
+        with self.assertRaisesRegex(firm_index.FirmIndexError, 'other fields'):
+            self.open_index(field_list=e58_fetch.FIRM_FIELD_LIST + ('extra',))
+
+class IndexMainTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmp_dir.name, 'index.db')
+        self.in_path = os.path.join(self.tmp_dir.name, 'out.jsonl')
+        
+        out_sink_ctx = out_sink.OutSinkCtx()
+        out_sink.init_out_sink(
+                out_sink_ctx,
+                'jsonl',
+                self.in_path,
+                e58_fetch.FIRM_FIELD_LIST,
+                )
+        
+        for record_url, fetch_data in RECORD_LIST:
+            out_sink.out_sink_put(out_sink_ctx, record_url, fetch_data)
+        
+        out_sink.out_sink_close(out_sink_ctx)
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def run_main(self, main_func, argv):
+        # returns standard output
+        
+        stdout = io.StringIO()
+        
+        with contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(io.StringIO()):
+            main_func(argv)
+        
+        return stdout.getvalue()
+    
+    def test_index_and_query(self):
+        self.assertIn(
+                '3 added',
+                self.run_main(
+                        main.index_main,
+                        ['--format', 'jsonl', self.index_path, self.in_path],
+                        ),
+                )
+        self.assertIn(
+                '3 unchanged',
+                self.run_main(
+                        main.index_main,
+                        ['--format', 'jsonl', self.index_path, self.in_path],
+                        ),
+                )
+        
+        row_list = list(csv.reader(io.StringIO(self.run_main(
+                main.query_main,
+                [self.index_path, 'шиномонтаж', '--address', 'Кирова'],
+                ))))
+        
+        self.assertEqual(row_list[0], ['url'] + list(e58_fetch.FIRM_FIELD_LIST))
+        self.assertEqual(
+                row_list[1:],
+                [[RECORD_LIST[0][0]] + [
+                        RECORD_LIST[0][1][field_name]
+                        for field_name in e58_fetch.FIRM_FIELD_LIST
+                        ]],
+                )
+        
+        line_list = self.run_main(
+                main.query_main,
+                [self.index_path, '--rubriks', 'Автосервис', '--format', 'jsonl'],
+                ).splitlines()
+        
+        self.assertEqual(
+                sorted(json.loads(line)['url'] for line in line_list),
+                [RECORD_LIST[0][0], RECORD_LIST[2][0]],
+                )
+    
+    def test_query_errors(self):
+        for argv in (
+                [self.index_path, 'слово'],
+                [self.in_path],
+                ):
+            with self.subTest(argv=argv):
+                with self.assertRaises(SystemExit):
+                    self.run_main(main.query_main, argv)
+        
+        self.run_main(main.index_main, ['--format', 'jsonl', self.index_path, self.in_path])
+        
+        with self.assertRaises(SystemExit):
+            self.run_main(main.query_main, [self.index_path, '"unclosed'])
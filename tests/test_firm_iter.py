@@ -0,0 +1,138 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# firm iter -- generator API of crawler on the synthetic site of
+# benchmarks: every firm is yielded by both engines, and closing of
+# generator cancels crawl
+
+import asyncio
+import contextlib
+import itertools
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import e58_fetch_async
+from lib_e58_fetch_2013_08_19 import firm_iter
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+RUBRIC_COUNT = 2
+PAGE_DEPTH = 2
+FIRM_COUNT = 60
+CONCURRENCY = 4
+BUFFER_SIZE = 2
+BREAK_COUNT = 3
+
+class FirmIterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                cls.synthetic_site_ctx,
+                rubric_count=RUBRIC_COUNT,
+                page_depth=PAGE_DEPTH,
+                firm_count=FIRM_COUNT,
+                )
+        cls.site_url = synthetic_site.synthetic_site_start(cls.synthetic_site_ctx)
+    
+    @classmethod
+    def tearDownClass(cls):
+        synthetic_site.synthetic_site_stop(cls.synthetic_site_ctx)
+    
+    def on_error(self, url, err_type, err_msg):
+        self.fail('{}: {}: {}'.format(url, err_type, err_msg))
+    
+    def iter_firms(self, engine):
+        return firm_iter.iter_firms(
+                site_url=self.site_url,
+                engine=engine,
+                concurrency=CONCURRENCY,
+                buffer_size=BUFFER_SIZE,
+                on_error=self.on_error,
+                )
+    
+    def aiter_firms(self, engine):
+        return firm_iter.aiter_firms(
+                site_url=self.site_url,
+                engine=engine,
+                concurrency=CONCURRENCY,
+                buffer_size=BUFFER_SIZE,
+                on_error=self.on_error,
+                )
+    
+    def test_iter_firms(self):
+        for engine in e58_fetch_async.ENGINE_NAME_LIST:
+            with self.subTest(engine=engine):
+                firm_url_set = set(
+                        firm_url
+                        for firm_url, fetch_data in self.iter_firms(engine)
+                        )
+                
+                self.assertEqual(
+                        len(firm_url_set),
+                        synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                        )
+    
+    def test_aiter_firms(self):
+        async def collect(engine):
+            return set([
+                    firm_url
+                    async for firm_url, fetch_data in self.aiter_firms(engine)
+                    ])
+        
+        for engine in e58_fetch_async.ENGINE_NAME_LIST:
+            with self.subTest(engine=engine):
+                self.assertEqual(
+                        len(asyncio.run(collect(engine))),
+                        synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                        )
+    
+    def test_break(self):
+        # generator returns from ``close()`` when workers are stopped
+        
+        async def take(engine):
+            firm_list = []
+            
+            async with contextlib.aclosing(self.aiter_firms(engine)) as firm_aiter:
+                async for firm in firm_aiter:
+                    firm_list.append(firm)
+                    
+                    if len(firm_list) == BREAK_COUNT:
+                        break
+            
+            return firm_list
+        
+        for engine in e58_fetch_async.ENGINE_NAME_LIST:
+            with self.subTest(engine=engine):
+                with contextlib.closing(self.iter_firms(engine)) as firm_iter_obj:
+                    firm_list = list(itertools.islice(firm_iter_obj, BREAK_COUNT))
+                
+                self.assertEqual(len(firm_list), BREAK_COUNT)
+                self.assertEqual(len(asyncio.run(take(engine))), BREAK_COUNT)
+    
+    def test_default_concurrency(self):
+        self.assertEqual(
+                e58_fetch_async.get_default_concurrency('thread'),
+                (e58_fetch.THREAD_COUNT, e58_fetch.MAX_THREAD_COUNT),
+                )
+        self.assertEqual(
+                e58_fetch_async.get_default_concurrency('asyncio'),
+                (e58_fetch_async.ASYNC_CONCURRENCY, e58_fetch_async.ASYNC_MAX_CONCURRENCY),
+                )
+        
+        with self.assertRaises(ValueError):
+            firm_iter.iter_firms(site_url=self.site_url, engine='other').send(None)
@@ -0,0 +1,295 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# http cache -- entries, least recently used eviction, lost bodies,
+# batched access times, offline mode and revalidation of
+# ``e58_fetch.fetch_raw()``
+
+import http.server
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import http_cache
+from lib_e58_fetch_2013_08_19 import http_pool
+
+ETAG = '"v1"'
+
+def get_body(body_i, length=2000):
+    # random bytes do not compress, so body size is known
+    
+    return bytes([body_i]) + os.urandom(length - 1)
+
+class RevalidateRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        self.server.request_list.append(self.headers.get('If-None-Match'))
+        
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            
+            return
+        
+        body = 'page {}'.format(self.path).encode('utf-8')
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def open_cache(self, max_size=None, offline=False):
+        http_cache_ctx = http_cache.HttpCacheCtx()
+        http_cache.init_http_cache(
+                http_cache_ctx,
+                self.cache_dir,
+                max_size=max_size,
+                offline=offline,
+                )
+        
+        return http_cache_ctx
+    
+    def read_access_time(self, cache_url):
+        # by other connection: only committed state is seen
+        
+        db = sqlite3.connect(os.path.join(self.cache_dir, http_cache.INDEX_FILE_NAME))
+        
+        try:
+            return db.execute(
+                    'SELECT access_time FROM entry WHERE url = ?',
+                    (cache_url,),
+                    ).fetchone()[0]
+        finally:
+            db.close()
+    
+    def test_put_and_load(self):
+        http_cache_ctx = self.open_cache()
+        body = get_body(1)
+        
+        http_cache.http_cache_put(http_cache_ctx, 'http://e58.ru/a', body, ETAG, None)
+        http_cache.http_cache_put(http_cache_ctx, 'http://e58.ru/b', body, None, 'Mon')
+        
+        cache_entry = http_cache.http_cache_get(http_cache_ctx, 'http://e58.ru/a')
+        
+        self.assertEqual(
+                http_cache.http_cache_conditional_header_map(cache_entry),
+                {'If-None-Match': ETAG},
+                )
+        self.assertEqual(
+                http_cache.http_cache_load(http_cache_ctx, 'http://e58.ru/a', cache_entry),
+                body,
+                )
+        self.assertIsNone(http_cache.http_cache_get(http_cache_ctx, 'http://e58.ru/c'))
+        self.assertEqual(
+                http_cache.http_cache_url_list(http_cache_ctx),
+                ('http://e58.ru/a', 'http://e58.ru/b'),
+                )
+        
+        # the same content is stored once
+        self.assertEqual(
+                len(os.listdir(os.path.dirname(
+                        http_cache.get_body_path(http_cache_ctx, cache_entry[0])))),
+                1,
+                )
+        
+        total_size = http_cache_ctx.total_size
+        http_cache.http_cache_close(http_cache_ctx)
+        
+        http_cache_ctx = self.open_cache()
+        
+        self.assertEqual(http_cache_ctx.total_size, total_size)
+        
+        http_cache.http_cache_close(http_cache_ctx)
+    
+    def test_evict_least_recently_used(self):
+        http_cache_ctx = self.open_cache()
+        
+        http_cache.http_cache_put(http_cache_ctx, 'http://e58.ru/a', get_body(1), None, None)
+        time.sleep(0.01)
+        http_cache.http_cache_put(http_cache_ctx, 'http://e58.ru/b', get_body(2), None, None)
+        time.sleep(0.01)
+        
+        # hit makes ``a`` newer than ``b``, though its time is not written yet
+        http_cache.http_cache_load(
+                http_cache_ctx,
+                'http://e58.ru/a',
+                http_cache.http_cache_get(http_cache_ctx, 'http://e58.ru/a'),
+                )
+        time.sleep(0.01)
+        
+        http_cache_ctx.max_size = http_cache_ctx.total_size
+        http_cache.http_cache_put(http_cache_ctx, 'http://e58.ru/c', get_body(3), None, None)
+        
+        self.assertEqual(
+                http_cache.http_cache_url_list(http_cache_ctx),
+                ('http://e58.ru/a', 'http://e58.ru/c'),
+                )
+        self.assertEqual(http_cache_ctx.evicted_count, 1)
+        self.assertLessEqual(http_cache_ctx.total_size, http_cache_ctx.max_size)
+        
+        http_cache.http_cache_close(http_cache_ctx)
+        
+        # lowered limit is applied at start
+        http_cache_ctx = self.open_cache(max_size=1)
+        
+        self.assertEqual(http_cache.http_cache_url_list(http_cache_ctx), ())
+        self.assertEqual(http_cache_ctx.total_size, 0)
+        
+        http_cache.http_cache_close(http_cache_ctx)
+    
+    def test_access_time_batch(self):
+        http_cache_ctx = self.open_cache()
+        
+        http_cache.http_cache_put(http_cache_ctx, 'http://e58.ru/a', get_body(1), None, None)
+        put_access_time = self.read_access_time('http://e58.ru/a')
+        cache_entry = http_cache.http_cache_get(http_cache_ctx, 'http://e58.ru/a')
+        time.sleep(0.01)
+        
+        for load_i in range(http_cache.ACCESS_BATCH_SIZE - 1):
+            http_cache.http_cache_load(http_cache_ctx, 'http://e58.ru/a', cache_entry)
+        
+        self.assertEqual(self.read_access_time('http://e58.ru/a'), put_access_time)
+        
+        http_cache.http_cache_close(http_cache_ctx)
+        
+        self.assertGreater(self.read_access_time('http://e58.ru/a'), put_access_time)
+    
+    def test_lost_body(self):
+        http_cache_ctx = self.open_cache()
+        
+        http_cache.http_cache_put(http_cache_ctx, 'http://e58.ru/a', get_body(1), None, None)
+        cache_entry = http_cache.http_cache_get(http_cache_ctx, 'http://e58.ru/a')
+        os.remove(http_cache.get_body_path(http_cache_ctx, cache_entry[0]))
+        
+        self.assertIsNone(
+                http_cache.http_cache_load(http_cache_ctx, 'http://e58.ru/a', cache_entry))
+        self.assertIsNone(http_cache.http_cache_get(http_cache_ctx, 'http://e58.ru/a'))
+        self.assertEqual(http_cache_ctx.total_size, 0)
+        self.assertEqual(http_cache_ctx.hit_count, 0)
+        
+        http_cache.http_cache_close(http_cache_ctx)
+
+class FetchRawCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(
+                ('127.0.0.1', 0),
+                RevalidateRequestHandler,
+                )
+        cls.server.daemon_threads = True
+        cls.server.request_list = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.page_url = 'http://127.0.0.1:{}/firm/1/'.format(cls.server.server_address[1])
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.http_pool_ctx = http_pool.HttpPoolCtx()
+        http_pool.init_http_pool(self.http_pool_ctx)
+        self.server.request_list.clear()
+    
+    def tearDown(self):
+        http_pool.http_pool_close(self.http_pool_ctx)
+        self.tmp_dir.cleanup()
+    
+    def open_cache(self, offline=False):
+        http_cache_ctx = http_cache.HttpCacheCtx()
+        http_cache.init_http_cache(http_cache_ctx, self.tmp_dir.name, offline=offline)
+        
+        return http_cache_ctx
+    
+    def fetch_raw(self, http_cache_ctx):
+        return e58_fetch.fetch_raw(
+                self.http_pool_ctx,
+                self.page_url,
+                http_cache_ctx=http_cache_ctx,
+                )
+    
+    def test_revalidate(self):
+        http_cache_ctx = self.open_cache()
+        
+        self.assertEqual(self.fetch_raw(http_cache_ctx), b'page /firm/1/')
+        self.assertEqual(self.fetch_raw(http_cache_ctx), b'page /firm/1/')
+        self.assertEqual(self.server.request_list, [None, ETAG])
+        self.assertEqual(http_cache_ctx.revalidated_count, 1)
+        
+        http_cache.http_cache_close(http_cache_ctx)
+    
+    def test_revalidate_lost_body(self):
+        http_cache_ctx = self.open_cache()
+        
+        self.fetch_raw(http_cache_ctx)
+        cache_entry = http_cache.http_cache_get(http_cache_ctx, self.page_url)
+        os.remove(http_cache.get_body_path(http_cache_ctx, cache_entry[0]))
+        
+        # ``304`` for lost body: page is fetched again in full
+        self.assertEqual(self.fetch_raw(http_cache_ctx), b'page /firm/1/')
+        self.assertEqual(self.server.request_list, [None, ETAG, None])
+        self.assertIsNotNone(http_cache.http_cache_get(http_cache_ctx, self.page_url))
+        
+        http_cache.http_cache_close(http_cache_ctx)
+    
+    def test_offline(self):
+        http_cache_ctx = self.open_cache()
+        self.fetch_raw(http_cache_ctx)
+        http_cache.http_cache_close(http_cache_ctx)
+        
+        http_cache_ctx = self.open_cache(offline=True)
+        
+        self.assertEqual(self.fetch_raw(http_cache_ctx), b'page /firm/1/')
+        
+        with self.assertRaisesRegex(e58_fetch.FetchError, 'not in cache'):
+            e58_fetch.fetch_raw(
+                    self.http_pool_ctx,
+                    self.page_url + 'other/',
+                    http_cache_ctx=http_cache_ctx,
+                    )
+        
+        cache_entry = http_cache.http_cache_get(http_cache_ctx, self.page_url)
+        os.remove(http_cache.get_body_path(http_cache_ctx, cache_entry[0]))
+        
+        with self.assertRaisesRegex(e58_fetch.FetchError, 'not in cache'):
+            self.fetch_raw(http_cache_ctx)
+        
+        self.assertEqual(self.server.request_list, [None])
+        
+        http_cache.http_cache_close(http_cache_ctx)
@@ -0,0 +1,181 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# http pool -- keep-alive connections, retry of connection closed by
+# server while idle, content encodings and redirects of
+# ``http_pool.http_pool_get()``
+
+import gzip
+import http.server
+import threading
+import unittest
+import zlib
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import http_pool
+
+PAGE = ('<html><body>' + '<p>фирма</p>' * 500 + '</body></html>').encode('utf-8')
+TIMEOUT = 10.0
+MAX_LENGTH = 100000
+
+class PoolRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/page')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            
+            return
+        
+        body = PAGE
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+        if self.path == '/drop':
+            # keep-alive response, but server drops idle connection
+            self.close_connection = True
+
+class DecodeContentTest(unittest.TestCase):
+    def test_decode(self):
+        raw_deflate_obj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        
+        for content_encoding, body in (
+                (None, PAGE),
+                ('identity', PAGE),
+                ('gzip', gzip.compress(PAGE)),
+                ('x-gzip', gzip.compress(PAGE)),
+                (' GZIP ', gzip.compress(PAGE)),
+                ('deflate', zlib.compress(PAGE)),
+                ('deflate', raw_deflate_obj.compress(PAGE) + raw_deflate_obj.flush()),
+                ):
+            with self.subTest(content_encoding=content_encoding):
+                self.assertEqual(
+                        http_pool.decode_content(content_encoding, body, MAX_LENGTH),
+                        PAGE,
+                        )
+                
+                if content_encoding not in (None, 'identity'):
+                    # decoded body is cut. plain body is cut while read
+                    self.assertEqual(
+                            http_pool.decode_content(content_encoding, body, 100),
+                            PAGE[:100],
+                            )
+    
+    def test_unsupported(self):
+        with self.assertRaisesRegex(http_pool.HttpPoolError, 'unsupported'):
+            http_pool.decode_content('compress', b'', MAX_LENGTH)
+    
+    def test_html_content_type(self):
+        for content_type, is_html in (
+                (None, True),
+                ('text/html', True),
+                ('Text/HTML; charset=windows-1251', True),
+                ('application/xhtml+xml', True),
+                ('application/pdf', False),
+                ('image/png', False),
+                ):
+            with self.subTest(content_type=content_type):
+                self.assertEqual(http_pool.is_html_content_type(content_type), is_html)
+
+class HttpPoolGetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(
+                ('127.0.0.1', 0),
+                PoolRequestHandler,
+                )
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        self.http_pool_ctx = http_pool.HttpPoolCtx()
+        http_pool.init_http_pool(self.http_pool_ctx)
+    
+    def tearDown(self):
+        http_pool.http_pool_close(self.http_pool_ctx)
+    
+    def get(self, path):
+        return http_pool.http_pool_get(
+                self.http_pool_ctx,
+                self.base_url + path,
+                TIMEOUT,
+                MAX_LENGTH,
+                )
+    
+    def test_keep_alive(self):
+        for get_i in range(3):
+            code, resp_header_map, body = self.get('/page')
+            
+            self.assertEqual(code, 200)
+            self.assertEqual(body, PAGE)
+        
+        self.assertEqual(self.http_pool_ctx.conn_new_count, 1)
+        self.assertEqual(self.http_pool_ctx.conn_reuse_count, 2)
+        
+        # body is compressed on wire
+        self.assertEqual(self.http_pool_ctx.content_byte_count, len(PAGE) * 3)
+        self.assertLess(
+                self.http_pool_ctx.wire_byte_count,
+                self.http_pool_ctx.content_byte_count,
+                )
+    
+    def test_dropped_idle_conn(self):
+        self.assertEqual(self.get('/drop')[2], PAGE)
+        self.assertEqual(self.get('/page')[2], PAGE)
+        
+        # dropped connection is taken from pool, then new one is made
+        self.assertEqual(self.http_pool_ctx.conn_reuse_count, 1)
+        self.assertEqual(self.http_pool_ctx.conn_new_count, 2)
+    
+    def test_redirect(self):
+        code, resp_header_map, body = self.get('/redirect')
+        
+        self.assertEqual(code, 302)
+        self.assertEqual(resp_header_map['location'], '/page')
+        
+        with self.assertRaises(e58_fetch.FetchCodeError) as cm:
+            e58_fetch.fetch_raw(self.http_pool_ctx, self.base_url + '/redirect')
+        
+        self.assertEqual(cm.exception.code, 302)
+    
+    def test_unsupported_url(self):
+        for get_url in ('ftp://e58.ru/', 'http:///firms/', 'e58.ru/firms/'):
+            with self.subTest(get_url=get_url):
+                with self.assertRaisesRegex(http_pool.HttpPoolError, 'unsupported url'):
+                    http_pool.http_pool_get(self.http_pool_ctx, get_url, TIMEOUT, MAX_LENGTH)
@@ -0,0 +1,155 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# streaming fetch -- incremental decode of content encodings and limits
+# of ``http_pool.http_pool_get_stream()``: compressed body must never be
+# expanded over ``max_length``
+
+import gzip
+import http.server
+import threading
+import unittest
+import zlib
+from lib_e58_fetch_2013_08_19 import http_pool
+
+PAGE = ('<html><body><div class="firminfo"><h1>Фирма</h1></div>' +
+        '<p>текст</p>' * 2000 + '</body></html>').encode('utf-8')
+BOMB_LENGTH = 64 * 1024 * 1024
+MAX_LENGTH = 100000
+TIMEOUT = 10.0
+
+def get_raw_deflate(body):
+    compress_obj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    
+    return compress_obj.compress(body) + compress_obj.flush()
+
+# ``{path: (content_encoding, body)}``
+RESPONSE_MAP = {
+        '/page': (None, PAGE),
+        '/page.gz': ('gzip', gzip.compress(PAGE)),
+        '/page.deflate': ('deflate', zlib.compress(PAGE)),
+        '/page.raw-deflate': ('deflate', get_raw_deflate(PAGE)),
+        '/bomb.gz': ('gzip', gzip.compress(bytes(BOMB_LENGTH))),
+        '/bomb.deflate': ('deflate', zlib.compress(bytes(BOMB_LENGTH))),
+        }
+
+class StreamRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        content_encoding, body = RESPONSE_MAP[self.path]
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        
+        if content_encoding is not None:
+            self.send_header('Content-Encoding', content_encoding)
+        
+        self.end_headers()
+        self.wfile.write(body)
+
+class StreamDecodeTest(unittest.TestCase):
+    def test_bomb_is_cut(self):
+        stream_decode_ctx = http_pool.StreamDecodeCtx()
+        http_pool.init_stream_decode(stream_decode_ctx, 'gzip')
+        
+        chunk = http_pool.stream_decode(
+                stream_decode_ctx,
+                RESPONSE_MAP['/bomb.gz'][1],
+                MAX_LENGTH,
+                )
+        
+        self.assertEqual(len(chunk), MAX_LENGTH)
+        self.assertTrue(stream_decode_ctx.unconsumed_tail)
+    
+    def test_tail_is_kept(self):
+        # small budgets give the same body as one call
+        
+        stream_decode_ctx = http_pool.StreamDecodeCtx()
+        http_pool.init_stream_decode(stream_decode_ctx, 'gzip')
+        
+        chunk_list = [http_pool.stream_decode(
+                stream_decode_ctx,
+                RESPONSE_MAP['/page.gz'][1],
+                1000,
+                )]
+        
+        while stream_decode_ctx.unconsumed_tail:
+            chunk_list.append(http_pool.stream_decode(stream_decode_ctx, b'', 1000))
+        
+        self.assertEqual(b''.join(chunk_list), PAGE)
+
+class HttpPoolGetStreamTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(
+                ('127.0.0.1', 0),
+                StreamRequestHandler,
+                )
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        self.http_pool_ctx = http_pool.HttpPoolCtx()
+        http_pool.init_http_pool(self.http_pool_ctx)
+    
+    def tearDown(self):
+        http_pool.http_pool_close(self.http_pool_ctx)
+    
+    def get_stream(self, path):
+        chunk_list = []
+        
+        code, resp_header_map = http_pool.http_pool_get_stream(
+                self.http_pool_ctx,
+                'http://127.0.0.1:{}{}'.format(self.server.server_address[1], path),
+                TIMEOUT,
+                MAX_LENGTH,
+                chunk_list.append,
+                )
+        
+        self.assertEqual(code, 200)
+        
+        return chunk_list
+    
+    def test_page(self):
+        for path in ('/page', '/page.gz', '/page.deflate', '/page.raw-deflate'):
+            with self.subTest(path=path):
+                self.assertEqual(b''.join(self.get_stream(path)), PAGE)
+    
+    def test_bomb(self):
+        for path in ('/bomb.gz', '/bomb.deflate'):
+            with self.subTest(path=path):
+                with self.assertRaisesRegex(http_pool.HttpPoolError, 'too long'):
+                    self.get_stream(path)
+                
+                self.assertLessEqual(
+                        self.http_pool_ctx.content_byte_count,
+                        MAX_LENGTH + 1,
+                        )
+                
+                self.http_pool_ctx.content_byte_count = 0
@@ -0,0 +1,165 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# out sink -- records of every format, commit marks and resume of
+# output which is cut by interrupted run
+
+import os
+import tempfile
+import unittest
+from lib_e58_fetch_2013_08_19 import out_sink
+
+FIELD_LIST = ('title', 'address')
+
+def get_record_list(first_i, count):
+    # address has line break and quotes: CSV cell of it is quoted
+    
+    return [
+            (
+                    'http://e58.ru/firm/{}/'.format(record_i),
+                    {
+                            'title': 'Фирма "{}"'.format(record_i),
+                            'address': 'г. Пенза,\nул. {}'.format(record_i),
+                            },
+                    )
+            for record_i in range(first_i, first_i + count)
+            ]
+
+class OutSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def get_out_path(self, sink_format):
+        return os.path.join(self.tmp_dir.name, 'out.{}'.format(sink_format))
+    
+    def write(self, sink_format, record_list, is_append=False, on_commit=None):
+        # returns ``written_url_set`` of resumed output
+        
+        out_sink_ctx = out_sink.OutSinkCtx()
+        out_sink.init_out_sink(
+                out_sink_ctx,
+                sink_format,
+                self.get_out_path(sink_format),
+                FIELD_LIST,
+                is_append=is_append,
+                batch_size=3,
+                on_commit=on_commit,
+                )
+        
+        for record_url, fetch_data in record_list:
+            out_sink.out_sink_put(out_sink_ctx, record_url, fetch_data)
+            out_sink.out_sink_mark(out_sink_ctx, record_url)
+        
+        out_sink.out_sink_close(out_sink_ctx)
+        
+        return out_sink_ctx.written_url_set
+    
+    def read(self, sink_format):
+        return list(out_sink.read_record_iter(
+                sink_format,
+                self.get_out_path(sink_format),
+                FIELD_LIST,
+                ))
+    
+    def cut(self, sink_format, cut_bytes):
+        # simulates crash in the middle of ``cut_bytes`` of the last
+        # record
+        
+        out_path = self.get_out_path(sink_format)
+        
+        with open(out_path, 'rb') as fd:
+            data = fd.read()
+        
+        with open(out_path, 'wb') as fd:
+            fd.write(data[:data.rindex(cut_bytes) + len(cut_bytes) // 2])
+    
+    def test_write_and_mark(self):
+        for sink_format in out_sink.SINK_FORMAT_LIST:
+            with self.subTest(sink_format=sink_format):
+                record_list = get_record_list(0, 7)
+                commit_url_list = []
+                
+                self.write(sink_format, record_list, on_commit=commit_url_list.extend)
+                
+                self.assertEqual(self.read(sink_format), record_list)
+                self.assertEqual(
+                        commit_url_list,
+                        [record_url for record_url, fetch_data in record_list],
+                        )
+                
+                # not resumed run writes output again
+                self.write(sink_format, record_list[:2])
+                
+                self.assertEqual(self.read(sink_format), record_list[:2])
+    
+    def test_resume(self):
+        for sink_format in out_sink.SINK_FORMAT_LIST:
+            with self.subTest(sink_format=sink_format):
+                record_list = get_record_list(0, 10)
+                
+                self.write(sink_format, record_list[:5])
+                written_url_set = self.write(
+                        sink_format,
+                        record_list[3:],
+                        is_append=True,
+                        )
+                
+                self.assertEqual(
+                        written_url_set,
+                        frozenset(record_url for record_url, fetch_data in record_list[:5]),
+                        )
+                self.assertEqual(self.read(sink_format), record_list)
+    
+    def test_resume_after_cut(self):
+        # cut in quoted cell of CSV leaves line break and open quote
+        
+        for sink_format, cut_bytes in (
+                ('csv', 'Пенза,\nул. 4'.encode('utf-8')),
+                ('csv', 'Фирма ""4""'.encode('utf-8')),
+                ('csv', b'http://e58.ru/firm/4/'),
+                ('jsonl', b'http://e58.ru/firm/4/'),
+                ('jsonl', 'Пенза'.encode('utf-8')),
+                ):
+            with self.subTest(sink_format=sink_format, cut_bytes=cut_bytes):
+                record_list = get_record_list(0, 10)
+                
+                self.write(sink_format, record_list[:5])
+                self.cut(sink_format, cut_bytes)
+                
+                self.assertEqual(
+                        out_sink.read_url_set(sink_format, self.get_out_path(sink_format)),
+                        frozenset(record_url for record_url, fetch_data in record_list[:4]),
+                        )
+                
+                self.write(sink_format, record_list[4:], is_append=True)
+                
+                self.assertEqual(self.read(sink_format), record_list)
+    
+    def test_resume_after_cut_header(self):
+        record_list = get_record_list(0, 3)
+        
+        with open(self.get_out_path('csv'), 'w', encoding='utf-8') as fd:
+            fd.write('url,ti')
+        
+        self.write('csv', record_list, is_append=True)
+        
+        self.assertEqual(self.read('csv'), record_list)
@@ -0,0 +1,137 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# link scan -- fast path of listing pages (``e58_fetch.scan_page_elems()``):
+# which pages are scanned, and that scan finds the same links as full
+# parse of synthetic site pages
+
+import unittest
+from unittest import mock
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+PAGE_URL = 'http://e58.ru/firms/rubric/1/'
+
+def get_synthetic_site_ctx():
+    synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+    synthetic_site.init_synthetic_site(
+            synthetic_site_ctx,
+            rubric_count=3,
+            page_depth=4,
+            firm_count=50,
+            )
+    
+    return synthetic_site_ctx
+
+class ScanPageElemsTest(unittest.TestCase):
+    def test_firm_page(self):
+        # ``FIRM_MARKER`` in any case: page may have firm info
+        
+        for html in (
+                '<div class="firminfo"><h1>Firm</h1></div>',
+                '<div class="FirmInfo"><h1>Firm</h1></div>',
+                '<div id="firms"><h3><a href="/firm/1/">firm</a></h3></div>'
+                        '<!-- FIRMINFO -->',
+                ):
+            with self.subTest(html=html):
+                self.assertIsNone(e58_fetch.scan_page_elems(html))
+    
+    def test_no_links(self):
+        for html in ('', '<p>nothing</p>', '<div id="firms"></div>'):
+            with self.subTest(html=html):
+                self.assertIsNone(e58_fetch.scan_page_elems(html))
+    
+    def test_listing_page(self):
+        html = '<div id="firms"><div><h3><a href="/firm/1/">one</a></h3>' \
+                '<h3><a href="/firm/2/">two</a></div></div>' \
+                '<div class="paginator"><a href="?page=2">2</a><br/>' \
+                '<a href="?page=3">3</a></div>'
+        timing_map = {}
+        
+        elem_list_map = e58_fetch.scan_page_elems(html, timing_map=timing_map)
+        
+        self.assertEqual(set(elem_list_map), set(e58_fetch.PAGE_CHAIN_MAP))
+        self.assertEqual(elem_list_map['title'], ())
+        self.assertEqual(
+                e58_fetch.extract_page_elems(PAGE_URL, elem_list_map),
+                (
+                        [
+                                'http://e58.ru/firm/1/',
+                                'http://e58.ru/firm/2/',
+                                'http://e58.ru/firms/rubric/1/?page=2',
+                                'http://e58.ru/firms/rubric/1/?page=3',
+                                ],
+                        None,
+                        ),
+                )
+        self.assertIn('parse', timing_map)
+    
+    def test_as_full_parse(self):
+        synthetic_site_ctx = get_synthetic_site_ctx()
+        
+        for path in (
+                '/firms/',
+                '/firms/rubric/0/',
+                '/firms/rubric/2/?page=3',
+                ):
+            with self.subTest(path=path):
+                html = synthetic_site.get_page(synthetic_site_ctx, path)
+                
+                self.assertEqual(
+                        e58_fetch.extract_page_elems(
+                                PAGE_URL,
+                                e58_fetch.scan_page_elems(html),
+                                ),
+                        e58_fetch.extract_page_elems(
+                                PAGE_URL,
+                                e58_fetch.find_page_elems(html, 'html5lib'),
+                                ),
+                        )
+
+class ExtractPageTest(unittest.TestCase):
+    def test_fast_path(self):
+        # full parse is for firm pages only
+        
+        synthetic_site_ctx = get_synthetic_site_ctx()
+        listing_html = synthetic_site.get_page(synthetic_site_ctx, '/firms/rubric/1/')
+        firm_html = synthetic_site.get_page(synthetic_site_ctx, '/firm/7/')
+        
+        with mock.patch.object(
+                e58_fetch,
+                'find_page_elems',
+                wraps=e58_fetch.find_page_elems,
+                ) as find_page_elems:
+            link_url_list, fetch_data = e58_fetch.extract_page(
+                    PAGE_URL,
+                    listing_html,
+                    parser_name='html5lib',
+                    )
+            
+            self.assertTrue(link_url_list)
+            self.assertIsNone(fetch_data)
+            self.assertEqual(find_page_elems.call_count, 0)
+            
+            link_url_list, fetch_data = e58_fetch.extract_page(
+                    PAGE_URL,
+                    firm_html,
+                    parser_name='html5lib',
+                    )
+            
+            self.assertEqual(fetch_data['title'], 'Firm 7 & Co')
+            self.assertEqual(find_page_elems.call_count, 1)
@@ -0,0 +1,164 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# parse processes -- ``e58_fetch.extract_page_raw_timed()`` in spawned
+# process must give the same records as ``extract_page()``, and crawl
+# with parse processes must give the same records as crawl without them
+# on both engines
+
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import e58_fetch_async
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURE_URL = 'http://e58.ru/firms/rubric/1/'
+PARSE_PROCESS_COUNT = 2
+CONCURRENCY = 4
+CRAWL_TIMEOUT = 60.0
+
+def read_raw_fixture_map():
+    # ``{file_name: raw_html}``
+    
+    raw_fixture_map = {}
+    
+    for file_name in sorted(os.listdir(FIXTURE_DIR)):
+        if not file_name.endswith('.html'):
+            continue
+        
+        with open(os.path.join(FIXTURE_DIR, file_name), 'rb') as fd:
+            raw_fixture_map[file_name] = fd.read()
+    
+    return raw_fixture_map
+
+def crawl(site_url, engine, parse_process_count):
+    # returns set of records ``(firm_url, fetch_data_items)``
+    
+    bulk_data_ctx = e58_fetch.BulkDataCtx()
+    e58_fetch.init_bulk_data_ctx(bulk_data_ctx, site_url=site_url)
+    
+    lock = threading.Lock()
+    done_event = threading.Event()
+    record_set = set()
+    error_list = []
+    
+    def on_fetch(fetch_url, fetch_data):
+        with lock:
+            record_set.add((fetch_url, tuple(sorted(fetch_data.items()))))
+    
+    def on_error(fetch_url, error_type, error_str):
+        with lock:
+            error_list.append((fetch_url, error_type, error_str))
+    
+    if engine == 'asyncio':
+        e58_fetch_async.bulk_data_fetch_async(
+                bulk_data_ctx,
+                concurrency=CONCURRENCY,
+                parse_process_count=parse_process_count,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=done_event.set,
+                )
+    else:
+        e58_fetch.bulk_data_fetch(
+                bulk_data_ctx,
+                thread_count=CONCURRENCY,
+                parse_process_count=parse_process_count,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=done_event.set,
+                )
+    
+    if not done_event.wait(CRAWL_TIMEOUT):
+        e58_fetch.bulk_data_cancel(bulk_data_ctx)
+        
+        raise AssertionError('crawl of {} engine is not over'.format(engine))
+    
+    if error_list:
+        raise AssertionError('crawl errors: {!r}'.format(error_list))
+    
+    return record_set
+
+class ExtractPageRawTimedTest(unittest.TestCase):
+    def test_in_process(self):
+        raw_fixture_map = read_raw_fixture_map()
+        
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'),
+                ) as executor:
+            future_map = dict(
+                    (file_name, executor.submit(
+                            e58_fetch.extract_page_raw_timed,
+                            FIXTURE_URL,
+                            raw_html,
+                            'html5lib',
+                            ))
+                    for file_name, raw_html in raw_fixture_map.items()
+                    )
+            
+            for file_name, future in future_map.items():
+                with self.subTest(file_name=file_name):
+                    link_url_list, fetch_data, timing_map = future.result()
+                    
+                    self.assertEqual(
+                            (link_url_list, fetch_data),
+                            e58_fetch.extract_page(
+                                    FIXTURE_URL,
+                                    raw_fixture_map[file_name].decode('utf-8'),
+                                    parser_name='html5lib',
+                                    ),
+                            )
+                    self.assertGreater(timing_map['parse'], 0.0)
+                    self.assertNotIn('profile_map', timing_map)
+
+class ParseProcessCrawlTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                cls.synthetic_site_ctx,
+                rubric_count=2,
+                page_depth=2,
+                firm_count=40,
+                )
+        cls.site_url = synthetic_site.synthetic_site_start(cls.synthetic_site_ctx)
+    
+    @classmethod
+    def tearDownClass(cls):
+        synthetic_site.synthetic_site_stop(cls.synthetic_site_ctx)
+    
+    def test_crawl(self):
+        record_set = crawl(self.site_url, 'thread', None)
+        
+        self.assertEqual(
+                len(record_set),
+                synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                )
+        
+        for engine in e58_fetch_async.ENGINE_NAME_LIST:
+            with self.subTest(engine=engine):
+                self.assertEqual(
+                        crawl(self.site_url, engine, PARSE_PROCESS_COUNT),
+                        record_set,
+                        )
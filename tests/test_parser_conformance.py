@@ -0,0 +1,193 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# parser conformance -- every parser backend must give the same records
+# and links as ``html5lib`` (reference parser) on pages of ``fixtures``:
+# firm list pages and firm pages, clean and broken. trees of fast
+# backends are compared without ``html5lib`` fallback, so fallback can
+# not hide their errors. streaming parse (``--stream``) and link scan of
+# listing pages (``html_parse.ElemScanner``) are compared too.
+
+import functools
+import http.server
+import os
+import threading
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import html_parse
+from lib_e58_fetch_2013_08_19 import http_pool
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURE_URL = 'http://e58.ru/firms/rubric/1/'
+STREAM_PART_LENGTH = 7
+
+def get_parser_name_list(parser_name_list):
+    # ``lxml`` is optional dependency
+    
+    return tuple(
+            parser_name
+            for parser_name in parser_name_list
+            if parser_name != 'lxml' or html_parse.lxml is not None
+            )
+
+def read_fixture_map():
+    # ``{file_name: html}``
+    
+    fixture_map = {}
+    
+    for file_name in sorted(os.listdir(FIXTURE_DIR)):
+        if not file_name.endswith('.html'):
+            continue
+        
+        with open(os.path.join(FIXTURE_DIR, file_name), 'r', encoding='utf-8') as fd:
+            fixture_map[file_name] = fd.read()
+    
+    return fixture_map
+
+def extract_tree(html, parser_name):
+    # record of tree of one backend, without fallback
+    
+    elem_list_map = e58_fetch.find_page_chains(html_parse.parse(html, parser_name))
+    
+    return e58_fetch.extract_page_elems(FIXTURE_URL, elem_list_map)
+
+def extract_stream_by_parts(html, parser_name):
+    stream_parse_ctx = html_parse.StreamParseCtx()
+    html_parse.init_stream_parse(stream_parse_ctx, parser_name)
+    
+    for part_i in range(0, len(html), STREAM_PART_LENGTH):
+        html_parse.stream_parse_feed(
+                stream_parse_ctx,
+                html[part_i:part_i + STREAM_PART_LENGTH],
+                )
+    
+    elem_list_map = e58_fetch.find_page_chains(
+            html_parse.stream_parse_close(stream_parse_ctx))
+    
+    return e58_fetch.extract_page_elems(FIXTURE_URL, elem_list_map)
+
+class FixtureRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class ParserConformanceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fixture_map = read_fixture_map()
+        cls.reference_map = dict(
+                (file_name, extract_tree(html, 'html5lib'))
+                for file_name, html in cls.fixture_map.items()
+                )
+    
+    def test_fixtures(self):
+        # every kind of page is in corpus, and reference finds something
+        # on every page
+        
+        firm_count = 0
+        
+        for file_name, (link_url_list, fetch_data) in self.reference_map.items():
+            if fetch_data is None:
+                self.assertTrue(link_url_list, file_name)
+            else:
+                firm_count += 1
+                self.assertTrue(fetch_data['title'], file_name)
+        
+        self.assertTrue(firm_count)
+        self.assertLess(firm_count, len(self.reference_map))
+    
+    def test_tree(self):
+        for parser_name in get_parser_name_list(html_parse.PARSER_NAME_LIST):
+            for file_name, html in self.fixture_map.items():
+                with self.subTest(parser_name=parser_name, file_name=file_name):
+                    self.assertEqual(
+                            extract_tree(html, parser_name),
+                            self.reference_map[file_name],
+                            )
+    
+    def test_extract_page(self):
+        for parser_name in get_parser_name_list(html_parse.PARSER_NAME_LIST):
+            for file_name, html in self.fixture_map.items():
+                with self.subTest(parser_name=parser_name, file_name=file_name):
+                    self.assertEqual(
+                            e58_fetch.extract_page(
+                                    FIXTURE_URL,
+                                    html,
+                                    parser_name=parser_name,
+                                    ),
+                            self.reference_map[file_name],
+                            )
+    
+    def test_scan(self):
+        for file_name, html in self.fixture_map.items():
+            if self.reference_map[file_name][1] is not None:
+                # firm pages are not scanned
+                continue
+            
+            with self.subTest(file_name=file_name):
+                elem_list_map = e58_fetch.scan_page_elems(html)
+                
+                self.assertIsNotNone(elem_list_map)
+                self.assertEqual(
+                        e58_fetch.extract_page_elems(FIXTURE_URL, elem_list_map),
+                        self.reference_map[file_name],
+                        )
+    
+    def test_stream_parse_by_parts(self):
+        # parts split tags, entities and ``FIRM_MARKER``
+        
+        for parser_name in get_parser_name_list(html_parse.STREAM_PARSER_NAME_LIST):
+            for file_name, html in self.fixture_map.items():
+                with self.subTest(parser_name=parser_name, file_name=file_name):
+                    self.assertEqual(
+                            extract_stream_by_parts(html, parser_name),
+                            self.reference_map[file_name],
+                            )
+    
+    def test_fetch_page_elems_stream(self):
+        server = http.server.ThreadingHTTPServer(
+                ('127.0.0.1', 0),
+                functools.partial(FixtureRequestHandler, directory=FIXTURE_DIR),
+                )
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        
+        http_pool_ctx = http_pool.HttpPoolCtx()
+        http_pool.init_http_pool(http_pool_ctx)
+        
+        try:
+            for parser_name in get_parser_name_list(html_parse.STREAM_PARSER_NAME_LIST):
+                for file_name, html in self.fixture_map.items():
+                    with self.subTest(parser_name=parser_name, file_name=file_name):
+                        elem_list_map, byte_count = e58_fetch.fetch_page_elems_stream(
+                                http_pool_ctx,
+                                'http://127.0.0.1:{}/{}'.format(
+                                        server.server_address[1], file_name),
+                                parser_name,
+                                )
+                        
+                        self.assertIsNotNone(elem_list_map)
+                        self.assertEqual(byte_count, len(html.encode('utf-8')))
+                        self.assertEqual(
+                                e58_fetch.extract_page_elems(FIXTURE_URL, elem_list_map),
+                                self.reference_map[file_name],
+                                )
+        finally:
+            http_pool.http_pool_close(http_pool_ctx)
+            server.shutdown()
+            server.server_close()
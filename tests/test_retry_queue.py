@@ -0,0 +1,190 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# retry queue -- delays and order of retries, limit of attempts, and
+# crawl of the synthetic site which fails part of responses
+
+import threading
+import time
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import retry_queue
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+BASE_DELAY = 0.05
+CRAWL_TIMEOUT = 60.0
+
+class RetryQueueTest(unittest.TestCase):
+    def open_queue(self, max_attempts=3, base_delay=BASE_DELAY, max_delay=None):
+        retry_queue_ctx = retry_queue.RetryQueueCtx()
+        retry_queue.init_retry_queue(
+                retry_queue_ctx,
+                max_attempts=max_attempts,
+                base_delay=base_delay,
+                max_delay=max_delay,
+                )
+        
+        return retry_queue_ctx
+    
+    def test_delay(self):
+        # exponential, with jitter in upper half, and bounded
+        
+        retry_queue_ctx = self.open_queue(base_delay=1.0, max_delay=5.0)
+        
+        for attempt, (min_delay, max_delay) in (
+                (1, (0.5, 1.0)),
+                (2, (1.0, 2.0)),
+                (3, (2.0, 4.0)),
+                (4, (2.5, 5.0)),
+                (10, (2.5, 5.0)),
+                ):
+            with self.subTest(attempt=attempt):
+                for delay_i in range(20):
+                    delay = retry_queue.get_delay(retry_queue_ctx, attempt)
+                    
+                    self.assertGreaterEqual(delay, min_delay)
+                    self.assertLessEqual(delay, max_delay)
+    
+    def test_max_attempts(self):
+        retry_queue_ctx = self.open_queue(max_attempts=3)
+        
+        self.assertIsNotNone(retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/1/'))
+        self.assertIsNotNone(retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/1/'))
+        self.assertIsNone(retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/1/'))
+        self.assertEqual(retry_queue.retry_queue_len(retry_queue_ctx), 2)
+        
+        # one attempt: no retries at all
+        retry_queue_ctx = self.open_queue(max_attempts=1)
+        
+        self.assertIsNone(retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/1/'))
+    
+    def test_order(self):
+        # urls are due in order of due time, not of scheduling
+        
+        retry_queue_ctx = self.open_queue(max_attempts=10)
+        
+        self.assertIsNone(retry_queue.retry_queue_wait_time(retry_queue_ctx))
+        
+        # ``a`` waits for fourth attempt, ``b`` and ``c`` for first one
+        retry_queue_ctx.attempt_map['http://e58.ru/a/'] = 4
+        retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/a/')
+        retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/b/')
+        retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/c/')
+        
+        self.assertEqual(retry_queue.retry_queue_pop_due(retry_queue_ctx), [])
+        self.assertLessEqual(retry_queue.retry_queue_wait_time(retry_queue_ctx), BASE_DELAY)
+        
+        time.sleep(BASE_DELAY)
+        
+        self.assertEqual(
+                sorted(retry_queue.retry_queue_pop_due(retry_queue_ctx)),
+                ['http://e58.ru/b/', 'http://e58.ru/c/'],
+                )
+        self.assertEqual(retry_queue.retry_queue_len(retry_queue_ctx), 1)
+        
+        self.assertGreater(retry_queue.retry_queue_wait_time(retry_queue_ctx), 0.0)
+        
+        time.sleep(retry_queue.retry_queue_wait_time(retry_queue_ctx))
+        
+        self.assertEqual(retry_queue.retry_queue_pop_due(retry_queue_ctx), ['http://e58.ru/a/'])
+        self.assertIsNone(retry_queue.retry_queue_wait_time(retry_queue_ctx))
+    
+    def test_same_due_time(self):
+        # urls with equal due time keep order of scheduling
+        
+        retry_queue_ctx = self.open_queue(base_delay=0.0)
+        
+        for url_i in range(10):
+            retry_queue.retry_queue_schedule(retry_queue_ctx, 'http://e58.ru/{}/'.format(url_i))
+        
+        self.assertEqual(
+                retry_queue.retry_queue_pop_due(retry_queue_ctx),
+                ['http://e58.ru/{}/'.format(url_i) for url_i in range(10)],
+                )
+
+class RetryCrawlTest(unittest.TestCase):
+    def crawl(self, site_url, max_attempts):
+        # returns ``(fetch_url_set, error_list)``
+        
+        retry_queue_ctx = retry_queue.RetryQueueCtx()
+        retry_queue.init_retry_queue(
+                retry_queue_ctx,
+                max_attempts=max_attempts,
+                base_delay=0.001,
+                )
+        bulk_data_ctx = e58_fetch.BulkDataCtx()
+        e58_fetch.init_bulk_data_ctx(
+                bulk_data_ctx,
+                site_url=site_url,
+                retry_queue_ctx=retry_queue_ctx,
+                )
+        
+        lock = threading.Lock()
+        done_event = threading.Event()
+        fetch_url_set = set()
+        error_list = []
+        
+        def on_fetch(fetch_url, fetch_data):
+            with lock:
+                fetch_url_set.add(fetch_url)
+        
+        def on_error(fetch_url, error_type, error_str):
+            with lock:
+                error_list.append(fetch_url)
+        
+        e58_fetch.bulk_data_fetch(
+                bulk_data_ctx,
+                thread_count=4,
+                on_fetch=on_fetch,
+                on_error=on_error,
+                on_done=done_event.set,
+                )
+        
+        self.assertTrue(done_event.wait(CRAWL_TIMEOUT))
+        
+        return fetch_url_set, error_list
+    
+    def test_crawl(self):
+        synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                synthetic_site_ctx,
+                rubric_count=2,
+                page_depth=2,
+                firm_count=20,
+                error_rate=0.3,
+                )
+        site_url = synthetic_site.synthetic_site_start(synthetic_site_ctx)
+        
+        try:
+            # ``503`` is transient: every url gets through at last
+            fetch_url_set, error_list = self.crawl(site_url, 30)
+            
+            self.assertEqual(
+                    len(fetch_url_set),
+                    synthetic_site.get_covered_firm_count(synthetic_site_ctx),
+                    )
+            self.assertEqual(error_list, [])
+            self.assertGreater(synthetic_site_ctx.error_count, 0)
+            
+            # without retries failed urls are errors
+            fetch_url_set, error_list = self.crawl(site_url, 1)
+            
+            self.assertTrue(error_list)
+        finally:
+            synthetic_site.synthetic_site_stop(synthetic_site_ctx)
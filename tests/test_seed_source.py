@@ -0,0 +1,248 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# seed source -- sitemaps and sitemap indexes, url files, outputs and id
+# ranges as seeds, and seeded crawl of the synthetic site by probes of ids
+
+import gzip
+import itertools
+import os
+import tempfile
+import threading
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import out_sink
+from lib_e58_fetch_2013_08_19 import seed_source
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+CRAWL_TIMEOUT = 60.0
+
+def get_sitemap(loc_list, is_index=False, ns=True):
+    tag = 'sitemapindex' if is_index else 'urlset'
+    item_tag = 'sitemap' if is_index else 'url'
+    
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<{}{}>{}</{}>'.format(
+            tag,
+            ' xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"' if ns else '',
+            ''.join(
+                    '<{0}><loc> {1} </loc><lastmod>2013-08-19</lastmod></{0}>'.format(
+                            item_tag, loc)
+                    for loc in loc_list
+                    ),
+            tag,
+            ).encode('utf-8')
+
+class SitemapTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def write(self, file_name, body):
+        path = os.path.join(self.tmp_dir.name, file_name)
+        
+        with open(path, 'wb') as fd:
+            fd.write(body)
+        
+        return path
+    
+    def test_parse(self):
+        loc_list = ('http://e58.ru/firm/1/', 'http://e58.ru/firm/2/')
+        
+        for body, is_index in (
+                (get_sitemap(loc_list), False),
+                (get_sitemap(loc_list, ns=False), False),
+                (gzip.compress(get_sitemap(loc_list)), False),
+                (get_sitemap(loc_list, is_index=True), True),
+                ):
+            with self.subTest(body=body[:20], is_index=is_index):
+                self.assertEqual(seed_source.parse_sitemap(body), (loc_list, is_index))
+        
+        self.assertEqual(seed_source.parse_sitemap(get_sitemap(())), ((), False))
+        
+        with self.assertRaisesRegex(seed_source.SeedSourceError, 'invalid sitemap'):
+            seed_source.parse_sitemap(b'<urlset><url>')
+    
+    def test_index(self):
+        # sitemaps of index are relative to it, and may be gzipped
+        
+        self.write('a.xml', get_sitemap(('http://e58.ru/firm/1/',)))
+        self.write('b.xml.gz', gzip.compress(get_sitemap(('http://e58.ru/firm/2/',))))
+        self.write('nested.xml', get_sitemap(('b.xml.gz',), is_index=True))
+        index_path = self.write('index.xml', get_sitemap(('a.xml', 'nested.xml'), is_index=True))
+        
+        self.assertEqual(
+                seed_source.read_sitemap(index_path),
+                ('http://e58.ru/firm/1/', 'http://e58.ru/firm/2/'),
+                )
+    
+    def test_index_loop(self):
+        index_path = self.write('index.xml', get_sitemap(('index.xml',), is_index=True))
+        
+        with self.assertRaisesRegex(seed_source.SeedSourceError, 'too deep'):
+            seed_source.read_sitemap(index_path)
+    
+    def test_no_sitemap(self):
+        with self.assertRaisesRegex(seed_source.SeedSourceError, 'is not read'):
+            seed_source.read_sitemap(os.path.join(self.tmp_dir.name, 'none.xml'))
+        
+        synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(synthetic_site_ctx)
+        site_url = synthetic_site.synthetic_site_start(synthetic_site_ctx)
+        
+        try:
+            with self.assertRaisesRegex(seed_source.SeedSourceError, 'is not fetched'):
+                seed_source.read_sitemap(site_url + 'sitemap.xml')
+        finally:
+            synthetic_site.synthetic_site_stop(synthetic_site_ctx)
+
+class SeedFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def test_url_file(self):
+        url_file_path = os.path.join(self.tmp_dir.name, 'urls.txt')
+        
+        with open(url_file_path, 'w', encoding='utf-8') as fd:
+            fd.write('# firms\nhttp://e58.ru/firm/1/\n\n  http://e58.ru/firm/2/  \n'
+                    '  # http://e58.ru/firm/3/\n')
+        
+        self.assertEqual(
+                seed_source.read_url_file(url_file_path),
+                ('http://e58.ru/firm/1/', 'http://e58.ru/firm/2/'),
+                )
+        
+        with self.assertRaisesRegex(seed_source.SeedSourceError, 'is not read'):
+            seed_source.read_url_file(url_file_path + '.none')
+    
+    def test_output(self):
+        out_path = os.path.join(self.tmp_dir.name, 'out.csv')
+        
+        with self.assertRaisesRegex(seed_source.SeedSourceError, 'no output'):
+            seed_source.read_output_urls('csv', out_path)
+        
+        out_sink_ctx = out_sink.OutSinkCtx()
+        out_sink.init_out_sink(out_sink_ctx, 'csv', out_path, e58_fetch.FIRM_FIELD_LIST)
+        
+        for firm_i in (3, 1, 2):
+            out_sink.out_sink_put(
+                    out_sink_ctx,
+                    'http://e58.ru/firm/{}/'.format(firm_i),
+                    dict(
+                            (field_name, 'x')
+                            for field_name in e58_fetch.FIRM_FIELD_LIST
+                            ),
+                    )
+        
+        out_sink.out_sink_close(out_sink_ctx)
+        
+        self.assertEqual(
+                seed_source.read_output_urls('csv', out_path),
+                tuple('http://e58.ru/firm/{}/'.format(firm_i) for firm_i in (1, 2, 3)),
+                )
+
+class IdRangeTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(seed_source.parse_id_range('1-3'), (1, 3))
+        self.assertEqual(seed_source.parse_id_range('5-5'), (5, 5))
+        
+        for id_range in ('1', '3-1', '-1-3', 'a-b', '1-', ''):
+            with self.subTest(id_range=id_range):
+                with self.assertRaisesRegex(seed_source.SeedSourceError, 'invalid id range'):
+                    seed_source.parse_id_range(id_range)
+    
+    def test_urls(self):
+        self.assertEqual(
+                tuple(seed_source.iter_id_urls('http://e58.ru/', 1, 3)),
+                ('http://e58.ru/firm/1/', 'http://e58.ru/firm/2/', 'http://e58.ru/firm/3/'),
+                )
+        self.assertEqual(
+                tuple(seed_source.iter_id_urls(
+                        'http://e58.ru/base/',
+                        7,
+                        7,
+                        url_template='/firms/{}.html',
+                        )),
+                ('http://e58.ru/firms/7.html',),
+                )
+        
+        # long range is lazy
+        self.assertEqual(
+                tuple(itertools.islice(seed_source.iter_id_urls('http://e58.ru/', 0, 10 ** 12), 2)),
+                ('http://e58.ru/firm/0/', 'http://e58.ru/firm/1/'),
+                )
+
+class SeededCrawlTest(unittest.TestCase):
+    def test_probes(self):
+        # probes reach every firm (not only firms of listing pages), and
+        # their ``404`` is not error. ``404`` of direct url is error
+        
+        synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                synthetic_site_ctx,
+                rubric_count=2,
+                page_depth=2,
+                firm_count=30,
+                )
+        site_url = synthetic_site.synthetic_site_start(synthetic_site_ctx)
+        
+        try:
+            bulk_data_ctx = e58_fetch.BulkDataCtx()
+            e58_fetch.init_bulk_data_ctx(
+                    bulk_data_ctx,
+                    site_url=site_url,
+                    seed_url_list=(),
+                    direct_url_iter=iter((site_url + 'firm/1000/',)),
+                    probe_url_iter=seed_source.iter_id_urls(site_url, 0, 34),
+                    )
+            
+            lock = threading.Lock()
+            done_event = threading.Event()
+            fetch_url_set = set()
+            error_list = []
+            
+            def on_fetch(fetch_url, fetch_data):
+                with lock:
+                    fetch_url_set.add(fetch_url)
+            
+            def on_error(fetch_url, error_type, error_str):
+                with lock:
+                    error_list.append(fetch_url)
+            
+            e58_fetch.bulk_data_fetch(
+                    bulk_data_ctx,
+                    thread_count=4,
+                    on_fetch=on_fetch,
+                    on_error=on_error,
+                    on_done=done_event.set,
+                    )
+            
+            self.assertTrue(done_event.wait(CRAWL_TIMEOUT))
+        finally:
+            synthetic_site.synthetic_site_stop(synthetic_site_ctx)
+        
+        self.assertEqual(
+                fetch_url_set,
+                set(seed_source.iter_id_urls(site_url, 0, 29)),
+                )
+        self.assertEqual(error_list, [site_url + 'firm/1000/'])
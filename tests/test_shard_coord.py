@@ -0,0 +1,318 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# shard coord -- owners of urls, routing of urls between shards and end
+# of sharded crawl, merge of outputs of shards (``e58-fetch-merge``), and
+# sharded crawl of the synthetic site by ``e58-fetch`` processes
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from lib_e58_fetch_2013_08_19 import e58_fetch
+from lib_e58_fetch_2013_08_19 import main
+from lib_e58_fetch_2013_08_19 import out_sink
+from lib_e58_fetch_2013_08_19 import shard_coord
+from lib_e58_fetch_2013_08_19.bench import synthetic_site
+
+E58_FETCH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'e58-fetch')
+SHARD_COUNT = 3
+CRAWL_TIMEOUT = 60.0
+
+def get_fetch_data(title):
+    fetch_data = dict(
+            (field_name, '')
+            for field_name in e58_fetch.FIRM_FIELD_LIST
+            )
+    fetch_data['title'] = title
+    
+    return fetch_data
+
+class UrlShardTest(unittest.TestCase):
+    def test_url_shard(self):
+        url_list = ['http://e58.ru/firm/{}/'.format(url_i) for url_i in range(300)]
+        shard_list = [shard_coord.get_url_shard(url, SHARD_COUNT) for url in url_list]
+        
+        # every shard owns part of urls
+        self.assertEqual(set(shard_list), set(range(SHARD_COUNT)))
+        
+        # normalized url is of the same shard
+        for url, shard_index in zip(url_list[:10], shard_list):
+            with self.subTest(url=url):
+                self.assertEqual(
+                        shard_coord.get_url_shard(url.replace('e58.ru', 'E58.RU'), SHARD_COUNT),
+                        shard_index,
+                        )
+        
+        # stable value (not of ``hash()``), so hosts agree
+        self.assertEqual(
+                subprocess.check_output((
+                        sys.executable,
+                        '-c',
+                        'from lib_e58_fetch_2013_08_19 import shard_coord; '
+                        'print(shard_coord.get_url_shard({!r}, {}))'.format(
+                                url_list[0], SHARD_COUNT),
+                        ), cwd=os.path.dirname(E58_FETCH)).decode().strip(),
+                str(shard_list[0]),
+                )
+
+class ShardCoordTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.coord_path = os.path.join(self.tmp_dir.name, 'coord.db')
+        self.shard_coord_ctx_list = []
+    
+    def tearDown(self):
+        for shard_coord_ctx in self.shard_coord_ctx_list:
+            shard_coord.shard_coord_close(shard_coord_ctx)
+        
+        self.tmp_dir.cleanup()
+    
+    def open_shard(self, shard_index, shard_count=2, is_resume=False):
+        shard_coord_ctx = shard_coord.ShardCoordCtx()
+        shard_coord.init_shard_coord(
+                shard_coord_ctx,
+                self.coord_path,
+                shard_index,
+                shard_count,
+                is_resume=is_resume,
+                )
+        self.shard_coord_ctx_list.append(shard_coord_ctx)
+        
+        return shard_coord_ctx
+    
+    def get_url(self, shard_index, shard_count=2):
+        # url owned by ``shard_index``
+        
+        for url_i in range(100):
+            url = 'http://e58.ru/firm/{}/'.format(url_i)
+            
+            if shard_coord.get_url_shard(url, shard_count) == shard_index:
+                return url
+    
+    def test_register(self):
+        self.open_shard(0)
+        
+        with self.assertRaisesRegex(shard_coord.ShardCoordError, 'invalid shard index'):
+            self.open_shard(2)
+        
+        with self.assertRaisesRegex(shard_coord.ShardCoordError, 'in coordinator already'):
+            self.open_shard(0)
+        
+        with self.assertRaisesRegex(shard_coord.ShardCoordError, 'other count of shards'):
+            self.open_shard(1, shard_count=3)
+        
+        self.open_shard(0, is_resume=True)
+    
+    def test_route(self):
+        shard_a = self.open_shard(0)
+        shard_b = self.open_shard(1)
+        url = self.get_url(1)
+        
+        self.assertFalse(shard_coord.shard_coord_is_own(shard_a, url))
+        self.assertTrue(shard_coord.shard_coord_is_own(shard_b, url))
+        
+        # both shards found the url, owner gets it once
+        shard_coord.shard_coord_route(shard_a, url)
+        shard_coord.shard_coord_route(shard_a, url.replace('e58.ru', 'E58.RU'))
+        
+        self.assertEqual(shard_coord.shard_coord_sync(shard_a, True), ((), False))
+        self.assertEqual(shard_coord.shard_coord_sync(shard_b, True), ((url,), False))
+        
+        shard_coord.shard_coord_route(shard_a, url)
+        
+        self.assertEqual(shard_coord.shard_coord_sync(shard_a, True), ((), False))
+        self.assertEqual(shard_coord.shard_coord_sync(shard_b, True), ((), True))
+        self.assertEqual(shard_coord.shard_coord_sync(shard_a, True), ((), True))
+        self.assertEqual(shard_a.routed_count, 1)
+        self.assertEqual(shard_b.taken_count, 1)
+    
+    def test_done(self):
+        # crawl is over when every shard is registered and idle, and no
+        # routed url waits for its owner
+        
+        shard_a = self.open_shard(0)
+        
+        self.assertEqual(shard_coord.shard_coord_sync(shard_a, True), ((), False))
+        
+        shard_b = self.open_shard(1)
+        shard_coord.shard_coord_route(shard_b, self.get_url(0))
+        
+        self.assertEqual(shard_coord.shard_coord_sync(shard_b, True), ((), False))
+        
+        url_list, is_done = shard_coord.shard_coord_sync(shard_a, True)
+        
+        self.assertEqual(url_list, (self.get_url(0),))
+        self.assertFalse(is_done)
+        self.assertEqual(shard_coord.shard_coord_sync(shard_b, True), ((), False))
+        self.assertEqual(shard_coord.shard_coord_sync(shard_a, False), ((), False))
+        self.assertEqual(shard_coord.shard_coord_sync(shard_a, True), ((), True))
+    
+    def test_resume(self):
+        # resumed shard takes all urls routed to it again
+        
+        shard_a = self.open_shard(0)
+        shard_b = self.open_shard(1)
+        shard_coord.shard_coord_route(shard_a, self.get_url(1))
+        shard_coord.shard_coord_sync(shard_a, False)
+        
+        self.assertEqual(shard_coord.shard_coord_sync(shard_b, False), ((self.get_url(1),), False))
+        
+        shard_b = self.open_shard(1, is_resume=True)
+        
+        self.assertEqual(shard_coord.shard_coord_sync(shard_b, True), ((self.get_url(1),), False))
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def write(self, file_name, record_list, sink_format='csv'):
+        out_path = os.path.join(self.tmp_dir.name, file_name)
+        out_sink_ctx = out_sink.OutSinkCtx()
+        out_sink.init_out_sink(out_sink_ctx, sink_format, out_path, e58_fetch.FIRM_FIELD_LIST)
+        
+        for record_url, title in record_list:
+            out_sink.out_sink_put(out_sink_ctx, record_url, get_fetch_data(title))
+        
+        out_sink.out_sink_close(out_sink_ctx)
+        
+        return out_path
+    
+    def test_merge(self):
+        for sink_format in ('csv', 'jsonl'):
+            with self.subTest(sink_format=sink_format):
+                in_path_list = [
+                        self.write('a.' + sink_format, (
+                                ('http://e58.ru/firm/1/', 'one'),
+                                ('http://e58.ru/firm/2/', 'two'),
+                                ), sink_format=sink_format),
+                        self.write('b.' + sink_format, (
+                                ('http://E58.RU/firm/2/', 'two again'),
+                                ('http://e58.ru/firm/3/', 'three'),
+                                ), sink_format=sink_format),
+                        ]
+                out_path = os.path.join(self.tmp_dir.name, 'out.' + sink_format)
+                
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main.merge_main(
+                            ['--format', sink_format, out_path] + in_path_list)
+                
+                self.assertEqual(
+                        [
+                                (record_url, fetch_data['title'])
+                                for record_url, fetch_data in out_sink.read_record_iter(
+                                        sink_format, out_path, e58_fetch.FIRM_FIELD_LIST)
+                                ],
+                        [
+                                ('http://e58.ru/firm/1/', 'one'),
+                                ('http://e58.ru/firm/2/', 'two'),
+                                ('http://e58.ru/firm/3/', 'three'),
+                                ],
+                        )
+    
+    def test_out_is_in(self):
+        in_path = self.write('a.csv', ())
+        
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                main.merge_main([in_path, in_path])
+
+class ShardedCrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.synthetic_site_ctx = synthetic_site.SyntheticSiteCtx()
+        synthetic_site.init_synthetic_site(
+                self.synthetic_site_ctx,
+                rubric_count=3,
+                page_depth=3,
+                firm_count=60,
+                )
+        self.site_url = synthetic_site.synthetic_site_start(self.synthetic_site_ctx)
+    
+    def tearDown(self):
+        synthetic_site.synthetic_site_stop(self.synthetic_site_ctx)
+        self.tmp_dir.cleanup()
+    
+    def start(self, out_path, *arg_list):
+        return subprocess.Popen(
+                (
+                        sys.executable,
+                        E58_FETCH,
+                        '--site-url', self.site_url,
+                        '--concurrency', '2',
+                        ) + arg_list + (out_path,),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                )
+    
+    def read(self, out_path):
+        return sorted(out_sink.read_record_iter('csv', out_path, e58_fetch.FIRM_FIELD_LIST))
+    
+    def test_sharded_crawl(self):
+        full_path = os.path.join(self.tmp_dir.name, 'full.csv')
+        
+        self.assertEqual(self.start(full_path).wait(CRAWL_TIMEOUT), 0)
+        
+        full_request_count = self.synthetic_site_ctx.request_count
+        synthetic_site.synthetic_site_reset(self.synthetic_site_ctx)
+        
+        coord_path = os.path.join(self.tmp_dir.name, 'coord.db')
+        shard_path_list = [
+                os.path.join(self.tmp_dir.name, 'shard-{}.csv'.format(shard_index))
+                for shard_index in range(SHARD_COUNT)
+                ]
+        proc_list = [
+                self.start(
+                        shard_path,
+                        '--shard-count', str(SHARD_COUNT),
+                        '--shard-index', str(shard_index),
+                        '--coordinator', coord_path,
+                        )
+                for shard_index, shard_path in enumerate(shard_path_list)
+                ]
+        
+        for proc in proc_list:
+            self.assertEqual(proc.wait(CRAWL_TIMEOUT), 0)
+        
+        # no url is fetched twice, and every shard fetched its own firms
+        self.assertEqual(self.synthetic_site_ctx.request_count, full_request_count)
+        
+        for shard_index, shard_path in enumerate(shard_path_list):
+            for record_url, fetch_data in self.read(shard_path):
+                self.assertEqual(
+                        shard_coord.get_url_shard(record_url, SHARD_COUNT),
+                        shard_index,
+                        )
+        
+        merge_path = os.path.join(self.tmp_dir.name, 'merge.csv')
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.merge_main([merge_path] + shard_path_list)
+        
+        self.assertEqual(
+                len(self.read(merge_path)),
+                synthetic_site.get_covered_firm_count(self.synthetic_site_ctx),
+                )
+        self.assertEqual(self.read(merge_path), self.read(full_path))
@@ -0,0 +1,125 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# url frontier -- normalized form of urls, duplicates and order of
+# lanes
+
+import unittest
+from lib_e58_fetch_2013_08_19 import url_frontier
+
+class NormalizeUrlTest(unittest.TestCase):
+    def test_same(self):
+        for raw_url_list in (
+                (
+                        'http://e58.ru/firms/rubric/1/',
+                        'http://e58.ru/firms/rubric/1',
+                        'HTTP://E58.RU/firms/rubric/1/',
+                        'http://e58.ru/firms/rubric/1/#top',
+                        ),
+                (
+                        'http://e58.ru/firms/?page=2&sort=name',
+                        'http://e58.ru/firms?sort=name&page=2',
+                        ),
+                (
+                        'http://e58.ru',
+                        'http://e58.ru/',
+                        ),
+                ):
+            with self.subTest(raw_url=raw_url_list[0]):
+                self.assertEqual(
+                        set(url_frontier.normalize_url(raw_url) for raw_url in raw_url_list),
+                        set((url_frontier.normalize_url(raw_url_list[0]),)),
+                        )
+    
+    def test_different(self):
+        # path case and blank query values are significant
+        
+        for raw_url, other_url in (
+                ('http://e58.ru/firm/1/', 'http://e58.ru/Firm/1/'),
+                ('http://e58.ru/firms/?page=2', 'http://e58.ru/firms/?page=3'),
+                ('http://e58.ru/firms/?page=', 'http://e58.ru/firms/'),
+                ('http://e58.ru/firm/1/', 'https://e58.ru/firm/1/'),
+                ):
+            with self.subTest(raw_url=raw_url, other_url=other_url):
+                self.assertNotEqual(
+                        url_frontier.normalize_url(raw_url),
+                        url_frontier.normalize_url(other_url),
+                        )
+
+class UrlFrontierTest(unittest.TestCase):
+    def setUp(self):
+        self.url_frontier_ctx = url_frontier.UrlFrontierCtx()
+        url_frontier.init_url_frontier(self.url_frontier_ctx)
+    
+    def pop_all(self):
+        url_list = []
+        
+        while url_frontier.url_frontier_len(self.url_frontier_ctx):
+            url_list.append(url_frontier.url_frontier_pop(self.url_frontier_ctx))
+        
+        return url_list
+    
+    def test_duplicate(self):
+        self.assertTrue(url_frontier.url_frontier_add(
+                self.url_frontier_ctx, 'http://e58.ru/firm/1/'))
+        self.assertFalse(url_frontier.url_frontier_add(
+                self.url_frontier_ctx, 'http://E58.ru/firm/1'))
+        self.assertFalse(url_frontier.url_frontier_add(
+                self.url_frontier_ctx, 'http://e58.ru/firm/1/', is_background=True))
+        
+        # queue keeps url as it was given
+        self.assertEqual(self.pop_all(), ['http://e58.ru/firm/1/'])
+        
+        # popped url stays seen
+        self.assertFalse(url_frontier.url_frontier_add(
+                self.url_frontier_ctx, 'http://e58.ru/firm/1/'))
+        
+        with self.assertRaises(IndexError):
+            url_frontier.url_frontier_pop(self.url_frontier_ctx)
+    
+    def test_mark_seen(self):
+        self.assertTrue(url_frontier.url_frontier_mark_seen(
+                self.url_frontier_ctx, 'http://e58.ru/firm/1/'))
+        self.assertFalse(url_frontier.url_frontier_mark_seen(
+                self.url_frontier_ctx, 'http://e58.ru/firm/1'))
+        self.assertFalse(url_frontier.url_frontier_add(
+                self.url_frontier_ctx, 'http://e58.ru/firm/1/'))
+        self.assertEqual(url_frontier.url_frontier_len(self.url_frontier_ctx), 0)
+    
+    def test_lanes(self):
+        # background lane goes only after main lane, which is FIFO
+        
+        url_frontier.url_frontier_add(self.url_frontier_ctx, 'http://e58.ru/b/1/', True)
+        url_frontier.url_frontier_add(self.url_frontier_ctx, 'http://e58.ru/m/1/')
+        url_frontier.url_frontier_add(self.url_frontier_ctx, 'http://e58.ru/b/2/', True)
+        url_frontier.url_frontier_add(self.url_frontier_ctx, 'http://e58.ru/m/2/')
+        url_frontier.url_frontier_push(self.url_frontier_ctx, 'http://e58.ru/m/1/')
+        
+        self.assertEqual(url_frontier.url_frontier_main_len(self.url_frontier_ctx), 3)
+        self.assertEqual(url_frontier.url_frontier_len(self.url_frontier_ctx), 5)
+        self.assertEqual(
+                self.pop_all(),
+                [
+                        'http://e58.ru/m/1/',
+                        'http://e58.ru/m/2/',
+                        'http://e58.ru/m/1/',
+                        'http://e58.ru/b/1/',
+                        'http://e58.ru/b/2/',
+                        ],
+                )